@@ -0,0 +1,67 @@
+# -*- coding: UTF-8 -*-
+# ------------------------------------------------------------------------------
+#     Copyright (c) 2023+ TYPETR
+#     Usage by MIT License
+# ..............................................................................
+#
+#    TYPETR bench-codec.py
+#
+#   Microbenchmark of building loco drive/function packets: the byte-string concatenation with the
+#   CMD/XOR helpers (as locoDrive/locoFunction did) against the preallocated Encoder packets in z21codec.py.
+#   No Z21/DR5000 is needed, nothing is sent.
+#
+import timeit
+
+from z21 import CMD, XOR, LITTLE_ORDER, loco2Bytes
+from z21codec import Encoder
+
+N = 200000
+
+def legacyXOR(b):
+    """The byte-by-byte XOR, as it was in z21.py."""
+    xor = None
+    for byte in bytes(b):
+        if xor is None:
+            xor = byte
+        else:
+            xor = xor ^ byte
+    return xor.to_bytes(1, LITTLE_ORDER)
+
+LAN_X_SET_LOCO_DRIVE = CMD(0x0A, 0, 0x40, 0, 0xE4)
+LAN_X_SET_LOCO_FUNCTION = CMD(0x0A, 0, 0x40, 0, 0xE4, 0xF8)
+
+def legacyLocoDrive(loco, speed):
+    cmd = LAN_X_SET_LOCO_DRIVE + (0x13).to_bytes(1, LITTLE_ORDER) + loco2Bytes(loco) + (0x80 | speed).to_bytes(1, LITTLE_ORDER)
+    cmd += legacyXOR(cmd[4:])
+    return cmd
+
+def cmdLocoDrive(loco, speed):
+    cmd = LAN_X_SET_LOCO_DRIVE + (0x13).to_bytes(1, LITTLE_ORDER) + loco2Bytes(loco) + (0x80 | speed).to_bytes(1, LITTLE_ORDER)
+    cmd += XOR(cmd[4:])
+    return cmd
+
+def legacyLocoFunction(loco, functionCode):
+    cmd = LAN_X_SET_LOCO_FUNCTION + loco2Bytes(loco) + functionCode.to_bytes(1, LITTLE_ORDER)
+    cmd += legacyXOR(cmd[4:])
+    return cmd
+
+encoder = Encoder()
+
+def run(name, f, *args):
+    t = timeit.timeit(lambda: f(*args), number=N)
+    packet = f(*args)
+    newPacket = f(*args) is not packet # The Encoder answers the same memoryview every time.
+    print(f'{name:40s} {t/N*1e9:8.0f} ns/packet  new packet object per call: {newPacket}')
+    return t
+
+# All variants must produce identical packets.
+assert bytes(encoder.locoDrive(3, 0x13, 0x80 | 71)) == legacyLocoDrive(3, 71) == cmdLocoDrive(3, 71)
+assert bytes(encoder.locoFunction(3, 0x42)) == legacyLocoFunction(3, 0x42)
+
+print(f'Building {N} packets per variant')
+t0 = run('locoDrive: CMD + legacy XOR', legacyLocoDrive, 3, 71)
+t1 = run('locoDrive: CMD + reduce XOR', cmdLocoDrive, 3, 71)
+t2 = run('locoDrive: Encoder (preallocated)', encoder.locoDrive, 3, 0x13, 0x80 | 71)
+t3 = run('locoFunction: CMD + legacy XOR', legacyLocoFunction, 3, 0x42)
+t4 = run('locoFunction: Encoder (preallocated)', encoder.locoFunction, 3, 0x42)
+print(f'Speedup locoDrive {t0/t2:.1f}x, locoFunction {t3/t4:.1f}x')
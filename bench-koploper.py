@@ -0,0 +1,79 @@
+# -*- coding: UTF-8 -*-
+# ------------------------------------------------------------------------------
+#     Copyright (c) 2023+ TYPETR
+#     Usage by MIT License
+# ..............................................................................
+#
+#    TYPETR bench-koploper.py
+#
+#   Benchmark of reading the Koploper backups in trainthetrain/docs/koploper: the conversion of the rows by
+#   values() (int/float trials for every field, answering lists), against the compiled converters of the
+#   Schema of each record type (answering slotted records). Both variants must answer the same values.
+#   The last columns compare opening the backup with KoploperIO, parsed and from its cache file.
+#
+#       PYTHONPATH=trainthetrain/lib python bench-koploper.py
+#
+import glob
+import os
+import shutil
+import tempfile
+import time
+
+from koploper import iterRecords, schemaOf, values, KoploperIO, Row, COLUMN_STR
+
+N = 20
+
+PATHS = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'trainthetrain/docs/koploper/*.bck')))
+
+def readRows(path):
+    with open(path, 'rb') as f:
+        return [record for record in iterRecords(f) if isinstance(record, Row)]
+
+def legacy(rows):
+    return [values(row.data) for row in rows]
+
+def compiled(rows):
+    return [schemaOf(row.type).convert(row.fields, row.key) for row in rows]
+
+def stream(path):
+    with open(path, 'rb') as f:
+        return [schemaOf(record.type).convert(record.fields, record.key) for record in iterRecords(f) if isinstance(record, Row)]
+
+def best(f, *args):
+    """Answer the fastest time of N runs of @f(*args)."""
+    times = []
+    for _ in range(N):
+        t = time.perf_counter()
+        f(*args)
+        times.append(time.perf_counter() - t)
+    return min(times)
+
+def check(rows):
+    """Assert that both variants answer the same values. values() keeps 1.0 style numbers and empty fields as
+    text and has no None, so only the fields that it converted to int/bool are compared."""
+    for row, record in zip(rows, compiled(rows)):
+        for index, value in enumerate(values(row.data)):
+            if index >= record.SCHEMA.offset and index < record.SCHEMA.offset + len(record.SCHEMA.types):
+                if record.SCHEMA.types[index - record.SCHEMA.offset] != COLUMN_STR and not isinstance(value, str):
+                    assert record[index] == value, (row, index, record[index], value)
+
+print(f'Best of {N} runs per file')
+print(f'{"File":32s} {"rows":>6s} {"parse ms":>9s} {"values() ms":>12s} {"schema ms":>10s} {"speedup":>8s} {"read+convert ms":>16s} {"open ms":>8s} {"cache ms":>9s}')
+tmp = tempfile.mkdtemp()
+totalLegacy = totalCompiled = 0
+for path in PATHS:
+    rows = readRows(path)
+    check(rows)
+    tParse = best(readRows, path)
+    tLegacy = best(legacy, rows)
+    tCompiled = best(compiled, rows)
+    tStream = best(stream, path)
+    cachedPath = shutil.copy(path, tmp)
+    KoploperIO(cachedPath, cache=True)
+    tOpen = best(KoploperIO, cachedPath)
+    tCache = best(KoploperIO, cachedPath, True)
+    totalLegacy += tLegacy
+    totalCompiled += tCompiled
+    print(f'{os.path.basename(path):32s} {len(rows):6d} {tParse*1e3:9.2f} {tLegacy*1e3:12.2f} {tCompiled*1e3:10.2f} {tLegacy/tCompiled:7.1f}x {tStream*1e3:16.2f} {tOpen*1e3:8.2f} {tCache*1e3:9.2f}')
+print(f'Speedup of the conversion, all files: {totalLegacy/totalCompiled:.1f}x')
+shutil.rmtree(tmp)
@@ -0,0 +1,159 @@
+# -*- coding: UTF-8 -*-
+# ------------------------------------------------------------------------------
+#     Copyright (c) 2023+ TYPETR
+#     Usage by MIT License
+# ..............................................................................
+#
+#    TYPETR bench-z21.py
+#
+#   [Z21] <----- (UDP localhost) -----> [Z21Simulator]
+#
+#   Throughput and latency benchmark of the Z21 class against the simulator in z21simulator.py.
+#   No Z21/DR5000 is needed. The results are written as JSON, to compare them between commits:
+#
+#       PYTHONPATH=trainthetrain/lib python bench-z21.py -o bench-z21.json
+#
+#   Round-trip latency (p50/p99) of version, status and getLocoInfo, commands per second of
+#   locoDrive/locoFunction/setTurnout, CV read/write per second and the rate of broadcasts that are
+#   received and decoded into z21.locos. The packets that the commands really send are counted: locoDrive
+#   also sets the head light and functions that do not change are skipped.
+#
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+
+from z21 import Z21, ON, OFF
+from z21broadcast import BroadcastFlags
+from z21simulator import Z21Simulator
+
+def percentile(values, p):
+    """Answer the @p percentile (0-100) of the sorted @values, nearest rank."""
+    index = min(len(values) - 1, max(0, int(round(p / 100 * len(values))) - 1))
+    return values[index]
+
+def latency(f, count):
+    """Call @f @count times and answer the dictionary with the round-trip times in microseconds."""
+    times = []
+    for _ in range(count):
+        t = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - t)
+    times.sort()
+    return dict(count=count, p50_us=round(percentile(times, 50)*1e6, 1), p99_us=round(percentile(times, 99)*1e6, 1),
+        max_us=round(times[-1]*1e6, 1))
+
+def rate(f, count):
+    """Call @f(index) @count times and answer the dictionary with the number of calls per second."""
+    t = time.perf_counter()
+    for index in range(count):
+        f(index)
+    t = time.perf_counter() - t
+    return dict(count=count, seconds=round(t, 4), per_second=round(count/t))
+
+def waitUntil(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+def countSent(z21):
+    """Replace z21.send by a method that counts the packets, answer the list with the count."""
+    sent = [0]
+    send = z21.send
+    def countingSend(cmd):
+        sent[0] += 1
+        send(cmd)
+    z21.send = countingSend
+    return sent
+
+def benchCommands(z21, simulator, count):
+    """Commands without reply: measure the send rate and check how many of the sent packets the simulator got."""
+    results = {}
+    sent = countSent(z21)
+    for name, f in (
+            ('locoDrive', lambda i: z21.locoDrive(1 + i % 100, i % 120)), # Head light (if it changes) and drive
+            ('locoFunction', lambda i: z21.locoFunction(1 + i % 100, i % 29, ON if i % 2 else OFF)),
+            ('setTurnout', lambda i: z21.setTurnout(i % 64, i % 2))):
+        received = simulator.received
+        sent[0] = 0
+        results[name] = rate(f, count)
+        packets = sent[0]
+        waitUntil(lambda: simulator.received - received >= packets, 2)
+        results[name]['packets_sent'] = packets
+        results[name]['received_by_simulator'] = simulator.received - received
+    del z21.send
+    return results
+
+def benchBroadcasts(z21, simulator, count):
+    """Let the simulator send @count LAN_X_LOCO_INFO broadcasts of changing locos, as fast as it can.
+    Answer the rate in which they are received and decoded into z21.locos."""
+    changed = []
+    z21.locos.addListener(changed.append)
+    z21.broadcastFlags = BroadcastFlags.ALL_LOCO_INFO
+    z21.lanGetCode # Round-trip, so the flags are set before the broadcasts start.
+    t = time.perf_counter()
+    for index in range(count):
+        decoder = simulator.decoder(1 + index % 500)
+        decoder.speedByte = 0x80 | (2 + index % 120)
+        simulator.broadcastLocoInfo(decoder.address)
+    waitUntil(lambda: len(changed) >= count, 2)
+    t = time.perf_counter() - t
+    z21.broadcastFlags = BroadcastFlags.NONE
+    z21.locos.removeListener(changed.append)
+    return dict(sent=count, decoded=len(changed), seconds=round(t, 4), per_second=round(len(changed)/t))
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Z21 client against the Z21 simulator.')
+    parser.add_argument('-n', '--count', type=int, default=2000, help='Number of calls per benchmark')
+    parser.add_argument('--latency', type=float, default=0, help='Simulated one-way latency in seconds')
+    parser.add_argument('-o', '--output', help='Write the JSON results to this file instead of stdout')
+    args = parser.parse_args()
+    count = args.count
+
+    simulator = Z21Simulator(latency=args.latency)
+    simulator.start()
+    z21 = Z21(*simulator.address, timeout=1)
+    results = dict(
+        commit=commit(),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        time=time.strftime('%Y-%m-%dT%H:%M:%S'),
+        count=count,
+        simulatedLatency=args.latency,
+    )
+    try:
+        results['latency'] = dict(
+            version=latency(lambda: z21.version, count),
+            status=latency(lambda: z21.status, count),
+            getLocoInfo=latency(lambda: z21.getLocoInfo(3), count),
+        )
+        results['commands'] = benchCommands(z21, simulator, count)
+        cvCount = max(1, count // 10)
+        results['cv'] = dict(
+            read=rate(lambda i: z21.readCV(1 + i % 100), cvCount),
+            write=rate(lambda i: z21.writeCV(2 + i % 100, i % 256), cvCount), # Not CV1, that changes the address
+        )
+        results['broadcasts'] = benchBroadcasts(z21, simulator, count)
+    finally:
+        z21.close()
+        simulator.stop()
+    results['simulator'] = dict(received=simulator.received, sent=simulator.sent, dropped=simulator.dropped,
+        errors=simulator.errors)
+
+    s = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(s + '\n')
+    else:
+        print(s)
+
+if __name__ == '__main__':
+    sys.exit(main())
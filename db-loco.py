@@ -21,11 +21,10 @@ class Assistant:
     
     def __init__(self):
         self.loco = 3
-        self.layout = Layout(HOST, verbose=False)
+        self.layout = Layout(HOST, verbose=False, sendQueue=True) # Coalesce the slider ticks.
         z21 = self.layout.z21 # Get Z21 Socket controller
-        for f in (z21.F0, z21.F1, z21.F2, z21.F3, z21.F4, z21.F5, z21.F6, z21.F7, z21.F8,
-                  z21.F9, z21.F10, z21.F11, z21.F12):
-            z21.locoFunction(self.loco, f, OFF)
+        # All F0-F12 off, sent as 3 function group packets.
+        z21.locoFunctions(self.loco, {f: OFF for f in range(z21.F0, z21.F12 + 1)})
     
         self.w = Window((50, 50, W, H), 'Layout Controller')
         y = L/2
@@ -178,8 +177,12 @@ class Assistant:
 
     def allLocosCallback(self, sender):
         """Answer a list of all locos on the track."""
-        locos = []
-        for loco in range(0, 40):
-            print(loco, self.layout.z21.getLocoInfo(loco))
+        # Send all requests at once, then collect the replies. About one round-trip instead of 40.
+        futures = [self.layout.z21.requestLocoInfo(loco, timeout=1, retries=1) for loco in range(0, 40)]
+        for loco, future in enumerate(futures):
+            try:
+                print(loco, future.result())
+            except TimeoutError:
+                print(loco, 'No reply')
                    
 Assistant()
\ No newline at end of file
@@ -0,0 +1,62 @@
+# -*- coding: UTF-8 -*-
+# ------------------------------------------------------------------------------
+#     Copyright (c) 2023+ TYPETR
+#     Usage by MIT License
+# ..............................................................................
+#
+#    TYPETR dump-decoder.py
+#
+#   [Z21] <----- (LAN) -----> [DR5000] <----- (programming track) -----> [LokSound5]
+#
+#   Backup of all documented CVs (the DecoderProfile in z21decoders.py) of the decoder on the programming
+#   track into a JSON snapshot, one file per decoder:
+#
+#       PYTHONPATH=trainthetrain/lib python dump-decoder.py 192.168.178.242 -o loco3.json
+#       PYTHONPATH=trainthetrain/lib python dump-decoder.py --simulator  # No DR5000 needed
+#
+#   The snapshot includes the timing of the read modes that were measured for the decoder.
+#
+import argparse
+import json
+import sys
+
+from z21 import Z21
+from z21simulator import Z21Simulator
+
+def main():
+    parser = argparse.ArgumentParser(description='Dump the CVs of the decoder on the programming track to JSON.')
+    parser.add_argument('host', nargs='?', default='192.168.178.242', help='Address of the Z21/DR5000')
+    parser.add_argument('--simulator', action='store_true', help='Dump a decoder of the Z21 simulator')
+    parser.add_argument('-p', '--pages', default='0', help='Comma separated page indexes of CV257-511, e.g. 0,2')
+    parser.add_argument('-o', '--output', help='Write the JSON to this file instead of stdout')
+    args = parser.parse_args()
+
+    simulator = None
+    if args.simulator:
+        simulator = Z21Simulator()
+        simulator.start()
+        z21 = Z21(*simulator.address, timeout=1)
+    else:
+        z21 = Z21(args.host, timeout=5, retries=1)
+    try:
+        def progress(cvId, done, total):
+            print(f'\r{done}/{total} CV{cvId}  ', end='', file=sys.stderr, flush=True)
+        snapshot = z21.dumpCVs(pageIndexes=[int(page) for page in args.pages.split(',')], progress=progress)
+        print(file=sys.stderr)
+    finally:
+        z21.close()
+        if simulator is not None:
+            simulator.stop()
+    if snapshot is None:
+        print('No decoder on the programming track', file=sys.stderr)
+        return 1
+
+    s = json.dumps(snapshot, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(s + '\n')
+    else:
+        print(s)
+
+if __name__ == '__main__':
+    sys.exit(main())
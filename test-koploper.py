@@ -0,0 +1,195 @@
+# -*- coding: UTF-8 -*-
+# ------------------------------------------------------------------------------
+#     Copyright (c) 2023+ TYPETR
+#     Usage by MIT License
+# ..............................................................................
+#
+#    TYPETR test-koploper.py
+#
+#   Round-trip test of KoploperIO.write over the backups in trainthetrain/docs/koploper: unchanged backups
+#   are written byte for byte, the serializer reproduces every section, the code page and the line ends
+#   are kept and only the changed sections are serialized. A backup read from its cache file has the same
+#   tables and sections as the parsed one. Stops with an AssertionError on the first difference.
+#
+#       PYTHONPATH=trainthetrain/lib python test-koploper.py
+#
+import glob
+import os
+import shutil
+import tempfile
+
+from koploper import KoploperIO, KoploperDatabase, Section, SCHEMAS, FILE_BAAN, FILE_BLOK, FILE_KOPL, cachePath,\
+    schemaOf
+
+PATHS = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'trainthetrain/docs/koploper/*.*')))
+PATHS = [path for path in PATHS if path.endswith(('.bck', '.txt'))]
+
+tmp = tempfile.mkdtemp()
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def sectionBytes(kl):
+    return {section.name: section.raw for section in kl.sections}
+
+for path in PATHS:
+    name = os.path.basename(path)
+    data = read(path)
+
+    # Unchanged: byte for byte
+    kl = KoploperIO(path)
+    copyPath = os.path.join(tmp, name)
+    assert kl.write(copyPath) == []
+    assert read(copyPath) == data, name
+
+    # The serializer reproduces every section, as if all of them changed.
+    for section in kl.sections:
+        assert section.serialize(kl.database, kl.encoding) == section.raw, (name, section)
+
+    # Code page: .bck --> .txt (UTF-8) --> .bck
+    if path.endswith('.bck'):
+        txtPath = os.path.join(tmp, name.replace('.bck', '.txt'))
+        kl.write(txtPath)
+        read(txtPath).decode('utf-8')
+        bckPath = os.path.join(tmp, 'back-' + name)
+        KoploperIO(txtPath).write(bckPath)
+        assert read(bckPath) == data, name
+
+    # The cache: the same tables, sections and elements as the parsed backup, written byte for byte.
+    cachedPath = os.path.join(tmp, 'cached-' + name)
+    shutil.copy(path, cachedPath)
+    parsed = KoploperIO(cachedPath, cache=True)
+    cached = KoploperIO(cachedPath, cache=True)
+    assert os.path.exists(cachePath(cachedPath)) and parsed.readCache(cachedPath)
+    assert list(cached.database.tables) == list(kl.database.tables), name
+    for recordType, table in kl.database.tables.items():
+        cachedTable = cached.database[recordType]
+        assert cachedTable.section == table.section and cachedTable.keys == table.keys, (name, recordType)
+        assert list(cachedTable.counts) == list(table.counts) and cachedTable.extras == table.extras, (name, recordType)
+        for column in table.columns:
+            assert cachedTable.column(column) == table.column(column), (name, recordType, column)
+    assert [(s.name, s.newline, s.raw, s.entries) for s in cached.sections] == \
+        [(s.name, s.newline, s.raw, s.entries) for s in kl.sections], name
+    assert repr(cached.elements) == repr(kl.elements) and cached.comments == kl.comments, name
+    assert cached.detectorBlocks() == kl.detectorBlocks(), name
+    assert cached.write(copyPath) == [] and read(copyPath) == data, name
+    for section in cached.sections:
+        assert section.serialize(cached.database, cached.encoding) == section.raw, (name, section)
+
+    # A single change only serializes its section, the other sections keep their bytes.
+    before = sectionBytes(kl)
+    table = kl.database['LIJN']
+    table.set(0, 'x', table.get(0, 'x') + 1)
+    assert kl.write(copyPath) == [FILE_BAAN], name
+    after = sectionBytes(kl)
+    assert [section for section in before if before[section] != after[section]] == [FILE_BAAN]
+    assert KoploperDatabase(copyPath)['LIJN'].get(0, 'x') == table.get(0, 'x')
+
+# Windows line ends: a CRLF backup keeps them in the changed and in the unchanged sections.
+path = os.path.join(tmp, 'crlf.bck')
+data = read(PATHS[0]).replace(b'\n', b'\r\n')
+with open(path, 'wb') as f:
+    f.write(data)
+kl = KoploperIO(path)
+assert kl.write() == [] and read(path) == data
+assert all(section.newline == b'\r\n' for section in kl.sections)
+kl.database['LIJN'].set(1, 'y', 999)
+assert kl.write() == [FILE_BAAN]
+written = read(path)
+assert written.count(b'\n') == written.count(b'\r\n') == data.count(b'\r\n')
+assert sum(a != b for a, b in zip(written.split(b'\r\n'), data.split(b'\r\n'))) == 1
+
+# Appended rows follow the last row of their table, edited text lines are written as they are.
+path = os.path.join(tmp, 'Blausee-Mitholz.bck')
+shutil.copy(os.path.join(os.path.dirname(PATHS[0]), 'Blausee-Mitholz.bck'), path)
+kl = KoploperIO(path)
+table = kl.database['LIJN']
+count = len(table)
+table.append(SCHEMAS['LIJN'].convert(['LIJN', '277', '0', '10', '20', '0', '']))
+kopl = kl.section(FILE_KOPL)
+index = kopl.entries.index('KoplVer=8.3')
+kopl.setText(index, 'KoplVer=8.7')
+assert kl.write() == [FILE_BAAN, FILE_KOPL]
+lines = read(path).split(b'\n')
+assert lines.index(b'LIJN\t277\t0\t10\t20\t0\t') == lines.index(b'LIJN\t276\t1\t538\t98\t1\t') + 1
+assert b'KoplVer=8.7' in lines and b'KoplVer=8.3' not in lines
+# Saving again places the appended row once. The LF rows of lf29.dba, lf34.dba and lf58.dba share a table,
+# a new LF row follows the last one, in lf58.dba.
+table.set(count, 'y', 21)
+kl.database['LF'].append(SCHEMAS['LF'].convert(['99', '1', '', '', '', '1', '']))
+assert kl.write() == [FILE_BAAN, 'lf29.dba', 'lf34.dba', 'lf58.dba']
+data = read(path)
+assert data.count(b'\nLIJN\t277\t') == 1 and b'\nLIJN\t277\t0\t10\t21\t0\t\n' in data
+assert b'27\t21\t\x83:0U\t\t\t1\t\n99\t1\t\t\t\t1\t\n[<<>>]w31.dba' in data
+kl = KoploperIO(path)
+assert len(kl.database['LIJN']) == count + 1 and kl.section(FILE_KOPL).entries[index] == 'KoplVer=8.7'
+assert isinstance(kl.section(FILE_KOPL), Section)
+
+# Rows that did not change keep their text, also where the values would be formatted otherwise.
+data = read(path).replace(b'\nLIJN\t276\t1\t538\t', b'\nLIJN\t276\t1\t0538\t')
+with open(path, 'wb') as f:
+    f.write(data)
+kl = KoploperIO(path)
+kl.database['WSTR'].set(0, 'position', 0)
+assert kl.write() == [FILE_BAAN]
+assert b'\nLIJN\t276\t1\t0538\t' in read(path)
+assert sum(a != b for a, b in zip(read(path).split(b'\n'), data.split(b'\n'))) == 1
+# New tables need a section of the backup, rows are not written before the first marker.
+kl.database.table('ZZZZ').append(schemaOf('ZZZZ').convert(['ZZZZ', '1', '']))
+try:
+    kl.write()
+    raise AssertionError('New table without section was written')
+except ValueError:
+    pass
+assert read(path).count(b'ZZZZ') == 0
+del kl.database.tables['ZZZZ']
+kl.database.table('ZZZZ', FILE_BLOK).append(schemaOf('ZZZZ').convert(['ZZZZ', '1', '']))
+assert kl.write() == [FILE_BLOK]
+data = read(path)
+assert data.index(b'\nZZZZ\t1\t\n') > data.index(b'[<<>>]' + FILE_BLOK.encode())
+assert len(KoploperIO(path).database['ZZZZ']) == 1
+
+# Changes of a backup read from its cache: the mapped columns become arrays, the cache follows the writes.
+kl = KoploperIO(path, cache=True)
+kl = KoploperIO(path, cache=True)
+table = kl.database['LIJN']
+assert isinstance(table.columns['y'], memoryview)
+table.set(count, 'y', 22)
+table.append(SCHEMAS['LIJN'].convert(['LIJN', '278', '0', '10', '20', '0', '']))
+assert kl.write() == [FILE_BAAN]
+kl = KoploperIO(path, cache=True)
+assert kl.readCache(path) and len(kl.database['LIJN']) == count + 2 and kl.database['LIJN'].get(count, 'y') == 22
+assert KoploperIO(path).database['LIJN'].column('y') == kl.database['LIJN'].column('y')
+# A backup of the same size with the same modification time, but another content, is parsed again. Writing
+# it keeps the change.
+data = read(path)
+stat = os.stat(path)
+index = data.index(b'\nLIJN\t') + 1
+line = data[index:data.index(b'\n', index)]
+changed = line[:-2] + (b'8' if line[-2:-1] != b'8' else b'9') + line[-1:]
+with open(path, 'wb') as f:
+    f.write(data[:index] + changed + data[index + len(line):])
+os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+kl = KoploperIO(path, cache=True)
+assert kl.database['LIJN'].column('y') == KoploperIO(path).database['LIJN'].column('y')
+kl.database['LIJN'].set(1, 'x', kl.database['LIJN'].get(1, 'x'))
+kl.write()
+assert changed in read(path).split(b'\n')
+# A damaged cache is read again from the backup.
+for damage in (b'{', bytes(100)):
+    with open(cachePath(path), 'r+b') as f:
+        f.seek(80)
+        f.write(damage)
+    assert not KoploperIO(path).readCache(path)
+    assert len(KoploperIO(path, cache=True).database['LIJN']) == count + 2
+    assert KoploperIO(path).readCache(path)
+# A backup changed by another application (Koploper) is parsed again.
+with open(path, 'ab') as f:
+    f.write(b'LIJN\t279\t0\t10\t20\t0\t\n')
+assert not kl.readCache(path)
+assert len(KoploperIO(path, cache=True).database['LIJN']) == count + 3
+assert len(KoploperIO(path, cache=True).database['LIJN']) == count + 3
+
+shutil.rmtree(tmp)
+print('Done', len(PATHS), 'backups')
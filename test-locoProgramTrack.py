@@ -21,6 +21,9 @@ z21.setTrackPowerOn()
 # Try to set the CV values to default, as described in the LokSound5 manual
 # If the value already has its default value, then do nothing.
 
+# Reads the manufacturer, version and address once. From then on each CV is read from the decoder only once,
+# so the comparisons below come from the shadow, and writing a value that the decoder already has is skipped.
+z21.identifyDecoder()
 print(f'Loco {z21.cvLocoAddress}')
 
 if 0:
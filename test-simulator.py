@@ -0,0 +1,269 @@
+# -*- coding: UTF-8 -*-
+# ------------------------------------------------------------------------------
+#     Copyright (c) 2023+ TYPETR
+#     Usage by MIT License
+# ..............................................................................
+#
+#    TYPETR test-simulator.py
+#
+#   [Z21] <----- (UDP localhost) -----> [Z21Simulator]
+#
+#   Regression test of the Z21 class against the simulator in z21simulator.py. No DR5000 is needed.
+#   Stops with an AssertionError on the first difference.
+#
+import time
+
+from z21 import Z21, ON, OFF
+from z21broadcast import BroadcastFlags
+from z21feedback import detectorId
+from z21loconet import locoNetMessage, DETECTOR_REQUEST_REPORT, OPC_INPUT_REP, OPC_LOCO_SPD
+from z21simulator import Z21Simulator
+
+def waitFor(condition, timeout=1):
+    """Wait until @condition() is True, for the broadcasts that arrive through the receiver thread."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'Timeout waiting for condition'
+        time.sleep(0.005)
+
+simulator = Z21Simulator(programmingTrack=3)
+simulator.start()
+z21 = Z21(*simulator.address, timeout=1)
+
+# System, status, versions
+assert z21.serialNumber == simulator.serialNumber
+assert z21.version.commandStationId == 0x12
+assert z21.hwInfo == (0x201, 0x143)
+assert z21.firmwareVersion == '1.43'
+assert z21.lanGetCode == z21.NO_LOCK
+z21.setTrackPowerOff()
+assert z21.status['csTrackVoltageOff']
+z21.setTrackPowerOn()
+assert not z21.status['csTrackVoltageOff']
+assert z21.systemState.supplyVoltage == 18000
+
+# Broadcast flags
+z21.broadcastFlags = {'DRIVING_SWITCHING': True, 'SYSTEM_STATE': True}
+assert z21.broadcastFlags['SYSTEM_STATE'] and not z21.broadcastFlags['RMBUS']
+z21.broadcastFlags = 0
+
+# Driving and functions, the state arrives by broadcast in z21.locos
+z21.broadcasts.subscribeLoco(3).result()
+z21.broadcasts.subscribeLoco(259).result()
+z21.locoDrive(3, 50)
+z21.locoFunction(3, z21.F2_HORN, ON)
+waitFor(lambda: z21.locos[3].speed == 50 and z21.locos[3].function(2))
+z21.locoDrive(259, 20, forward=False)
+waitFor(lambda: z21.locos[259].speed == 20 and not z21.locos[259].forward)
+assert z21.getLocoInfo(3)['functions'] & 0x05 == 0x05 # F0 head light is on when moving, F2 horn
+z21.stop(3)
+z21.locoFunction(3, z21.F2_HORN, OFF)
+waitFor(lambda: z21.locos[3].speed == 0 and not z21.locos[3].function(2))
+
+# Function sends are skipped when their state is known, changes of a whole group go as one packet.
+received = simulator.received
+assert z21.locoFunctions(4, {f: OFF for f in range(13)}) == 3 # F0-F4, F5-F8, F9-F12 groups
+assert z21.locoFunctions(4, {f: OFF for f in range(13)}) == 0
+assert z21.locoFunction(4, 7, ON) == 1 and z21.locoFunction(4, 7, ON) == 0
+assert z21.locoFunction(4, 7, ON, force=True) == 1
+waitFor(lambda: simulator.received - received == 5)
+locoUpdates = []
+z21.dispatcher.unsubscribe(z21.KEY_LAN_X_LOCO_INFO, z21.locos.update) # Count the updates of the cache.
+z21.dispatcher.subscribe(z21.KEY_LAN_X_LOCO_INFO, lambda packet: locoUpdates.append(z21.locos.update(packet)))
+assert z21.getLocoInfo(4)['functions'] == 0x80 # F7
+assert z21.locos[4].functions == 0x80 and len(locoUpdates) == 1 # Current when the reply is answered, updated once.
+assert z21.locoFunctions(4, {5: ON, 6: ON, 7: OFF, 20: ON}) == 2 # Group F5-F8, single F20
+waitFor(lambda: z21.locos[4].functions == 0x100060) # F5, F6, F20 by broadcast, loco 4 was polled
+z21.locoFunctions(4, {5: OFF, 6: OFF, 20: OFF})
+
+# Programming on the main, reads are answered as if by RailCom
+z21.pomWriteCV(3, z21.CV_ACCELERATION, 20)
+assert z21.pomReadCV(3, z21.CV_ACCELERATION).result() == 20
+z21.pomWriteBit(3, z21.CV_CONFIGURATION_REGISTER, 0, 1)
+assert z21.pomReadCV(3, z21.CV_CONFIGURATION_REGISTER).result() == 13
+z21.pomWriteBit(3, z21.CV_CONFIGURATION_REGISTER, 0, 0)
+z21.pomAccessoryWriteCV(1, 3, 7)
+assert z21.pomAccessoryReadCV(1, 3).result() == 7 and z21.pomAccessoryReadCV(1, 3, output=2).result() == 0
+z21.pomScheduleProfile((3, 4, 259), {z21.CV_MASTER_VOLUME: 80, z21.CV_MEDIUM_SPEED: 128})
+assert z21.pomScheduler.flush(2) and z21.pomScheduler.written == 6
+waitFor(lambda: all(simulator.decoder(loco).readCV(z21.CV_MEDIUM_SPEED) == 128 for loco in (3, 4, 259)))
+assert simulator.decoder(259).readCV(z21.CV_MASTER_VOLUME) == 80
+
+# Turnouts, without broadcasts that could answer the getTurnoutInfo polls
+z21.broadcasts.clear()
+assert z21.getTurnoutInfo(5) == 0
+z21.setTurnout(5, True)
+assert z21.getTurnoutInfo(5) == 2
+z21.setTurnout(5, False)
+assert z21.getTurnoutInfo(5) == 1
+
+# R-Bus feedback: occupancy by broadcasts, read without traffic, edge events with the Koploper blocks
+simulator.setDetector(13, True) # Module 2, input 5, occupied before watching.
+replies = [future.result() for future in z21.watchFeedback()]
+assert replies[0].module(2) == 0x10 and z21.occupancy[13] and not z21.occupancy[14]
+z21.occupancy.setBlocks({13: 12, 14: 12, 160: (20, 21), 161: 22}) # Detector 161 is not on the R-Bus, skipped.
+events = []
+z21.occupancy.addListener(events.append)
+received = simulator.received
+simulator.setDetector(13, False)
+simulator.setDetector(160, True) # Module 20, input 8, in group index 1
+waitFor(lambda: len(events) == 2)
+assert [(event.detector, event.occupied, event.blocks) for event in events] == [(13, False, (12,)), (160, True, (20, 21))]
+assert not z21.occupancy.blockOccupied(12) and z21.occupancy.occupiedBlocks() == [20, 21]
+assert simulator.received == received # Reading needs no traffic.
+z21.unwatchFeedback()
+
+# RailCom telemetry of the subscribed loco, stored in its ring buffer
+z21.broadcasts.subscribeLoco(3).result()
+z21.watchRailCom()
+for speed in (30, 40):
+    z21.locoDrive(3, speed)
+waitFor(lambda: 3 in z21.railCom and z21.railCom.latest(3)['speed'] == 40)
+window = z21.railCom.window(3, 60)
+assert window['samples'] == 2 and window['speed'][:2] == (30, 40) and window['qos'] == 100
+assert z21.requestRailComData(259).result().address == 259 and 259 in z21.railCom
+z21.unwatchRailCom()
+z21.locoDrive(3, 0)
+z21.broadcasts.clear()
+
+# LocoNet through the LAN socket: sensors raise the same OccupancyEvent as the R-Bus, the slots follow the bus
+z21.watchLocoNet()
+waitFor(lambda: all(client.flags & BroadcastFlags.LOCONET for client in simulator.clients.values()))
+events = []
+z21.locoNet.occupancy.addListener(events.append)
+simulator.locoNetReceive(locoNetMessage(OPC_INPUT_REP, 0x06, 0x50)) # Sensor 13 occupied
+waitFor(lambda: events)
+assert (events[0].detector, events[0].occupied) == (13, True) and z21.locoNet.occupancy[13]
+slot = z21.requestLocoNetDispatch(3).result().slot
+assert slot == 1
+z21.locoNet.requestSlot(slot)
+waitFor(lambda: z21.locoNet.slots.findAddress(3) is not None)
+z21.locoNet.send(locoNetMessage(OPC_LOCO_SPD, slot, 40))
+waitFor(lambda: simulator.decoder(3).speedByte & 0x7F == 40)
+assert z21.locoNet.slots[slot].speed == 40 and z21.locoNet.slots.addresses() == {3: slot}
+simulator.setLocoNetDetector(1021, True)
+waitFor(lambda: z21.locoNet.occupancy[1021])
+assert z21.requestLocoNetDetector(DETECTOR_REQUEST_REPORT, 1021).result().occupied
+assert z21.locoNet.errors == 0
+z21.unwatchLocoNet()
+z21.locoDrive(3, 0)
+
+# CAN detectors in the occupancy model of the R-Bus, booster states as time series per output
+simulator.setCanDetector(0xD001, 5, 2, True) # Occupied before watching, reported on request.
+z21.watchCanDetectors()
+waitFor(lambda: z21.canOccupancy[detectorId(5, 3)])
+assert z21.requestCanDetector(0xD001).result().occupied
+simulator.setCanDetector(0xD001, 5, 2, False)
+waitFor(lambda: not z21.canOccupancy[detectorId(5, 3)])
+z21.unwatchCanDetectors()
+z21.watchBoosters()
+waitFor(lambda: all(client.flags & BroadcastFlags.CAN_BOOSTER for client in simulator.clients.values()))
+for current in (1200, 1800):
+    simulator.setCanBooster(0xC101, 1, current)
+simulator.setCanBooster(0xC101, 2, 3000, state=0x0002) # Short circuit
+waitFor(lambda: len(z21.boosters.outputs()) == 2 and z21.boosters.totalCurrent() == 4800)
+assert z21.boosters.shortCircuits() == [(0xC101, 2)] and z21.boosters.window(0xC101, 1, 60)['current'][:2] == (1200, 1800)
+z21.setCanBoosterPower(0xC101, False, port=1)
+waitFor(lambda: z21.boosters.latest(0xC101, 1)['current'] == 0)
+z21.setCanDeviceDescription(0xC101, 'Booster 1')
+assert z21.requestCanDeviceDescription(0xC101).result().name == 'Booster 1'
+z21.unwatchBoosters()
+
+# System state telemetry from the broadcasts, the raw samples and rollups take constant memory
+z21.watchSystemState()
+waitFor(lambda: all(client.flags & BroadcastFlags.SYSTEM_STATE for client in simulator.clients.values()))
+z21.locoDrive(3, 40)
+waitFor(lambda: simulator.decoder(3).moving)
+for _ in range(3):
+    simulator.broadcastSystemState()
+waitFor(lambda: z21.systemStates.received == 3)
+current = 60 + 150 * sum(1 for decoder in simulator.decoders.values() if decoder.moving) # As the simulator does
+assert z21.systemStates.latest()['mainCurrent'] == current and z21.systemStates.latest()['temperature'] == 35
+assert {mean for _, _, _, mean in z21.systemStates.series('mainCurrent', 60, interval=10)} == {current}
+z21.unwatchSystemState()
+z21.locoDrive(3, 0)
+older = Z21Simulator(fwVersion=0x0140) # No capabilities in the system state before FW 1.42
+older.start()
+z21Older = Z21(*older.address, timeout=1)
+assert z21Older.systemState.capabilities == 0
+z21Older.close()
+older.stop()
+
+# Programming track
+assert z21.readCV(z21.CV_LOCO_ADDRESS) == 3
+assert Z21.CV_ACCELERATION == z21.CV_ACCELERATION == 3 and Z21.CV_BRAKE_VOLUME == 259
+z21.writeCV(z21.CV_ACCELERATION, 13)
+assert z21.cvAcceleration == 13
+z21.writeCV(z21.CV_BRAKE_VOLUME, 100, pageIndex=2)
+assert z21.readCV(z21.CV_BRAKE_VOLUME, pageIndex=2) == 100
+assert z21.readCV(z21.CV_BRAKE_VOLUME) == 0 # Other page
+
+# CV batch, one page index change per page instead of two CV31/CV32 writes around every paged CV
+received = simulator.received
+batch = z21.cvBatch()
+volumes = [batch.write(z21.CV_BRAKE_VOLUME, 10 + page, pageIndex=page) for page in (3, 2, 2)]
+acceleration = batch.read(z21.CV_ACCELERATION)
+done = []
+operations = batch.execute(progress=lambda operation, index, total: done.append((operation.cvId, index, total)))
+assert operations[0] is acceleration and acceleration.value == 13
+assert all(operation.ok for operation in operations)
+assert done == [(3, 1, 4), (259, 2, 4), (259, 3, 4), (259, 4, 4)], done
+assert simulator.received - received == 8 # 4 operations, CV31, CV32 for page 2 and 3, CV32 restored
+assert z21.readCV(z21.CV_BRAKE_VOLUME, pageIndex=2) == 12 and z21.readCV(z21.CV_BRAKE_VOLUME, pageIndex=3) == 13
+assert simulator.decoder(3).readCV(32) == 0
+batch = z21.cvBatch() # In a background thread
+volume = batch.read(z21.CV_BRAKE_VOLUME, pageIndex=3)
+assert batch.start().result() == [volume] and volume.value == 13
+
+# CV shadow of the identified decoder, only the CVs that differ are written
+cvs = z21.identifyDecoder()
+assert cvs.key == (151, 1, 3) and z21.decoderCvs is cvs
+received = simulator.received
+assert z21.cvAcceleration == 13 and z21.cvAcceleration == 13 # Read once
+z21.cvAcceleration = 13 # Not written, the decoder has it.
+assert simulator.received - received == 1
+assert cvs.setProfile({z21.CV_ACCELERATION: 13, z21.CV_DECELERATION: 21, (z21.CV_BRAKE_VOLUME, 2): 12,
+    (z21.CV_BRAKE_VOLUME, 4): 50}) == 3
+writes = z21.writeDirtyCVs()
+assert [(operation.cvId, operation.pageIndex, operation.value) for operation in writes] == [(259, 4, 50)]
+assert not cvs.dirty() and z21.readCV(z21.CV_BRAKE_VOLUME, pageIndex=4) == 50
+assert simulator.received - received == 1 + 7 + 3 # Read CV4 and both pages, then write page 4 only.
+assert z21.readCV(z21.CV_BRAKE_VOLUME, pageIndex=4, verify=True) == 50
+z21.forgetDecoder()
+assert z21.identifyDecoder() is cvs and cvs.get(z21.CV_BRAKE_VOLUME, 4) == 50
+assert z21.decoderProfile.name == 'LokSound5' # Selected by CV8 and CV7, validates the writes.
+for cvId, value in ((z21.CV_MASTER_VOLUME, 200), (z21.CV_VERSION_NUMBER, 2)):
+    try:
+        z21.writeCV(cvId, value)
+        assert False, f'CV{cvId}={value} should not be written'
+    except ValueError:
+        pass
+z21.forgetDecoder()
+assert z21.decoderProfile is None
+
+# Register mode and the dump of all documented CVs
+assert z21.requestRegister(5).result() == simulator.decoder(3).readCV(z21.CV_CONFIGURATION_REGISTER) # CV29
+snapshot = z21.dumpCVs(pageIndexes=(0, 2))
+assert snapshot['address'] == 3 and snapshot['readModes']['register']['reliable']
+assert snapshot['cvs']['3']['value'] == 13 and snapshot['cvs']['259.2']['value'] == 12
+assert snapshot['cvs']['259.0']['value'] == 0 and 'CV_BRAKE_VOLUME' in snapshot['cvs']['259.2']['names']
+z21.forgetDecoder()
+
+simulator.placeOnProgrammingTrack(None)
+assert z21.readCV(z21.CV_LOCO_ADDRESS) is None # LAN_X_CV_NACK
+
+z21.close()
+simulator.stop()
+assert simulator.errors == 0, f'{simulator.errors} packets with wrong XOR'
+
+# Lost packets are resent by the retries of the RetryPolicy.
+simulator = Z21Simulator(latency=0.002, jitter=0.001, loss=0.2, seed=1)
+simulator.start()
+z21 = Z21(*simulator.address, timeout=0.05, retries=10)
+futures = [z21.requestLocoInfo(loco) for loco in range(1, 101)]
+assert [future.result()['loco'] for future in futures] == list(range(1, 101))
+assert simulator.dropped > 0
+z21.close()
+simulator.stop()
+
+print('Done', simulator)
@@ -1,4 +1,4 @@
- -*- coding: UTF-8 -*-
+# -*- coding: UTF-8 -*-
 # ------------------------------------------------------------------------------
 #     Copyright (c) 2023+ TYPETR
 #     Usage by MIT License
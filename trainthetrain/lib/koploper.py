@@ -5,7 +5,7 @@
 #     Usage by MIT License
 # ..............................................................................
 #
-#    TYPETR __init__.py
+#    TYPETR koploper.py
 #
 #   The KoploperIO class implements the methods neede for reading/writing existing databases.
 #   For that it offers an api to read/write all data that the original Koploper application can hold.
@@ -46,25 +46,1044 @@
 #   OPST4
 #   ...
 #
-import codecs
+#   The backup (.bck) holds all database files of Koploper in one text file, each of them after a line
+#   with the marker [<<>>] and the file name, the “section”. iterRecords(f) streams the lines of an open
+#   binary file and answers one record per line, selected by the parser of the section in SECTION_PARSERS:
+#   SectionStart for the marker, Row for the tab separated rows (BAAN, LIJN, WISS, WSTR, BLOK, SEIN, BZTM, ...),
+#   IniLine for kopl.ini and TextLine for the notes and sections without parser. Nothing is kept by the
+#   parser, so the memory stays the same for any size of database:
+#
+#       with open(path, 'rb') as f:
+#           for record in iterRecords(f):
+#               if isinstance(record, Row) and record.type == 'WSTR':
+#                   ...
+#
+#   KoploperDatabase keeps the rows of a backup as a column Table for each record type, with indexes on the
+#   block numbers, turnout addresses and routes, so queries don't scan the rows:
+#
+#       db = KoploperDatabase(path)
+#       db.tracksOfBlock(17)                    # LIJN line numbers of the routes from/to block 17
+#       db['WSTR'].select(('step', 'turnout', 'position'), db.route(21, 36))
+#
+#   KoploperIO keeps the bytes of each section (Section) next to its KoploperDatabase. KoploperIO.write()
+#   writes the unchanged sections as they were read and serializes only the sections of which a table or
+#   text line changed, so an unchanged backup is written byte for byte, with its code page and line ends.
+#
+#   KoploperIO(path, cache=True) keeps the parsed tables and sections in a binary sidecar file next to the
+#   backup (cachePath(path), path + .cache), keyed by the size and hash of the backup and of the SCHEMAS.
+#   The next time the cache is mapped and the integer and bool columns are memoryviews on it, so opening a
+#   large backup does not parse it again. A backup that changed is parsed and its cache written again.
+#
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+from array import array
 
 EXT_BCK = '.bck'
 EXT_TXT = '.txt'
+EXT_TMP = '.tmp'
+
+ENCODING_BCK = 'cp1252' # Koploper is a Windows application, the backup is in its code page.
+ENCODING_TXT = 'utf-8'
+ENCODING_ERRORS = 'surrogateescape' # Bytes that the code page does not define survive a round trip.
 
 FILE_BAAN = 'baan.dba'
+FILE_BLOK = 'blok.dba'
+FILE_DVRE = 'dvre.dba'
+FILE_KOPD = 'kopd.dba'
+FILE_KOPL = 'kopl.ini'
+FILE_KOPLG = 'koplg.dba'
+FILE_LOKO = 'loko.ini'
+FILE_SAVE = 'save.txt'
+FILE_SNEL = 'snel.dba'
 
 ID_BAAN = 'BAAN'
 ID_LIJN = 'LIJN'
+ID_BLOK = 'BLOK'
+ID_DVRE = 'DVRE' # Type of the rows in dvre.dba, that have no type field.
+ID_LF = 'LF' # Type of the rows in the lf<n>.dba files.
 
 TAG_FILEPATH = '[<<>>]' # Marker for file name data below
+TAG_FILEPATH_BYTES = TAG_FILEPATH.encode()
+TAG_GROUP = '<@' # dvre.dba: the rows below belong to this number.
+FIELD_SEPARATOR = '\t'
+
+RE_RECORD_ID = re.compile(r'([A-Za-z_]+)(.*)') # SEIN1 --> ('SEIN', '1'), BTTT1|2 --> ('BTTT', '1|2')
+
+def values(fields):
+    """Answer the list of translated values of the list of @fields.
+
+    >>> values(['LIJN', '10', 'TRUE', 'FALSE', ''])
+    ['LIJN', 10, True, False, '']
+    """
+    vLine = [] # Line with translated values
+    for value in fields:
+        if value == 'FALSE':
+            vLine.append(False)
+        elif value == 'TRUE':
+            vLine.append(True)
+        else:
+            try:
+                v = int(value)
+                vf = float(value)
+                if v == int(vf):
+                    vLine.append(v)
+                else:
+                    vLine.append(vf)
+            except ValueError:
+                vLine.append(value)
+    return vLine
+
+#   R E C O R D S
+
+class Record:
+    """Base class of the records that iterRecords() answers, one for each line of the backup. @section is
+    the name of the database file that the line belongs to, None for the lines before the first marker."""
+    __slots__ = ('section',)
+
+    def __init__(self, section):
+        self.section = section
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.section} {self.text()!r}>'
+
+    def text(self):
+        """Answer the line of the record, without line end."""
+        raise NotImplementedError
+
+class SectionStart(Record):
+    """Marker line [<<>>]name that starts the @section."""
+    __slots__ = ()
+
+    def text(self):
+        return TAG_FILEPATH + self.section
+
+class TextLine(Record):
+    """Line of free text, e.g. the notes in d<n>.dba and w<n>.dba, or the lines of unknown sections."""
+    __slots__ = ('line',)
+
+    def __init__(self, section, line):
+        Record.__init__(self, section)
+        self.line = line
+
+    def text(self):
+        return self.line
+
+class IniLine(TextLine):
+    """Line of an ini file as kopl.ini: a [group] or a key=value line of the current @group.
+
+    >>> line = IniLine(FILE_KOPL, 'KoplVer=8.3', 'Instellingen')
+    >>> line.group, line.key, line.value
+    ('Instellingen', 'KoplVer', '8.3')
+    """
+    __slots__ = ('group',)
+
+    def __init__(self, section, line, group):
+        TextLine.__init__(self, section, line)
+        self.group = group
+
+    def _get_key(self):
+        return self.line.split('=', 1)[0]
+    key = property(_get_key)
+
+    def _get_value(self):
+        parts = self.line.split('=', 1)
+        if len(parts) == 2:
+            return parts[1]
+        return None
+    value = property(_get_value)
+
+class Row(Record):
+    """Tab separated row of a database file. @type is the record type (BAAN, LIJN, SEIN, ...), @key is the
+    rest of the first field (e.g. 1 of SEIN1, empty for the baan.dba rows) and @fields is the list of all
+    fields as in the line. Most rows end with a tab, the empty last field is kept in @fields.
+
+    >>> row = Row(FILE_BAAN, ID_LIJN, '', 'LIJN\\t10\\t0\\t218\\t228\\t0\\t'.split(FIELD_SEPARATOR))
+    >>> row, len(row.fields), row.data, row.values
+    (<Row baan.dba 'LIJN\\t10\\t0\\t218\\t228\\t0\\t'>, 7, ['LIJN', '10', '0', '218', '228', '0'], ['LIJN', 10, 0, 218, 228, 0])
+    """
+    __slots__ = ('type', 'key', 'fields')
+
+    def __init__(self, section, type, key, fields):
+        Record.__init__(self, section)
+        self.type = type
+        self.key = key
+        self.fields = fields
+
+    def __getitem__(self, index):
+        return self.fields[index]
+
+    def __len__(self):
+        return len(self.fields)
+
+    def text(self):
+        return FIELD_SEPARATOR.join(self.fields)
+
+    def _get_data(self):
+        """Answer the fields without the empty field after the closing tab."""
+        fields = self.fields
+        if len(fields) > 1 and not fields[-1]:
+            return fields[:-1]
+        return fields
+    data = property(_get_data)
+
+    def _get_values(self):
+        return values(self.data)
+    values = property(_get_values)
+
+    def _get_record(self):
+        """Answer the typed record of the row, converted by the Schema of its type."""
+        return schemaOf(self.type).convert(self.fields, self.key)
+    record = property(_get_record)
+
+#   P A R S E R S
+
+class SectionParser:
+    """Parser of the lines of one section into records. The base class answers free text."""
+
+    def __init__(self, section):
+        self.section = section
+
+    def parse(self, line):
+        return TextLine(self.section, line)
+
+class TableParser(SectionParser):
+    """Tab separated rows that start with the record type, optionally followed by a key, e.g. LIJN, SEIN1
+    or BTTT1|2 in kopd.dba. Lines that do not start with a type (empty lines) are answered as text.
+
+    >>> parser = TableParser(FILE_KOPD)
+    >>> row = parser.parse('BTTT1|2\\t1\\t2\\t')
+    >>> row.type, row.key, row.fields
+    ('BTTT', '1|2', ['BTTT1|2', '1', '2', ''])
+    >>> parser.parse('')
+    <TextLine kopd.dba ''>
+    """
+    def __init__(self, section):
+        SectionParser.__init__(self, section)
+        self.ids = {} # Cache of first field --> (type, key), as most types repeat.
+
+    def parse(self, line):
+        fields = line.split(FIELD_SEPARATOR)
+        id = fields[0]
+        typeKey = self.ids.get(id)
+        if typeKey is None:
+            m = RE_RECORD_ID.match(id)
+            if m is None:
+                return TextLine(self.section, line)
+            typeKey = self.ids[id] = m.groups()
+        return Row(self.section, typeKey[0], typeKey[1], fields)
+
+class DvreParser(SectionParser):
+    """dvre.dba: rows without type field, in groups that start with a line <@number. The rows get type DVRE
+    and the number of their group as key.
+
+    >>> parser = DvreParser(FILE_DVRE)
+    >>> parser.parse('<@17')
+    <TextLine dvre.dba '<@17'>
+    >>> row = parser.parse('9\\t4\\t1\\t')
+    >>> row.type, row.key, row.data
+    ('DVRE', '17', ['9', '4', '1'])
+    """
+    def __init__(self, section):
+        SectionParser.__init__(self, section)
+        self.group = ''
+
+    def parse(self, line):
+        if line.startswith(TAG_GROUP):
+            self.group = line[len(TAG_GROUP):]
+            return TextLine(self.section, line)
+        if not line:
+            return TextLine(self.section, line)
+        return Row(self.section, ID_DVRE, self.group, line.split(FIELD_SEPARATOR))
+
+class LfParser(SectionParser):
+    """lf<number>.dba: rows without type field, they get type LF and the number of the file as key."""
+
+    def __init__(self, section):
+        SectionParser.__init__(self, section)
+        self.key = section[2:-4]
+
+    def parse(self, line):
+        if not line:
+            return TextLine(self.section, line)
+        return Row(self.section, ID_LF, self.key, line.split(FIELD_SEPARATOR))
+
+class IniParser(SectionParser):
+    """Ini files as kopl.ini, answering IniLine with the current [group]."""
+
+    def __init__(self, section):
+        SectionParser.__init__(self, section)
+        self.group = None
+
+    def parse(self, line):
+        if line.startswith('[') and line.endswith(']'):
+            self.group = line[1:-1]
+        return IniLine(self.section, line, self.group)
+
+SECTION_PARSERS = { # Section name --> parser class
+    FILE_BAAN: TableParser, # BAAN, LIJN, WISS, PBLK, LIBL, WSTR, INBL, BZWL
+    FILE_BLOK: TableParser, # BLKT, BLOK, BLVN, BLRI, DLCK
+    FILE_KOPD: TableParser, # SEIN, SEBE, BZTM, BTTT, BTYP, OPST, LOKO, TYPE, ACTI, ACLO, DVHE, DRGL, ...
+    FILE_SAVE: TableParser, # DATE, LSAV, BSAV, ASAV, WSAV, DSAV, OPSV
+    FILE_SNEL: TableParser, # snel
+    FILE_DVRE: DvreParser,
+    FILE_KOPL: IniParser,
+    FILE_KOPLG: IniParser,
+    FILE_LOKO: IniParser,
+}
+SECTION_PATTERNS = ( # (Regular expression of section names, parser class), the other sections are text.
+    (re.compile(r'lf\d+\.dba$'), LfParser),
+)
+
+def sectionParser(section):
+    """Answer a new parser for the lines of @section.
+
+    >>> sectionParser(FILE_BLOK), sectionParser('lf29.dba').key, sectionParser('w31.dba') # doctest: +ELLIPSIS
+    (<...TableParser object at ...>, '29', <...SectionParser object at ...>)
+    """
+    parserClass = SECTION_PARSERS.get(section)
+    if parserClass is None:
+        parserClass = SectionParser
+        for pattern, patternClass in SECTION_PATTERNS:
+            if pattern.match(section):
+                parserClass = patternClass
+                break
+    return parserClass(section)
+
+def fileEncoding(path):
+    """Answer the encoding of the backup file at @path, by its extension. The .txt files are the backups
+    converted to UTF-8."""
+    if path.endswith(EXT_BCK):
+        return ENCODING_BCK
+    if path.endswith(EXT_TXT):
+        return ENCODING_TXT
+    raise ValueError(f'Unknown type of data file: {path}')
+
+def iterRecords(f, encoding=ENCODING_BCK):
+    """Answer the generator of the records of the lines of the binary file @f, decoded with @encoding.
+    The lines are read one at the time, the parser only keeps the state of the current section.
+
+    >>> import collections
+    >>> with open('../docs/koploper/Blausee-Mitholz.bck', 'rb') as f:
+    ...     counts = collections.Counter((r.section, r.type) for r in iterRecords(f) if isinstance(r, Row))
+    >>> counts[(FILE_BAAN, 'WSTR')], counts[(FILE_BAAN, ID_LIJN)], counts[(FILE_BLOK, 'BLRI')], counts[(FILE_KOPD, 'SEIN')]
+    (1078, 552, 135, 9)
+    >>> counts[(FILE_DVRE, ID_DVRE)], counts[('lf58.dba', ID_LF)], counts[(FILE_SNEL, 'snel')]
+    (167, 4, 289)
+    >>> with open('../docs/koploper/Blausee-Mitholz.bck', 'rb') as f:
+    ...     records = iterRecords(f)
+    ...     next(records), next(records), next(records)
+    (<TextLine None '# Koploper versie: 8.3 / 7\\t Backup gemaakt op: 31-1-2015 21:16:42'>, <TextLine None '[<save.txt>]'>, <SectionStart baan.dba '[<<>>]baan.dba'>)
+    """
+    parser = SectionParser(None)
+    for line in f:
+        line = line.decode(encoding, ENCODING_ERRORS).rstrip('\r\n')
+        if line.startswith(TAG_FILEPATH):
+            section = line[len(TAG_FILEPATH):]
+            parser = sectionParser(section)
+            yield SectionStart(section)
+        else:
+            yield parser.parse(line)
+
+#   S C H E M A S
+
+COLUMN_INT = 'i' # Integer, None if the field is empty.
+COLUMN_BOOL = 'b' # TRUE/FALSE, None if the field is empty.
+COLUMN_STR = 's' # Text as in the field.
+
+BOOLS = {'TRUE': True, 'FALSE': False, '': None}
+
+class Numbers(dict):
+    """Dictionary of the integer texts that are common in the rows, as most fields are small numbers. A
+    lookup is faster than int(), other texts are converted by int() without being kept.
+
+    >>> NUMBERS['12'], NUMBERS[''], NUMBERS['-4096'], NUMBERS['-4096'] is NUMBERS['-4096']
+    (12, None, -4096, False)
+    """
+    def __missing__(self, text):
+        return int(text)
+
+NUMBERS = Numbers((str(value), value) for value in range(-1, 1024))
+NUMBERS[''] = None
+BOOL_TEXTS = {True: 'TRUE', False: 'FALSE'}
+
+class TableRecord:
+    """Base class of the typed records of a Schema. The subclasses are made by the Schema, with the columns
+    as __slots__. @key is the key of the row (e.g. 1 of SEIN1), @count is the number of fields of the row
+    and @extra is the list of fields after the columns of the schema, as text. Indexing answers the value
+    of the field at the same index as in the row, so record[BLOK_ID] is record.block."""
+    __slots__ = ('key', 'count', 'extra')
+    SCHEMA = None
+
+    def __repr__(self):
+        parts = [self.__class__.__name__]
+        if self.key:
+            parts.append(self.key)
+        parts.extend(f'{name}={getattr(self, name)!r}' for name in self.SCHEMA.named)
+        return f'<{" ".join(parts)}>'
+
+    def __getitem__(self, index):
+        schema = self.SCHEMA
+        if index < schema.offset:
+            return schema.type + self.key
+        return getattr(self, schema.names[index - schema.offset])
+
+    def asDict(self):
+        """Answer the columns of the record as dictionary."""
+        return {name: getattr(self, name) for name in self.SCHEMA.names}
+
+    def fields(self):
+        """Answer the list of fields of the record as text, as in the row."""
+        return self.SCHEMA.format(self)
+
+class Schema:
+    """Columns of the rows of @recordType. @types is the string with the type of each column, as COLUMN_INT,
+    COLUMN_BOOL and COLUMN_STR, @names the column names separated by spaces, from the first column on.
+    The columns without name (or with name -) are called field<index>, with the index of the field in the
+    row. @offset is the index of the first column, 1 as the first field is the type, 0 for the rows of
+    DVRE and LF that have no type field.
+
+    The schema compiles its types into a converter function for each length of row, that makes a record in
+    a single expression, without the int/float trials of values(). A field that does not fit its type (e.g. text in an integer
+    column) makes the converter fall back to the conversion field by field, keeping such fields as text.
+
+    >>> schema = Schema(ID_LIJN, 'iiiii', 'line end x y')
+    >>> record = schema.convert('LIJN\\t10\\t1\\t218\\t228\\t0\\t'.split(FIELD_SEPARATOR))
+    >>> record, record.x, record[3], record.field5, record.extra, schema.format(record)
+    (<LIJNRecord line=10 end=1 x=218 y=228>, 218, 218, 0, [''], ['LIJN', '10', '1', '218', '228', '0', ''])
+    >>> record = schema.convert(['LIJN', '10', 'A', '', '228'])
+    >>> record.end, record.x, record.field5, schema.format(record)
+    ('A', None, None, ['LIJN', '10', 'A', '', '228'])
+    """
+    def __init__(self, recordType, types, names='', offset=1):
+        self.type = recordType
+        self.types = types
+        self.offset = offset
+        names = names.split()
+        self.names = tuple(names[index] if index < len(names) and names[index] != '-' else f'field{index + offset}'
+            for index in range(len(types)))
+        self.named = tuple(name for name in names if name != '-') # Columns shown in the record __repr__
+        self.recordClass = self._makeRecordClass()
+        self.converters = {} # Number of fields --> compiled converter function
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.type} columns={len(self.types)}>'
+
+    def _makeRecordClass(self):
+        """Answer the TableRecord subclass with the columns as slots."""
+        arguments = ''.join(f', {name}' for name in self.names)
+        assignments = ''.join(f'\n    self.{name} = {name}' for name in self.names)
+        source = f"""
+def __init__(self, key, count, extra{arguments}):
+    self.key = key
+    self.count = count
+    self.extra = extra{assignments}
+"""
+        namespace = {}
+        exec(source, namespace)
+        return type(f'{self.type}Record', (TableRecord,), dict(__slots__=self.names, __init__=namespace['__init__'], SCHEMA=self))
+
+    def convert(self, fields, key=''):
+        """Answer the record of the list of text @fields of a row, with @key."""
+        converter = self.converters.get(len(fields))
+        if converter is None:
+            converter = self.converters[len(fields)] = self._compile(len(fields))
+        return converter(fields, key)
+
+    def _compile(self, count):
+        """Answer the converter function (fields, key) --> record for the rows of @count fields. The columns
+        after the last field get their empty value without conversion."""
+        end = self.offset + len(self.types) # Index of the first extra field
+        expressions = []
+        for index, columnType in enumerate(self.types, self.offset):
+            if index >= count:
+                expressions.append("''" if columnType == COLUMN_STR else 'None')
+            elif columnType == COLUMN_INT:
+                expressions.append(f'NUMBERS[f[{index}]]')
+            elif columnType == COLUMN_BOOL:
+                expressions.append(f'BOOLS[f[{index}]]')
+            else:
+                expressions.append(f'f[{index}]')
+        extra = f'f[{end}:]' if count > end else '[]'
+        values = ''.join(f',\n            {expression}' for expression in expressions)
+        source = f"""
+def convert(f, key):
+    try:
+        return Record(key, {count}, {extra}{values})
+    except (ValueError, KeyError):
+        return convertFields(f, key)
+"""
+        namespace = dict(NUMBERS=NUMBERS, BOOLS=BOOLS, Record=self.recordClass, convertFields=self._convertFields)
+        exec(source, namespace)
+        return namespace['convert']
+
+    def _convertFields(self, f, key):
+        """Answer the record of the fields @f, converting field by field. Fields that do not fit the type of
+        their column are kept as text."""
+        count = len(f)
+        f = f + [''] * (self.offset + len(self.types) - count)
+        values = [convertValue(columnType, f[index]) for index, columnType in enumerate(self.types, self.offset)]
+        return self.recordClass(key, count, f[self.offset + len(self.types):], *values)
+
+    def format(self, record):
+        """Answer the list of fields of @record as text, as in the row."""
+        fields = [self.type + record.key] if self.offset else []
+        fields.extend(formatValue(getattr(record, name)) for name in self.names)
+        fields.extend(record.extra)
+        return fields[:record.count]
+
+def convertValue(columnType, text):
+    """Answer the value of field @text in a column of @columnType. Text that does not fit the type is kept."""
+    if not text:
+        return '' if columnType == COLUMN_STR else None
+    if columnType == COLUMN_INT:
+        try:
+            return int(text)
+        except ValueError:
+            return text
+    if columnType == COLUMN_BOOL:
+        return BOOLS.get(text, text)
+    return text
+
+def formatValue(value):
+    """Answer @value as the text of its field, the reverse of convertValue()."""
+    if value is None:
+        return ''
+    if value is True or value is False:
+        return BOOL_TEXTS[value]
+    return str(value)
+
+# Column types of the record types, as found in the backups of Koploper 8.0-8.7. Most columns are not known
+# yet, they get the name field<index>. The rows of different length (e.g. WSTR, LOKO) share one schema.
+SCHEMAS = {schema.type: schema for schema in (
+    # baan.dba
+    Schema(ID_BAAN, 'sisiiisiibbbbbiibiiiibbibbiiiib', 'kind page text x y - font fontSize'),
+    Schema(ID_LIJN, 'iiiii', 'line end x y'), # Line of the track drawing, a row for each end
+    Schema('WISS', 'iiiiisiisiibbissiiibbiibsbibbbiiis', 'address page'), # Turnout
+    Schema('PBLK', 'iiii', 'block x - y'), # Position of the block number in the drawing
+    Schema('LIBL', 'iiiii'),
+    Schema('INBL', 'iiiii'),
+    Schema('WSTR', 'iiiiiiiiiiiisibsissiisbbiibbbi', 'fromBlock toBlock line - - - step turnout position'), # Route step
+    Schema('BZWL', 'iiiii', 'detector - line'),
+    # blok.dba
+    Schema('BLKT', 'ss', 'kind text'),
+    Schema(ID_BLOK, 'ibbiibibiiiiiiiiiisbibiiibibbbbbbbbsis', '- - - block - - - - - - detector - - - - - - - detectors'),
+    Schema('BLVN', 'iiiiiiissii', '- fromBlock toBlock'),
+    Schema('BLRI', 'iiibiib', 'block'),
+    Schema('DLCK', 'iiibs'),
+    # dvre.dba
+    Schema(ID_DVRE, 'iiiibbsiiiiibsbsiiiiiiiiiiibiiibiiibi', offset=0),
+    # kopd.dba
+    Schema('ACLO', 'sbiiiiibsiisissiisis', 'name'),
+    Schema('ACTI', 'siiisiisiissiiiiiiiiisbbsbiibbissss', 'name'),
+    Schema('BLAV', 'isiiiibbbbbbbbbbbbbiibbbsbsibiibbiiiiiiiibiiiib'),
+    Schema('BTTT', 'iiiiiiiiiii'),
+    Schema('BTYP', 'sbbbbiiiiiiiiiiiibiii', 'name'),
+    Schema('BZTM', 'iibbsbiiiiibs'),
+    Schema('DRGL', 'ssibssissssbsssiisibbibsib', 'name'),
+    Schema('DVHE', 'siibsbibiibibiibibbb', 'name block'),
+    Schema('LOKO', 'sssiibbbiiibiiibbbiiiiiiiiiiissiibbibisibiiiiisi', 'name'),
+    Schema('OPST', 'ssbbisbiisbiibissiiiisiiiib', 'name'),
+    Schema('SEBE', 'siibiibsbbsiibibbiib', 'name'),
+    Schema('SEIN', 'siibiibiiiiiiiissssssssiiiiiiiiiiiiiiiibbbbbbbbiiiissssiiiiiiiibbbbib', 'name'),
+    Schema('STUU', 'sbibsbsbsbsiibbbisibsbsbsbsbsbsbsbsbsbsbsbs', 'name'),
+    Schema('TABL', 'sissiisis', 'name'),
+    Schema('TYPE', 'siiiiiiisibbiib', 'name'),
+    Schema('WLBK', 's'),
+    # lf<n>.dba
+    Schema(ID_LF, 'iisssi', offset=0),
+    # save.txt
+    Schema('ASAV', 'ibs'),
+    Schema('BSAV', 'iiiibbbsissiibiiiiis'),
+    Schema('DATE', 'ii', 'date time'),
+    Schema('DSAV', 'iiiiiiiiiiiiiiiiiiiiiii'),
+    Schema('LSAV', 'iiiiibbbiibbbissbibissiiiiiiisbsiiiiibbssssssssssssssssbbsibibbibssissbiibssbbbssiibiibiiiiibiibiiiiiibiiiiiiiiiiissiiiiiiiiiiiiiiiiiiiiiiiiiiibi'),
+    Schema('OPSV', 'issbiii'),
+    Schema('TSAV', 'iii'),
+    Schema('WSAV', 'iisiiibbss'),
+    # snel.dba
+    Schema('snel', 'siiibi'),
+)}
+
+def schemaOf(recordType):
+    """Answer the Schema of @recordType. Unknown types get a schema without columns, the fields of their
+    records are all in record.extra."""
+    schema = SCHEMAS.get(recordType)
+    if schema is None:
+        schema = SCHEMAS[recordType] = Schema(recordType, '')
+    return schema
+
+#   D A T A B A S E
+
+NULL_INT = -0x8000000000000000 # Empty field in an integer column
+NULL_BOOL = -1 # Empty field in a bool column
+COLUMN_ARRAYS = {COLUMN_INT: 'q', COLUMN_BOOL: 'b'} # Column type --> array typecode, the text columns are lists.
+INDEX_TYPECODE = 'L' # Row indexes
+COUNT_TYPECODE = 'H' # Number of fields of the rows
+
+# Columns with block numbers, turnout addresses and the route ID (fromBlock, toBlock), the secondary indexes
+# that KoploperDatabase keeps for each table that has them.
+BLOCK_COLUMNS = ('block', 'fromBlock', 'toBlock')
+TURNOUT_COLUMNS = ('address', 'turnout')
+ROUTE_COLUMNS = ('fromBlock', 'toBlock')
+ID_WISS = 'WISS'
+ID_WSTR = 'WSTR'
+
+def typecodeOf(column):
+    """Answer the typecode of the array @column, or the format of a memoryview column of the cache file."""
+    if isinstance(column, memoryview):
+        return column.format
+    return column.typecode
+
+class Table:
+    """Rows of one record type as columns: array('q') for the integer columns, array('b') for the bool
+    columns and lists for the text columns. Empty fields are stored as NULL_INT and NULL_BOOL, answered as
+    None. A column that gets a value that does not fit its array (e.g. text in an integer column) becomes
+    a list. The indexes value --> array of row indexes are made on first use and kept until the column
+    changes. The integer and bool columns of a table from the cache file (see KoploperIO.readCache) are
+    memoryviews on the mapped file, copied into an array when rows are appended.
+
+    >>> table = Table(Schema(ID_LIJN, 'iiiii', 'line end x y'))
+    >>> table.extend(SCHEMAS[ID_LIJN].convert(['LIJN', str(line), str(end), str(10 * line), '20', '0', ''])
+    ...     for line in (1, 2, 3) for end in (0, 1))
+    >>> table, table.columns['x'], table.column('x'), table.get(4, 'x')
+    (<Table LIJN rows=6>, array('q', [10, 10, 20, 20, 30, 30]), [10, 10, 20, 20, 30, 30], 30)
+    >>> table.where('line', 2), table.filter(lambda line, end: line > 1 and end == 0, 'line', 'end')
+    (array('L', [2, 3]), array('L', [2, 4]))
+    >>> table.select(('line', 'x'), table.where('end', 1)), table.groupBy('x', (0, 1, 2))
+    ([(1, 10), (2, 20), (3, 30)], {10: array('L', [0, 1]), 20: array('L', [2])})
+    >>> table.set(5, 'x', None), table.record(5), table.where('x', 30), table.set(0, 'y', 'A'), table.columns['y'][:2]
+    (None, <LIJNRecord line=3 end=1 x=None y=20>, array('L', [4]), None, ['A', 20])
+    >>> table.where('line', 1).append(5), table.groupBy('line')[1].append(5), table.where('line', 1)
+    (None, None, array('L', [0, 1]))
+    >>> _ = table.index('end'), table.index(('line', 'end')); table.set(0, 'line', 1); sorted(table.indexes, key=str)
+    ['end', 'x']
+    """
+    def __init__(self, schema, section=None):
+        self.schema = schema
+        self.section = section
+        self.columns = {name: self._newColumn(columnType) for name, columnType in zip(schema.names, schema.types)}
+        self.keys = [] # Key of each row, as 1 of SEIN1
+        self.counts = array(COUNT_TYPECODE) # Number of fields of each row
+        self.extras = [] # Fields after the columns of the schema, mostly the empty field after the last tab
+        self.indexes = {} # Column name or tuple of names --> {value: array of row indexes}
+        self.changed = False
+        self.changedRows = set() # Indexes of the placed rows that were set, the other rows keep their text.
+        self.placed = 0 # Number of rows that have their place in a Section of the backup, for the writer.
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.schema.type} rows={len(self)}>'
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _newColumn(self, columnType):
+        if columnType in COLUMN_ARRAYS:
+            return array(COLUMN_ARRAYS[columnType])
+        return []
+
+    def _array(self, column):
+        """Answer @column as array, a copy of the view of a column in the cache file, which cannot grow."""
+        if isinstance(column, memoryview):
+            return array(column.format, column.tobytes())
+        return column
+
+    #   S T O R A G E
+
+    def _encode(self, name, values):
+        """Answer the @values for the storage of column @name, with None as NULL_INT or NULL_BOOL."""
+        column = self.columns[name]
+        if isinstance(column, list):
+            return values
+        if typecodeOf(column) == COLUMN_ARRAYS[COLUMN_BOOL]:
+            return [NULL_BOOL if value is None else value for value in values]
+        return [NULL_INT if value is None else value for value in values]
+
+    def _decode(self, name, values):
+        """Answer the list of stored @values of column @name, with NULL_INT and NULL_BOOL as None."""
+        column = self.columns[name]
+        if isinstance(column, list):
+            return list(values)
+        if typecodeOf(column) == COLUMN_ARRAYS[COLUMN_BOOL]:
+            return [None if value == NULL_BOOL else bool(value) for value in values]
+        return [None if value == NULL_INT else value for value in values]
+
+    def _store(self, name, values):
+        """Append the list of @values to column @name. A column that cannot hold them becomes a list."""
+        column = self.columns[name] = self._array(self.columns[name])
+        encoded = self._encode(name, values)
+        if not isinstance(column, list):
+            try:
+                column.extend(array(column.typecode, [True if value is True else value for value in encoded]))
+                return
+            except (TypeError, OverflowError):
+                column = self.columns[name] = self._decode(name, column)
+        column.extend(values)
+
+    def extend(self, records):
+        """Append the @records of the schema, column by column."""
+        records = list(records)
+        if not records:
+            return
+        for name in self.schema.names:
+            self._store(name, [getattr(record, name) for record in records])
+        self.keys.extend(record.key for record in records)
+        self.counts = self._array(self.counts)
+        self.counts.extend(record.count for record in records)
+        self.extras.extend(record.extra for record in records)
+        self.indexes = {}
+        self.changed = True
+
+    def append(self, record):
+        self.extend((record,))
+
+    #   R O W S
+
+    def get(self, index, name):
+        """Answer the value of column @name of row @index."""
+        value = self.columns[name][index]
+        if isinstance(self.columns[name], list):
+            return value
+        return self._decode(name, (value,))[0]
+
+    def set(self, index, name, value):
+        """Set column @name of row @index to @value. The indexes on the column are dropped."""
+        column = self.columns[name]
+        if not isinstance(column, list):
+            try:
+                column[index] = self._encode(name, (value,))[0]
+            except (TypeError, OverflowError):
+                column = self.columns[name] = self._decode(name, column)
+        if isinstance(column, list):
+            column[index] = value
+        for names in list(self.indexes):
+            if name == names or (isinstance(names, tuple) and name in names):
+                del self.indexes[names]
+        self.changed = True
+        self.changedRows.add(index)
+
+    def column(self, name):
+        """Answer the list of the values of column @name, with None for empty fields."""
+        return self._decode(name, self.columns[name])
+
+    def record(self, index):
+        """Answer row @index as record of the schema."""
+        return self.schema.recordClass(self.keys[index], self.counts[index], self.extras[index],
+            *(self.get(index, name) for name in self.schema.names))
+
+    def records(self, indexes=None):
+        """Answer the generator of the records of the rows at @indexes, default all rows."""
+        if indexes is not None:
+            for index in indexes:
+                yield self.record(index)
+            return
+        # All rows: decode each column once.
+        recordClass = self.schema.recordClass
+        columns = [self.column(name) for name in self.schema.names]
+        for index, values in enumerate(zip(*columns) if columns else [()] * len(self)):
+            yield recordClass(self.keys[index], self.counts[index], self.extras[index], *values)
+
+    #   Q U E R I E S
+
+    def _values(self, names):
+        """Answer the iterator of the values of column @names, tuples if @names is a tuple of column names."""
+        if isinstance(names, tuple):
+            return zip(*(self.column(name) for name in names))
+        return self.column(names)
+
+    def index(self, names):
+        """Answer the index {value: array of row indexes} of column @names, or of the tuples of values of the
+        columns if @names is a tuple of column names."""
+        index = self.indexes.get(names)
+        if index is None:
+            index = self.indexes[names] = {}
+            for rowIndex, value in enumerate(self._values(names)):
+                rows = index.get(value)
+                if rows is None:
+                    rows = index[value] = array(INDEX_TYPECODE)
+                rows.append(rowIndex)
+        return index
+
+    def where(self, names, value):
+        """Answer a new array of the indexes of the rows where column @names equals @value, by the index of
+        the column. @names can be a tuple of column names with a tuple @value."""
+        return array(INDEX_TYPECODE, self.index(names).get(value, ()))
+
+    def filter(self, test, *names):
+        """Answer the array of the indexes of the rows where @test(values) is true, called with the values of
+        the columns @names of each row."""
+        return array(INDEX_TYPECODE, (index for index, values in enumerate(zip(*(self.column(name) for name in names)))
+            if test(*values)))
+
+    def select(self, names, indexes=None):
+        """Answer the list of the tuples of the values of the columns @names, of the rows at @indexes, default
+        all rows."""
+        columns = [self.column(name) for name in names]
+        if indexes is None:
+            return list(zip(*columns))
+        return [tuple(column[index] for column in columns) for index in indexes]
+
+    def groupBy(self, names, indexes=None):
+        """Answer the dictionary {value: array of row indexes} of column @names, of the rows at @indexes,
+        default all rows. The arrays are new, changing them does not change the index."""
+        if indexes is None:
+            return {value: array(INDEX_TYPECODE, rows) for value, rows in self.index(names).items()}
+        values = list(self._values(names))
+        groups = {}
+        for index in indexes:
+            value = values[index]
+            rows = groups.get(value)
+            if rows is None:
+                rows = groups[value] = array(INDEX_TYPECODE)
+            rows.append(index)
+        return groups
+
+    #   C A C H E
+
+    def cacheContents(self, blocks, encoding):
+        """Add the columns, keys, field counts and extra fields of the table to the CacheBlocks @blocks,
+        answer the dictionary with their (kind, offset, length). The integer and bool columns are stored as
+        the bytes of their array, the text columns as lines in @encoding and the columns that became a list
+        as the lines of their field texts."""
+        columns = {}
+        for name, columnType in zip(self.schema.names, self.schema.types):
+            column = self.columns[name]
+            if not isinstance(column, list):
+                columns[name] = (typecodeOf(column),) + blocks.add(column)
+            elif columnType == COLUMN_STR and all(isinstance(value, str) for value in column):
+                columns[name] = (CACHE_TEXT,) + blocks.add(joinLines(column, encoding))
+            else:
+                columns[name] = (CACHE_FIELDS,) + blocks.add(joinLines([formatValue(value) for value in column], encoding))
+        return dict(type=self.schema.type, section=self.section, rows=len(self), columns=columns,
+            keys=blocks.add(joinLines(self.keys, encoding)),
+            counts=blocks.add(self.counts),
+            extras=blocks.add(joinLines([FIELD_SEPARATOR.join(extra) for extra in self.extras], encoding)))
+
+    @classmethod
+    def fromCache(cls, contents, view, encoding):
+        """Answer the Table of the @contents, as answered by cacheContents(), with the data in the
+        memoryview @view. The integer and bool columns and the field counts are casts of @view, no copies."""
+        table = cls(schemaOf(contents['type']), contents['section'])
+        schema = table.schema
+        rows = contents['rows']
+        for name, (kind, offset, length) in contents['columns'].items():
+            data = view[offset:offset + length]
+            if kind == CACHE_TEXT:
+                column = splitLines(data, rows, encoding)
+            elif kind == CACHE_FIELDS:
+                columnType = schema.types[schema.names.index(name)]
+                column = [convertValue(columnType, text) for text in splitLines(data, rows, encoding)]
+            elif kind in COLUMN_ARRAYS.values():
+                column = data.cast(kind)
+            else:
+                raise ValueError(f'Unknown kind {kind!r} of column {name} in the cache of {schema.type}')
+            table.columns[name] = column
+        offset, length = contents['keys']
+        table.keys = splitLines(view[offset:offset + length], rows, encoding)
+        offset, length = contents['counts']
+        table.counts = view[offset:offset + length].cast(COUNT_TYPECODE)
+        end = schema.offset + len(schema.types) # Index of the first extra field
+        offset, length = contents['extras']
+        table.extras = [text.split(FIELD_SEPARATOR) if count > end else []
+            for text, count in zip(splitLines(view[offset:offset + length], rows, encoding), table.counts)]
+        if list(table.columns) != list(schema.names) or \
+                any(len(column) != rows for column in (*table.columns.values(), table.keys, table.counts, table.extras)):
+            raise ValueError(f'Cache of {schema.type} does not match its schema or its {rows} rows')
+        table.placed = rows
+        return table
+
+class KoploperDatabase:
+    """The rows of a Koploper backup as a Table for each record type, with the secondary indexes on the
+    block numbers, turnout addresses and route IDs. A route is the list of WSTR steps from block to block,
+    its ID is the tuple (fromBlock, toBlock).
+
+    >>> db = KoploperDatabase('../docs/koploper/Blausee-Mitholz.bck')
+    >>> db, db['LIJN'], db['WSTR'], len(db.routes())
+    (<KoploperDatabase tables=38 rows=3107>, <Table LIJN rows=552>, <Table WSTR rows=1078>, 74)
+    >>> db.route(21, 36), db['WSTR'].select(('step', 'line', 'turnout', 'position'), db.route(21, 36)[:4])
+    (array('L', [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10]), [(0, 0, 102, 1), (1, 0, 101, 1), (2, 0, 94, 0), (3, 0, 93, 1)])
+    >>> db.tracksOfBlock(36)
+    [201, 202, 203, 204, 226, 244, 247]
+    >>> wstr = db['WSTR']
+    >>> for index in wstr.where('line', 201): wstr.set(index, 'line', None)
+    >>> for index in wstr.where('line', 247): wstr.set(index, 'line', 'x') # Text makes the column a list.
+    >>> type(wstr.columns['line'])
+    <class 'list'>
+    >>> db.tracksOfBlock(36)
+    [202, 203, 204, 226, 244]
+    >>> db = KoploperDatabase('../docs/koploper/Blausee-Mitholz.bck')
+    >>> sorted(db.blockRows(36).items())
+    [('BLOK', array('L', [33])), ('BLRI', array('L', [105, 106, 107])), ('BLVN', array('L', [52, 74])), ('DVHE', array('L', [18])), ('PBLK', array('L', [52, 53])), ('WSTR', array('L', [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21]))]
+    >>> db.turnoutRows(93)['WISS'], len(db.turnoutRows(93)['WSTR'])
+    (array('L', [48]), 10)
+    """
+    def __init__(self, path=None):
+        self.tables = {} # Record type --> Table
+        if path is not None:
+            self.read(path)
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} tables={len(self.tables)} rows={sum(len(table) for table in self.tables.values())}>'
+
+    def __getitem__(self, recordType):
+        return self.tables[recordType]
+
+    def __contains__(self, recordType):
+        return recordType in self.tables
+
+    def read(self, path):
+        """Read the rows of the backup at @path."""
+        with open(path, 'rb') as f:
+            self.addRecords(iterRecords(f, fileEncoding(path)))
+
+    def addRecords(self, records):
+        """Add the rows of @records, as answered by iterRecords(), to the tables of their type. The rows are
+        collected per type and added column by column."""
+        rows = {}
+        for record in records:
+            if isinstance(record, Row):
+                typeRows = rows.get(record.type)
+                if typeRows is None:
+                    typeRows = rows[record.type] = (record.section, [])
+                typeRows[1].append(record.record)
+        for recordType, (section, records) in rows.items():
+            self.table(recordType, section).extend(records)
+        self.makeIndexes()
+
+    def saved(self):
+        """Mark all tables as unchanged and all their rows as placed in the backup, after reading or writing."""
+        for table in self.tables.values():
+            table.changed = False
+            table.changedRows = set()
+            table.placed = len(table)
+
+    def table(self, recordType, section=None):
+        """Answer the Table of @recordType, a new one if it does not exist yet."""
+        table = self.tables.get(recordType)
+        if table is None:
+            table = self.tables[recordType] = Table(schemaOf(recordType), section)
+        return table
+
+    def makeIndexes(self):
+        """Make the indexes on the block, turnout and route columns of all tables."""
+        for table in self.tables.values():
+            names = table.schema.names
+            for name in BLOCK_COLUMNS + TURNOUT_COLUMNS:
+                if name in names:
+                    table.index(name)
+            if ROUTE_COLUMNS[0] in names and ROUTE_COLUMNS[1] in names:
+                table.index(ROUTE_COLUMNS)
+
+    def _rows(self, columns, value):
+        rows = {}
+        for recordType, table in self.tables.items():
+            indexes = [table.where(name, value) for name in columns if name in table.columns]
+            indexes = sorted(set().union(*indexes))
+            if indexes:
+                rows[recordType] = array(INDEX_TYPECODE, indexes)
+        return rows
+
+    def blockRows(self, block):
+        """Answer the dictionary {record type: array of row indexes} of the rows that refer to @block."""
+        return self._rows(BLOCK_COLUMNS, block)
+
+    def turnoutRows(self, address):
+        """Answer the dictionary {record type: array of row indexes} of the rows that refer to the turnout
+        with @address, the WISS turnout and the WSTR route steps that set it."""
+        return self._rows(TURNOUT_COLUMNS, address)
+
+    def routes(self):
+        """Answer the sorted list of route IDs (fromBlock, toBlock)."""
+        if ID_WSTR not in self.tables:
+            return []
+        return sorted(self.tables[ID_WSTR].index(ROUTE_COLUMNS))
+
+    def route(self, fromBlock, toBlock):
+        """Answer the array of the indexes of the WSTR rows (steps) of the route from @fromBlock to @toBlock."""
+        if ID_WSTR not in self.tables:
+            return array(INDEX_TYPECODE)
+        return self.tables[ID_WSTR].where(ROUTE_COLUMNS, (fromBlock, toBlock))
+
+    def tracksOfBlock(self, block):
+        """Answer the sorted list of the LIJN line numbers of the routes from and to @block, the track that
+        touches the block. db['LIJN'].where('line', line) answers the rows of a line."""
+        if ID_WSTR not in self.tables:
+            return []
+        table = self.tables[ID_WSTR]
+        lines = table.column('line') # Empty fields are None, also if the column became a list.
+        indexes = set(table.where('fromBlock', block)).union(table.where('toBlock', block))
+        return sorted({lines[index] for index in indexes if isinstance(lines[index], int)} - {0})
+
+#   C A C H E
+
+EXT_CACHE = '.cache' # Sidecar of the backup, Blausee-Mitholz.bck.cache
+CACHE_MAGIC = b'KPDB'
+CACHE_VERSION = 2 # Increment when the layout of the cache changes, older caches are read again.
+# Magic, version, little endian, size of the backup, mtime of the backup (ns), size of the contents, hash of
+# the backup, hash of the SCHEMAS
+CACHE_HEADER = struct.Struct('<4sHBxQqQ16s16s')
+CACHE_ALIGN = 8 # Data blocks start at a multiple of 8 bytes, so the array columns can be cast in place.
+CACHE_TEXT = 's' # Kind of a text column, lines in the encoding of the backup.
+CACHE_FIELDS = 'f' # Kind of a column that became a list, lines of the field texts.
+CACHE_ENTRY_TYPECODE = 'q' # Pairs (record type index, row index) of the section entries, -1 and the text index for a text line.
+
+# Hash of the declared SCHEMAS, in the cache header: a cache of other schemas is read again.
+SCHEMAS_HASH = hashlib.blake2b(repr([(schema.type, schema.types, schema.names, schema.offset)
+    for schema in SCHEMAS.values()]).encode('utf-8'), digest_size=16).digest()
+
+def cachePath(path):
+    """Answer the path of the cache file of the backup at @path."""
+    return path + EXT_CACHE
+
+def sourceHash(data):
+    """Answer the 16 byte hash of the bytes @data of a backup."""
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+def joinLines(texts, encoding):
+    """Answer the @texts as one block of lines in @encoding. The texts come from lines of the backup,
+    they have no line ends."""
+    return '\n'.join(texts).encode(encoding, ENCODING_ERRORS)
+
+def splitLines(data, count, encoding):
+    """Answer the list of the @count texts in the block @data, as made by joinLines()."""
+    if not count:
+        return []
+    return str(data, encoding, ENCODING_ERRORS).split('\n')
+
+class CacheBlocks:
+    """Data blocks of a cache file, in their order, each padded to a multiple of CACHE_ALIGN."""
+
+    def __init__(self):
+        self.blocks = []
+        self.size = 0
+
+    def add(self, data):
+        """Add the bytes (or array) @data as block, answer the tuple (offset, length) of the block in the data."""
+        data = bytes(data)
+        offset = self.size
+        padding = -len(data) % CACHE_ALIGN
+        self.blocks.append(data + bytes(padding))
+        self.size += len(data) + padding
+        return offset, len(data)
+
+#   D A T A B A S E  F I L E S
 
 class File:
     def __init__(self):
         pass
 
+    def values(self, line):
+        """Answer the list of translated values of the @line of fields."""
+        return values(line)
+
 class Baan(File): # Koploper “Baan”
 
     BAAN_LINE_LENGTH = 32
+    BAAN_LINE_LENGTH_80 = 31 # Koploper 8.0 has one field less.
     LIJN_LINE_LENGTH = 6
     def __init__(self):
         self.layout = [] # Set of “Baan” elements
@@ -75,38 +1094,160 @@ class Baan(File): # Koploper “Baan”
 
     def appendLine(self, line):
         """Add a line of fields"""
-        vLine = [] # Line with translated values
-        for value in line:
-            if value == 'FALSE':
-                vLine.append(False)
-            elif value == 'TRUE':
-                vLine.append(True)
-            else:
-                try:
-                    v = int(value)
-                    vf = float(value)
-                    if v == int(vf):
-                        vLine.append(v)
-                    else:
-                        vLine.append(vf)
-                except ValueError:
-                    vLine.append(value)
-        if vLine[0] == ID_BAAN:
+        if line[0] == ID_BAAN:
             #BAAN    L   0   Perron 1b   140 300 0   Arial   8   0   FALSE   TRUE    FALSE   FALSE   TRUE    -1  -1  TRUE    
             #8454143 0   0   0   FALSE   FALSE   0   FALSE   FALSE   0   -1  -1  -1  FALSE
-            assert len(line) == self.BAAN_LINE_LENGTH, f'BAAN line was {len(line)} excepted {self.BAAN_LINE_LENGTH}'
-            self.layout.append(vLine)
-        elif vLine[0] == ID_LIJN:
+            assert len(line) in (self.BAAN_LINE_LENGTH, self.BAAN_LINE_LENGTH_80), f'BAAN line was {len(line)} excepted {self.BAAN_LINE_LENGTH}'
+            self.appendRecord(SCHEMAS[ID_BAAN].convert(line))
+        elif line[0] == ID_LIJN:
             #LIJN    10  0   218 228 0
             assert len(line) == self.LIJN_LINE_LENGTH
-            self.tracks.append(vLine)
+            self.appendRecord(SCHEMAS[ID_LIJN].convert(line))
         else:
             pass # Element type not yet implemented
 
+    def appendRecord(self, record):
+        """Add a record of the schema of its type"""
+        if record.SCHEMA.type == ID_BAAN:
+            self.layout.append(record)
+        elif record.SCHEMA.type == ID_LIJN:
+            self.tracks.append(record)
+
+class Blok(File): # Koploper “Blok”
+
+    BLOK_LINE_LENGTH = 39
+    BLOK_ID = 4 # Field index of the block number
+    BLOK_DETECTOR = 11 # Field index of the occupancy detector (melder) of the block, 0 is none.
+
+    def __init__(self):
+        self.blocks = []
+
+    def __repr__(self):
+        return(f'<{self.__class__.__name__} blocks={len(self.blocks)}>')
+
+    def appendLine(self, line):
+        """Add a line of fields"""
+        if line[0] == ID_BLOK:
+            #BLOK    0   FALSE   FALSE   1   3   TRUE    560 FALSE   0   0   1   0   0   165 ...
+            assert len(line) == self.BLOK_LINE_LENGTH, f'BLOK line was {len(line)} excepted {self.BLOK_LINE_LENGTH}'
+            self.appendRecord(SCHEMAS[ID_BLOK].convert(line))
+        else:
+            pass # Element type not yet implemented
+
+    def appendRecord(self, record):
+        """Add a record of the schema of its type"""
+        if record.SCHEMA.type == ID_BLOK:
+            self.blocks.append(record)
+
+    def detectorBlocks(self):
+        """Answer the dictionary detector --> tuple of block numbers, of the blocks that have an occupancy
+        detector. Blocks can share a detector. The detectors are numbered as in Koploper, (module - 1) * 8 +
+        input for the 8 inputs of a module.
+
+        >>> blok = KoploperIO('../docs/koploper/StationLelybaan.txt').elements[1]
+        >>> blok.blocks[1].detector = blok.blocks[0].detector # Blocks 1 and 2 on detector 1
+        >>> blok.detectorBlocks()[1], blok.detectorBlocks()[3]
+        ((1, 2), (3,))
+        """
+        detectorBlocks = {}
+        for block in self.blocks:
+            if block.detector:
+                detectorBlocks[block.detector] = detectorBlocks.get(block.detector, ()) + (block.block,)
+        return detectorBlocks
+
+class Section:
+    """Lines of one database file of the backup, for the writer. @name is the file name, None for the lines
+    before the first marker. @raw is the bytes of the section as read or as written last, including the
+    marker line, @entries has for each line after the marker its text, or the tuple (record type, row index)
+    of the row in the KoploperDatabase. Set @changed after changing the text entries, changes of the rows
+    are known by their tables."""
+
+    def __init__(self, name, newline=b'\n'):
+        self.name = name
+        self.newline = newline # Line end of the section, \r\n as written by Koploper on Windows.
+        self.lines = [] # Raw lines while reading
+        self.raw = b''
+        self.entries = []
+        self.changed = False
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.name} lines={len(self.entries)} bytes={len(self.raw)}>'
+
+    def setText(self, index, text):
+        """Replace the text of entry @index by @text."""
+        assert isinstance(self.entries[index], str), f'Entry {index} of {self.name} is a row'
+        self.entries[index] = text
+        self.changed = True
+
+    def recordTypes(self):
+        """Answer the set of the record types of the rows in the section."""
+        return {entry[0] for entry in self.entries if not isinstance(entry, str)}
+
+    def isChanged(self, database):
+        """Answer True if the text or any of the tables of the section changed since the last read or write."""
+        if self.changed:
+            return True
+        recordTypes = self.recordTypes()
+        return any(table.changed and (recordType in recordTypes or self.isSectionOf(table))
+            for recordType, table in database.tables.items())
+
+    def isSectionOf(self, table):
+        """Answer True if @table is a new table (without placed rows) of this section. The lines before the
+        first marker have no tables."""
+        return self.name is not None and not table.placed and table.section == self.name
+
+    def placedEntries(self, database):
+        """Answer the entries with the rows that do not have a place in a section yet: the rows that were
+        appended to a table follow its last placed row, the rows of a new table of the section come last."""
+        entries = []
+        for entry in self.entries:
+            entries.append(entry)
+            if not isinstance(entry, str):
+                recordType, index = entry
+                table = database[recordType]
+                if index == table.placed - 1:
+                    entries.extend((recordType, newIndex) for newIndex in range(table.placed, len(table)))
+        for recordType, table in database.tables.items():
+            if self.isSectionOf(table):
+                entries.extend((recordType, index) for index in range(len(table)))
+        return entries
+
+    def rowLines(self):
+        """Answer the dictionary (record type, row index) --> line of the rows, as in @raw."""
+        lines = self.raw.split(b'\n')
+        if self.name is not None:
+            lines = lines[1:] # Marker line
+        return {entry: line[:-1] if line.endswith(b'\r') else line
+            for entry, line in zip(self.entries, lines) if not isinstance(entry, str)}
+
+    def serialize(self, database, encoding):
+        """Answer the bytes of the section, with the rows from their tables in @database. The rows that did
+        not change keep their line as it was, e.g. with 0458 in an integer field, the changed and the new
+        rows are formatted from their values."""
+        lines = []
+        if self.name is not None:
+            lines.append(TAG_FILEPATH + self.name)
+        rowLines = self.rowLines()
+        for entry in self.placedEntries(database):
+            if isinstance(entry, str):
+                lines.append(entry)
+                continue
+            recordType, index = entry
+            table = database[recordType]
+            line = rowLines.get(entry)
+            if line is not None and index < table.placed and index not in table.changedRows:
+                lines.append(line.decode(encoding, ENCODING_ERRORS))
+            else:
+                lines.append(FIELD_SEPARATOR.join(table.record(index).fields()))
+        data = self.newline.join(line.encode(encoding, ENCODING_ERRORS) for line in lines)
+        if self.raw.endswith(b'\n') or not self.raw: # Only the last line of a file may have no line end.
+            data += self.newline
+        return data
+
 class KoploperIO:
     """Constructor of KoploperIO, reading/writing Koploper databases."""
 
-    def __init__(self, path):
+    def __init__(self, path, cache=False):
         """
         >>> kl = KoploperIO('../docs/koploper/StationLelybaan.txt')
         >>> kl
@@ -115,61 +1256,313 @@ class KoploperIO:
         27
         >>> len(kl.elements[0].tracks)
         76
-        >>> kl = KoploperIO('../docs/koploper/Hennie.bck')
-        >>> kl
-        <KoploperIO ../docs/koploper/Hennie.bck>
+        >>> kl.elements[1], kl.detectorBlocks()[5]
+        (<Blok blocks=20>, (5,))
+        >>> kl.elements[0].tracks[0], kl.elements[1].blocks[4].detector
+        (<LIJNRecord line=1 end=0 x=98 y=38>, 5)
+        >>> kl = KoploperIO('../docs/koploper/Hennie1.bck')
+        >>> kl, kl.sectionNames(), kl.database
+        (<KoploperIO ../docs/koploper/Hennie1.bck>, ['baan.dba', 'blok.dba', 'kopd.dba', 'kopl.ini', 'snel.dba'], <KoploperDatabase tables=7 rows=115>)
         """
-        self.read(path) # Read the databse, construct internal data containers.
+        self.cache = cache # Read from and keep the sidecar cache file, see readCache()
+        if not (cache and self.readCache(path)):
+            self.read(path) # Read the databse, construct internal data containers.
+            if cache:
+                self.writeCache()
 
     def __repr__(self):
         return f'<{self.__class__.__name__} {self.path}>'
 
+    def records(self):
+        """Answer the generator of the records of all lines of the file, see iterRecords()."""
+        with open(self.path, 'rb') as f:
+            yield from iterRecords(f, self.encoding)
+
     def read(self, path):
         """Read the Koploper database file at path. This can be a folder of (backup) file."""
+        self._start(path, fileEncoding(path))
+
+        with open(path, 'rb') as f:
+            self.database.addRecords(self._records(f))
+        for section in self.sections:
+            section.raw = b''.join(section.lines)
+            section.lines = []
+        self.database.saved()
+
+    def _start(self, path, encoding):
+        """Set the @path and @encoding and prepare storage for the data components."""
         self.path = path
-        # Prepare storage for data components
+        self.encoding = encoding
         self.comments = []
         self.connectors = []
         self.elements = []
+        self.sections = [] # Section of each database file in the backup, in their order, for the writer.
+        self.database = KoploperDatabase()
+
+    def readCache(self, path):
+        """Read the backup at @path from its cache file, cachePath(@path), as written by writeCache(). Answer
+        False, without reading, if there is no cache, if it has another version, byte order or schemas, if
+        it is damaged, or if the backup changed since: another size or another hash. The modification time
+        is only kept as information, the backup is read anyway, for the bytes of its sections. The cache is
+        mapped, the integer and bool columns of the tables are memoryviews on it, copy on write, so opening
+        a backup does not parse or convert its rows.
 
-        if path.endswith(EXT_BCK):
-            fin = codecs.open(self.path, 'r')
-            data = fin.read()
-            fin.close()
-        elif path.endswith(EXT_TXT):
-           # Needs to be fixed, reading the 0xff of the binary.
-            fin = codecs.open(self.path, 'r', encoding='utf-8')
-            data = fin.read()
-            fin.close()
+        >>> import shutil, tempfile
+        >>> path = shutil.copy('../docs/koploper/Blausee-Mitholz.bck', tempfile.mkdtemp())
+        >>> kl = KoploperIO(path, cache=True)
+        >>> os.path.exists(cachePath(path)), kl.readCache(path), kl.database, type(kl.database['LIJN'].columns['x'])
+        (True, True, <KoploperDatabase tables=38 rows=3107>, <class 'memoryview'>)
+        >>> kl.database.tracksOfBlock(36), kl.write(), kl.readCache(path)
+        ([201, 202, 203, 204, 226, 244, 247], [], True)
+        >>> kl.database['LIJN'].set(0, 'x', 219), kl.write(), KoploperIO(path, cache=True).database['LIJN'].get(0, 'x')
+        (None, ['baan.dba'], 219)
+        >>> os.utime(path, ns=(0, 0)) # Another modification time, the same hash
+        >>> kl.readCache(path)
+        True
+        >>> with open(path, 'r+b') as f: f.write(b'X') # Another hash, the same size and modification time
+        1
+        >>> os.utime(path, ns=(0, 0))
+        >>> kl.readCache(path), KoploperIO(path, cache=True).readCache(path)
+        (False, True)
+        >>> with open(cachePath(path), 'r+b') as f: f.truncate(os.path.getsize(cachePath(path)) - 100) > 0
+        True
+        >>> kl.readCache(path), kl.database, KoploperIO(path, cache=True).readCache(path)
+        (False, <KoploperDatabase tables=38 rows=3107>, True)
+        """
+        try:
+            f = open(cachePath(path), 'rb')
+        except OSError:
+            return False
+        with f:
+            header = f.read(CACHE_HEADER.size)
+            if len(header) < CACHE_HEADER.size:
+                return False
+            magic, version, littleEndian, size, mtime, contentsSize, digest, schemas = CACHE_HEADER.unpack(header)
+            if magic != CACHE_MAGIC or version != CACHE_VERSION or littleEndian != (sys.byteorder == 'little') or \
+                    schemas != SCHEMAS_HASH:
+                return False
+            with open(path, 'rb') as backup:
+                data = backup.read()
+            if len(data) != size or sourceHash(data) != digest:
+                return False
+            view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY))
+        try:
+            encoding, database, sections = self._readCacheContents(view, contentsSize, data)
+        except (ValueError, TypeError, LookupError, AttributeError):
+            return False # Damaged cache, the backup is parsed again.
+        self._start(path, encoding)
+        self.database = database
+        self.sections = sections
+        for section in sections:
+            self._addElement(section)
+        return True
+
+    def _readCacheContents(self, view, contentsSize, data):
+        """Answer the encoding, KoploperDatabase and Sections of the cache in the memoryview @view, with the
+        raw bytes of the sections from the backup @data. Raise ValueError (or another exception of the
+        contents) if the cache is damaged."""
+        contents = json.loads(bytes(view[CACHE_HEADER.size:CACHE_HEADER.size + contentsSize]))
+        start = CACHE_HEADER.size + contentsSize
+        view = view[start + -start % CACHE_ALIGN:]
+        encoding = contents['encoding']
+        database = KoploperDatabase()
+        recordTypes = []
+        for tableContents in contents['tables']:
+            table = Table.fromCache(tableContents, view, encoding)
+            database.tables[table.schema.type] = table
+            recordTypes.append(table.schema.type)
+        offset, length = contents['texts']
+        texts = str(view[offset:offset + length], encoding, ENCODING_ERRORS).split('\n')
+        sections = []
+        end = 0
+        for sectionContents in contents['sections']:
+            if sectionContents['start'] != end:
+                raise ValueError(f'Section {sectionContents["name"]} does not follow the previous one')
+            end = sectionContents['end']
+            section = Section(sectionContents['name'], sectionContents['newline'].encode('ascii'))
+            section.raw = data[sectionContents['start']:end]
+            offset, length = sectionContents['entries']
+            entries = view[offset:offset + length].cast(CACHE_ENTRY_TYPECODE)
+            section.entries = [texts[index] if typeIndex < 0 else (recordTypes[typeIndex], index)
+                for typeIndex, index in zip(entries[::2], entries[1::2])]
+            for entry in section.entries:
+                if not isinstance(entry, str) and not 0 <= entry[1] < len(database[entry[0]]):
+                    raise IndexError(f'Row {entry[1]} of {entry[0]} in section {section.name} is not in the cache')
+            sections.append(section)
+        if end != len(data):
+            raise ValueError('The sections of the cache do not cover the backup')
+        return encoding, database, sections
+
+    def _addElement(self, section):
+        """Add the Baan or Blok element of @section from the rows in the database, and the comments of
+        the lines before the first section, as _records() does while reading."""
+        if section.name == FILE_BAAN:
+            e = Baan()
+        elif section.name == FILE_BLOK:
+            e = Blok()
         else:
-            raise ValueError(f'Unknown type of data file: {path}')
+            if section.name is None:
+                self.comments.extend(entry for entry in section.entries if isinstance(entry, str) and entry.startswith('#'))
+            return
+        self.elements.append(e)
+        for recordType in (ID_BAAN, ID_LIJN, ID_BLOK):
+            indexes = [entry[1] for entry in section.entries if not isinstance(entry, str) and entry[0] == recordType]
+            if indexes:
+                table = self.database[recordType]
+                for record in table.records(None if len(indexes) == len(table) else indexes):
+                    e.appendRecord(record)
 
-        self.txt = data.replace(chr(0x0d), '') # Remove newlines, just to be sure
-        # have their own line. Each line probably is separated by Windows' <cr><lf>
-        # Parse the data. The Koploper data file seems to be relative simple, as all of items
+    def writeCache(self):
+        """Write the tables and sections to the cache file of the backup, cachePath(self.path), keyed by the
+        size and hash of the backup and the hash of the SCHEMAS. The file has a header (CACHE_HEADER), the contents
+        as JSON and the data blocks, aligned for readCache() to map them. Answer the path of the cache, or
+        None if the database has changes that are not written to the backup yet."""
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        stat = os.stat(self.path)
+        if b''.join(section.raw for section in self.sections) != data or \
+                any(section.isChanged(self.database) for section in self.sections):
+            return None
+        blocks = CacheBlocks()
+        typeIndexes = {recordType: typeIndex for typeIndex, recordType in enumerate(self.database.tables)}
+        tables = [table.cacheContents(blocks, self.encoding) for table in self.database.tables.values()]
+        texts = []
+        sections = []
+        start = 0
+        for section in self.sections:
+            entries = array(CACHE_ENTRY_TYPECODE)
+            for entry in section.entries:
+                if isinstance(entry, str):
+                    entries.extend((-1, len(texts)))
+                    texts.append(entry)
+                else:
+                    entries.extend((typeIndexes[entry[0]], entry[1]))
+            end = start + len(section.raw)
+            sections.append(dict(name=section.name, newline=section.newline.decode('ascii'), start=start, end=end,
+                entries=blocks.add(entries)))
+            start = end
+        contents = dict(encoding=self.encoding, tables=tables, sections=sections,
+            texts=blocks.add(joinLines(texts, self.encoding)))
+        contents = json.dumps(contents, separators=(',', ':')).encode('utf-8')
+        header = CACHE_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, sys.byteorder == 'little', stat.st_size,
+            stat.st_mtime_ns, len(contents), sourceHash(data), SCHEMAS_HASH)
+        padding = -(len(header) + len(contents)) % CACHE_ALIGN
+        path = cachePath(self.path)
+        tmpPath = path + EXT_TMP
+        with open(tmpPath, 'wb') as f:
+            f.write(header + contents + bytes(padding))
+            f.write(b''.join(blocks.blocks))
+        os.replace(tmpPath, path)
+        return path
+
+    def _lines(self, f):
+        """Answer the generator of the lines of the binary file @f, adding them to the raw lines of their section."""
+        section = None
+        for line in f:
+            if section is None or line.startswith(TAG_FILEPATH_BYTES):
+                name = None
+                if line.startswith(TAG_FILEPATH_BYTES):
+                    name = line.rstrip(b'\r\n')[len(TAG_FILEPATH_BYTES):].decode(self.encoding, ENCODING_ERRORS)
+                section = Section(name, b'\r\n' if line.endswith(b'\r\n') else b'\n')
+                self.sections.append(section)
+            section.lines.append(line)
+            yield line
 
+    def _records(self, f):
+        """Answer the generator of the records of the binary file @f, keeping the order of the lines in the
+        sections and filling the Baan and Blok elements."""
         e = None # Current element to add a line of data to.
+        rowCounts = {} # Record type --> number of rows, the index of the next row in its table.
 
-        for line in self.txt.split('\n'):
-            line = line.strip()
-            if line.startswith('#'):
-                self.comments.append(line)
-            elif line.startswith(TAG_FILEPATH): # Select the file type for this data block
-                if line.endswith(FILE_BAAN):
+        for record in iterRecords(self._lines(f), self.encoding):
+            section = self.sections[-1]
+            if isinstance(record, Row):
+                index = rowCounts.get(record.type, 0)
+                rowCounts[record.type] = index + 1
+                section.entries.append((record.type, index))
+                if e is not None and record.type in (ID_BAAN, ID_LIJN, ID_BLOK):
+                    e.appendLine(record.data)
+            elif isinstance(record, SectionStart): # Select the file type for this data block
+                if record.section == FILE_BAAN:
                     e = Baan()
                     self.elements.append(e)
+                elif record.section == FILE_BLOK:
+                    e = Blok()
+                    self.elements.append(e)
                 # More file types here.
                 else:
                     e = None
+            else:
+                section.entries.append(record.text())
+                if record.section is None and record.line.startswith('#'):
+                    self.comments.append(record.line)
+            yield record
+
+    def sectionNames(self):
+        """Answer the list of the names of the database files in the backup."""
+        return [section.name for section in self.sections if section.name is not None]
+
+    def section(self, name):
+        """Answer the Section of database file @name, None if it does not exist."""
+        for section in self.sections:
+            if section.name == name:
+                return section
+        return None
 
-            if e is not None:
-                fields = line.split('\t')
-                if fields[0] in (ID_BAAN, ID_LIJN):
-                    e.appendLine(line.split('\t'))
-        
+    def detectorBlocks(self):
+        """Answer the dictionary detector --> tuple of block numbers of all blocks, e.g. for Occupancy.setBlocks
+        in z21feedback.py."""
+        detectorBlocks = {}
+        for e in self.elements:
+            if isinstance(e, Blok):
+                for detector, blocks in e.detectorBlocks().items():
+                    detectorBlocks[detector] = detectorBlocks.get(detector, ()) + blocks
+        return detectorBlocks
 
     def write(self, path=None):
-        pass
+        """Write the backup to @path, default the path it was read from. The sections without changes are
+        written as the bytes that were read, only the changed sections are serialized from the database, with
+        the line ends of the section. Writing to a .txt path from a .bck (or the other way) converts the code
+        page. The file is replaced at once, through a temporary file. Answer the list of the names of the
+        serialized sections. Raise ValueError if a new table has no section of the backup to be written in.
+
+        >>> import tempfile
+        >>> kl = KoploperIO('../docs/koploper/Blausee-Mitholz.bck')
+        >>> path = os.path.join(tempfile.mkdtemp(), 'Blausee-Mitholz.bck')
+        >>> kl.write(path), open(path, 'rb').read() == open(kl.path, 'rb').read()
+        ([], True)
+        >>> kl.database['WSTR'].set(0, 'position', 0)
+        >>> kl.write(path), KoploperDatabase(path)['WSTR'].get(0, 'position'), kl.write(path)
+        (['baan.dba'], 0, [])
+        """
+        if path is None:
+            path = self.path
+        encoding = fileEncoding(path)
+        names = set(self.sectionNames())
+        for recordType, table in self.database.tables.items():
+            if not table.placed and len(table) and table.section not in names:
+                raise ValueError(f'New table {recordType} has no section of the backup, got {table.section!r}, '
+                    f'see KoploperDatabase.table(recordType, section)')
+        changed = [section for section in self.sections if section.isChanged(self.database)]
+        for section in changed:
+            section.raw = section.serialize(self.database, self.encoding)
+        for section in changed:
+            section.entries = section.placedEntries(self.database)
+            section.changed = False
+        self.database.saved()
+        parts = []
+        for section in self.sections:
+            raw = section.raw
+            if encoding != self.encoding:
+                raw = raw.decode(self.encoding, ENCODING_ERRORS).encode(encoding, ENCODING_ERRORS)
+            parts.append(raw)
+        tmpPath = path + EXT_TMP
+        with open(tmpPath, 'wb') as f:
+            f.write(b''.join(parts))
+        os.replace(tmpPath, path)
+        if self.cache and path == self.path:
+            self.writeCache()
+        return [section.name for section in changed]
 
 if __name__ == '__main__':
     import doctest
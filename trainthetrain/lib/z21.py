@@ -23,9 +23,28 @@
 import logging
 import struct
 import sys
+import threading
 import time
+from concurrent.futures import Future
 from socket import * #socket, timeout, AF_INET, SOCK_STREAM, SOCK_DGRAM
 
+from z21broadcast import BroadcastFlags, BroadcastManager
+from z21codec import (Encoder, xorChecksum, functionGroupMask, functionGroupValue, FUNCTION_GROUPS,
+    POM_READ_BYTE, POM_WRITE_BIT, POM_WRITE_BYTE)
+from z21cvbatch import CvBatch
+from z21cvcache import CvShadowCache
+from z21cvread import CvReadStrategy, MODE_DIRECT, MODE_REGISTER
+from z21decoders import CV_NUMBERS, DEFAULT_PROFILE, LOKPILOT, LOKSOUND5, NMRA, SWITCHPILOT_SERVO, profileFor
+from z21feedback import Occupancy, CAN_ALL_DETECTORS, CAN_MODULES, RMBUS_GROUPS
+from z21locostate import LocoStateCache
+from z21loconet import LocoNetGateway
+from z21messages import (decode, BroadcastFlagsInfo, CanDetector, CanDeviceDescription, Code, CvResult, FirmwareVersion, HwInfo, LocoInfo, LocoMode,
+    LocoNetDetector, LocoNetDispatch, RailComData, RmBusData, SerialNumber, StatusChanged, SystemState, TurnoutInfo, Version)
+from z21pom import PomScheduler
+from z21receiver import Dispatcher, Receiver, RetryPolicy
+from z21sendqueue import SendQueue
+from z21telemetry import BoosterTelemetry, RailComTelemetry, SystemStateTelemetry
+
 VERSION = '0.001'
 
 # LITTLE_ORDER is positional to be compatible with micropython
@@ -60,14 +79,9 @@ def int2Bytes(i):
     """Convert an unsigned integer to bytes."""
 
 def XOR(b):
-    """Answer the XOR-parity byte from the byte-array that is necessary for most Z21 commands."""
-    xor = None
-    for byte in bytes(b):
-        if xor is None:
-            xor = byte
-        else:
-            xor = xor ^ byte
-    return xor.to_bytes(1, LITTLE_ORDER)
+    """Answer the XOR-parity byte from the byte-array that is necessary for most Z21 commands.
+    For the commands that are sent often, the Encoder in z21codec.py patches preallocated packets instead."""
+    return xorChecksum(b).to_bytes(1, LITTLE_ORDER)
 
 def CMD(*args):
     """Construct the byte-array from a list of arguments. If the argument is None, then substitute the XOR checksum, 
@@ -86,6 +100,58 @@ def CMD(*args):
         b += xor
     return b
 
+#   R E P L Y  C O R R E L A T I O N
+
+# These functions answer a match function for the Dispatcher, that accepts only the reply packet
+# for the requested address. Other packets with the same (header, X-header), such as broadcasts for 
+# other locos, are not mistaken as the reply.
+
+def locoInfoMatch(loco):
+    """Answer a function that matches LAN_X_LOCO_INFO of @loco: 0x40 0x00 0xEF Adr_MSB Adr_LSB ...
+
+    >>> locoInfoMatch(3)(CMD(0x0E, 0, 0x40, 0, 0xEF, 0, 3, 4, 0x80, 0, 0, 0, 0, None))
+    True
+    >>> locoInfoMatch(259)(CMD(0x0E, 0, 0x40, 0, 0xEF, 0xC1, 3, 4, 0x80, 0, 0, 0, 0, None))
+    True
+    >>> locoInfoMatch(4)(CMD(0x0E, 0, 0x40, 0, 0xEF, 0, 3, 4, 0x80, 0, 0, 0, 0, None))
+    False
+    """
+    def match(packet):
+        return ((packet[5] & 0x3F) << 8 | packet[6]) == loco
+    return match
+
+def cvResultMatch(cvId):
+    """Answer a function that matches LAN_X_CV_RESULT of @cvId, or LAN_X_CV_NACK(_SC), which has no address.
+    @cvId None matches the LAN_X_CV_RESULT of any CV.
+
+    >>> cvResultMatch(1)(CMD(0x0A, 0, 0x40, 0, 0x64, 0x14, 0, 0, 3, None))
+    True
+    >>> cvResultMatch(2)(CMD(0x0A, 0, 0x40, 0, 0x64, 0x14, 0, 0, 3, None))
+    False
+    >>> cvResultMatch(2)(CMD(0x07, 0, 0x40, 0, 0x61, 0x13, None))
+    True
+    >>> cvResultMatch(None)(CMD(0x0A, 0, 0x40, 0, 0x64, 0x14, 0, 0, 3, None))
+    True
+    """
+    cvAddress = None if cvId is None else cvId - 1 # CV-Address = (CVAdr_MSB << 8) + CVAdr_LSB, where 0=CV1
+    def match(packet):
+        if packet[4] == 0x64:
+            return packet[5] == 0x14 and (cvAddress is None or (packet[6] << 8 | packet[7]) == cvAddress)
+        return packet[4] == 0x61 and packet[5] in (0x12, 0x13)
+    return match
+
+def turnoutInfoMatch(turnoutId):
+    """Answer a function that matches LAN_X_TURNOUT_INFO of @turnoutId: 0x40 0x00 0x43 FAdr_MSB FAdr_LSB ZZ
+
+    >>> turnoutInfoMatch(1)(CMD(0x09, 0, 0x40, 0, 0x43, 0, 1, 2, None))
+    True
+    >>> turnoutInfoMatch(2)(CMD(0x09, 0, 0x40, 0, 0x43, 0, 1, 2, None))
+    False
+    """
+    def match(packet):
+        return (packet[5] << 8 | packet[6]) == turnoutId
+    return match
+
 #   B A S E  C L A S S  Z 2 1
 
 class Z21:
@@ -145,7 +211,7 @@ class Z21:
     LAN_X_GET_LOCO_INFO =           CMD(0x09, 0, 0x40, 0, 0xE3, 0xF0) # Add address MSB, address LSB and XOR-Byte, Z21: 4.1
     LAN_X_SET_LOCO_DRIVE =          CMD(0x0A, 0, 0x40, 0, 0xE4) # Add DCC steps, address MSB, address LSB, RVVV VVVV, XOR-Byte, Z21: 4.2
     LAN_X_SET_LOCO_FUNCTION =       CMD(0x0A, 0, 0x40, 0, 0xE4, 0xF8) # Add address MSB, address LSB, TTNN NNNN, XOR-Byte, Z21: 4.3.1
-    LAN_X_SET_LOCO_FUNCTION_GROUP = CMD(0x0A, 0, 0x40, 0, 0xE4), # Add group, address MSB, address LSB, Functions, XOR-Byte, Z21: 4.3.2
+    LAN_X_SET_LOCO_FUNCTION_GROUP = CMD(0x0A, 0, 0x40, 0, 0xE4) # Add group, address MSB, address LSB, Functions, XOR-Byte, Z21: 4.3.2
     LAN_X_SET_LOCO_BINARY_STATE =   CMD(0x0A, 0, 0x40, 0, 0xE5, 0x5F) # Add address MSB, address LSB, FLLL LLLL, HHHH HHHH, XOR-Byte, Z21: 4.3.3
     # LAN_X_LOCO_INFO Z21: 4.4
     LAN_X_SET_LOCO_E_STOP =         CMD(0x08, 0, 0x40, 0, 0x92) # Add address MSB, address LSB, XOR-Byte, Z21: 4.5
@@ -165,38 +231,37 @@ class Z21:
     LAN_X_CV_NACK_SC =              CMD(0x07, 0, 0x40, 0, 0x61, 0x21, None) # XOR: 0x73, Z21: 6.3
     LAN_X_CV_NACK =                 CMD(0x07, 0, 0x40, 0, 0x61, 0x13, None) # XOR: 0x72, Z21: 6.4
     LAN_X_CV_RESULT =               CMD(0x0A, 0, 0x40, 0, 0x64, 0x14) # Add address MSB, address LSB, value, XOR-Byte, Z21: 6.5
-    # LAN_X_CV_POM_WRITE_BYTE Z21: 6.6
-    # LAN_X_CV_POM_WRITE_BIT Z21: 6.7
-    # LAN_X_CV_POM_READ_BYTE Z21: 6.8
-    # LAN_X_CV_POM_ACCESSORY_WRITE_BYTE Z21: 6.9
-    # LAN_X_CV_POM_ACCESSORY_WRITE_BIT Z21: 6.10
-    # LAN_X_CV_POM_ACCESSORY_READ_BYTE Z21: 6.11
+    LAN_X_CV_POM =                  CMD(0x0C, 0, 0x40, 0, 0xE6, 0x30) # Add address MSB, address LSB, DB3, CV LSB, value, XOR-Byte, Z21: 6.6-6.8
+    # LAN_X_CV_POM_WRITE_BYTE DB3 = 0xEC | CV MSB, Z21: 6.6
+    # LAN_X_CV_POM_WRITE_BIT DB3 = 0xE8 | CV MSB, value 1111VPPP, Z21: 6.7
+    # LAN_X_CV_POM_READ_BYTE DB3 = 0xE4 | CV MSB, value 0, Z21: 6.8
+    LAN_X_CV_POM_ACCESSORY =        CMD(0x0C, 0, 0x40, 0, 0xE6, 0x31) # Add aaaaaaaa AAAACDDD, DB3, CV LSB, value, XOR-Byte, Z21: 6.9-6.11
     # LAN_X_MM_WRITE_BYTE Z21: 6.12
-    # LAN_X_DCC_READ_REGISTER Z21: 6.13
+    LAN_X_DCC_READ_REGISTER =       CMD(0x08, 0, 0x40, 0, 0x22, 0x11) # Add register 0x01-0x08, XOR-Byte, Z21: 6.13
     # LAN_X_DCC_WRITE_REGISTER Z21: 6.14
 
     # Z21: 7 Feedback - R-BUS
-    # LAN_RMBUS_DATACHANGED Z21: 7.1
-    # LAN_RMBUS_GETDATA Z21: 7.2
-    # LAN_RMBUS_PROGRAMMODULE Z21: 7.3
+    LAN_RMBUS_DATACHANGED =         CMD(0x0F, 0, 0x80, 0) # Add group index, 10 bytes feedback status, Z21: 7.1
+    LAN_RMBUS_GETDATA =             CMD(0x05, 0, 0x81, 0) # Add group index 0 (modules 1-10) or 1 (modules 11-20), Z21: 7.2
+    LAN_RMBUS_PROGRAMMODULE =       CMD(0x05, 0, 0x82, 0) # Add module address 1-20, 0 ends programming, Z21: 7.3
 
     # Z21: 8 RailCom
-    # LAN_RAILCOM_DATACHANGED Z21: 8.1
-    # LAN_RAILCOM_GETDATA Z21: 8.2
+    LAN_RAILCOM_DATACHANGED =       CMD(0x11, 0, 0x88, 0) # Add 13 bytes RailCom data, Z21: 8.1
+    LAN_RAILCOM_GETDATA =           CMD(0x07, 0, 0x89, 0, 0x01) # Add loco address LSB, MSB (0: next loco of the Z21), Z21: 8.2
 
     # Z21: 9 LocoNet
-    # LAN_LOCONET_Z21_RX Z21: 9.1
-    # LAN_LOCONET_Z21_TX Z12: 9.2
-    # LAN_LOCONET_FROM_LAN Z12: 9.3
-    # LAN_LOCONET_DISPATCH_ADDR Z21: 9.4
-    # LAN_LOCONET_DETECTOR Z21: 9.5
+    LAN_LOCONET_Z21_RX =            CMD(0x04, 0, 0xA0, 0) # Add LocoNet message received by the Z21, Z21: 9.1
+    LAN_LOCONET_Z21_TX =            CMD(0x04, 0, 0xA1, 0) # Add LocoNet message sent by the Z21, Z21: 9.2
+    LAN_LOCONET_FROM_LAN =          CMD(0x04, 0, 0xA2, 0) # Add LocoNet message, add its length to DataLen, Z21: 9.3
+    LAN_LOCONET_DISPATCH_ADDR =     CMD(0x06, 0, 0xA3, 0) # Add loco address LSB, MSB, Z21: 9.4
+    LAN_LOCONET_DETECTOR =          CMD(0x07, 0, 0xA4, 0) # Add type, report address LSB, MSB, Z21: 9.5
 
     # Z21: 10 CAN
-    # LAN_CAN_DETECTOR Z21: 10.1
-    # LAN_CAN_DEVICE_GET_DESCRIPTION Z21: 10.2.1
-    # LAN_CAN_DEVICE_SET_DESCRIPTION Z21: 10.2.2
-    # LAN_CAN_BOOSTER_SYSTEMSTATE_CHGD Z21: 10.2.3
-    # LAN_CAN_BOOSTER_SET_TRACKPOWER Z21: 10.2.4
+    LAN_CAN_DETECTOR =              CMD(0x07, 0, 0xC4, 0, 0x00) # Add NId LSB, MSB (0xD000: all detectors), Z21: 10.1
+    LAN_CAN_DEVICE_GET_DESCRIPTION = CMD(0x06, 0, 0xC8, 0) # Add NId LSB, MSB, Z21: 10.2.1
+    LAN_CAN_DEVICE_SET_DESCRIPTION = CMD(0x16, 0, 0xC9, 0) # Add NId LSB, MSB, 16 bytes name, Z21: 10.2.2
+    LAN_CAN_BOOSTER_SYSTEMSTATE_CHGD = CMD(0x0E, 0, 0xCA, 0) # Add NId, output port, state, voltage, current, Z21: 10.2.3
+    LAN_CAN_BOOSTER_SET_TRACKPOWER = CMD(0x07, 0, 0xCB, 0) # Add NId LSB, MSB, power, Z21: 10.2.4
 
     # Z21: zLink
     # LAN_ZLINK_GET_HWINFO Z21: 11.1.1.1
@@ -220,19 +285,85 @@ class Z21:
     # LAN_FAST_CLOCK_SETTINGS_GET Z21: 12.3
     # LAN_FAST_CLOCK_SETTINGS_SET Z21: 12.4
 
-    def __init__(self, host, port=PORT, verbose=False, timeout=0):
+    #   Z 2 1  R E P L Y  K E Y S
+
+    # Incoming packets are routed by the Dispatcher on their (header, X-header) key.
+    # The X-header is only used for LAN_X_... packets (header 0x40), otherwise it is None.
+
+    KEY_LAN_SERIAL_NUMBER =         (0x10, None) # Z21: 2.1
+    KEY_LAN_X_VERSION =             (0x40, 0x63) # Reply to LAN_X_GET_VERSION, Z21: 2.3
+    KEY_LAN_X_BC =                  (0x40, 0x61) # LAN_X_BC_..., LAN_X_UNKNOWN_COMMAND, LAN_X_CV_NACK(_SC), Z21: 2.7-2.11, 6.3, 6.4
+    KEY_LAN_X_STATUS_CHANGED =      (0x40, 0x62) # Z21: 2.12
+    KEY_LAN_X_BC_STOPPED =          (0x40, 0x81) # Z21: 2.14
+    KEY_LAN_X_FIRMWARE_VERSION =    (0x40, 0xF3) # Reply to LAN_X_GET_FIRMWARE_VERSION, Z21: 2.15
+    KEY_LAN_BROADCASTFLAGS =        (0x51, None) # Reply to LAN_GET_BROADCASTFLAGS, Z21: 2.17
+    KEY_LAN_SYSTEMSTATE_DATACHANGED = (0x84, None) # Z21: 2.18
+    KEY_LAN_HWINFO =                (0x1A, None) # Z21: 2.20
+    KEY_LAN_CODE =                  (0x18, None) # Z21: 2.21
+    KEY_LAN_LOCOMODE =              (0x60, None) # Reply to LAN_GET_LOCOMODE, Z21: 3.1
+    KEY_LAN_TURNOUTMODE =           (0x70, None) # Reply to LAN_GET_TURNOUTMODE, Z21: 3.3
+    KEY_LAN_X_LOCO_INFO =           (0x40, 0xEF) # Z21: 4.4
+    KEY_LAN_X_TURNOUT_INFO =        (0x40, 0x43) # Z21: 5.3
+    KEY_LAN_X_CV_RESULT =           (0x40, 0x64) # Z21: 6.5
+    KEY_LAN_RMBUS_DATACHANGED =     (0x80, None) # Also the reply to LAN_RMBUS_GETDATA, Z21: 7.1
+    KEY_LAN_RAILCOM_DATACHANGED =   (0x88, None) # Also the reply to LAN_RAILCOM_GETDATA, Z21: 8.1
+    KEY_LAN_LOCONET_Z21_RX =        (0xA0, None) # Z21: 9.1
+    KEY_LAN_LOCONET_Z21_TX =        (0xA1, None) # Z21: 9.2
+    KEY_LAN_LOCONET_FROM_LAN =      (0xA2, None) # LocoNet messages of the other LAN clients, Z21: 9.3
+    KEY_LAN_LOCONET_DISPATCH_ADDR = (0xA3, None) # Z21: 9.4
+    KEY_LAN_LOCONET_DETECTOR =      (0xA4, None) # Also the reply to LAN_LOCONET_DETECTOR, Z21: 9.5
+    KEY_LAN_CAN_DETECTOR =          (0xC4, None) # Also the reply to LAN_CAN_DETECTOR, Z21: 10.1
+    KEY_LAN_CAN_DEVICE_GET_DESCRIPTION = (0xC8, None) # Z21: 10.2.1
+    KEY_LAN_CAN_BOOSTER_SYSTEMSTATE_CHGD = (0xCA, None) # Z21: 10.2.3
+
+    def __init__(self, host, port=PORT, verbose=False, timeout=0, retries=0, receiver=True, sendQueue=False):
         """Constructor of Z21 object, holding the open LAN socket to the Z21/DR5000 controller and offering a 
-        more abstract interface to the Z21 commands (or a logical sequence of commands.)"""
+        more abstract interface to the Z21 commands (or a logical sequence of commands.)
+        If @receiver is True (default), then a background thread reads all incoming packets and the dispatcher
+        routes them to the waiting query or to the subscribers. This way broadcast packets cannot be mistaken
+        for the reply of a query. Queries wait @timeout seconds for their reply, where 0 waits forever.
+        If the reply did not arrive in time, the command is sent again for @retries times.
+        If @sendQueue is True, then loco and turnout commands go through a SendQueue, that coalesces the
+        commands of the same loco/function/turnout and limits the packets per second, see z21sendqueue.py.
+        """
         self.host = host
         self.port = port # Port for Z21, default on 
         self.s = socket(AF_INET, SOCK_DGRAM) # Keep the socket opeb, e.g. to the DR5000 device via LAN
         self.s.connect((self.host, self.port))
-        #self.s.setblocking(False) # Don't hang for non-responsive objects on the track.
-        #self.s.settimeout(timeout)
+        self.timeout = timeout or None # None makes the query wait forever for its reply.
+        self.retries = retries # Default number of times to resend a request that timed out.
         self.verbose = verbose # Optionally show what it is doing.
 
-        # In case it is on, currently still disturbing the reading of other packages.
-        self.broadcastFlags = 0 
+        self.encoder = Encoder() # Preallocated packets of the commands that are sent often.
+        self.sendLock = threading.Lock() # Patching and sending a shared Encoder packet must not be interrupted.
+        self.sendQueue = None # Optional rate limiting of the commands that become DCC packets on the rails.
+        if sendQueue:
+            self.sendQueue = SendQueue(self.send)
+            self.sendQueue.start()
+
+        self.dispatcher = Dispatcher() # Routes incoming packets by (header, X-header) key.
+        self.locos = LocoStateCache() # Last LAN_X_LOCO_INFO by loco address, from replies and broadcasts.
+        self.dispatcher.subscribe(self.KEY_LAN_X_LOCO_INFO, self.locos.update)
+        self.broadcasts = BroadcastManager(self) # Sets only the broadcast flags that the listeners need.
+        self.occupancy = Occupancy() # Feedback detectors of the R-Bus, kept current by self.watchFeedback()
+        self.railCom = RailComTelemetry() # RailCom data per loco, kept current by self.watchRailCom()
+        self.locoNet = LocoNetGateway(self) # LocoNet slots and sensors, kept current by self.watchLocoNet()
+        self.canOccupancy = Occupancy(CAN_MODULES) # CAN occupancy detectors, kept current by self.watchCanDetectors()
+        self.boosters = BoosterTelemetry() # States of the CAN booster outputs, kept current by self.watchBoosters()
+        self.systemStates = SystemStateTelemetry() # Currents, temperature and voltages, see self.watchSystemState()
+        self.cvShadows = CvShadowCache() # Known CV values of the decoders that were on the programming track.
+        self.decoderCvs = None # DecoderCvs of the decoder on the programming track, set by identifyDecoder()
+        self.decoderProfile = None # DecoderProfile of the decoder on the programming track, set by identifyDecoder()
+        self.readStrategies = {} # Decoder key --> CvReadStrategy with the measured read modes, see dumpCVs()
+        self._pomScheduler = None # Started by the first use of self.pomScheduler
+        if receiver:
+            self.receiver = Receiver(self.s, self.dispatcher)
+            self.receiver.start()
+        else: # Blocking reads directly from the socket, e.g. if threads are not available.
+            self.receiver = None
+
+        # Broadcasts no longer disturb the replies of queries, but keep them off until subscribed.
+        self.broadcastFlags = BroadcastFlags.NONE
 
     def __repr__(self):
         return f'<{self.__class__.__name__}({self.host}, {self.port})>'
@@ -240,9 +371,62 @@ class Z21:
     #   L A N  C O N T R O L L E R  C O M M U N I C A T I O N 
 
     def send(self, cmd):
-        """Send the command to the LAN device."""
+        """Send the command to the LAN device. @cmd can be bytes or the memoryview of an Encoder packet."""
         self.s.send(cmd)
 
+    def sendCommand(self, cmd, key=None):
+        """Send the loco or turnout @cmd through the send queue, if there is one. Queued commands with the same 
+        @key tuple, e.g. ('drive', loco), are coalesced into the latest one. Without queue, just send."""
+        if self.sendQueue is None:
+            self.send(cmd)
+        else:
+            self.sendQueue.put(cmd, key)
+
+    def request(self, cmd, *keys, match=None, parse=None, timeout=None, retries=None):
+        """Send the @cmd and answer a concurrent.futures.Future for the first reply packet that has one of 
+        the (header, X-header) @keys. The method does not wait, so many requests can be in flight at the same time.
+        If @match is defined, then only packets with match(packet) == True are accepted as reply.
+        If @parse is defined, then the future holds parse(packet) instead of the reply packet.
+        If the reply did not arrive within @timeout seconds (default self.timeout), then the command is sent again 
+        for @retries times (default self.retries), after which future.result() raises TimeoutError.
+
+            futures = [z21.requestLocoInfo(loco) for loco in range(40)] # All sent at once.
+            infos = [future.result() for future in futures] # About one round-trip for all of them.
+        """
+        if self.receiver is None: # Blocking read from the socket. Answer a future that is already done.
+            future = Future()
+            self.send(cmd)
+            packet = self.receiveBytes()
+            future.set_result(packet if parse is None else parse(packet))
+            return future
+        if timeout is None:
+            timeout = self.timeout
+        if retries is None:
+            retries = self.retries
+        policy = RetryPolicy(timeout, retries)
+        # Register before sending, so the reply cannot get lost.
+        future = self.dispatcher.expect(*keys, match=match, parse=parse, resend=lambda: self.send(cmd), policy=policy)
+        future.add_done_callback(lambda f: self.dispatcher.cancel(f, *keys)) # Cleanup the other keys
+        self.send(cmd)
+        return future
+
+    def query(self, cmd, *keys, match=None, parse=None):
+        """Send the @cmd and wait for the first reply packet that has one of the (header, X-header) @keys.
+        If @match is defined, then only packets with match(packet) == True are accepted as reply.
+        If @parse is defined, e.g. a message class from z21messages.py, then answer parse(packet).
+        Without receiver thread, just answer the next packet that can be read from the socket.
+        """
+        return self.request(cmd, *keys, match=match, parse=parse).result()
+
+    def subscribe(self, key, callback):
+        """Call @callback(packet) for every incoming packet with (header, X-header) @key, e.g. 
+        z21.subscribe(z21.KEY_LAN_X_LOCO_INFO, callback). Key None subscribes to all packets.
+        Note that the callback is called from the receiver thread."""
+        self.dispatcher.subscribe(key, callback)
+
+    def unsubscribe(self, key, callback):
+        self.dispatcher.unsubscribe(key, callback)
+
     def receiveInt(self):
         # receive and process response
         incomingPacket = self.receiveBytes() # Read packet from the Z21 device.
@@ -253,11 +437,19 @@ class Z21:
     def receiveBytes(self, cnt=MAX_READ):
         """Read and answer a number of bytes from the LAN socket. If no @cnt is defined, then try to read the MAX_READ amount.
         If there's less bytes available, then just answer those.
+        Only to be used directly if there is no receiver thread. Otherwise use self.query(cmd, key).
         """
         return self.s.recv(cnt)
         
     def close(self):
-        """Close the socket LAN connection to the Z21 device."""
+        """Stop the receiver thread and close the socket LAN connection to the Z21 device.
+        Commands that are still in the send queue are sent first."""
+        if self._pomScheduler is not None:
+            self._pomScheduler.stop(flush=False)
+        if self.sendQueue is not None:
+            self.sendQueue.stop()
+        if self.receiver is not None:
+            self.receiver.stop()
         self.s.close()
 
     def wait(self, t):
@@ -270,42 +462,31 @@ class Z21:
     # as class-properties. This way z21.version is the short writing of calling z21._get_version()
 
     def _get_version(self):
-        """See Z21 LAN Protocol Specification: 2.3"""
-        self.send(self.LAN_GET_VERSION)
-        return self.receiveInt()
+        """Answer the Version message, with X-Bus version and command station ID. 
+        See Z21 LAN Protocol Specification: 2.3"""
+        return self.query(self.LAN_GET_VERSION, self.KEY_LAN_X_VERSION, parse=Version)
     version = property(_get_version)
 
     def _get_serialNumber(self):
-        """See Z21 LAN Protocol Specification: 2.11"""
-        self.send(self.LAN_GET_SERIAL_NUMBER)
-        return self.receiveInt()
+        """See Z21 LAN Protocol Specification: 2.1"""
+        return self.query(self.LAN_GET_SERIAL_NUMBER, self.KEY_LAN_SERIAL_NUMBER, parse=SerialNumber).serialNumber
     serialNumber = property(_get_serialNumber)
 
     def _get_firmwareVersion(self):
         """The firmware version of the Z21 can be read with this property."""
         cmd = self.LAN_X_GET_FIRMWARE_VERSION
-        self.send(cmd)
-        bb = self.receiveBytes(1024)
+        message = self.query(cmd, self.KEY_LAN_X_FIRMWARE_VERSION, parse=FirmwareVersion)
         if self.verbose:
             printCmd('--- LAN_X_GET_FIRMWARE_VERSION (cmd): ', cmd)
-            printCmd('--- LAN_X_GET_FIRMWARE_VERSION (result): ', bb)
-        return '%x.%x' % (bb[6], bb[7])       
+            printCmd('--- LAN_X_GET_FIRMWARE_VERSION (result): ', message.packet)
+        return message.firmwareVersion
     firmwareVersion = property(_get_firmwareVersion)
 
     def _get_status(self):
-        """See Z21 LAN Protocol Specification: 2.11"""
-        csEmergencyStop = 0x01 # The emergency stop is switched on
-        csTrackVoltageOff = 0x02 # The track voltage is switched off
-        csShortCircuit = 0x04 # Short-circuit
-        csProgrammingModeActive = 0x20 # The programming mode is active        
-        self.send(self.LAN_X_GET_STATUS)
-        status = self.receiveInt()
-        return dict(
-            csEmergencyStop=bool(status & csEmergencyStop),
-            csTrackVoltageOff=bool(status & csTrackVoltageOff),
-            csShortCircuit=bool(status & csShortCircuit),
-            csProgrammingModeActive=bool(status & csProgrammingModeActive),
-            )
+        """Answer the central status as dictionary of the StatusChanged flags.
+        See Z21 LAN Protocol Specification: 2.4, 2.12"""
+        # Reply LAN_X_STATUS_CHANGED: 0x08 0x00 0x40 0x00 0x62 0x22 Status XOR
+        return self.query(self.LAN_X_GET_STATUS, self.KEY_LAN_X_STATUS_CHANGED, parse=StatusChanged).asDict()
     status = property(_get_status)
 
     def _get_hwInfo(self):
@@ -332,11 +513,8 @@ class Z21:
         • V1.11 ... Z21 (hardware variant from 2012)
         • V1.12 ... SmartRail (from 2012)
         """
-        self.send(self.LAN_GET_HWINFO)
-        bb = self.receiveBytes(12)
-        hwInfo = int.from_bytes(bb[4:8], BIG_ORDER)
-        fwInfo = int.from_bytes(bb[8:12], BIG_ORDER)
-        return hwInfo, fwInfo
+        message = self.query(self.LAN_GET_HWINFO, self.KEY_LAN_HWINFO, parse=HwInfo) # Little-endian values
+        return message.hwType, message.fwVersion
     hwInfo = property(_get_hwInfo)
 
     NO_LOCK = 0x00
@@ -352,12 +530,11 @@ class Z21:
         #define z21_START_UNLOCKED 0x02 // „z21 start”: driving and switching is permitted
         """
         cmd = self.LAN_GET_CODE
-        self.send(cmd)
-        bb = self.receiveBytes()
+        message = self.query(cmd, self.KEY_LAN_CODE, parse=Code)
         if self.verbose:
             printCmd('LAN_GET_CODE ', cmd)
-            printCmd('LAN_GET_CODE_RESULT ', bb)
-        code = int.from_bytes(bb[-1:], BIG_ORDER)
+            printCmd('LAN_GET_CODE_RESULT ', message.packet)
+        code = message.code
         if code in (self.NO_LOCK, self.START_LOCKED, self.START_UNLOCKED):
             return code
         return None # Unknown code
@@ -365,62 +542,36 @@ class Z21:
 
     def _get_systemState(self):
         """Reports a change in the system status from the Z21 to the client.
-        For usage convenience, this property method break the 16 byte data into a readable dictionary.
+        Answers the SystemState message. Its properties (mainCurrent, temperature, csShortCircuit, capRailCom, ...)
+        are decoded from the 16 byte data when they are asked for. Use systemState.asDict() for a readable dictionary.
+        The capabilities are 0 with older firmware, they should not be evaluated then.
         This message is asynchronously reported to the client by the Z21 when the client
         • activated the corresponding broadcast, see 2.16 LAN_SET_BROADCASTFLAGS, Flag 0x00000100.
         • explicitly requested the system status, see 2.19 LAN_SYSTEMSTATE_GETDATA.
-
-        #### VALUES MAY NOT BE RIGHT YET, CALIBRATE with other app
         """
         cmd = self.LAN_SYSTEMSTATE_GETDATA
-        self.send(cmd)
         # This report LAN_SYSTEMSTATE_DATACHANGED from Z21 controller to client
-        bb = self.receiveBytes(20)
+        state = self.query(cmd, self.KEY_LAN_SYSTEMSTATE_DATACHANGED, parse=SystemState)
         
         if self.verbose:
             printCmd('LAN_SYSTEMSTATE_GETDATA', cmd)
-            printCmd(f'System state (result) {len(bb)}: ', bb)
+            printCmd(f'System state (result) {len(state.packet)}: ', state.packet)
 
-        centralState = int.from_bytes(bb[12:13], LITTLE_ORDER)
-        centralStateEx = int.from_bytes(bb[13:14], LITTLE_ORDER)
-        
         # SystemState.Capabilities provides an overview of the device's range of features.
         # If SystemState.Capabilities == 0, then it can be assumed that the device has an older firmware version. 
         # SystemState.Capabilities should not be evaluated when using older firmware versions!
-        capabilities = int.from_bytes(bb[15:16], LITTLE_ORDER)
-        assert capabilities != 0  
-
-        state = dict(
-            mainCurrent=int.from_bytes(bb[:2], LITTLE_ORDER), # mA, Current on the main track
-            progCurrent=int.from_bytes(bb[2:4], LITTLE_ORDER), # mA, Current on programming track
-            filteredMainCurrent=int.from_bytes(bb[4:6], LITTLE_ORDER), # mA, smoothed current on the main track
-            temperature=int.from_bytes(bb[6:8], LITTLE_ORDER), # °C, command station internal temperature
-            supplyVoltage=int.from_bytes(bb[8:10], LITTLE_ORDER), # mV, supply voltage
-            vccVoltage=int.from_bytes(bb[10:12], LITTLE_ORDER), # mV, internal voltage, identical to track voltage
-            # Bitmask for CentralState
-            csEmergencyStop=bool(centralState & 0x01), # The emergency stop is switched on
-            csTrackVoltageOff=bool(centralState & 0x02), # The track voltage is switched off
-            csShortCircuit=bool(centralState & 0x04), # Short-circuit
-            csProgrammingModeActive=bool(centralState & 0x20), # The programming mode is active
-            # Bitmask for CentralStateEx
-            cseHighTemperature=bool(centralStateEx & 0x01), # Temperature too high
-            csePowerLost=bool(centralStateEx & 0x02), # Input voltage too low
-            cseShortCircuitExternal=bool(centralStateEx & 0x04), # S.C. at the external booster output
-            cseShortCircuitInternal=bool(centralStateEx & 0x08), # S.C. at the main track or programming track
-            cseRCN213=bool(centralStateEx & 0x20), # Turnout addresses according to RCN-213
-            # Bitmask for Capabilities
-            capDCC=bool(capabilities & 0x01), # Capable of DCC
-            capMM=bool(capabilities & 0x02), # Capable of MM
-            #capReserved 0x04 reserved for future development
-            capRailCom=bool(capabilities & 0x08), # Railcom is active
-            capLocoCmds=bool(capabilities & 0x10), # Accepts LAN commands for locomotive decoders
-            capAccessoryCmds=bool(capabilities & 0x20), # Accepts LAN commands for assessory decoders
-            capDetectorCmds=bool(capabilities & 0x40), # Accepts LAN commands for detectors
-            capNeedsUnlockCode=bool(capabilities & 0x80), # Device needs activate code (z21start)
-        )
         return state
     systemState = property(_get_systemState)
 
+    def watchSystemState(self):
+        """Keep self.systemStates current with the LAN_SYSTEMSTATE_DATACHANGED broadcasts (flag 0x00000100), 
+        the currents, temperature and voltages as time series, instead of polling self.systemState."""
+        self.broadcasts.subscribe(BroadcastFlags.SYSTEM_STATE, self.systemStates.update)
+
+    def unwatchSystemState(self):
+        """Stop keeping self.systemStates current. The broadcast flag is cleared if there are no other listeners."""
+        self.broadcasts.unsubscribe(BroadcastFlags.SYSTEM_STATE, self.systemStates.update)
+
     #   R E T R I E V E  L O C O  D A T A   ( P O M )
 
     LOCOMODE_DCC = 0
@@ -437,16 +588,15 @@ class Z21:
         1 ... MM Format
         """
         cmd = self.LAN_GET_LOCOMODE + loco2Bytes(loco)
-        self.send(cmd)
-        bb = self.receiveBytes(7)
-        rLoco = int.from_bytes(bb[4:6], BIG_ORDER)
+        message = self.query(cmd, self.KEY_LAN_LOCOMODE, parse=LocoMode)
+        rLoco = message.address
         if rLoco != loco:
             print(f'Sent loco #{loco} and received loco #{rLoco} are not identical.') # Should always be identical.
         if 1 or self.verbose:
             printCmd('LAN_GET_LOCOMODE: ', cmd)
-            printCmd('LAN_GET_LOCOMODE-Result: ', bb)
+            printCmd('LAN_GET_LOCOMODE-Result: ', message.packet)
 
-        mode = int.from_bytes(bb[-1:], BIG_ORDER)
+        mode = message.mode
         assert mode in (self.LOCOMODE_DCC, self.LOCOMODE_MM)
         return mode
 
@@ -465,7 +615,8 @@ class Z21:
         """The following command can be used to poll the status of a locomotive. At the same time, 
         the client also "subscribes" to the locomotive information for this locomotive address (only 
         in combination with LAN_SET_BROADCASTFLAGS, Flag 0x00000001).
-        This method answers a dictionary with all binary flags placed by the key/value.
+        This method answers a dictionary with all binary flags placed by the key/value, see LocoInfo in
+        z21messages.py. The state is also stored in self.locos, that keeps being updated by broadcasts.
 
         Note: loco address = (Adr_MSB & 0x3F) << 8 + Adr_LSB
         For locomotive addresses ≥ 128, the two highest bits in DB1 must be set to 1:
@@ -482,17 +633,23 @@ class Z21:
         The actual packet length n may vary depending on the data actually sent, with 7 ≤ n ≤ 14.
         From Z21 FW version 1.42 DataLen is ≥ 15 (n ≥ 8) for also transferring the status of F29, F30 and F31! 
         """
-        cmd = self.LAN_X_GET_LOCO_INFO + loco2Bytes(loco)
-        cmd += XOR(cmd)
-        self.send(cmd)
-        # Result format: LAN_X_LOCO_INFO
-        bb = self.receiveBytes() # Length of return package is not fixed.
+        return self.requestLocoInfo(loco).result()
+
+    def requestLocoInfo(self, loco, timeout=None, retries=None):
+        """Send LAN_X_GET_LOCO_INFO for @loco and answer the future for its reply, see self.getLocoInfo."""
+        cmd = self.encoder.getLocoInfo(loco)
         if self.verbose:
             printCmd('getLocoInfo ', cmd)
+        # Result format: LAN_X_LOCO_INFO. Length of return package is not fixed.
+        return self.request(cmd, self.KEY_LAN_X_LOCO_INFO, match=locoInfoMatch(loco), parse=self._parseLocoInfo, 
+            timeout=timeout, retries=retries)
+
+    def _parseLocoInfo(self, bb):
+        if self.verbose:
             printCmd('getLocoInfo result ', bb)
-        info = dict(
-            loco=int.from_bytes(bb[5:7], BIG_ORDER) & 0x3f,
-        )
+        message = LocoInfo(bytes(bb)) # self.locos is updated by its subscription, before the future is done.
+        info = dict(loco=message.address)
+        info.update(message.asDict())
         return info
 
     #   T R A C K  P O W E R 
@@ -521,6 +678,8 @@ class Z21:
             • or the track voltage has been switched off by some input device (multiMaus).
             • and the relevant client has activated the corresponding broadcast, see 2.16 LAN_SET_BROADCASTFLAGS, Flag 0x00000001"""
         cmd = self.LAN_X_SET_TRACK_POWER_OFF
+        if self.sendQueue is not None: # Urgent, skip the queue and drop the commands that are waiting.
+            self.sendQueue.purge()
         self.send(cmd)
         bb = 0 # self.receiveBytes()
         if bb and self.verbose:
@@ -537,13 +696,15 @@ class Z21:
         """Perform an emergency stop, by setting the speed to 1"""
         self.locoDrive(loco, 1)
 
+    SPEED_STEPS = {14: 0x10, 28: 0x12, 128: 0x13} # Number of speed steps --> DCC steps code in LAN_X_SET_LOCO_DRIVE
+
     def locoDrive(self, loco, speed, forward=True, steps=128):
         """Set the loco speed. @loco is the integer loco address. Speed depends on the defined number of steps. 
         Speed can be negative, which then reverses the driving direction (in the same way that the @forward 
         boolean flag works). @steps choice is in (14, 28, 128), where 128 is default.
         If the head light is set on when moving, it is not turn off for speed == 0
         """
-        speedSteps = {14: 0x10, 28: 0x12, 128: 0x13}
+        speedSteps = self.SPEED_STEPS
         assert steps in speedSteps
         if steps == 128:
             if speed < 0:
@@ -563,11 +724,15 @@ class Z21:
         # Make sure it is on when moving
         self.setHeadRearLight(loco, bool(speed not in (0, 1))) # If moving, independent from direction
 
-        cmd = self.LAN_X_SET_LOCO_DRIVE + speedSteps[steps].to_bytes(1, LITTLE_ORDER) + loco2Bytes(loco) + bSpeed.to_bytes(1, LITTLE_ORDER)
-        cmd += XOR(cmd)
-        if self.verbose:
-            printCmd(f'locoDrive(loco={loco}, speed={speed} forward={forward}) cmd: ', cmd)
-        self.send(cmd) 
+        with self.sendLock:
+            cmd = self.encoder.locoDrive(loco, speedSteps[steps], bSpeed)
+            if self.verbose:
+                printCmd(f'locoDrive(loco={loco}, speed={speed} forward={forward}) cmd: ', cmd)
+            if speed == 1 and self.sendQueue is not None: # Emergency stop is urgent, skip the queue.
+                self.sendQueue.purge(lambda key: key == ('drive', loco))
+                self.send(cmd)
+            else:
+                self.sendCommand(cmd, ('drive', loco))
 
     #   L O C O  F U N C T I O N S
 
@@ -606,7 +771,7 @@ class Z21:
     F30 = 30 # Key F30                                              Soundslot 11
     F31 = 31 # Key F31  AUX3
 
-    def locoFunction(self, loco, function, value):
+    def locoFunction(self, loco, function, value, force=False):
         """Set the loco function value. @loco is the integer loco address and @function is the id, if supported by the loco-decoder.
 
         @value in (0, False, 'off') --> off, 
@@ -625,24 +790,84 @@ class Z21:
         Value byte: TTNNNNNN      
         TT switch type: 00=off, 01=on, 10=toggle,11=not allowed 
         NNNNNN Function index, 0x00=F0 (light), 0x01=F1 etc.
-        """
-        if value in (0, False, OFF):
-            functionCode = 0x00 # TT = 00 --> off
-        elif value in (1, True, ON):
-            functionCode = 0x40 # TT = 01 --> on
-        elif value in (-1, TOGGLE):
-            functionCode = 0x80 # TT = 10 --> toggle
-        else:
-            raise ValueError(f'locoFunction: Wrong value {value}')
 
+        Nothing is sent if the function is known to have the @value already (sent before by this client, 
+        or received in self.locos), unless @force is True. See self.locoFunctions.
+        """
         assert function in range(0, 32)
-        functionCode |= function # Add NNNNNN
-
-        cmd = self.LAN_X_SET_LOCO_FUNCTION + loco2Bytes(loco) + functionCode.to_bytes(1, LITTLE_ORDER)
-        cmd += XOR(cmd)
-        self.send(cmd)
-        if self.verbose:
-            printCmd(f'locoFunction(loco={loco}, function={function}, value={value}) cmd: ', cmd)
+        if value not in (-1, TOGGLE):
+            return self.locoFunctions(loco, {function: value}, force=force)
+
+        bit = 1 << function
+        with self.sendLock:
+            cmd = self.encoder.locoFunction(loco, 0x80 | function) # TT = 10 --> toggle
+            # Toggles cannot be coalesced, two of them cancel each other.
+            self.sendCommand(cmd)
+            bits, known = self.locos.functionState(loco)
+            if known & bit:
+                self.locos.setFunctions(loco, bits ^ bit, bit)
+            if self.verbose:
+                printCmd(f'locoFunction(loco={loco}, function={function}, value={value}) cmd: ', cmd)
+        return 1
+
+    def locoFunctions(self, loco, functions, force=False):
+        """Set multiple functions of @loco. @functions is a dictionary function index --> value, where 
+        @value in (0, False, 'off') --> off and @value in (1, True, 'on') --> on. Answer the number of packets sent.
+
+        The function state of each loco is kept in self.locos. Functions that already have the wanted value 
+        are not sent, unless @force is True. If more than one function of a LAN_X_SET_LOCO_FUNCTION_GROUP changes 
+        and all functions in the group are known, then they are sent as a single group packet. Z21: 4.3.2
+        So setting F0-F12 off at startup sends 3 packets instead of 13, and 0 if they were already off.
+        """
+        wanted = mask = 0
+        for function, value in functions.items():
+            assert function in range(0, 32)
+            bit = 1 << function
+            mask |= bit
+            if value in (1, True, ON):
+                wanted |= bit
+            elif value not in (0, False, OFF):
+                raise ValueError(f'locoFunctions: Wrong value {value}')
+
+        packets = 0
+        with self.sendLock:
+            bits, known = self.locos.functionState(loco)
+            changed = mask
+            if not force: # Skip the known functions that already have the wanted value.
+                changed &= ~(known & ~(bits ^ wanted))
+            state = (bits & ~mask) | wanted
+            known |= mask
+            self.locos.setFunctions(loco, wanted, mask)
+            sendQueue = self.sendQueue
+
+            for group in FUNCTION_GROUPS:
+                groupMask = functionGroupMask(group)
+                groupChanged = changed & groupMask
+                if not groupChanged or known & groupMask != groupMask:
+                    continue
+                groupKey = ('functionGroup', loco, group)
+                # Send the group if 2 or more functions changed, or if the group is still queued.
+                if groupChanged & (groupChanged - 1) or (sendQueue is not None and sendQueue.isPending(groupKey)):
+                    if sendQueue is not None: # The group packet overrules the queued functions of the group.
+                        sendQueue.purge(lambda key: key[:2] == ('function', loco) and (1 << key[2]) & groupMask)
+                    cmd = self.encoder.locoFunctionGroup(loco, group, functionGroupValue(group, state))
+                    self.sendCommand(cmd, groupKey)
+                    if self.verbose:
+                        printCmd(f'locoFunctions(loco={loco}, group=0x{group:02x}) cmd: ', cmd)
+                    changed &= ~groupMask
+                    packets += 1
+
+            function = 0
+            while changed >> function:
+                if changed >> function & 1:
+                    functionCode = (0x40 if state >> function & 1 else 0x00) | function # TT = 01 on, 00 off
+                    cmd = self.encoder.locoFunction(loco, functionCode)
+                    self.sendCommand(cmd, ('function', loco, function))
+                    if self.verbose:
+                        printCmd(f'locoFunction(loco={loco}, function={function}, value={bool(state >> function & 1)}) cmd: ', cmd)
+                    packets += 1
+                function += 1
+        return packets
 
     def setHeadRearLight(self, loco, value=ON):
         """Turn head light on/off, assuming default function=0"""
@@ -665,42 +890,48 @@ class Z21:
     #   B R O A D C A S T I N G  F L A G S
 
     def _get_broadcastFlags(self):
-        """Answer the broadcast flags as dictionary with readable Python values.
+        """Answer the broadcast flags as dictionary with readable Python values, flag name --> bool. 
         The dictionary can be used by self.setBroadcastFlags(flags), which packs the values 
-        into the 32bits flags parameter.
+        into the 32bits flags parameter. See BroadcastFlags in z21broadcast.py for the flag names.
         """
         cmd = self.LAN_GET_BROADCASTFLAGS
-        self.send(cmd)
-        bb = self.receiveBytes()
-        flagsInt = int.from_bytes(bb[4:], LITTLE_ORDER)
-        d = dict(flags=flagsInt)
+        message = self.query(cmd, self.KEY_LAN_BROADCASTFLAGS, parse=BroadcastFlagsInfo)
+        d = message.flags.asDict()
         if self.verbose:
             printCmd('LAN_GET_BROADCASTFLAGS: ', cmd)
-            printCmd('Broadcast flags (result): ', bb)
+            printCmd('Broadcast flags (result): ', message.packet)
         return d
-    def _set_broadcastFlags(self, d):
-        """Set the broadcast flags from Python dictionary @d. This can be the (modified) version
-        that was answered by self.getBroadcastFlags.
+    def _set_broadcastFlags(self, flags):
+        """Set the broadcast flags from Python dictionary @flags. This can be the (modified) version
+        that was answered by self.getBroadcastFlags. @flags can also be a BroadcastFlags or integer.
+        Normally the flags are set by self.broadcasts, for the listeners that subscribed to broadcasts.
         """
-        flagsInt = 0
-
-        cmd = self.LAN_SET_BROADCASTFLAGS + flagsInt.to_bytes(4, LITTLE_ORDER)
+        if isinstance(flags, dict):
+            flags = BroadcastFlags.fromDict(flags)
+        cmd = self.encoder.setBroadcastFlags(int(flags))
         if self.verbose:
             printCmd('setBroadcastFlags: ', cmd)
         self.send(cmd)
     broadcastFlags = property(_get_broadcastFlags, _set_broadcastFlags)
+    getBroadcastFlags = _get_broadcastFlags
+    setBroadcastFlags = _set_broadcastFlags
 
     #  5  S W I T C H I N G
 
     def getTurnoutInfo(self, turnoutId):
         """The following command can be used to poll the status of a turnout (or any accessory function)."""
-        cmd = self.LAN_X_GET_TURNOUT_INFO + turnoutId.to_bytes(2, BIG_ORDER)
-        cmd += XOR(cmd[4:])
-        self.send(cmd)
-        bb = self.receiveBytes()
+        return self.requestTurnoutInfo(turnoutId).result()
+
+    def requestTurnoutInfo(self, turnoutId, timeout=None, retries=None):
+        """Send LAN_X_GET_TURNOUT_INFO for @turnoutId and answer the future for its reply, see self.getTurnoutInfo."""
+        cmd = self.encoder.getTurnoutInfo(turnoutId)
+        return self.request(cmd, self.KEY_LAN_X_TURNOUT_INFO, match=turnoutInfoMatch(turnoutId), 
+            parse=self._parseTurnoutInfo, timeout=timeout, retries=retries)
+
+    def _parseTurnoutInfo(self, bb):
+        # LAN_X_TURNOUT_INFO: 0x09 0x00 0x40 0x00 0x43 FAdr_MSB FAdr_LSB 000000ZZ XOR
         printCmd('getTurnoutInfo result', bb)
-        flags = int(bb[-1])
-        return flags & 0x03
+        return TurnoutInfo(bb).state
 
     def setTurnout(self, turnoutId, value):
         """A turnout (or any accessory function) can be switched with the following command.
@@ -716,146 +947,217 @@ class Z21:
             v = 0x89 # 10001001
         else:
             v = 0x88 # 10001000
-        cmd = self.LAN_X_SET_TURNOUT + turnoutId.to_bytes(2, BIG_ORDER) + v.to_bytes(1, BIG_ORDER)
-        cmd += XOR(cmd[4:])
+        with self.sendLock:
+            cmd = self.encoder.setTurnout(turnoutId, v)
+            if self.verbose:
+                printCmd(f'setTurnout({turnoutId}): ', cmd)
+            self.sendCommand(cmd, ('turnout', turnoutId))
+
+    #   F E E D B A C K  ( R - B U S )
+
+    def requestRmBusData(self, groupIndex, timeout=None, retries=None):
+        """Send LAN_RMBUS_GETDATA for the modules of @groupIndex (0: modules 1-10, 1: modules 11-20) and answer
+        the future for the RmBusData reply. The status is stored in self.occupancy. Z21: 7.2"""
+        assert groupIndex in range(RMBUS_GROUPS)
+        cmd = self.LAN_RMBUS_GETDATA + bytes((groupIndex,))
         if self.verbose:
-            printCmd(f'setTurnout({turnoutId}): ', cmd)
+            printCmd('LAN_RMBUS_GETDATA ', cmd)
+        return self.request(cmd, self.KEY_LAN_RMBUS_DATACHANGED, match=lambda packet: packet[4] == groupIndex, 
+            parse=self._parseRmBusData, timeout=timeout, retries=retries)
+
+    def _parseRmBusData(self, bb):
+        self.occupancy.updateRmBus(bb) # Before the future is done, so self.occupancy is current for the caller.
+        return RmBusData(bytes(bb))
+
+    def watchFeedback(self):
+        """Keep self.occupancy current: set the broadcast flag of LAN_RMBUS_DATACHANGED and read the current 
+        status of all modules. From then on reading a detector, e.g. self.occupancy[13], needs no traffic to the Z21.
+        Answer the list of futures of the LAN_RMBUS_GETDATA requests."""
+        self.broadcasts.subscribe(BroadcastFlags.RMBUS, self.occupancy.updateRmBus)
+        return [self.requestRmBusData(groupIndex) for groupIndex in range(RMBUS_GROUPS)]
+
+    def unwatchFeedback(self):
+        """Stop keeping self.occupancy current. The broadcast flag is cleared if there are no other listeners."""
+        self.broadcasts.unsubscribe(BroadcastFlags.RMBUS, self.occupancy.updateRmBus)
+
+    def programRmBusModule(self, address):
+        """Send LAN_RMBUS_PROGRAMMODULE, to set the address (1-20) of the feedback module, that has its programming 
+        key pressed. Address 0 ends the programming. Z21: 7.3"""
+        assert address in range(0, 21)
+        cmd = self.LAN_RMBUS_PROGRAMMODULE + bytes((address,))
+        if self.verbose:
+            printCmd('LAN_RMBUS_PROGRAMMODULE ', cmd)
+        self.send(cmd)
+
+    #   R A I L C O M
+
+    def requestRailComData(self, loco=0, timeout=None, retries=None):
+        """Send LAN_RAILCOM_GETDATA for @loco and answer the future for the RailComData reply. With @loco 0, the 
+        Z21 answers the next loco of its RailCom buffer, round robin. The data is stored in self.railCom. Z21: 8.2"""
+        cmd = self.LAN_RAILCOM_GETDATA + struct.pack('<H', loco)
+        if self.verbose:
+            printCmd('LAN_RAILCOM_GETDATA ', cmd)
+        match = None
+        if loco:
+            match = lambda packet: struct.unpack_from('<H', packet, 4)[0] == loco
+        return self.request(cmd, self.KEY_LAN_RAILCOM_DATACHANGED, match=match, parse=self._parseRailComData, 
+            timeout=timeout, retries=retries)
+
+    def _parseRailComData(self, bb):
+        self.railCom.update(bb) # Before the future is done, so self.railCom is current for the caller.
+        return RailComData(bytes(bb))
+
+    def watchRailCom(self, allLocos=False):
+        """Keep self.railCom current with the LAN_RAILCOM_DATACHANGED broadcasts of the locos that are subscribed
+        with self.broadcasts.subscribeLoco, or of all locos if @allLocos is True (high traffic, from FW 1.29)."""
+        flag = BroadcastFlags.ALL_RAILCOM if allLocos else BroadcastFlags.RAILCOM
+        self.broadcasts.subscribe(flag, self.railCom.update)
+
+    def unwatchRailCom(self):
+        """Stop keeping self.railCom current. The broadcast flags are cleared if there are no other listeners."""
+        for flag in (BroadcastFlags.RAILCOM, BroadcastFlags.ALL_RAILCOM):
+            self.broadcasts.unsubscribe(flag, self.railCom.update)
+
+    #   L O C O N E T
+
+    def sendLocoNet(self, data):
+        """Send LAN_LOCONET_FROM_LAN, to put the LocoNet message @data (including its checksum) onto the bus.
+        Use self.locoNet.send(data) to have the message decoded and applied to the slots as well. Z21: 9.3"""
+        cmd = bytearray(self.LAN_LOCONET_FROM_LAN + bytes(data))
+        cmd[0] = len(cmd)
+        if self.verbose:
+            printCmd('LAN_LOCONET_FROM_LAN ', cmd)
+        self.send(cmd)
+
+    def requestLocoNetDispatch(self, loco, timeout=None, retries=None):
+        """Send LAN_LOCONET_DISPATCH_ADDR, to put @loco into the dispatch slot of the LocoNet command station, so a
+        LocoNet throttle can take it. Answer the future for the LocoNetDispatch reply, with the slot number or 0
+        if that failed. Z21: 9.4"""
+        cmd = self.LAN_LOCONET_DISPATCH_ADDR + struct.pack('<H', loco)
+        if self.verbose:
+            printCmd('LAN_LOCONET_DISPATCH_ADDR ', cmd)
+        return self.request(cmd, self.KEY_LAN_LOCONET_DISPATCH_ADDR, 
+            match=lambda packet: struct.unpack_from('<H', packet, 4)[0] == loco, 
+            parse=lambda bb: LocoNetDispatch(bytes(bb)), timeout=timeout, retries=retries)
+
+    def requestLocoNetDetector(self, requestType, address=0, timeout=None, retries=None):
+        """Send LAN_LOCONET_DETECTOR with @requestType (DETECTOR_REQUEST_... in z21loconet.py) for the report
+        @address. Answer the future for the first LocoNetDetector report of that address. The occupancy reports
+        are stored in self.locoNet.occupancy. Z21: 9.5"""
+        cmd = self.LAN_LOCONET_DETECTOR + struct.pack('<BH', requestType, address)
+        if self.verbose:
+            printCmd('LAN_LOCONET_DETECTOR ', cmd)
+        match = None
+        if address:
+            match = lambda packet: struct.unpack_from('<H', packet, 5)[0] == address
+        return self.request(cmd, self.KEY_LAN_LOCONET_DETECTOR, match=match, parse=self._parseLocoNetDetector, 
+            timeout=timeout, retries=retries)
+
+    def _parseLocoNetDetector(self, bb):
+        message = LocoNetDetector(bytes(bb))
+        if message.type == message.OCCUPANCY: # Before the future is done, so self.locoNet is current for the caller.
+            self.locoNet.occupancy.set(message.address, message.occupied)
+        return message
+
+    def watchLocoNet(self, locos=True, turnouts=True, detectors=True):
+        """Keep self.locoNet current with the LocoNet messages that the Z21 forwards. The flags of @locos and 
+        @turnouts add those messages to the same LAN_LOCONET_... packets, @detectors adds LAN_LOCONET_DETECTOR."""
+        self.broadcasts.subscribe(BroadcastFlags.LOCONET, self.locoNet.receive)
+        if locos:
+            self.broadcasts.subscribe(BroadcastFlags.LOCONET_LOCOS, self.locoNet.receive)
+        if turnouts:
+            self.broadcasts.subscribe(BroadcastFlags.LOCONET_TURNOUTS, self.locoNet.receive)
+        if detectors:
+            self.broadcasts.subscribe(BroadcastFlags.LOCONET_DETECTOR, self.locoNet.receiveDetector)
+
+    def unwatchLocoNet(self):
+        """Stop keeping self.locoNet current. The broadcast flags are cleared if there are no other listeners."""
+        for flag in (BroadcastFlags.LOCONET, BroadcastFlags.LOCONET_LOCOS, BroadcastFlags.LOCONET_TURNOUTS):
+            self.broadcasts.unsubscribe(flag, self.locoNet.receive)
+        self.broadcasts.unsubscribe(BroadcastFlags.LOCONET_DETECTOR, self.locoNet.receiveDetector)
+
+    #   C A N
+
+    def requestCanDetector(self, netId=CAN_ALL_DETECTORS, timeout=None, retries=None):
+        """Send LAN_CAN_DETECTOR for the detector @netId and answer the future for its first CanDetector report.
+        The occupancy reports are stored in self.canOccupancy. With the default CAN_ALL_DETECTORS, all detectors
+        report, use watchCanDetectors() to store all of them. Z21: 10.1"""
+        cmd = self.LAN_CAN_DETECTOR + struct.pack('<H', netId)
+        if self.verbose:
+            printCmd('LAN_CAN_DETECTOR ', cmd)
+        match = None
+        if netId != CAN_ALL_DETECTORS:
+            match = lambda packet: struct.unpack_from('<H', packet, 4)[0] == netId
+        return self.request(cmd, self.KEY_LAN_CAN_DETECTOR, match=match, parse=self._parseCanDetector, 
+            timeout=timeout, retries=retries)
+
+    def _parseCanDetector(self, bb):
+        self.canOccupancy.updateCanDetector(bb) # Before the future is done, so self.canOccupancy is current for the caller.
+        return CanDetector(bytes(bb))
+
+    def watchCanDetectors(self):
+        """Keep self.canOccupancy current: set the broadcast flag of LAN_CAN_DETECTOR and ask all CAN detectors
+        for their state, that arrives as reports to the same subscriber."""
+        self.broadcasts.subscribe(BroadcastFlags.CAN_DETECTOR, self.canOccupancy.updateCanDetector)
+        cmd = self.LAN_CAN_DETECTOR + struct.pack('<H', CAN_ALL_DETECTORS)
+        if self.verbose:
+            printCmd('LAN_CAN_DETECTOR ', cmd)
+        self.send(cmd)
+
+    def unwatchCanDetectors(self):
+        """Stop keeping self.canOccupancy current. The broadcast flag is cleared if there are no other listeners."""
+        self.broadcasts.unsubscribe(BroadcastFlags.CAN_DETECTOR, self.canOccupancy.updateCanDetector)
+
+    def watchBoosters(self):
+        """Keep self.boosters current with the LAN_CAN_BOOSTER_SYSTEMSTATE_CHGD broadcasts of all CAN boosters
+        (from FW 1.41), e.g. for the current and the short circuits per district."""
+        self.broadcasts.subscribe(BroadcastFlags.CAN_BOOSTER, self.boosters.update)
+
+    def unwatchBoosters(self):
+        """Stop keeping self.boosters current. The broadcast flag is cleared if there are no other listeners."""
+        self.broadcasts.unsubscribe(BroadcastFlags.CAN_BOOSTER, self.boosters.update)
+
+    def requestCanDeviceDescription(self, netId, timeout=None, retries=None):
+        """Send LAN_CAN_DEVICE_GET_DESCRIPTION and answer the future for the CanDeviceDescription of the CAN
+        device @netId. Z21: 10.2.1"""
+        cmd = self.LAN_CAN_DEVICE_GET_DESCRIPTION + struct.pack('<H', netId)
+        if self.verbose:
+            printCmd('LAN_CAN_DEVICE_GET_DESCRIPTION ', cmd)
+        return self.request(cmd, self.KEY_LAN_CAN_DEVICE_GET_DESCRIPTION, 
+            match=lambda packet: struct.unpack_from('<H', packet, 4)[0] == netId, 
+            parse=lambda bb: CanDeviceDescription(bytes(bb)), timeout=timeout, retries=retries)
+
+    def setCanDeviceDescription(self, netId, name):
+        """Send LAN_CAN_DEVICE_SET_DESCRIPTION, to name the CAN device @netId, at most 15 characters. Z21: 10.2.2"""
+        data = name.encode('latin-1')
+        assert len(data) < 16, f'Name {name!r} is longer than 15 characters'
+        cmd = self.LAN_CAN_DEVICE_SET_DESCRIPTION + struct.pack('<H16s', netId, data)
+        if self.verbose:
+            printCmd('LAN_CAN_DEVICE_SET_DESCRIPTION ', cmd)
+        self.send(cmd)
+
+    def setCanBoosterPower(self, netId, on, port=None):
+        """Send LAN_CAN_BOOSTER_SET_TRACKPOWER, to switch output @port (1 or 2) of the CAN booster @netId on or off.
+        If @port is None, both outputs are switched. Z21: 10.2.4"""
+        if port is None:
+            power = 0xFF if on else 0x00
+        else:
+            assert port in (1, 2)
+            power = (port << 4) | bool(on)
+        cmd = self.LAN_CAN_BOOSTER_SET_TRACKPOWER + struct.pack('<HB', netId, power)
+        if self.verbose:
+            printCmd('LAN_CAN_BOOSTER_SET_TRACKPOWER ', cmd)
         self.send(cmd)
 
     #   R E A D  /  W R I T E  C O N F I G U R A T I O N  V A R I A B L E S  ( C V )
 
-    # LokSound5 documentation: List of all supported CV's
-    # 51989_LokSound_5_ESUKG_EN_InstructionManual_Edition-15_eBook_01.pdf
-
-    CV_LOCO_ADDRESS             = 1 # Address of engine (For Multiprotocol decoders: Range 1-255 for Motorola). Range: 1-127. Default: 3
-    CV_START_VOLTAGE            = 2 # Sets the minimum speed of the engine. Range: 1-127. Default: 3
-    CV_ACCELERATION             = 3 # This value multiplied by 0.25 is the time from stop to maximum speed. For LokSound 5 DCC: The unit is 0.896 seconds. Range: 0-255. Default: 28
-    CV_DECELERATION             = 4 # This value multiplied by 0.25 is the time from maximum speed to stop For LokSound 5 DCC: The unit is 0.896 seconds. Range: 0-255. Default: 21
-    CV_MAXIMUM_SPEED            = 5 # Maximum speed of the engine. Range: 0-255. Default: 255
-    CV_MEDIUM_SPEED             = 6 # Medium speed of the engine. Use only if 3-point speed table is enabled. For LokSound 5 DCC only.
-    CV_VERSION_NUMBER           = 7 # Internal software version of decoder
-    CV_MANUFACTURERS_ID         = 8 # Manufacturers‘s ID ESU - Writing value 8 in this CV triggers a reset to factory default values. Range: 151.
-    CV_MOTOR_PWM_FREQUENZ       = 9 # Motor PWM frequency as a multiple of 1000 Hz. Range: 10-50. Default: 40.
-    CV_ANALOG_MODUS_F1_F8       = 13 # Status of functions F1 to F8 in analogue mode (see chapter 12.7). Range 0-255. Default: 1.
-    CV_ANALOG_MODUS_F9_F15      = 14 # Status of function F0, F9 to F12 in analogue mode (see chapter 12.7). Range 0-63. Defailt: 1.
-    CV_DECODER_LOCK             = 15 # [15,16] Decoder-Lock Function according to NMRA. For details please see: http://www.nmra.org/standards/DCC/WGpublic/0305051/0305051.html. Range 0-255. Default: 0.
-    CV_LOCO_LONG_ADDRESS        = 17 # [17,18] Long address of engine (see chapter 9.2). Range: 128-9999. Default: 192.
-    CV_CONSIST_ADRESS           = 19 # Additional address for consist operation. Value 0 or 128 means: consist address is disabled. 1 – 127 consist address active, normal direction. 129 – 255 consist address active reverse direction
-    CV_CONSIST_MODE_F1_F8       = 21 # Status of functions F1 to F8 in Consist mode Meaning of the bits as in CV 13. Range 0-255. Default: 0.
-    CV_CONSIST_MODE_F9_F12      = 22 # Status of functions FL, F9 to F12 in Consist mode Meaning of the bits as in CV 14. Range 0-255. Default: 0.
-    CV_ADJUST_ACCELERATION      = 23 # Factor for adjusting Acceleration CV 3. Values from 0 to 127 are added to CV 3. If the values are to be subtracted, additionally set bit 7 (value 128). The unit is 0.896 seconds. Range: 0-127. Default: 0.
-    CV_ADJUST_DECELERATION      = 24 # Factor for adjusting the deceleration CV 4. Values from 0 to 127 are ad- ded to CV 3. If the values are to be subtracted, additionally set bit 7 (value 128). The unit is 0.896 seconds. Range: 0-127. Default: 0.
-    CV_BRAKE_MODE               = 27 # 8 Allowed (enabled) Brake modes by bits. Default: 28.
-    CV_RAILCOM_CONFIGURATION    = 28 # Settings for RailCom®
-    CV_CONFIGURATION_REGISTER   = 29 # IThis register contains important information, some of which are only relevant for DCC operation. Default: 12.
-    CV_INDEX_REGISTER_H         = 31 # Selection page for CV257-512. For LokSound 5 usually set to 16. 
-    CV_INDEX_REGISTER_L         = 32 # Selection page for CV257-512. Range 0-16. Default: 0.
-    CV_PROTOCOL_SELECTION       = 47 # Which protocols are active. Please see chapter 9.5. Default: 13.
-    CV_EXTENDED_CONFIGURATION   = 49 # Range 0-255. Value: 19.
-    CV_ANALOGUE_MODE            = 50 # Selection of allowed analogue modes. Range 0-3. Default: 3.
-    CV_K_SLOW_CUTOFF            = 51 # Internal Speedstep, until «K Slow» is active. Range 0-255. Default: 10.
-    CV_BEMF_PARAM_K_SLOW        = 52 # «K» -Portion of the PI-Controller valid for lower speed steps. Range 0-255. Default: 10.
-    CV_CONTROL_REF_VOLTAGE      = 53 # Defines the Back EMF voltage, which the motor should generate at maxi- mum speed. The higher the efficiency of the motor, the higher this value may be set. If the engine does not reach maximum speed, reduce this pa- rameter. Range: 0-255. Default: 130.
-    CV_LOAD_CONTROL_PARAMS_K    = 54 # «K»–component of the internal PI-controller. Defines the effect of load control. The higher the value, the stronger the effect of Back EMF control. Range 0-255. Default: 50.
-    CV_LOAD_CONTROL_PARAMS_I    = 55 # «I»–component of the internal PI-controller. Defines the momentum (iner- tia) of the motor. The higher the momentum of the motor (large flywheel or bigger motor), the lower this value has to be set. The higher the value, the stronger the effect of Back EMF control. Range 0-255. Default: 100.
-    CV_BEMF_INFLUENCE_VMIN      = 56 # 0-100%. Defines the “Strengh” of the BEMF at minimum speed step. Range: 1-255. Default: 255.
-    CV_STEAM_CHUFF_SYNCH_1      = 57 # [LokSound5 only] Defines the steam chuff synchronisation. See chapter 13.3. Range: 1-255. Default: 30.
-    CV_STEAM_CHUFF_SYNCH_2      = 58 # [LokSound5 only] Defines the steam chuff synchronisation. See chapter 13.3. Range: 1-255. Default: 20.
-    # [LokSound5 only] The master volume control controls all sound effects. A value of „0“ would mute the decoder completely. 
-    # The resulting sound vo- lume for each individual sound effect therefore is a mixture of the master volume control 
-    # settings and the individual volume control sliders. Range: 0-192. Default: 180.
-    CV_MASTER_VOLUME            = 63 
-    # [LokSound5 only] If the actual loco speed step is smaller than or equals the value indicated here, the brake sound is triggered. 
-    # Compare chapter 13.4. Range: 0-255. Default: 60.
-    # 13.4. Adjusting the braking sound threshold
-    # The LokSound decoder is able to play a wheel-synchron brakesound. To play a brake sound, Damit das Bremsgeräusch abgespielt wird, 
-    # there are several conditions necessary:
-    #   •The braking time in CV 4 is set sufficiently high (at least value 20 or higher).
-    #   •The loco drives with high speed at the time of the braking command.
-    #   •The loco receives the driving command “Speed step 0”. The LokSound decoder will now start to play the braking sound at
-    #   the time determined in CV 64. The higher the value in CV 64 is, the sooner the braking sound will be played. The default value 100
-    #   is approximately equivalent to speed step 48 of 128. The braking sound should and when the loco stopps. You are able
-    #   to do some “finetuning” with CV 65, if the loco stops too early.
-    CV_BRAKE_SOUND_ON           = 64 
-    # [LokSound5 only] If the actual loco speed step is smaller than the one indicated here (up to 255), the brake sound will be switched off again. 
-    # Compare chapter 13.4. Range: 0-255. Default: 7.
-    CV_BRAKE_SOUND_OFF          = 65 
-    CV_FORWARD_TRIMM            = 66 # Divided by 128 is the factor used to multiply the motor voltage when driving forward. The value 0 deactivates the trim. Range: 0-255. Default: 128.
-    CV_SPEED_TABLE              = 67 # [65:95] Defines motor voltage for speed steps. The values „in between“ will be interpolated. Range 0-255
-    CV_REVERSE_TRIMM            = 95 # Divided by 128 is the factor used to multiply the motor voltage when driving backwards. Value 0 deactivates the trim. Range: 0-255. Default: 128.
-    CV_SHUNTING_MODE_TRIMM      = 101 # Divided by 128, this gives the factor by which the motor voltage is multi- plied when the shunting gear is active. See section 10.1.2. Range: 0-128. Default: 64.
-    CV_BREAK_MODE_EXIT_DELAY    = 102 # Time as a multiple of 16 milliseconds that must pass before a detected braking distance is left again. See section 10.4.6. Range: 0-255. Default: 12.
-    CV_LOAD_ADJ_OPTIONAL_LOAD   = 103 # Divided by 128, this gives the factor that changes CV3, CV4 and the sound when „Optional Load” is active. See section 10.7. Range: 0-255. Default: 0.
-    CV_LOAD_ADJ_PRIMARY_LOAD    = 104 # Divided by 128, this gives the factor that changes CV3, CV4 and the sound when „Primry Load” is active. See section 10.7. Range: 0-255. Default: 255.
-    CV_USER_CV1                 = 105 # Free CV. Here you are able to save what ever you want. Range: 0-255. Default: 0.
-    CV_USER_CV2                 = 106 # Free CV. Here you are able to save what ever you want. Range: 0-255. Default: 0.
-    CV_GEARBOX_BACKLASH         = 111 # Time as a multiple of 16 mS, for which the motor runs at minimum speed after reversing the direction to prevent gear box jerking. Range: 0-255. DefaultL 0.
-    CV_FREQUENCY_FLASH_LIGHTS   = 112 # Flashing frequency for Strobe lighting effects. Multiple of 0.065536 seconds. See section 12.5.4. Range: 0-255. Default: 20.
-    CV_POWER_FAIL_BYPASS        = 133 # The time that the decoder bridges via the PowerPack after an interruption of voltage. Unit: A multiple of 0.032768 sec. See section 6.12.2. Range: 0-255. Default: 32.
-    CV_SLOW_SPEED_BEMF_SAMPL    = 116 # Frequency of BEMF measurement in 0.1 milliseconds at speed step 1. Range: 50-200. Default: 50.
-    CV_FULL_SPEED_BEMF_SAMPL    = 117 # Frequency of BEMF measurement in 0.1 milliseconds at speed step 255. Range: 50-200. Default: 150.
-    CV_SLOW_SPEED_BEMF_GAP_VMIN = 118 # Length of the BEMF measuring gap in 0.1 milliseconds at speed step 1. Range: 10-20. Default: 150. ???
-    CV_FULL_SPEED_BEMF_GAP_VMIN = 119 # Length of the BEMF measuring gap in 0.1 milliseconds at speed step 255. Range: 10-20. Default: 15.
-    CV_ABC_MODE_SLOW_DRIVE      = 123 # Speed which is valid in the slow driving section during ABC braking. Range: 0-255. Default: 100.
-    CV_EXTENDED_CONFIGURATION_2 = 124 # Additional important settings for decoders. Default: 21.
-    CV_START_VOLTAGE_ANALOG_DC  = 125 # See section 10.8. Range: 0-255. Default: 90.
-    CV_MAX_SPEED_ANALOG_DC      = 126 # See section 10.8. Range: 0-255. Default: 130.
-    CV_START_VOLTAGE_ANALOG_AC  = 127 # See section 10.8. Range: 0-255. Default: 90.
-    CV_MAX_SPEED_ANALOG_AC      = 128 # See section 10.8. Range: 0-255. Default: 130.
-    CV_ANALOG_FUNC_HYSTERESE    = 129 # Offset voltage for functions in analogue mode. Chapter 10.8. Range: 0-255. Default: 15.
-    CV_ANALOG_MOTOR_HYSTERESE   = 130 # Offset voltage for motor functions in analogue mode. Chapter 10.8. Range: 0-255. Default: 5.
-    CV_GRADE_CROSSING_HOLD_TIME = 132 # Grade Crossing holding time. See chapter 12.5.3. Range: 0-255. Default: 80.
-    CV_SOUND_FADER              = 133 # Volume when sound fader is active. See chapter 13.5. Range: 0-255. Default: 128.
-    CV_ABC_MODE_SENSIBILITY     = 134 # Threshold, from which asymmentry on ABC shall be recognised. Range: 4-32. Default: 10.
-    CV_SMOKE_UNIT_TRIM_FAN      = 138 # [LokSound5 only] Divided by 128, this gives the factor by which the fan speed of synchronized smoke units can be adjusted. Range: 0-255. Default: 128.
-    CV_SMOKE_UNIT_TRIM_TEMP     = 139 # [LokSound5 only] Divided by 128, this gives the factor by which the temperature of synchronized smoke units can be adjusted. Range: 0-255. Default: 128.
-    CV_SMOKE_TIMEOUT            = 140 # [LokSound5 only] Time until automatic shutdown of the smoke unit. Range: 0-255. Default: 255.
-    CV_SMOKE_CHUFF_MIN          = 141 # [LokSound5 only] Minimum duration of a steam chuff of an external smoke unit in 0.041 resolution. Range: 0-255. Default: 10.
-    CV_SMOKE_CHUFF_MAX          = 142 # [LokSound5 only] Maximum duration of a steam chuff of an external smoke unit in 0.041 resolution. Range: 0-255. Default: 125.
-    CV_SMOKE_CHUF_LENGTH        = 143 # [LokSound5 only] Divided by 128, this gives the factor by which the duration of the steam chuffs can be adjusted relative to the trigger pulses. Range: 0-255. Default: 255.
-    CV_SMOKE_PREHEAT_TEMP       = 144 # [LokSound5 only] Preheating temperature in degrees Celsius for secondary smoke generators (cylinder smoke unit). Range: 0-255. Default: 150.
-    CV_ABC_SHUTTLE_TRAIN_HOLD   = 149 # Time in seconds, which has to be passed for ABC shuttle train operation, before the direction of travel is changed. See section 10.4.4.3. Range: 0-255. Default: 255.
-    CV_HLU_SPEEDLIMIT_1         = 150 # HLU Speed limit 1. Internal speedstep. Range: 0-255. Default: 42.
-    CV_HLU_SPEEKLIMIT_2U        = 151 # HLU Speed limit 2 (U). Internal speedstep. Range: 0-255. Default: 85.
-    CV_HLU_SPEEDLIMIT_3         = 152 # HLU Speed limit 3. Internal speedstep. Range: 0-255. Default: 127.
-    CV_HLU_SPEEKLIMIT_4L        = 153 # HLU Speed limit 4 (L). Internal speedstep. Range: 0-255. Default: 170.
-    CV_HLU_SPEEKLIMIT_5         = 154 # HLU Speed limit 5. Internal speedstep. Range: 0-255. Default: 212.
-    CV_SOUND_CV1                = 155 # 16 CVs for selecting sounds that can be assigned within sound projects. Please note the documentation for the sound project. Range: 0-255. Default: 0.
-    CV_SOUND_CV2                = 156 # 16 CVs for selecting sounds that can be assigned within sound projects. Please note the documentation for the sound project. Range: 0-255. Default: 0.
-    CV_SOUND_CV3                = 157 # 16 CVs for selecting sounds that can be assigned within sound projects. Please note the documentation for the sound project. Range: 0-255. Default: 0.
-    CV_SOUND_CV4                = 158 # 16 CVs for selecting sounds that can be assigned within sound projects. Please note the documentation for the sound project. Range: 0-255. Default: 0.
-    CV_SOUND_CV5                = 159 # 16 CVs for selecting sounds that can be assigned within sound projects. Please note the documentation for the sound project. Range: 0-255. Default: 0.
-    CV_SOUND_CV6                = 160 # 16 CVs for selecting sounds that can be assigned within sound projects. Please note the documentation for the sound project. Range: 0-255. Default: 0.
-    CV_SOUND_CV7                = 161 # 16 CVs for selecting sounds that can be assigned within sound projects. Please note the documentation for the sound project. Range: 0-255. Default: 0.
-    CV_SOUND_CV8                = 162 # 16 CVs for selecting sounds that can be assigned within sound projects. Please note the documentation for the sound project. Range: 0-255. Default: 0.
-    CV_SOUND_CV9                = 163 # 16 CVs for selecting sounds that can be assigned within sound projects. Please note the documentation for the sound project. Range: 0-255. Default: 0.
-    CV_SOUND_CV10               = 164 # 16 CVs for selecting sounds that can be assigned within sound projects. Please note the documentation for the sound project. Range: 0-255. Default: 0.
-    CV_SOUND_CV11               = 165 # 16 CVs for selecting sounds that can be assigned within sound projects. Please note the documentation for the sound project. Range: 0-255. Default: 0.
-    CV_SOUND_CV12               = 166 # 16 CVs for selecting sounds that can be assigned within sound projects. Please note the documentation for the sound project. Range: 0-255. Default: 0.
-    CV_SOUND_CV13               = 167 # 16 CVs for selecting sounds that can be assigned within sound projects. Please note the documentation for the sound project. Range: 0-255. Default: 0.
-    CV_SOUND_CV14               = 168 # 16 CVs for selecting sounds that can be assigned within sound projects. Please note the documentation for the sound project. Range: 0-255. Default: 0.
-    CV_SOUND_CV15               = 169 # 16 CVs for selecting sounds that can be assigned within sound projects. Please note the documentation for the sound project. Range: 0-255. Default: 0.
-    CV_SOUND_CV16               = 170 # 16 CVs for selecting sounds that can be assigned within sound projects. Please note the documentation for the sound project. Range: 0-255. Default: 0.
-    CV_BRAKE_FUNCTION_1_DEC     = 179 # Value of which 33% of CV 4 will be deducted if the Brake Function 1 is active. See section 10.6. Range: 0-255. Defualt: 80.
-    CV_BRAKE_FUNCTION_2_DEC     = 180 # Value of which 33% of CV 4 will be deducted if the Brake Function 2 is active. See section 10.6. Range: 0-255. Defualt: 40.
-    CV_BRAKE_FUNCTION_3_DEC     = 181 # Value of which 33% of CV 4 will be deducted if the Brake Function 3 is active. See section 10.6. Range: 0-255. Defualt: 40.
-    CV_BRAKE_FUNCTION_1_MAX     = 182 # Highest speed step that can be reached when Brake function 1 is active. Range: 0-126. Default: 0.
-    CV_BRAKE_FUNCTION_2_MAX     = 183 # Highest speed step that can be reached when Brake function 2?? is active. Range: 0-126. Default: 0.
-    CV_BRAKE_FUNCTION_3_MAX     = 184 # Highest speed step that can be reached when Brake function 3?? is active. Range: 0-126. Default: 0.
-    CV_AUTO_DECOULING_SPEED     = 246 # Speed of the loco while decoupling; the higher the value, the faster the loco. Value 0 switches the automatic coupler off. Automatic decoupling is only active if the function output is adjusted to „pulse“ or „coupler“. Range: 0-255. Default: 0.
-    CV_DECOUPLING_REMOVE_TIME   = 247 # This value multiplied with 0.016 defines the time the loco needs for moving away from the train (automatic decoupling). Range: 0-255. Default: 0.
-    CV_DECOUPLING_PUSH_TIME     = 248 # This value multiplied with 0.016 defines the time the loco needs for pushing against the train (automatic decoupling). Range: 0-255. Default: 0.
-    CV_MIN_STEAM_CHUFF_DISTANCE = 249 # Minimum distance of two steam chuffs, independant from sensor data. Compage chapter 13.3. Range: 0-255. Default: 0.
-    CV_SEC_STEAM_CHUFF_TRIGGER  = 250 # [LokSound5 only] Defines the distance between two consecutive steam chuffs for the secondary steam chuff generator. The value indicates the promilles the steam chuff distances of the secondary steam chuff generator ought to be shorter then those of the primary steam chuff generator. It is needed for steam locos with two independent boogies, such as „Big Boy” or „Mallet”. Range: 0-255. Default: 0.
-    CV_CONSTANT_BRAKE_MODE      = 253 # Determines the constant brake mode. Only active, if CV254 > 0. Range: 0-255. Default: 0.
-    CV_CONSTANT_BRAKE_DIST_FORW = 254 # A value > 0 determines the way of brake distance it adheres to, indepen- dent from speed. Range: 0-255. Default: 0.
-    CV_CONSTANT_BRAKE_DIST_BACK = 255 # Constant braking distances during reverse driving. Only active, if value > 0, otherwise the value of CV 254 is used. Useful for reversible trains. Range: 0-255. Default: 0.
-    CV_BRAKE_VOLUME             = 259 # Brake sound volume. Range: 0-128. Default: 0.
+    # The CV_... names, e.g. Z21.CV_ACCELERATION, are class attributes made from DEFAULT_PROFILE, see the end
+    # of the class. The decoder profiles in z21decoders.py have their range, default, page index and read only flag.
 
     BLOCK_MAP_CV32 = dict(
         A=3
     )
-    def readCV(self, cvId, pageIndex=0):
+    def readCV(self, cvId, pageIndex=0, verify=False):
         """Read the @cvId value, assuming that the loco is on a programming track. No loco id is required.
         Note that this method corrects the id-offset, so instead of:
         CV-Address = (CVAdr_MSB << 8) + CVAdr_LSB, where 0=CV1, 1=CV2, 255=CV256, etc.
@@ -873,51 +1175,310 @@ class Z21:
         So should you ever change any of the CVs located in the range from 257, please make sure first that the index registers 
         CV31 and CV32 have the indicated values.
         At this state, CV 31 must always have value 16. Page index CV 32 may have the values in range 0-16. Default: 0.
+
+        After self.identifyDecoder(), the value comes from the shadow of the decoder if it is known, unless @verify 
+        is True. See z21cvcache.py
         """
+        cvs = self.decoderCvs
+        if cvs is not None and not verify:
+            value = cvs.get(cvId, pageIndex)
+            if value is not None:
+                return value
+
         if pageIndex and cvId >= 257:
             assert pageIndex in range(0, 16)
             self.writeCV(self.CV_INDEX_REGISTER_H, 16) # Always this value for LokSound5. Set value, just to be sure.
             self.writeCV(self.CV_INDEX_REGISTER_L, pageIndex) # Needs to write in mode pageIndex = 0
 
-        cmd = self.LAN_X_CV_READ + loco2Bytes(cvId-1) # Corrected address offset by 1
-        cmd += XOR(cmd[4:])
-        self.send(cmd)
-        bb = self.receiveBytes()
-        if self.verbose:
-            printCmd(f'LAN_X_CV_READ({cvId}) ', cmd)
-            printCmd(f'{len(bb)} LAN_X_CV_READ({cvId}) (result) ', bb)
+        value = self.requestCV(cvId).result()
+        if cvs is not None:
+            self._storeCV(cvs, cvId, value, pageIndex)
 
         # Reset the page index, if it was changed. 
         # This is a bit of overhead, in case multiple CV's are written/read from the same page index.
         if pageIndex and cvId >= 257:
             self.writeCV(self.CV_INDEX_REGISTER_L, 0) # Needs to write in mode pageIndex = 0
 
-        return int(int.from_bytes(bb[8:9], LITTLE_ORDER))
+        return value
+
+    def requestCV(self, cvId, timeout=None, retries=None):
+        """Send LAN_X_CV_READ for @cvId and answer the future for its value. The value is None if the 
+        Z21 answered LAN_X_CV_NACK or LAN_X_CV_NACK_SC (no decoder or short circuit). No page index is set."""
+        cmd = self.encoder.cvRead(cvId-1) # Corrected address offset by 1
+        if self.verbose:
+            printCmd(f'LAN_X_CV_READ({cvId}) ', cmd)
+        return self.request(cmd, self.KEY_LAN_X_CV_RESULT, self.KEY_LAN_X_BC, match=cvResultMatch(cvId), 
+            parse=self._parseCvResult, timeout=timeout, retries=retries)
+
+    def requestRegister(self, register, timeout=None, retries=None):
+        """Send LAN_X_DCC_READ_REGISTER for @register 1-8 (register mode) and answer the future for its value. 
+        The value is None for LAN_X_CV_NACK or LAN_X_CV_NACK_SC. The reply is LAN_X_CV_RESULT, where any CV 
+        address is accepted. Not all decoders support register mode, see z21cvread.py"""
+        assert register in range(1, 9)
+        cmd = self.encoder.registerRead(register)
+        if self.verbose:
+            printCmd(f'LAN_X_DCC_READ_REGISTER({register}) ', cmd)
+        return self.request(cmd, self.KEY_LAN_X_CV_RESULT, self.KEY_LAN_X_BC, match=cvResultMatch(None), 
+            parse=self._parseCvResult, timeout=timeout, retries=retries)
+
+    def _parseCvResult(self, bb):
+        # LAN_X_CV_RESULT: 0x0A 0x00 0x40 0x00 0x64 0x14 CVAdr_MSB CVAdr_LSB Value XOR
+        if self.verbose:
+            printCmd(f'{len(bb)} LAN_X_CV_READ (result) ', bb)
+        message = decode(bb)
+        if not isinstance(message, CvResult): # LAN_X_CV_NACK or LAN_X_CV_NACK_SC, no decoder or short circuit.
+            return None
+        return message.value
 
-    def writeCV(self, cvId, cvValue, pageIndex=0):
+    def writeCV(self, cvId, cvValue, pageIndex=0, force=False):
         """Write the @cvId @value, assuming that the loco is on a programming track. No loco id is required.
         Note that this method corrects the id-offset, so instead of:
         CV-Address = (CVAdr_MSB << 8) + CVAdr_LSB, where 0=CV1, 1=CV2, 255=CV256, etc.
         the @cvId is the true CV address: 1=CV1, 2=CV2, 256=CV256, etc.
         Since the writing of a CV makes the controller/decoder write back on on the stream, don't forget to clean it.
+        Answer the value that the decoder confirmed, or None if the Z21 answered LAN_X_CV_NACK.
+        After self.identifyDecoder(), nothing is written if the decoder is known to have @cvValue, unless @force is True,
+        and ValueError is raised if the DecoderProfile of the decoder does not accept @cvValue.
         """
+        if self.decoderProfile is not None:
+            self.decoderProfile.validate(cvId, cvValue, pageIndex)
+        cvs = self.decoderCvs
+        if cvs is not None and not force and cvs.get(cvId, pageIndex) == cvValue:
+            cvs.store(cvId, cvValue, pageIndex) # No longer dirty
+            return cvValue
+
         if pageIndex and cvId >= 257:
             assert pageIndex in range(0, 16)
             self.writeCV(self.CV_INDEX_REGISTER_H, 16) # Always this value for LokSound5. Set value, just to be sure.
             self.writeCV(self.CV_INDEX_REGISTER_L, pageIndex) # Needs to write in pageIndex = 0
-
-        cmd = self.LAN_X_CV_WRITE + loco2Bytes(cvId-1) + cvValue.to_bytes(1, LITTLE_ORDER) # Corrected address offset by 1
-        cmd += XOR(cmd[4:])
-        self.send(cmd)
+        # The send generates feedback (LAN_X_CV_RESULT or LAN_X_CV_NACK). Wait for it, before the next command.
+        value = self.requestCVWrite(cvId, cvValue).result()
+        if cvs is not None:
+            if cvId == self.CV_MANUFACTURERS_ID: # Reset to the manufacturer default values.
+                cvs.forget()
+            else:
+                self._storeCV(cvs, cvId, value, pageIndex)
 
         # Recursively reset the page index, if it was changed. 
         # This is a bit of overhead, in case multiple CV's are written/read from the same page index. 
+        # Use self.cvBatch() to read/write many CVs with one page index change per page.
         if pageIndex and cvId >= 257:
             self.writeCV(self.CV_INDEX_REGISTER_L, 0) # Needs to write in mode pageIndex = 0
 
-        # The send generates feedback, makes sure to clear the socket for all packages.
-        bb = self.receiveBytes() # Read all bytes on the line, cleaning the buffer.
+        return value
+
+    def requestCVWrite(self, cvId, cvValue, timeout=None, retries=None):
+        """Send LAN_X_CV_WRITE for @cvId and answer the future for the value that the decoder confirmed with 
+        LAN_X_CV_RESULT. The value is None for LAN_X_CV_NACK or LAN_X_CV_NACK_SC. No page index is set."""
+        cmd = self.encoder.cvWrite(cvId-1, cvValue) # Corrected address offset by 1
+        if self.verbose:
+            printCmd(f'LAN_X_CV_WRITE({cvId}, {cvValue}) ', cmd)
+        return self.request(cmd, self.KEY_LAN_X_CV_RESULT, self.KEY_LAN_X_BC, match=cvResultMatch(cvId), 
+            parse=self._parseCvResult, timeout=timeout, retries=retries)
+
+    def cvBatch(self):
+        """Answer a new CvBatch for this Z21, to read and write many CVs on the programming track with
+        a single change of the page index per page. See z21cvbatch.py
+
+            batch = z21.cvBatch()
+            batch.write(z21.CV_BRAKE_VOLUME, 100, pageIndex=2)
+            batch.read(z21.CV_ACCELERATION)
+            for operation in batch.run(): # Streams the operations when they are done.
+                print(operation)
+        """
+        return CvBatch(self, cvs=self.decoderCvs)
 
+    def _storeCV(self, cvs, cvId, value, pageIndex):
+        if value is None: # LAN_X_CV_NACK, the value is unknown.
+            cvs.forget(cvId, pageIndex)
+        else:
+            cvs.store(cvId, value, pageIndex)
+
+    def identifyDecoder(self):
+        """Read the manufacturer id, version and address of the decoder on the programming track and answer
+        its DecoderCvs, the shadow of its CV values. From then on readCV answers the known values without 
+        reading and writeCV skips the values that the decoder already has. Answer None if there is no decoder.
+        A decoder that was identified before keeps its known values. Call self.forgetDecoder() if it is taken 
+        off the programming track. The DecoderProfile of CV8 and CV7 is selected as self.decoderProfile, that
+        writeCV uses to validate the values."""
+        self.decoderCvs = None
+        self.decoderProfile = None
+        values = {}
+        cvIds = [self.CV_MANUFACTURERS_ID, self.CV_VERSION_NUMBER, self.CV_CONFIGURATION_REGISTER]
+        while cvIds:
+            cvId = cvIds.pop(0)
+            value = values[cvId] = self.readCV(cvId)
+            if value is None: # LAN_X_CV_NACK, no decoder
+                return None
+            if cvId == self.CV_CONFIGURATION_REGISTER:
+                if value & 0x20: # Long address
+                    cvIds += [self.CV_LOCO_LONG_ADDRESS, self.CV_LOCO_LONG_ADDRESS + 1]
+                else:
+                    cvIds.append(self.CV_LOCO_ADDRESS)
+        self.decoderCvs = self.cvShadows.identify(values)
+        self.decoderProfile = profileFor(values[self.CV_MANUFACTURERS_ID], values[self.CV_VERSION_NUMBER])
+        return self.decoderCvs
+
+    def cvNames(self):
+        """Answer the dictionary cvId --> list of CV_... names, of all documented CVs of the identified decoder,
+        or of DEFAULT_PROFILE if there is none."""
+        return (self.decoderProfile or DEFAULT_PROFILE).cvNames()
+
+    def dumpCVs(self, pageIndexes=(0,), progress=None):
+        """Read all documented CV_... CVs of the decoder on the programming track and answer the snapshot as 
+        dictionary, that can be saved as JSON. The paged CVs (CV257-511) are read on each of the @pageIndexes.
+        The register mode CVs are read in the fastest mode that the CvReadStrategy of the decoder measured, 
+        all others in one CvBatch. The values are stored in the shadow self.decoderCvs as well.
+        If @progress is defined, it is called as progress(cvId, done, total). Answer None if there is no decoder.
+
+            with open('loco3.json', 'w') as f:
+                json.dump(z21.dumpCVs(), f, indent=2)
+        """
+        cvs = self.decoderCvs or self.identifyDecoder()
+        if cvs is None:
+            return None
+        key = cvs.key
+        strategy = self.readStrategies.get(key)
+        if strategy is None:
+            strategy = self.readStrategies[key] = CvReadStrategy(self)
+            strategy.calibrate()
+
+        names = self.cvNames()
+        reads = [] # (cvId, pageIndex)
+        for cvId in names:
+            for pageIndex in (pageIndexes if cvId >= 257 else (0,)):
+                reads.append((cvId, pageIndex))
+        total = len(reads)
+        values = {}
+        batch = self.cvBatch()
+        for cvId, pageIndex in reads:
+            if cvId in (self.CV_INDEX_REGISTER_H, self.CV_INDEX_REGISTER_L) or strategy.choose(cvId) == MODE_REGISTER:
+                # Read before the batch, that changes the index registers.
+                value = values[(cvId, pageIndex)] = strategy.read(cvId)
+                self._storeCV(cvs, cvId, value, pageIndex)
+                if progress is not None:
+                    progress(cvId, len(values), total)
+            else:
+                batch.read(cvId, pageIndex)
+        t = time.perf_counter()
+        for operation in batch.run():
+            values[(operation.cvId, operation.pageIndex)] = operation.value
+            strategy.timings[MODE_DIRECT].add(time.perf_counter() - t, operation.value is not None)
+            t = time.perf_counter()
+            if progress is not None:
+                progress(operation.cvId, len(values), total)
+
+        manufacturerId, version, address = key
+        snapshot = dict(manufacturerId=manufacturerId, version=version, address=address,
+            time=time.strftime('%Y-%m-%dT%H:%M:%S'), readModes=strategy.asDict(), cvs={})
+        for cvId, pageIndex in reads:
+            entry = dict(cv=cvId, names=names[cvId], value=values[(cvId, pageIndex)])
+            if cvId >= 257:
+                entry['pageIndex'] = pageIndex
+            snapshot['cvs'][f'{cvId}' if cvId < 257 else f'{cvId}.{pageIndex}'] = entry
+        return snapshot
+
+    def forgetDecoder(self):
+        """The decoder is taken off the programming track, read and write all CVs again. The known values
+        stay in self.cvShadows, for when the decoder is identified again."""
+        self.decoderCvs = None
+        self.decoderProfile = None
+
+    def writeDirtyCVs(self, readUnknown=True, progress=None):
+        """Write the dirty CVs of the identified decoder, as set by self.decoderCvs.set or setProfile, in one 
+        CvBatch. If @readUnknown is True, the CVs with unknown value are read first, so the EEPROM of the decoder 
+        is only written for the values that differ. Answer the list of CvOperation of the writes."""
+        cvs = self.decoderCvs
+        assert cvs is not None, 'writeDirtyCVs: No decoder identified'
+        if readUnknown:
+            batch = self.cvBatch()
+            for cvId, pageIndex, _ in cvs.dirty():
+                if cvs.get(cvId, pageIndex) is None:
+                    batch.read(cvId, pageIndex)
+            batch.execute() # Values are stored in the shadow, the ones that are equal are no longer dirty.
+        batch = self.cvBatch()
+        for cvId, pageIndex, value in cvs.dirty():
+            batch.write(cvId, value, pageIndex)
+        return batch.execute(progress)
+
+
+    # Programming on the Main, Z21: 6.6-6.11
+
+    def _forgetShadowCV(self, loco, cvId):
+        """The CV of @loco was written on the main, without confirmation. Forget it in the shadow of the decoder."""
+        for cvs in self.cvShadows.decoders:
+            if cvs.address == loco:
+                cvs.forget(cvId)
+
+    def pomWriteCV(self, loco, cvId, cvValue):
+        """Write @cvValue to @cvId of @loco on the main track (LAN_X_CV_POM_WRITE_BYTE), while it is running.
+        There is no confirmation. Use self.pomSchedule for many writes. Z21: 6.6"""
+        assert cvValue in range(0, 256)
+        cmd = self.encoder.pom(loco, POM_WRITE_BYTE, cvId-1, cvValue) # Corrected address offset by 1
+        self.sendCommand(cmd, ('pom', loco, cvId))
+        if self.verbose:
+            printCmd(f'LAN_X_CV_POM_WRITE_BYTE(loco={loco}, cv={cvId}, value={cvValue}) ', cmd)
+        self._forgetShadowCV(loco, cvId)
+
+    def pomWriteBit(self, loco, cvId, position, value):
+        """Write bit @position (0-7) of @cvId of @loco to @value on the main track (LAN_X_CV_POM_WRITE_BIT). Z21: 6.7"""
+        assert position in range(0, 8)
+        cmd = self.encoder.pom(loco, POM_WRITE_BIT, cvId-1, 0xF0 | (0x08 if value else 0) | position) # 1111VPPP
+        self.sendCommand(cmd) # Bits of the same CV cannot be coalesced.
+        if self.verbose:
+            printCmd(f'LAN_X_CV_POM_WRITE_BIT(loco={loco}, cv={cvId}, bit={position}, value={value}) ', cmd)
+        self._forgetShadowCV(loco, cvId)
+
+    def pomReadCV(self, loco, cvId, timeout=None, retries=None):
+        """Read @cvId of @loco on the main track (LAN_X_CV_POM_READ_BYTE) and answer the future for its value.
+        The decoder answers by RailCom, so this needs a RailCom capable decoder and command station. 
+        The value is None for LAN_X_CV_NACK. Z21: 6.8"""
+        cmd = self.encoder.pom(loco, POM_READ_BYTE, cvId-1)
+        if self.verbose:
+            printCmd(f'LAN_X_CV_POM_READ_BYTE(loco={loco}, cv={cvId}) ', cmd)
+        return self.request(cmd, self.KEY_LAN_X_CV_RESULT, self.KEY_LAN_X_BC, match=cvResultMatch(cvId), 
+            parse=self._parseCvResult, timeout=timeout, retries=retries)
+
+    def pomAccessoryWriteCV(self, address, cvId, cvValue, output=None):
+        """Write @cvValue to @cvId of the accessory decoder @address on the main track. If @output (0-7) is 
+        defined, then only the CV of that output is written. Z21: 6.9"""
+        assert cvValue in range(0, 256)
+        cmd = self.encoder.pomAccessory(address, output, POM_WRITE_BYTE, cvId-1, cvValue)
+        self.sendCommand(cmd, ('pomAccessory', address, output, cvId))
+
+    def pomAccessoryWriteBit(self, address, cvId, position, value, output=None):
+        """Write bit @position (0-7) of @cvId of the accessory decoder @address to @value on the main track. Z21: 6.10"""
+        assert position in range(0, 8)
+        cmd = self.encoder.pomAccessory(address, output, POM_WRITE_BIT, cvId-1, 0xF0 | (0x08 if value else 0) | position)
+        self.sendCommand(cmd)
+
+    def pomAccessoryReadCV(self, address, cvId, output=None, timeout=None, retries=None):
+        """Read @cvId of the accessory decoder @address on the main track, by RailCom. Answer the future for its value. 
+        Z21: 6.11"""
+        cmd = self.encoder.pomAccessory(address, output, POM_READ_BYTE, cvId-1)
+        return self.request(cmd, self.KEY_LAN_X_CV_RESULT, self.KEY_LAN_X_BC, match=cvResultMatch(cvId), 
+            parse=self._parseCvResult, timeout=timeout, retries=retries)
+
+    def _get_pomScheduler(self):
+        """Answer the PomScheduler, that writes the scheduled POM writes round robin over the locos, at a rate that 
+        leaves the track time to the drive commands. See z21pom.py"""
+        if self._pomScheduler is None:
+            self._pomScheduler = PomScheduler(self.pomWriteCV)
+            self._pomScheduler.start()
+        return self._pomScheduler
+    pomScheduler = property(_get_pomScheduler)
+
+    def pomSchedule(self, loco, cvId, cvValue):
+        """Schedule writing @cvValue to @cvId of @loco on the main track. A pending write of the same CV is replaced."""
+        assert cvValue in range(0, 256)
+        self.pomScheduler.put(loco, cvId, cvValue)
+
+    def pomScheduleProfile(self, locos, profile):
+        """Schedule writing the dictionary cvId --> value @profile to all @locos on the main track, e.g. to retune 
+        the acceleration and volume of a running fleet. Call self.pomScheduler.flush() to wait until all are written."""
+        for loco in locos:
+            for cvId, cvValue in profile.items():
+                self.pomSchedule(loco, cvId, cvValue)
 
     # Running on the Programming Track
 
@@ -1013,13 +1574,20 @@ class Z21:
         self.writeCV(self.CV_BRAKE_SOUND_OFF, 10) # CV65
         self.writeCV(self.CV_BRAKE_VOLUME, 100, pageIndex=2) # CV259
 
+# The CV_... numbers of DEFAULT_PROFILE (z21decoders.py) as class attributes, Z21.CV_ACCELERATION and self.CV_ACCELERATION.
+for _name, _cvId in CV_NUMBERS.items():
+    setattr(Z21, _name, _cvId)
+del _name, _cvId
+
 class BaseDecoder:
     """This will contain the knowledge of specific decoders: which functions and CV are supported.
     The Z21 then can query of a train decoder or turnout decoder is capable of performing a certain task.
+    The supported CVs are in the DecoderProfile of the class, see z21decoders.py.
     """
+    profile = NMRA
 
 class LokPilot(BaseDecoder):
-    pass
+    profile = LOKPILOT
 
 class LokSound5(LokPilot):
     """Subclassing for specifically LocSound5 decoder functionality. This inheriting class will know about
@@ -1028,16 +1596,18 @@ class LokSound5(LokPilot):
 
     Future change: the main Z21 class should detect which decoder is used in a certain loco, and switch behaviour
     accordingly. We may need to introduce another level of abstraction later."""
+    profile = LOKSOUND5
 
 class SwitchPilotServo(BaseDecoder):
     """These need to become a Decoder subclass, not a Z21 subclass."""
+    profile = SWITCHPILOT_SERVO
 
 class Layout:
     """Main Layout objects, containing the tracks and stationary such as all Turnouts and Signals.
     The Layout offers a high-level API to all parts (stationary, locomotives and wagons).
     It also will include the automated schedule to run."""
-    def __init__(self, host, verbose=False):
-        self.z21 = Z21(host, verbose=verbose)
+    def __init__(self, host, verbose=False, sendQueue=False):
+        self.z21 = Z21(host, verbose=verbose, sendQueue=sendQueue)
 
 #   S K E T C H  O T H E R  F U T U R E  C L A S S E S
 
@@ -0,0 +1,209 @@
+# -*- coding: UTF-8 -*-
+# ------------------------------------------------------------------------------
+#     Copyright (c) 2023+ TYPETR
+#     Usage by MIT License
+# ..............................................................................
+#
+#    TYPETR z21broadcast.py
+#
+#   Broadcast flags of the Z21 and the subscription manager that sets them.
+#
+#   The Z21 only sends broadcasts for the flags that the client set with LAN_SET_BROADCASTFLAGS.
+#   Every flag that is on costs UDP traffic and decoding time in the receiver thread, so the
+#   BroadcastManager only turns on the flags that the current listeners need. Subscribing the first
+#   listener of a flag sets it, unsubscribing the last listener clears it again.
+#
+#       z21.broadcasts.subscribe(BroadcastFlags.SYSTEM_STATE, callback)  # callback(packet)
+#       z21.broadcasts.subscribeLoco(3, callback)                        # callback(locoInfo)
+#
+#   Loco broadcasts are only sent for the loco addresses that the client polled with LAN_X_GET_LOCO_INFO,
+#   for at most 16 addresses per client. The manager sends these polls for the subscribed locos and uses
+#   the (much busier) flag for all locos only if there are more of them.
+#   "Z21:" is referencing to the chapters in the z21-lan-protokoll-en.pdf manual.
+#
+import threading
+from enum import IntFlag
+
+class BroadcastFlags(IntFlag):
+    """The 32 bits flags of LAN_SET_BROADCASTFLAGS and LAN_GET_BROADCASTFLAGS. Z21: 2.16
+
+    >>> flags = BroadcastFlags.DRIVING_SWITCHING | BroadcastFlags.SYSTEM_STATE
+    >>> int(flags), BroadcastFlags.SYSTEM_STATE in flags, BroadcastFlags.RMBUS in flags
+    (257, True, False)
+    >>> d = BroadcastFlags(0x00010001).asDict()
+    >>> d['DRIVING_SWITCHING'], d['ALL_LOCO_INFO'], d['RAILCOM']
+    (True, True, False)
+    >>> int(BroadcastFlags.fromDict(d))
+    65537
+    """
+    NONE =                  0x00000000
+    DRIVING_SWITCHING =     0x00000001 # LAN_X_BC_TRACK_POWER_..., LAN_X_BC_STOPPED, LAN_X_TURNOUT_INFO, LAN_X_LOCO_INFO of subscribed locos
+    RMBUS =                 0x00000002 # LAN_RMBUS_DATACHANGED, feedback modules on the R-Bus
+    RAILCOM =               0x00000004 # LAN_RAILCOM_DATACHANGED of subscribed locos
+    SYSTEM_STATE =          0x00000100 # LAN_SYSTEMSTATE_DATACHANGED
+    FAST_CLOCK =            0x00001000 # LAN_FAST_CLOCK_DATA, from FW 1.43
+    ALL_LOCO_INFO =         0x00010000 # LAN_X_LOCO_INFO of all locos (high traffic, for PC automation only), from FW 1.20
+    CAN_BOOSTER =           0x00020000 # LAN_CAN_BOOSTER_SYSTEMSTATE_CHGD, from FW 1.41
+    ALL_RAILCOM =           0x00040000 # LAN_RAILCOM_DATACHANGED of all locos, from FW 1.29
+    CAN_DETECTOR =          0x00080000 # LAN_CAN_DETECTOR, occupancy detectors on the CAN-Bus, from FW 1.30
+    LOCONET =               0x01000000 # LAN_LOCONET_Z21_RX/TX, LAN_LOCONET_FROM_LAN, without locos and turnouts
+    LOCONET_LOCOS =         0x02000000 # LocoNet messages about locos
+    LOCONET_TURNOUTS =      0x04000000 # LocoNet messages about turnouts
+    LOCONET_DETECTOR =      0x08000000 # LAN_LOCONET_DETECTOR, occupancy detectors on the LocoNet
+
+    def asDict(self):
+        """Answer the dictionary flag name --> bool of all documented flags."""
+        return {flag.name: bool(self & flag) for flag in BroadcastFlags if flag}
+
+    @classmethod
+    def fromDict(cls, d):
+        """Answer the flags from dictionary @d, as answered by asDict(). Unknown names raise a KeyError."""
+        flags = cls.NONE
+        for name, value in d.items():
+            if value:
+                flags |= cls[name]
+        return flags
+
+# Packet keys (header, X-header) of the broadcasts that each flag enables, see KEY_... in z21.py.
+BROADCAST_KEYS = {
+    BroadcastFlags.DRIVING_SWITCHING: ((0x40, 0x61), (0x40, 0x81), (0x40, 0x43), (0x40, 0xEF)),
+    BroadcastFlags.RMBUS: ((0x80, None),),
+    BroadcastFlags.RAILCOM: ((0x88, None),),
+    BroadcastFlags.SYSTEM_STATE: ((0x84, None),),
+    BroadcastFlags.FAST_CLOCK: ((0xCD, None),),
+    BroadcastFlags.ALL_LOCO_INFO: ((0x40, 0xEF),),
+    BroadcastFlags.CAN_BOOSTER: ((0xCA, None),),
+    BroadcastFlags.ALL_RAILCOM: ((0x88, None),),
+    BroadcastFlags.CAN_DETECTOR: ((0xC4, None),),
+    BroadcastFlags.LOCONET: ((0xA0, None), (0xA1, None), (0xA2, None)),
+    BroadcastFlags.LOCONET_LOCOS: (), # More messages in the packets of LOCONET, subscribe that flag too.
+    BroadcastFlags.LOCONET_TURNOUTS: (),
+    BroadcastFlags.LOCONET_DETECTOR: ((0xA4, None),),
+}
+
+MAX_LOCO_SUBSCRIPTIONS = 16 # The Z21 keeps the loco broadcasts of the last 16 polled addresses per client.
+
+class BroadcastManager:
+    """Keeps the broadcast flags of the Z21 @z21 to the minimum that the subscribed listeners need.
+    The @z21 is expected to have dispatcher, locos (LocoStateCache), requestLocoInfo(loco) and the
+    broadcastFlags property, as the Z21 class has. Note that the callbacks are called from the receiver thread.
+    """
+    def __init__(self, z21):
+        self.z21 = z21
+        self.lock = threading.RLock()
+        self.listeners = {} # BroadcastFlags --> list of callback(packet)
+        self.locoListeners = {} # Loco address --> list of callback(locoInfo), in order of subscription.
+        self.flags = BroadcastFlags.NONE # The flags that were last sent to the Z21.
+        z21.locos.addListener(self._locoChanged)
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} flags=0x{int(self.flags):08X} locos={len(self.locoListeners)}>'
+
+    def _get_locos(self):
+        """Answer the list of subscribed loco addresses."""
+        with self.lock:
+            return list(self.locoListeners)
+    locos = property(_get_locos)
+
+    def neededFlags(self):
+        """Answer the flags that the current listeners and loco subscriptions need."""
+        with self.lock:
+            flags = BroadcastFlags.NONE
+            for flag, callbacks in self.listeners.items():
+                if callbacks:
+                    flags |= flag
+            if self.locoListeners:
+                flags |= BroadcastFlags.DRIVING_SWITCHING
+                if len(self.locoListeners) > MAX_LOCO_SUBSCRIPTIONS:
+                    flags |= BroadcastFlags.ALL_LOCO_INFO
+            return flags
+
+    def update(self):
+        """Send LAN_SET_BROADCASTFLAGS if the needed flags differ from the flags that were last sent.
+        Answer the current flags."""
+        with self.lock:
+            flags = self.neededFlags()
+            if flags != self.flags:
+                self.z21.broadcastFlags = flags
+                self.flags = flags
+            return flags
+
+    def subscribe(self, flag, callback):
+        """Call @callback(packet) for all broadcasts of the single @flag and turn the flag on if needed."""
+        assert flag in BROADCAST_KEYS, f'{flag!r} is not a single broadcast flag'
+        with self.lock:
+            self.listeners.setdefault(flag, []).append(callback)
+            for key in BROADCAST_KEYS[flag]:
+                self.z21.dispatcher.subscribe(key, callback)
+            self.update()
+
+    def unsubscribe(self, flag, callback):
+        """Remove the @callback of @flag. The flag is turned off if it has no listeners left."""
+        with self.lock:
+            callbacks = self.listeners.get(flag)
+            if not callbacks or callback not in callbacks:
+                return
+            callbacks.remove(callback)
+            for key in BROADCAST_KEYS[flag]:
+                self.z21.dispatcher.unsubscribe(key, callback)
+            self.update()
+
+    def subscribeLoco(self, loco, callback=None):
+        """Subscribe to the broadcasts of @loco, so z21.locos keeps its state current. If @callback is defined,
+        it is called as callback(locoInfo) for every change of the state of this loco.
+        Answer the future of the LAN_X_GET_LOCO_INFO poll that subscribes the loco at the Z21."""
+        with self.lock:
+            callbacks = self.locoListeners.setdefault(loco, [])
+            if callback is not None:
+                callbacks.append(callback)
+            self.update()
+        return self.z21.requestLocoInfo(loco)
+
+    def unsubscribeLoco(self, loco, callback=None):
+        """Remove the @callback of @loco. Without @callback, remove all subscriptions of the loco.
+        The Z21 cannot unsubscribe a single address, it keeps sending until another address takes its place."""
+        with self.lock:
+            callbacks = self.locoListeners.get(loco)
+            if callbacks is None:
+                return
+            if callback is not None and callback in callbacks:
+                callbacks.remove(callback)
+            if callback is None or not callbacks:
+                del self.locoListeners[loco]
+            self.update()
+
+    def resubscribe(self):
+        """Send the broadcast flags and poll all subscribed locos again, e.g. after the Z21 restarted or
+        dropped this client after 60 seconds without communication. Answer the list of futures of the polls.
+        If there are more than MAX_LOCO_SUBSCRIPTIONS locos, then the flag for all locos already covers them."""
+        with self.lock:
+            flags = self.neededFlags()
+            self.z21.broadcastFlags = flags
+            self.flags = flags
+            locos = list(self.locoListeners)
+        if len(locos) > MAX_LOCO_SUBSCRIPTIONS:
+            return []
+        return [self.z21.requestLocoInfo(loco) for loco in locos]
+
+    def clear(self):
+        """Remove all listeners and turn all broadcasts off."""
+        with self.lock:
+            for flag, callbacks in self.listeners.items():
+                for callback in callbacks:
+                    for key in BROADCAST_KEYS[flag]:
+                        self.z21.dispatcher.unsubscribe(key, callback)
+            self.listeners.clear()
+            self.locoListeners.clear()
+            self.update()
+
+    def _locoChanged(self, info):
+        """Listener of z21.locos, calling the callbacks of the subscribed loco."""
+        callbacks = self.locoListeners.get(info.address)
+        if callbacks:
+            for callback in list(callbacks):
+                callback(info)
+
+if __name__ == '__main__':
+    import doctest
+    import sys
+    sys.exit(doctest.testmod()[0])
@@ -0,0 +1,299 @@
+# -*- coding: UTF-8 -*-
+# ------------------------------------------------------------------------------
+#     Copyright (c) 2023+ TYPETR
+#     Usage by MIT License
+# ..............................................................................
+#
+#    TYPETR z21codec.py
+#
+#   Encoding of Z21 commands into packets, without building a new byte string for every command.
+#
+#   Each command has a PacketTemplate: the fixed header bytes and a precompiled struct.Struct for the
+#   variable fields. The packet lives in a preallocated bytearray that is patched in place (address, speed,
+#   function, XOR) and sent as memoryview. The XOR of the fixed bytes is calculated once, so only the
+#   variable bytes need to be added for every packet.
+#
+#   A throttle slider firing at 50 Hz for dozens of locos then no longer allocates new packets.
+#   Note that the patched buffer is only valid until the next call of the same template. Send it
+#   immediately (the Z21 class holds its send lock). Requests that may be resent and commands that are
+#   kept use PacketTemplate.bytes(), that packs a new packet without the shared buffer.
+#
+#   See bench-codec.py for the comparison with the CMD/XOR helpers in z21.py.
+#
+import struct
+from functools import reduce
+from operator import xor
+
+#   H E L P E R S
+
+def xorChecksum(data):
+    """Answer the XOR-parity integer of all bytes in @data.
+
+    >>> xorChecksum(bytes((0x21, 0x81)))
+    160
+    >>> xorChecksum(b'')
+    0
+    """
+    return reduce(xor, data, 0)
+
+def locoAddress(loco):
+    """Answer the 16 bit loco address as it is sent in LAN_X_... commands. For locomotive addresses ≥ 128,
+    the two highest bits in DB1 must be set to 1: DB1 = (0xC0 | Adr_MSB).
+
+    >>> hex(locoAddress(3)), hex(locoAddress(259))
+    ('0x3', '0xc103')
+    """
+    if loco >= 128:
+        return loco | 0xC000
+    return loco
+
+# LAN_X_SET_LOCO_FUNCTION_GROUP: group code --> (first function, number of functions). Z21: 4.3.2
+# The bits of the functions byte are the functions in order, except group 1: 0 0 0 F0 F4 F3 F2 F1.
+# Group 0x29 (F29-F36) is not used, as only F0-F31 are known, the group would also set F32-F36.
+FUNCTION_GROUPS = {
+    0x20: (0, 5), # F0, F4 .. F1
+    0x21: (5, 4), # F8 .. F5
+    0x22: (9, 4), # F12 .. F9
+    0x23: (13, 8), # F20 .. F13
+    0x28: (21, 8), # F28 .. F21
+}
+
+def functionGroupMask(group):
+    """Answer the bitmap of the functions in @group, where bit n is Fn.
+
+    >>> hex(functionGroupMask(0x20)), hex(functionGroupMask(0x21))
+    ('0x1f', '0x1e0')
+    """
+    first, count = FUNCTION_GROUPS[group]
+    return ((1 << count) - 1) << first
+
+def functionGroupValue(group, functions):
+    """Answer the functions byte of LAN_X_SET_LOCO_FUNCTION_GROUP @group from the @functions bitmap.
+
+    >>> hex(functionGroupValue(0x20, 0b00101)) # F0 and F2
+    '0x12'
+    >>> hex(functionGroupValue(0x21, 1 << 8)) # F8
+    '0x8'
+    """
+    if group == 0x20:
+        return ((functions & 0x01) << 4) | ((functions >> 1) & 0x0F)
+    first, count = FUNCTION_GROUPS[group]
+    return (functions >> first) & ((1 << count) - 1)
+
+def functionGroupBits(group, value):
+    """Answer the functions bitmap of the functions byte @value of @group. Inverse of functionGroupValue.
+
+    >>> bin(functionGroupBits(0x20, 0x12)), bin(functionGroupBits(0x21, 0x08))
+    ('0b101', '0b100000000')
+    """
+    if group == 0x20:
+        return ((value >> 4) & 0x01) | ((value & 0x0F) << 1)
+    first, count = FUNCTION_GROUPS[group]
+    return (value & ((1 << count) - 1)) << first
+
+def functionGroup(function):
+    """Answer the group code of @function, or None if it is not in a group that is used.
+
+    >>> hex(functionGroup(0)), hex(functionGroup(12)), functionGroup(30)
+    ('0x20', '0x22', None)
+    """
+    for group, (first, count) in FUNCTION_GROUPS.items():
+        if first <= function < first + count:
+            return group
+    return None
+
+#   P A C K E T  T E M P L A T E
+
+class PacketTemplate:
+    """Preallocated packet for one Z21 command. The @prefix holds the fixed bytes (length, header, X-header, DB0),
+    @fmt is the struct format of the variable bytes that follow. If @checksum is True, then the last byte
+    is the XOR of all bytes after the 4 byte header.
+
+    >>> t = PacketTemplate('LAN_X_SET_LOCO_FUNCTION', (0x0A, 0, 0x40, 0, 0xE4, 0xF8), '>HB')
+    >>> bytes(t.pack(3, 0x42)).hex(' ')
+    '0a 00 40 00 e4 f8 00 03 42 5d'
+    >>> t.bytes(3, 0x02).hex(' ') # New packet, for commands that are kept
+    '0a 00 40 00 e4 f8 00 03 02 1d'
+    >>> bytes(t.view).hex(' ') # The shared buffer is unchanged
+    '0a 00 40 00 e4 f8 00 03 42 5d'
+    >>> PacketTemplate('LAN_SET_BROADCASTFLAGS', (0x08, 0, 0x50, 0), '<I', checksum=False).bytes(0x00010101).hex(' ')
+    '08 00 50 00 01 01 01 00'
+    """
+    def __init__(self, name, prefix, fmt, checksum=True):
+        self.name = name
+        self.struct = struct.Struct(fmt) # Precompiled layout of the variable fields.
+        self.offset = len(prefix) # Start of the variable fields.
+        self.size = self.offset + self.struct.size + int(checksum)
+        assert prefix[0] == self.size, f'{name}: length byte {prefix[0]} does not match template size {self.size}'
+        self.checksum = checksum
+        self.buffer = bytearray(self.size)
+        self.prefix = bytes(prefix)
+        self.buffer[:self.offset] = self.prefix
+        self.view = memoryview(self.buffer)
+        self.prefixXor = xorChecksum(self.buffer[4:self.offset]) # XOR of the fixed X-header and DB bytes.
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.name} {self.size} bytes>'
+
+    def pack(self, *values):
+        """Patch the @values into the preallocated buffer, update the XOR and answer the memoryview of the packet."""
+        self.struct.pack_into(self.buffer, self.offset, *values)
+        if self.checksum:
+            buffer = self.buffer
+            x = self.prefixXor
+            for index in range(self.offset, self.size - 1):
+                x ^= buffer[index]
+            buffer[-1] = x
+        return self.view
+
+    def bytes(self, *values):
+        """Answer a new packet of the @values, for commands that need to be kept, e.g. to be resent. The
+        shared buffer is not used, so any thread can call this without holding the send lock."""
+        packet = self.prefix + self.struct.pack(*values)
+        if self.checksum:
+            packet += bytes((xorChecksum(packet[self.offset:]) ^ self.prefixXor,))
+        return packet
+
+# DB3 of LAN_X_CV_POM, 1110MM11 + CV address bits 9-8. Z21: 6.6-6.8
+POM_WRITE_BYTE = 0xEC
+POM_WRITE_BIT = 0xE8
+POM_READ_BYTE = 0xE4
+
+#   E N C O D E R
+
+class Encoder:
+    """Holds the packet templates of one Z21 connection. The hot commands (driving, functions, turnouts)
+    have dedicated methods that calculate the XOR from the values, instead of reading back the buffer.
+    All methods answer a memoryview of the patched buffer, that is valid until the next call.
+
+    >>> e = Encoder()
+    >>> bytes(e.locoDrive(3, 0x13, 0x80 | 71)).hex(' ')
+    '0a 00 40 00 e4 13 00 03 c7 33'
+    >>> bytes(e.locoDrive(259, 0x13, 0x80 | 71)).hex(' ')
+    '0a 00 40 00 e4 13 c1 03 c7 f2'
+    >>> bytes(e.locoFunction(3, 0x40)).hex(' ')
+    '0a 00 40 00 e4 f8 00 03 40 5f'
+    >>> bytes(e.locoFunctionGroup(3, 0x20, 0x12)).hex(' ')
+    '0a 00 40 00 e4 20 00 03 12 d5'
+    >>> bytes(e.setTurnout(1, 0x89)).hex(' ')
+    '09 00 40 00 53 00 01 89 db'
+    >>> e.getLocoInfo(3).hex(' ')
+    '09 00 40 00 e3 f0 00 03 10'
+    >>> e.cvRead(0).hex(' ') # CV1
+    '09 00 40 00 23 11 00 00 32'
+    >>> e.registerRead(5).hex(' ') # CV29
+    '08 00 40 00 22 11 05 36'
+    >>> e.pom(3, POM_WRITE_BYTE, 2, 28).hex(' ') # CV3 = 28
+    '0c 00 40 00 e6 30 00 03 ec 02 1c 27'
+    >>> e.pom(259, POM_WRITE_BIT, 28, 0xF0 | 0x08 | 5).hex(' ') # CV29 bit 5 = 1
+    '0c 00 40 00 e6 30 c1 03 e8 1c fd 1d'
+    >>> e.pomAccessory(1, None, POM_READ_BYTE, 0).hex(' ')
+    '0c 00 40 00 e6 31 00 10 e4 00 00 23'
+    """
+    def __init__(self):
+        # Z21: 4.2 LAN_X_SET_LOCO_DRIVE, DCC steps, address MSB, address LSB, RVVV VVVV, XOR-Byte
+        self.LAN_X_SET_LOCO_DRIVE = PacketTemplate('LAN_X_SET_LOCO_DRIVE', (0x0A, 0, 0x40, 0, 0xE4), '>BHB')
+        # Z21: 4.3.1 LAN_X_SET_LOCO_FUNCTION, address MSB, address LSB, TTNN NNNN, XOR-Byte
+        self.LAN_X_SET_LOCO_FUNCTION = PacketTemplate('LAN_X_SET_LOCO_FUNCTION', (0x0A, 0, 0x40, 0, 0xE4, 0xF8), '>HB')
+        # Z21: 4.3.2 LAN_X_SET_LOCO_FUNCTION_GROUP, group, address MSB, address LSB, functions, XOR-Byte
+        self.LAN_X_SET_LOCO_FUNCTION_GROUP = PacketTemplate('LAN_X_SET_LOCO_FUNCTION_GROUP', (0x0A, 0, 0x40, 0, 0xE4), '>BHB')
+        # Z21: 4.5 LAN_X_SET_LOCO_E_STOP, address MSB, address LSB, XOR-Byte
+        self.LAN_X_SET_LOCO_E_STOP = PacketTemplate('LAN_X_SET_LOCO_E_STOP', (0x08, 0, 0x40, 0, 0x92), '>H')
+        # Z21: 4.1 LAN_X_GET_LOCO_INFO, address MSB, address LSB, XOR-Byte
+        self.LAN_X_GET_LOCO_INFO = PacketTemplate('LAN_X_GET_LOCO_INFO', (0x09, 0, 0x40, 0, 0xE3, 0xF0), '>H')
+        # Z21: 5.1 LAN_X_GET_TURNOUT_INFO, address MSB, address LSB, XOR-Byte
+        self.LAN_X_GET_TURNOUT_INFO = PacketTemplate('LAN_X_GET_TURNOUT_INFO', (0x08, 0, 0x40, 0, 0x43), '>H')
+        # Z21: 5.2 LAN_X_SET_TURNOUT, address MSB, address LSB, 10Q0A00P, XOR-Byte
+        self.LAN_X_SET_TURNOUT = PacketTemplate('LAN_X_SET_TURNOUT', (0x09, 0, 0x40, 0, 0x53), '>HB')
+        # Z21: 6.1 LAN_X_CV_READ, CV address MSB, CV address LSB, XOR-Byte
+        self.LAN_X_CV_READ = PacketTemplate('LAN_X_CV_READ', (0x09, 0, 0x40, 0, 0x23, 0x11), '>H')
+        # Z21: 6.2 LAN_X_CV_WRITE, CV address MSB, CV address LSB, value, XOR-Byte
+        self.LAN_X_CV_WRITE = PacketTemplate('LAN_X_CV_WRITE', (0x0A, 0, 0x40, 0, 0x24, 0x12), '>HB')
+        # Z21: 6.6-6.8 LAN_X_CV_POM, address MSB, address LSB, DB3 mode | CV MSB, CV LSB, value, XOR-Byte
+        self.LAN_X_CV_POM = PacketTemplate('LAN_X_CV_POM', (0x0C, 0, 0x40, 0, 0xE6, 0x30), '>HBBB')
+        # Z21: 6.9-6.11 LAN_X_CV_POM_ACCESSORY, aaaaaaaa AAAACDDD, DB3 mode | CV MSB, CV LSB, value, XOR-Byte
+        self.LAN_X_CV_POM_ACCESSORY = PacketTemplate('LAN_X_CV_POM_ACCESSORY', (0x0C, 0, 0x40, 0, 0xE6, 0x31), '>HBBB')
+        # Z21: 6.13 LAN_X_DCC_READ_REGISTER, register 0x01-0x08, XOR-Byte
+        self.LAN_X_DCC_READ_REGISTER = PacketTemplate('LAN_X_DCC_READ_REGISTER', (0x08, 0, 0x40, 0, 0x22, 0x11), '>B')
+        # Z21: 2.16 LAN_SET_BROADCASTFLAGS, 32 bits flags little-endian, no XOR
+        self.LAN_SET_BROADCASTFLAGS = PacketTemplate('LAN_SET_BROADCASTFLAGS', (0x08, 0, 0x50, 0), '<I', checksum=False)
+
+    def locoDrive(self, loco, stepsCode, speedByte):
+        """Answer LAN_X_SET_LOCO_DRIVE for @loco. @stepsCode is 0x10 (14), 0x12 (28) or 0x13 (128) steps,
+        @speedByte is RVVV VVVV, where R is the forward direction."""
+        t = self.LAN_X_SET_LOCO_DRIVE
+        address = locoAddress(loco)
+        t.struct.pack_into(t.buffer, 5, stepsCode, address, speedByte)
+        t.buffer[9] = 0xE4 ^ stepsCode ^ (address >> 8) ^ (address & 0xFF) ^ speedByte
+        return t.view
+
+    def locoFunction(self, loco, functionCode):
+        """Answer LAN_X_SET_LOCO_FUNCTION for @loco. @functionCode is TTNN NNNN: switch type and function index."""
+        t = self.LAN_X_SET_LOCO_FUNCTION
+        address = locoAddress(loco)
+        t.struct.pack_into(t.buffer, 6, address, functionCode)
+        t.buffer[9] = 0x1C ^ (address >> 8) ^ (address & 0xFF) ^ functionCode # 0x1C = 0xE4 ^ 0xF8
+        return t.view
+
+    def locoFunctionGroup(self, loco, group, value):
+        """Answer LAN_X_SET_LOCO_FUNCTION_GROUP for @loco. @group is the group code (0x20, 0x21, ...),
+        @value is the functions byte, see functionGroupValue()."""
+        t = self.LAN_X_SET_LOCO_FUNCTION_GROUP
+        address = locoAddress(loco)
+        t.struct.pack_into(t.buffer, 5, group, address, value)
+        t.buffer[9] = 0xE4 ^ group ^ (address >> 8) ^ (address & 0xFF) ^ value
+        return t.view
+
+    def eStop(self, loco):
+        """Answer LAN_X_SET_LOCO_E_STOP for @loco."""
+        t = self.LAN_X_SET_LOCO_E_STOP
+        address = locoAddress(loco)
+        t.struct.pack_into(t.buffer, 5, address)
+        t.buffer[7] = 0x92 ^ (address >> 8) ^ (address & 0xFF)
+        return t.view
+
+    def setTurnout(self, turnoutId, value):
+        """Answer LAN_X_SET_TURNOUT for @turnoutId. @value is the 10Q0A00P byte."""
+        t = self.LAN_X_SET_TURNOUT
+        t.struct.pack_into(t.buffer, 5, turnoutId, value)
+        t.buffer[8] = 0x53 ^ (turnoutId >> 8) ^ (turnoutId & 0xFF) ^ value
+        return t.view
+
+    # Requests, that may need to be resent, answer a new packet, see PacketTemplate.bytes().
+
+    def getLocoInfo(self, loco):
+        return self.LAN_X_GET_LOCO_INFO.bytes(locoAddress(loco))
+
+    def getTurnoutInfo(self, turnoutId):
+        return self.LAN_X_GET_TURNOUT_INFO.bytes(turnoutId)
+
+    def cvRead(self, cvAddress):
+        """Answer LAN_X_CV_READ. Note that @cvAddress is 0 for CV1."""
+        return self.LAN_X_CV_READ.bytes(cvAddress)
+
+    def cvWrite(self, cvAddress, value):
+        """Answer LAN_X_CV_WRITE. Note that @cvAddress is 0 for CV1."""
+        return self.LAN_X_CV_WRITE.bytes(cvAddress, value)
+
+    def registerRead(self, register):
+        """Answer LAN_X_DCC_READ_REGISTER of @register 1-8, register mode on the programming track."""
+        return self.LAN_X_DCC_READ_REGISTER.bytes(register)
+
+    def pom(self, loco, mode, cvAddress, value=0):
+        """Answer LAN_X_CV_POM for @loco. @mode is POM_WRITE_BYTE, POM_WRITE_BIT or POM_READ_BYTE, @value is
+        the byte to write, or 1111VPPP for writing bit PPP with value V. Note that @cvAddress is 0 for CV1."""
+        return self.LAN_X_CV_POM.bytes(locoAddress(loco), mode | ((cvAddress >> 8) & 0x03), cvAddress & 0xFF, value)
+
+    def pomAccessory(self, address, output, mode, cvAddress, value=0):
+        """Answer LAN_X_CV_POM_ACCESSORY for the accessory decoder @address (0-511). If @output (0-7) is not None,
+        then only the CV of that output is addressed."""
+        decoder = (address << 4) | (0 if output is None else 0x08 | output) # aaaaaaaa AAAACDDD
+        return self.LAN_X_CV_POM_ACCESSORY.bytes(decoder, mode | ((cvAddress >> 8) & 0x03), cvAddress & 0xFF, value)
+
+    def setBroadcastFlags(self, flags):
+        return self.LAN_SET_BROADCASTFLAGS.bytes(flags)
+
+if __name__ == '__main__':
+    import doctest
+    import sys
+    sys.exit(doctest.testmod()[0])
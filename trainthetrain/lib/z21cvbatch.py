@@ -0,0 +1,239 @@
+# -*- coding: UTF-8 -*-
+# ------------------------------------------------------------------------------
+#     Copyright (c) 2023+ TYPETR
+#     Usage by MIT License
+# ..............................................................................
+#
+#    TYPETR z21cvbatch.py
+#
+#   Batch of CV reads and writes on the programming track.
+#
+#   CV257-511 are indexed by the page in CV31/CV32. Z21.readCV and Z21.writeCV set CV31 and CV32 before
+#   every access of a paged CV and reset CV32 to 0 afterwards, so a single paged read takes four operations
+#   on the programming track, each taking hundreds of milliseconds on a real decoder.
+#   The CvBatch collects the reads and writes, groups them by page index and writes CV31 once and CV32 once
+#   per page. The page index is restored once at the end. The operations are streamed when they are done:
+#
+#       batch = z21.cvBatch()
+#       volume = batch.read(z21.CV_BRAKE_VOLUME, pageIndex=2)
+#       batch.write(z21.CV_ACCELERATION, 13)
+#       for operation in batch.run():
+#           print(operation) # <CvOperation write CV3=13 done>, <CvOperation read CV259 page=2 =100 done>
+#
+import threading
+from concurrent.futures import Future
+
+# CV31 selects the page of CV257-512, CV32 is the page index 0-15, the CvOperation.pageIndex
+from z21decoders import CV_INDEX_REGISTER_H, CV_INDEX_REGISTER_L, FIRST_PAGED_CV
+
+INDEX_REGISTER_H_VALUE = 16 # Always this value for LokSound5
+
+class CvOperation:
+    """A single read or write of the CvBatch. After the batch ran, @value is the value that the decoder
+    answered or confirmed, None for LAN_X_CV_NACK or an @error."""
+    __slots__ = ('cvId', 'pageIndex', 'writeValue', 'value', 'error', 'done')
+
+    def __init__(self, cvId, pageIndex=0, writeValue=None):
+        self.cvId = cvId
+        self.pageIndex = pageIndex
+        self.writeValue = writeValue # None for reading
+        self.value = None
+        self.error = None
+        self.done = False
+
+    def __repr__(self):
+        s = f'<{self.__class__.__name__} '
+        if self.writeValue is None:
+            s += f'read CV{self.cvId}'
+        else:
+            s += f'write CV{self.cvId}={self.writeValue}'
+        if self.paged:
+            s += f' page={self.pageIndex}'
+        if self.done:
+            s += f' ={self.value}' if self.writeValue is None else ''
+            s += f' error={self.error}' if self.error else ' done'
+        return s + '>'
+
+    def _get_paged(self):
+        """Answer True if the CV is indexed by the page in CV31/CV32."""
+        return self.cvId >= FIRST_PAGED_CV
+    paged = property(_get_paged)
+
+    def _get_ok(self):
+        """Answer True if the operation is done and confirmed by the decoder."""
+        return self.done and self.error is None and self.value is not None
+    ok = property(_get_ok)
+
+class CvBatch:
+    """Reads and writes a set of CVs of the decoder on the programming track of @z21, with one change of the
+    page index per page. @z21 is expected to have requestCV and requestCVWrite, as the Z21 class has.
+    Like Z21.readCV, the page index is assumed to be @currentPageIndex before the batch runs and it is set
+    to @currentPageIndex again at the end. Within each page, the operations keep the order of adding them.
+    If @cvs is a DecoderCvs (z21cvcache.py), the values that are read and written are stored in it.
+
+    >>> batch = CvBatch(None)
+    >>> volume = batch.read(259, pageIndex=2)
+    >>> for cvId in (3, 4): _ = batch.write(cvId, 10)
+    >>> _ = batch.write(260, 1, pageIndex=3); _ = batch.read(300, pageIndex=2); _ = batch.read(300)
+    >>> [(o.cvId, o.writeValue) for o in batch.plan()] # Unpaged and page 0 first, then the pages in order.
+    [(3, 10), (4, 10), (300, None), (31, 16), (32, 2), (259, None), (300, None), (32, 3), (260, 1), (32, 0)]
+    >>> len(batch), batch.accesses()
+    (6, 10)
+    >>> volume
+    <CvOperation read CV259 page=2>
+    """
+    def __init__(self, z21, currentPageIndex=0, cvs=None):
+        self.z21 = z21
+        self.cvs = cvs
+        self.currentPageIndex = currentPageIndex
+        self.operations = []
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} operations={len(self.operations)}>'
+
+    def __len__(self):
+        return len(self.operations)
+
+    def _add(self, cvId, pageIndex, writeValue):
+        if cvId in (CV_INDEX_REGISTER_H, CV_INDEX_REGISTER_L):
+            raise ValueError(f'CvBatch: CV{cvId} is set by the batch, use the pageIndex of the operations')
+        assert cvId in range(1, 1025) and pageIndex in range(0, 16)
+        operation = CvOperation(cvId, pageIndex if cvId >= FIRST_PAGED_CV else 0, writeValue)
+        self.operations.append(operation)
+        return operation
+
+    def read(self, cvId, pageIndex=0):
+        """Add reading @cvId, on @pageIndex if it is a paged CV. Answer the CvOperation, that has the value
+        when the batch ran."""
+        return self._add(cvId, pageIndex, None)
+
+    def write(self, cvId, value, pageIndex=0):
+        """Add writing @value to @cvId, on @pageIndex if it is a paged CV. Answer the CvOperation."""
+        assert value in range(0, 256)
+        return self._add(cvId, pageIndex, value)
+
+    def plan(self):
+        """Answer the list of CvOperation in the order that they are done, including the writes of the
+        index registers. Unpaged CVs and the CVs of the current page go first, then the other pages in order."""
+        pages = {}
+        for operation in self.operations:
+            page = operation.pageIndex if operation.paged else self.currentPageIndex
+            pages.setdefault(page, []).append(operation)
+
+        steps = pages.pop(self.currentPageIndex, [])
+        pageIndex = self.currentPageIndex
+        for page in sorted(pages):
+            if pageIndex == self.currentPageIndex and (self.cvs is None or
+                    self.cvs.get(CV_INDEX_REGISTER_H) != INDEX_REGISTER_H_VALUE):
+                steps.append(CvOperation(CV_INDEX_REGISTER_H, writeValue=INDEX_REGISTER_H_VALUE)) # Just to be sure.
+            steps.append(CvOperation(CV_INDEX_REGISTER_L, writeValue=page))
+            steps += pages[page]
+            pageIndex = page
+        if pageIndex != self.currentPageIndex: # Restore, once.
+            steps.append(CvOperation(CV_INDEX_REGISTER_L, writeValue=self.currentPageIndex))
+        return steps
+
+    def accesses(self):
+        """Answer the number of programming track operations that the batch needs."""
+        return len(self.plan())
+
+    def _do(self, operation):
+        try:
+            if operation.writeValue is None:
+                operation.value = self.z21.requestCV(operation.cvId).result()
+            else:
+                operation.value = self.z21.requestCVWrite(operation.cvId, operation.writeValue).result()
+            if operation.value is None:
+                operation.error = 'NACK'
+        except Exception as e: # Timeout after the retries
+            operation.error = e
+        operation.done = True
+        if self.cvs is not None:
+            if operation.value is None:
+                self.cvs.forget(operation.cvId, operation.pageIndex)
+            else:
+                self.cvs.store(operation.cvId, operation.value, operation.pageIndex)
+        return operation.error is None
+
+    def run(self, progress=None):
+        """Run the batch on the programming track. This is a generator that answers each added CvOperation
+        when it is done. If @progress is defined, it is called as progress(operation, done, total).
+        If the page index (CV31 or CV32) cannot be written, then the paged operations get the error, without
+        access. If the generator is closed before the end, the page index is still restored.
+
+        >>> class Track: # Programming track that answers the values, and cannot write @failing
+        ...     def __init__(self, failing=()): self.failing = failing; self.writes = []
+        ...     def reply(self, value): f = Future(); f.set_result(value); return f
+        ...     def requestCV(self, cvId): return self.reply(cvId % 256)
+        ...     def requestCVWrite(self, cvId, value):
+        ...         self.writes.append((cvId, value)); return self.reply(None if cvId in self.failing else value)
+        >>> track = Track(failing=(CV_INDEX_REGISTER_H,))
+        >>> batch = CvBatch(track)
+        >>> _ = batch.read(3), batch.read(259, pageIndex=2)
+        >>> batch.execute()
+        [<CvOperation read CV3 =3 done>, <CvOperation read CV259 page=2 =None error=Index register CV31: NACK>]
+        >>> track = Track()
+        >>> batch = CvBatch(track)
+        >>> _ = batch.read(259, pageIndex=2), batch.read(300, pageIndex=3)
+        >>> operations = batch.run()
+        >>> next(operations)
+        <CvOperation read CV259 page=2 =3 done>
+        >>> operations.close() # Stopped before page 3, the page index is restored.
+        >>> track.writes
+        [(31, 16), (32, 2), (32, 0)]
+        """
+        total = len(self.operations)
+        done = 0
+        indexError = None # CV31 failed, no paged CV can be addressed.
+        pageError = None # CV32 failed, the CVs of this page cannot be addressed.
+        pageChanged = False # The page index is not restored yet.
+        try:
+            for operation in self.plan():
+                if operation.cvId == CV_INDEX_REGISTER_H:
+                    if not self._do(operation):
+                        indexError = f'Index register CV{operation.cvId}: {operation.error}'
+                    continue
+                if operation.cvId == CV_INDEX_REGISTER_L:
+                    pageChanged = operation.writeValue != self.currentPageIndex
+                    if self._do(operation):
+                        pageError = None
+                    else:
+                        pageError = f'Page index {operation.writeValue}: {operation.error}'
+                    continue
+                error = indexError or pageError
+                if error is not None and operation.paged:
+                    operation.error = error
+                    operation.done = True
+                else:
+                    self._do(operation)
+                done += 1
+                if progress is not None:
+                    progress(operation, done, total)
+                yield operation
+        finally:
+            if pageChanged: # Closed before the end, restore the page index anyway.
+                self._do(CvOperation(CV_INDEX_REGISTER_L, writeValue=self.currentPageIndex))
+
+    def execute(self, progress=None):
+        """Run the batch and answer the list of the CvOperation in the order that they were done."""
+        return list(self.run(progress))
+
+    def start(self, progress=None):
+        """Run the batch in a background thread, e.g. to keep a user interface responsive. Answer the
+        concurrent.futures.Future for the list of CvOperation, as answered by execute(). Note that @progress
+        is called from the background thread."""
+        future = Future()
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(self.execute(progress))
+            except Exception as e:
+                future.set_exception(e)
+        threading.Thread(target=run, name='Z21CvBatch', daemon=True).start()
+        return future
+
+if __name__ == '__main__':
+    import doctest
+    import sys
+    sys.exit(doctest.testmod()[0])
@@ -0,0 +1,177 @@
+# -*- coding: UTF-8 -*-
+# ------------------------------------------------------------------------------
+#     Copyright (c) 2023+ TYPETR
+#     Usage by MIT License
+# ..............................................................................
+#
+#    TYPETR z21cvcache.py
+#
+#   Shadow of the CV values of the decoders on the programming track.
+#
+#   Every read or write of a CV takes hundreds of milliseconds on the programming track, and every write
+#   wears the EEPROM of the decoder. The DecoderCvs remembers the values that were read from or written to
+#   one decoder, so repeated reads come from the shadow and writes of a value that the decoder already has
+#   are skipped. Wanted values can be set in the shadow first (dirty), after which only the CVs that differ
+#   are written, in one CvBatch:
+#
+#       cvs = z21.identifyDecoder() # Reads CV8, CV7, CV29 and the address, selects the shadow of this decoder.
+#       z21.cvAcceleration          # Read from the decoder once, then from the shadow.
+#       cvs.setProfile({z21.CV_ACCELERATION: 28, (z21.CV_BRAKE_VOLUME, 2): 100})
+#       z21.writeDirtyCVs()         # Writes only the CVs that differ.
+#
+#   The shadow is only used after identifyDecoder(), so the decoder on the programming track is known.
+#   Call z21.forgetDecoder() when it is taken off the track.
+#
+from z21decoders import (cvKey, CV_CONFIGURATION_REGISTER, CV_LOCO_ADDRESS, CV_LOCO_LONG_ADDRESS,
+    CV_MANUFACTURERS_ID, CV_VERSION_NUMBER)
+
+class DecoderCvs:
+    """The known and the wanted (dirty) CV values of a single decoder. The key (manufacturer id, version,
+    address) is answered from the known values of CV8, CV7 and CV1 or CV17/CV18.
+
+    >>> cvs = DecoderCvs()
+    >>> for cvId, value in ((8, 151), (7, 1), (29, 12), (1, 3)): cvs.store(cvId, value)
+    >>> cvs.key
+    (151, 1, 3)
+    >>> cvs.setProfile({3: 28, 4: 21, (259, 2): 100})
+    3
+    >>> cvs.store(3, 28) # Read from the decoder, it already has this value.
+    >>> cvs.dirty(), cvs.get(259, 2), cvs.wanted(259, 2)
+    ([(4, 0, 21), (259, 2, 100)], None, 100)
+    >>> cvs.store(259, 100, 2); cvs.dirty()
+    [(4, 0, 21)]
+    >>> cvs.set(4, 21, force=True), cvs.forget(4), cvs.dirty()
+    (True, None, [(4, 0, 21)])
+    >>> cvs.store(29, 12 | 0x20); cvs.store(17, 0xC1); cvs.store(18, 0x03); cvs.key # Long address 259
+    (151, 1, 259)
+    """
+    def __init__(self):
+        self.values = {} # (cvId, pageIndex) --> value in the decoder, as read or written.
+        self.dirtyValues = {} # (cvId, pageIndex) --> wanted value, not written yet.
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.key} known={len(self.values)} dirty={len(self.dirtyValues)}>'
+
+    def _get_address(self):
+        """Answer the loco address from the known CV29, CV1 or CV17/CV18. Answer None if unknown."""
+        values = self.values
+        config = values.get((CV_CONFIGURATION_REGISTER, 0))
+        if config is None:
+            return None
+        if config & 0x20:
+            high = values.get((CV_LOCO_LONG_ADDRESS, 0))
+            low = values.get((CV_LOCO_LONG_ADDRESS + 1, 0))
+            if high is None or low is None:
+                return None
+            return ((high & 0x3F) << 8) | low
+        return values.get((CV_LOCO_ADDRESS, 0))
+    address = property(_get_address)
+
+    def _get_key(self):
+        """Answer the tuple (manufacturer id, version, address) that identifies the decoder."""
+        return self.values.get((CV_MANUFACTURERS_ID, 0)), self.values.get((CV_VERSION_NUMBER, 0)), self.address
+    key = property(_get_key)
+
+    def get(self, cvId, pageIndex=0):
+        """Answer the value that the decoder has for @cvId on @pageIndex. Answer None if it is unknown."""
+        return self.values.get(cvKey(cvId, pageIndex))
+
+    def wanted(self, cvId, pageIndex=0):
+        """Answer the wanted value of @cvId, the dirty value if there is one, otherwise the known value."""
+        key = cvKey(cvId, pageIndex)
+        return self.dirtyValues.get(key, self.values.get(key))
+
+    def store(self, cvId, value, pageIndex=0):
+        """Remember that the decoder has @value for @cvId, read or confirmed after writing. If it is the
+        wanted value, then the CV is no longer dirty."""
+        key = cvKey(cvId, pageIndex)
+        self.values[key] = value
+        if self.dirtyValues.get(key) == value:
+            del self.dirtyValues[key]
+
+    def forget(self, cvId=None, pageIndex=0):
+        """Make @cvId unknown, so it is read again. Without @cvId, forget all values, e.g. after a reset."""
+        if cvId is None:
+            self.values.clear()
+        else:
+            self.values.pop(cvKey(cvId, pageIndex), None)
+
+    def set(self, cvId, value, pageIndex=0, force=False):
+        """Set the wanted @value of @cvId. It becomes dirty if the decoder is not known to have it, or if @force
+        is True. Answer True if the CV is dirty."""
+        key = cvKey(cvId, pageIndex)
+        if not force and self.values.get(key) == value:
+            self.dirtyValues.pop(key, None)
+            return False
+        self.dirtyValues[key] = value
+        return True
+
+    def setProfile(self, profile, force=False):
+        """Set the wanted values of dictionary @profile, with keys cvId or (cvId, pageIndex).
+        Answer the number of dirty CVs."""
+        for cvId, value in profile.items():
+            self.set(cvId, value, force=force)
+        return len(self.dirtyValues)
+
+    def dirty(self):
+        """Answer the sorted list of (cvId, pageIndex, value) of the CVs that need to be written."""
+        return [(cvId, pageIndex, value) for (cvId, pageIndex), value in sorted(self.dirtyValues.items())]
+
+    def clean(self):
+        """Drop the wanted values that are not written."""
+        self.dirtyValues.clear()
+
+class CvShadowCache:
+    """The DecoderCvs of all decoders that were on the programming track, by key
+    (manufacturer id, version, address), so a decoder that comes back keeps its known values.
+
+    >>> cache = CvShadowCache()
+    >>> cvs = cache.identify({8: 151, 7: 1, 29: 12, 1: 3})
+    >>> cvs.key, cache.identify({8: 151, 7: 1, 29: 12, 1: 3}) is cvs, len(cache)
+    ((151, 1, 3), True, 1)
+    >>> cvs.store(1, 4) # Address changed by writing CV1
+    >>> cache.find(151, 1, 4) is cvs, cache.find(151, 1, 3)
+    (True, None)
+    """
+    def __init__(self):
+        self.decoders = []
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} decoders={len(self.decoders)}>'
+
+    def __len__(self):
+        return len(self.decoders)
+
+    def find(self, manufacturerId, version, address):
+        """Answer the DecoderCvs with this key, or None. The keys are answered from the current values,
+        so a decoder is found by its new address after CV1 was written."""
+        key = (manufacturerId, version, address)
+        for cvs in self.decoders:
+            if cvs.key == key:
+                return cvs
+        return None
+
+    def identify(self, values):
+        """Answer the DecoderCvs of the decoder with the dictionary cvId --> @values, as read from the decoder:
+        CV8, CV7, CV29 and CV1 or CV17/CV18. A new DecoderCvs is added if the decoder is not known."""
+        probe = DecoderCvs()
+        for cvId, value in values.items():
+            probe.store(cvId, value)
+        assert None not in probe.key, f'Incomplete decoder identification {values}'
+        # Drop the decoders that lost their key, e.g. after a reset to the manufacturer values.
+        self.decoders = [cvs for cvs in self.decoders if None not in cvs.key]
+        cvs = self.find(*probe.key)
+        if cvs is None:
+            self.decoders.append(probe)
+            return probe
+        for cvId, value in values.items():
+            cvs.store(cvId, value)
+        return cvs
+
+    def clear(self):
+        self.decoders = []
+
+if __name__ == '__main__':
+    import doctest
+    import sys
+    sys.exit(doctest.testmod()[0])
@@ -0,0 +1,132 @@
+# -*- coding: UTF-8 -*-
+# ------------------------------------------------------------------------------
+#     Copyright (c) 2023+ TYPETR
+#     Usage by MIT License
+# ..............................................................................
+#
+#    TYPETR z21cvread.py
+#
+#   Choice of the read mode of the programming track, per decoder.
+#
+#   The LAN protocol offers two ways to read a CV on the programming track:
+#   'direct'    LAN_X_CV_READ, any CV. The Z21 reads it in DCC direct mode, verifying it bit by bit
+#               itself, so the bit verify of the DCC protocol is not available as a separate LAN command. Z21: 6.1
+#   'register'  LAN_X_DCC_READ_REGISTER, only the 8 registers of the old register mode: CV1-CV4, CV29, CV7
+#               and CV8. Some decoders answer it faster, others not at all or wrong. Z21: 6.13
+#
+#   The CvReadStrategy of a decoder calibrates both modes on the register CVs, measures their timing and then
+#   answers the fastest mode that gave the same values as direct mode. Z21.dumpCVs uses it for a backup
+#   of all documented CVs of a decoder.
+#
+import time
+
+MODE_DIRECT = 'direct'
+MODE_REGISTER = 'register'
+
+# CV --> register of LAN_X_DCC_READ_REGISTER. Register 6 is the page register of paged mode, not a CV.
+REGISTER_CVS = {1: 1, 2: 2, 3: 3, 4: 4, 29: 5, 7: 7, 8: 8}
+
+class ReadTiming:
+    """Measured timing of the reads in one mode.
+
+    >>> timing = ReadTiming(MODE_DIRECT)
+    >>> timing.add(0.2, True); timing.add(0.4, True); timing.add(1.0, False)
+    >>> timing.count, timing.failures, round(timing.mean, 3)
+    (3, 1, 0.3)
+    """
+    __slots__ = ('mode', 'count', 'failures', 'seconds')
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.count = 0
+        self.failures = 0 # NACK or timeout
+        self.seconds = 0 # Total time of the successful reads
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.mode} count={self.count} mean={self.mean}>'
+
+    def add(self, seconds, ok):
+        self.count += 1
+        if ok:
+            self.seconds += seconds
+        else:
+            self.failures += 1
+
+    def _get_mean(self):
+        """Answer the mean seconds of the successful reads, None if there were none."""
+        succeeded = self.count - self.failures
+        if not succeeded:
+            return None
+        return self.seconds / succeeded
+    mean = property(_get_mean)
+
+    def asDict(self):
+        mean = self.mean
+        return dict(count=self.count, failures=self.failures, mean_ms=None if mean is None else round(mean * 1000, 1))
+
+class CvReadStrategy:
+    """Timing and reliability of the read modes of a single decoder on the programming track of @z21.
+    @z21 is expected to have requestCV and requestRegister, as the Z21 class has.
+
+    >>> strategy = CvReadStrategy(None)
+    >>> strategy.choose(29), strategy.choose(63) # Not calibrated
+    ('direct', 'direct')
+    >>> strategy.timings[MODE_DIRECT].add(0.5, True); strategy.timings[MODE_REGISTER].add(0.3, True)
+    >>> strategy.reliable[MODE_REGISTER] = True
+    >>> strategy.choose(29), strategy.choose(63) # Register mode only has CV1-CV4, CV7, CV8 and CV29.
+    ('register', 'direct')
+    """
+    def __init__(self, z21):
+        self.z21 = z21
+        self.timings = {MODE_DIRECT: ReadTiming(MODE_DIRECT), MODE_REGISTER: ReadTiming(MODE_REGISTER)}
+        self.reliable = {MODE_DIRECT: True, MODE_REGISTER: None} # None is not calibrated.
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.timings[MODE_DIRECT]} {self.timings[MODE_REGISTER]}>'
+
+    def read(self, cvId, mode=None):
+        """Read @cvId in @mode, default the chosen mode for this CV, and record the timing. Answer the value,
+        None for LAN_X_CV_NACK or a timeout."""
+        if mode is None:
+            mode = self.choose(cvId)
+        t = time.perf_counter()
+        try:
+            if mode == MODE_REGISTER:
+                value = self.z21.requestRegister(REGISTER_CVS[cvId]).result()
+            else:
+                value = self.z21.requestCV(cvId).result()
+        except TimeoutError:
+            value = None
+        self.timings[mode].add(time.perf_counter() - t, value is not None)
+        return value
+
+    def calibrate(self, samples=1):
+        """Read the register CVs @samples times in both modes. Register mode is reliable if it answered all
+        of them with the same value as direct mode. Answer the dictionary cvId --> value of direct mode."""
+        values = {}
+        reliable = True
+        for _ in range(samples):
+            for cvId in REGISTER_CVS:
+                value = values[cvId] = self.read(cvId, MODE_DIRECT)
+                if value is None or self.read(cvId, MODE_REGISTER) != value:
+                    reliable = False
+        self.reliable[MODE_REGISTER] = reliable
+        return values
+
+    def choose(self, cvId):
+        """Answer the fastest reliable mode for @cvId."""
+        if cvId in REGISTER_CVS and self.reliable[MODE_REGISTER]:
+            direct = self.timings[MODE_DIRECT].mean
+            register = self.timings[MODE_REGISTER].mean
+            if direct is not None and register is not None and register < direct:
+                return MODE_REGISTER
+        return MODE_DIRECT
+
+    def asDict(self):
+        """Answer the measured timing and reliability of the modes, e.g. for the JSON of a dump."""
+        return {mode: dict(reliable=self.reliable[mode], **timing.asDict()) for mode, timing in self.timings.items()}
+
+if __name__ == '__main__':
+    import doctest
+    import sys
+    sys.exit(doctest.testmod()[0])
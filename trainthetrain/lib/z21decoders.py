@@ -0,0 +1,361 @@
+# -*- coding: UTF-8 -*-
+# ------------------------------------------------------------------------------
+#     Copyright (c) 2023+ TYPETR
+#     Usage by MIT License
+# ..............................................................................
+#
+#    TYPETR z21decoders.py
+#
+#   Profiles of the CVs that the decoders support: range, default, page index and read only, by name and by number.
+#
+#   The tables are plain tuples. A DecoderProfile compiles its table and the table of its base profile into
+#   dictionaries on first use, after which finding and validating a CV is a single dictionary lookup. The
+#   CV_... names of DEFAULT_PROFILE, the superset of all loco CVs, are constants of this module (CV_NUMBERS)
+#   and class attributes of Z21:
+#
+#       z21.CV_ACCELERATION                     # 3
+#       profile = z21.identifyDecoder() and z21.decoderProfile # Selected by CV8 (manufacturer) and CV7 (version)
+#       profile['CV_BRAKE_VOLUME'].pageIndex    # 2
+#       profile.validate(63, 200)               # ValueError: CV_MASTER_VOLUME (CV63) value 200 not in range 0-192
+#
+#   LokSound5 documentation: List of all supported CV's
+#   51989_LokSound_5_ESUKG_EN_InstructionManual_Edition-15_eBook_01.pdf
+#
+FIRST_PAGED_CV = 257
+
+MANUFACTURER_ESU = 151 # CV8
+
+# Name, CV, page index, minimum, maximum, default (None is unknown), read only, description.
+# The page index only matters for the paged CV257-511, see Z21.readCV.
+
+NMRA_CVS = (
+    ('CV_LOCO_ADDRESS',              1,   0,   1, 127, 3,    False, 'Address of engine (For Multiprotocol decoders: Range 1-255 for Motorola). Range: 1-127. Default: 3'),
+    ('CV_START_VOLTAGE',             2,   0,   1, 127, 3,    False, 'Sets the minimum speed of the engine. Range: 1-127. Default: 3'),
+    ('CV_ACCELERATION',              3,   0,   0, 255, 28,   False, 'This value multiplied by 0.25 is the time from stop to maximum speed. For LokSound 5 DCC: The unit is 0.896 seconds. Range: 0-255. Default: 28'),
+    ('CV_DECELERATION',              4,   0,   0, 255, 21,   False, 'This value multiplied by 0.25 is the time from maximum speed to stop For LokSound 5 DCC: The unit is 0.896 seconds. Range: 0-255. Default: 21'),
+    ('CV_MAXIMUM_SPEED',             5,   0,   0, 255, 255,  False, 'Maximum speed of the engine. Range: 0-255. Default: 255'),
+    ('CV_MEDIUM_SPEED',              6,   0,   0, 255, None, False, 'Medium speed of the engine. Use only if 3-point speed table is enabled. For LokSound 5 DCC only.'),
+    ('CV_VERSION_NUMBER',            7,   0,   0, 255, None, True,  'Internal software version of decoder'),
+    ('CV_MANUFACTURERS_ID',          8,   0,   8,   8, 151,  False, 'Manufacturers‘s ID ESU - Writing value 8 in this CV triggers a reset to factory default values. Range: 151.'),
+    ('CV_DECODER_LOCK',              15,  0,   0, 255, 0,    False, '[15,16] Decoder-Lock Function according to NMRA. For details please see: http://www.nmra.org/standards/DCC/WGpublic/0305051/0305051.html. Range 0-255. Default: 0.'),
+    ('CV_LOCO_LONG_ADDRESS',         17,  0, 192, 231, 192,  False, '[17,18] Long address of engine (see chapter 9.2). Range: 128-9999. Default: 192.'),
+    ('CV_CONSIST_ADRESS',            19,  0,   0, 255, 0,    False, 'Additional address for consist operation. Value 0 or 128 means: consist address is disabled. 1 – 127 consist address active, normal direction. 129 – 255 consist address active reverse direction'),
+    ('CV_CONSIST_MODE_F1_F8',        21,  0,   0, 255, 0,    False, 'Status of functions F1 to F8 in Consist mode Meaning of the bits as in CV 13. Range 0-255. Default: 0.'),
+    ('CV_CONSIST_MODE_F9_F12',       22,  0,   0, 255, 0,    False, 'Status of functions FL, F9 to F12 in Consist mode Meaning of the bits as in CV 14. Range 0-255. Default: 0.'),
+    ('CV_ADJUST_ACCELERATION',       23,  0,   0, 127, 0,    False, 'Factor for adjusting Acceleration CV 3. Values from 0 to 127 are added to CV 3. If the values are to be subtracted, additionally set bit 7 (value 128). The unit is 0.896 seconds. Range: 0-127. Default: 0.'),
+    ('CV_ADJUST_DECELERATION',       24,  0,   0, 127, 0,    False, 'Factor for adjusting the deceleration CV 4. Values from 0 to 127 are ad- ded to CV 3. If the values are to be subtracted, additionally set bit 7 (value 128). The unit is 0.896 seconds. Range: 0-127. Default: 0.'),
+    ('CV_RAILCOM_CONFIGURATION',     28,  0,   0, 255, None, False, 'Settings for RailCom®'),
+    ('CV_CONFIGURATION_REGISTER',    29,  0,   0, 255, 12,   False, 'IThis register contains important information, some of which are only relevant for DCC operation. Default: 12.'),
+    ('CV_INDEX_REGISTER_H',          31,  0,   0, 255, 16,   False, 'Selection page for CV257-512. For LokSound 5 usually set to 16.'),
+    ('CV_INDEX_REGISTER_L',          32,  0,   0,  15, 0,    False, 'Selection page for CV257-512. Range 0-16. Default: 0.'),
+    ('CV_FORWARD_TRIMM',             66,  0,   0, 255, 128,  False, 'Divided by 128 is the factor used to multiply the motor voltage when driving forward. The value 0 deactivates the trim. Range: 0-255. Default: 128.'),
+    ('CV_SPEED_TABLE',               67,  0,   0, 255, None, False, '[65:95] Defines motor voltage for speed steps. The values „in between“ will be interpolated. Range 0-255'),
+    ('CV_REVERSE_TRIMM',             95,  0,   0, 255, 128,  False, 'Divided by 128 is the factor used to multiply the motor voltage when driving backwards. Value 0 deactivates the trim. Range: 0-255. Default: 128.'),
+    ('CV_USER_CV1',                  105, 0,   0, 255, 0,    False, 'Free CV. Here you are able to save what ever you want. Range: 0-255. Default: 0.'),
+    ('CV_USER_CV2',                  106, 0,   0, 255, 0,    False, 'Free CV. Here you are able to save what ever you want. Range: 0-255. Default: 0.'),
+)
+
+LOKPILOT_CVS = (
+    ('CV_MOTOR_PWM_FREQUENZ',        9,   0,  10,  50, 40,   False, 'Motor PWM frequency as a multiple of 1000 Hz. Range: 10-50. Default: 40.'),
+    ('CV_ANALOG_MODUS_F1_F8',        13,  0,   0, 255, 1,    False, 'Status of functions F1 to F8 in analogue mode (see chapter 12.7). Range 0-255. Default: 1.'),
+    ('CV_ANALOG_MODUS_F9_F15',       14,  0,   0,  63, 1,    False, 'Status of function F0, F9 to F12 in analogue mode (see chapter 12.7). Range 0-63. Defailt: 1.'),
+    ('CV_BRAKE_MODE',                27,  0,   0, 255, 28,   False, '8 Allowed (enabled) Brake modes by bits. Default: 28.'),
+    ('CV_PROTOCOL_SELECTION',        47,  0,   0, 255, 13,   False, 'Which protocols are active. Please see chapter 9.5. Default: 13.'),
+    ('CV_EXTENDED_CONFIGURATION',    49,  0,   0, 255, 19,   False, 'Range 0-255. Value: 19.'),
+    ('CV_ANALOGUE_MODE',             50,  0,   0,   3, 3,    False, 'Selection of allowed analogue modes. Range 0-3. Default: 3.'),
+    ('CV_K_SLOW_CUTOFF',             51,  0,   0, 255, 10,   False, 'Internal Speedstep, until «K Slow» is active. Range 0-255. Default: 10.'),
+    ('CV_BEMF_PARAM_K_SLOW',         52,  0,   0, 255, 10,   False, '«K» -Portion of the PI-Controller valid for lower speed steps. Range 0-255. Default: 10.'),
+    ('CV_CONTROL_REF_VOLTAGE',       53,  0,   0, 255, 130,  False, 'Defines the Back EMF voltage, which the motor should generate at maxi- mum speed. The higher the efficiency of the motor, the higher this value may be set. If the engine does not reach maximum speed, reduce this pa- rameter. Range: 0-255. Default: 130.'),
+    ('CV_LOAD_CONTROL_PARAMS_K',     54,  0,   0, 255, 50,   False, '«K»–component of the internal PI-controller. Defines the effect of load control. The higher the value, the stronger the effect of Back EMF control. Range 0-255. Default: 50.'),
+    ('CV_LOAD_CONTROL_PARAMS_I',     55,  0,   0, 255, 100,  False, '«I»–component of the internal PI-controller. Defines the momentum (iner- tia) of the motor. The higher the momentum of the motor (large flywheel or bigger motor), the lower this value has to be set. The higher the value, the stronger the effect of Back EMF control. Range 0-255. Default: 100.'),
+    ('CV_BEMF_INFLUENCE_VMIN',       56,  0,   1, 255, 255,  False, '0-100%. Defines the “Strengh” of the BEMF at minimum speed step. Range: 1-255. Default: 255.'),
+    ('CV_SHUNTING_MODE_TRIMM',       101, 0,   0, 128, 64,   False, 'Divided by 128, this gives the factor by which the motor voltage is multi- plied when the shunting gear is active. See section 10.1.2. Range: 0-128. Default: 64.'),
+    ('CV_BREAK_MODE_EXIT_DELAY',     102, 0,   0, 255, 12,   False, 'Time as a multiple of 16 milliseconds that must pass before a detected braking distance is left again. See section 10.4.6. Range: 0-255. Default: 12.'),
+    ('CV_LOAD_ADJ_OPTIONAL_LOAD',    103, 0,   0, 255, 0,    False, 'Divided by 128, this gives the factor that changes CV3, CV4 and the sound when „Optional Load” is active. See section 10.7. Range: 0-255. Default: 0.'),
+    ('CV_LOAD_ADJ_PRIMARY_LOAD',     104, 0,   0, 255, 255,  False, 'Divided by 128, this gives the factor that changes CV3, CV4 and the sound when „Primry Load” is active. See section 10.7. Range: 0-255. Default: 255.'),
+    ('CV_GEARBOX_BACKLASH',          111, 0,   0, 255, 0,    False, 'Time as a multiple of 16 mS, for which the motor runs at minimum speed after reversing the direction to prevent gear box jerking. Range: 0-255. DefaultL 0.'),
+    ('CV_FREQUENCY_FLASH_LIGHTS',    112, 0,   0, 255, 20,   False, 'Flashing frequency for Strobe lighting effects. Multiple of 0.065536 seconds. See section 12.5.4. Range: 0-255. Default: 20.'),
+    ('CV_POWER_FAIL_BYPASS',         133, 0,   0, 255, 32,   False, 'The time that the decoder bridges via the PowerPack after an interruption of voltage. Unit: A multiple of 0.032768 sec. See section 6.12.2. Range: 0-255. Default: 32.'),
+    ('CV_SLOW_SPEED_BEMF_SAMPL',     116, 0,  50, 200, 50,   False, 'Frequency of BEMF measurement in 0.1 milliseconds at speed step 1. Range: 50-200. Default: 50.'),
+    ('CV_FULL_SPEED_BEMF_SAMPL',     117, 0,  50, 200, 150,  False, 'Frequency of BEMF measurement in 0.1 milliseconds at speed step 255. Range: 50-200. Default: 150.'),
+    ('CV_SLOW_SPEED_BEMF_GAP_VMIN',  118, 0,   0, 255, 150,  False, 'Length of the BEMF measuring gap in 0.1 milliseconds at speed step 1. Range: 10-20. Default: 150. ???'),
+    ('CV_FULL_SPEED_BEMF_GAP_VMIN',  119, 0,   0, 255, 15,   False, 'Length of the BEMF measuring gap in 0.1 milliseconds at speed step 255. Range: 10-20. Default: 15.'),
+    ('CV_ABC_MODE_SLOW_DRIVE',       123, 0,   0, 255, 100,  False, 'Speed which is valid in the slow driving section during ABC braking. Range: 0-255. Default: 100.'),
+    ('CV_EXTENDED_CONFIGURATION_2',  124, 0,   0, 255, 21,   False, 'Additional important settings for decoders. Default: 21.'),
+    ('CV_START_VOLTAGE_ANALOG_DC',   125, 0,   0, 255, 90,   False, 'See section 10.8. Range: 0-255. Default: 90.'),
+    ('CV_MAX_SPEED_ANALOG_DC',       126, 0,   0, 255, 130,  False, 'See section 10.8. Range: 0-255. Default: 130.'),
+    ('CV_START_VOLTAGE_ANALOG_AC',   127, 0,   0, 255, 90,   False, 'See section 10.8. Range: 0-255. Default: 90.'),
+    ('CV_MAX_SPEED_ANALOG_AC',       128, 0,   0, 255, 130,  False, 'See section 10.8. Range: 0-255. Default: 130.'),
+    ('CV_ANALOG_FUNC_HYSTERESE',     129, 0,   0, 255, 15,   False, 'Offset voltage for functions in analogue mode. Chapter 10.8. Range: 0-255. Default: 15.'),
+    ('CV_ANALOG_MOTOR_HYSTERESE',    130, 0,   0, 255, 5,    False, 'Offset voltage for motor functions in analogue mode. Chapter 10.8. Range: 0-255. Default: 5.'),
+    ('CV_GRADE_CROSSING_HOLD_TIME',  132, 0,   0, 255, 80,   False, 'Grade Crossing holding time. See chapter 12.5.3. Range: 0-255. Default: 80.'),
+    ('CV_ABC_MODE_SENSIBILITY',      134, 0,   4,  32, 10,   False, 'Threshold, from which asymmentry on ABC shall be recognised. Range: 4-32. Default: 10.'),
+    ('CV_ABC_SHUTTLE_TRAIN_HOLD',    149, 0,   0, 255, 255,  False, 'Time in seconds, which has to be passed for ABC shuttle train operation, before the direction of travel is changed. See section 10.4.4.3. Range: 0-255. Default: 255.'),
+    ('CV_HLU_SPEEDLIMIT_1',          150, 0,   0, 255, 42,   False, 'HLU Speed limit 1. Internal speedstep. Range: 0-255. Default: 42.'),
+    ('CV_HLU_SPEEKLIMIT_2U',         151, 0,   0, 255, 85,   False, 'HLU Speed limit 2 (U). Internal speedstep. Range: 0-255. Default: 85.'),
+    ('CV_HLU_SPEEDLIMIT_3',          152, 0,   0, 255, 127,  False, 'HLU Speed limit 3. Internal speedstep. Range: 0-255. Default: 127.'),
+    ('CV_HLU_SPEEKLIMIT_4L',         153, 0,   0, 255, 170,  False, 'HLU Speed limit 4 (L). Internal speedstep. Range: 0-255. Default: 170.'),
+    ('CV_HLU_SPEEKLIMIT_5',          154, 0,   0, 255, 212,  False, 'HLU Speed limit 5. Internal speedstep. Range: 0-255. Default: 212.'),
+    ('CV_BRAKE_FUNCTION_1_DEC',      179, 0,   0, 255, 80,   False, 'Value of which 33% of CV 4 will be deducted if the Brake Function 1 is active. See section 10.6. Range: 0-255. Defualt: 80.'),
+    ('CV_BRAKE_FUNCTION_2_DEC',      180, 0,   0, 255, 40,   False, 'Value of which 33% of CV 4 will be deducted if the Brake Function 2 is active. See section 10.6. Range: 0-255. Defualt: 40.'),
+    ('CV_BRAKE_FUNCTION_3_DEC',      181, 0,   0, 255, 40,   False, 'Value of which 33% of CV 4 will be deducted if the Brake Function 3 is active. See section 10.6. Range: 0-255. Defualt: 40.'),
+    ('CV_BRAKE_FUNCTION_1_MAX',      182, 0,   0, 126, 0,    False, 'Highest speed step that can be reached when Brake function 1 is active. Range: 0-126. Default: 0.'),
+    ('CV_BRAKE_FUNCTION_2_MAX',      183, 0,   0, 126, 0,    False, 'Highest speed step that can be reached when Brake function 2?? is active. Range: 0-126. Default: 0.'),
+    ('CV_BRAKE_FUNCTION_3_MAX',      184, 0,   0, 126, 0,    False, 'Highest speed step that can be reached when Brake function 3?? is active. Range: 0-126. Default: 0.'),
+    ('CV_AUTO_DECOULING_SPEED',      246, 0,   0, 255, 0,    False, 'Speed of the loco while decoupling; the higher the value, the faster the loco. Value 0 switches the automatic coupler off. Automatic decoupling is only active if the function output is adjusted to „pulse“ or „coupler“. Range: 0-255. Default: 0.'),
+    ('CV_DECOUPLING_REMOVE_TIME',    247, 0,   0, 255, 0,    False, 'This value multiplied with 0.016 defines the time the loco needs for moving away from the train (automatic decoupling). Range: 0-255. Default: 0.'),
+    ('CV_DECOUPLING_PUSH_TIME',      248, 0,   0, 255, 0,    False, 'This value multiplied with 0.016 defines the time the loco needs for pushing against the train (automatic decoupling). Range: 0-255. Default: 0.'),
+    ('CV_CONSTANT_BRAKE_MODE',       253, 0,   0, 255, 0,    False, 'Determines the constant brake mode. Only active, if CV254 > 0. Range: 0-255. Default: 0.'),
+    ('CV_CONSTANT_BRAKE_DIST_FORW',  254, 0,   0, 255, 0,    False, 'A value > 0 determines the way of brake distance it adheres to, indepen- dent from speed. Range: 0-255. Default: 0.'),
+    ('CV_CONSTANT_BRAKE_DIST_BACK',  255, 0,   0, 255, 0,    False, 'Constant braking distances during reverse driving. Only active, if value > 0, otherwise the value of CV 254 is used. Useful for reversible trains. Range: 0-255. Default: 0.'),
+)
+
+LOKSOUND5_CVS = (
+    ('CV_STEAM_CHUFF_SYNCH_1',       57,  0,   1, 255, 30,   False, '[LokSound5 only] Defines the steam chuff synchronisation. See chapter 13.3. Range: 1-255. Default: 30.'),
+    ('CV_STEAM_CHUFF_SYNCH_2',       58,  0,   1, 255, 20,   False, '[LokSound5 only] Defines the steam chuff synchronisation. See chapter 13.3. Range: 1-255. Default: 20.'),
+    ('CV_MASTER_VOLUME',             63,  0,   0, 192, 180,  False, '[LokSound5 only] The master volume control controls all sound effects. A value of „0“ would mute the decoder completely. The resulting sound vo- lume for each individual sound effect therefore is a mixture of the master volume control settings and the individual volume control sliders. Range: 0-192. Default: 180.'),
+    ('CV_BRAKE_SOUND_ON',            64,  0,   0, 255, 60,   False, '[LokSound5 only] If the actual loco speed step is smaller than or equals the value indicated here, the brake sound is triggered. Compare chapter 13.4. Range: 0-255. Default: 60.'),
+    ('CV_BRAKE_SOUND_OFF',           65,  0,   0, 255, 7,    False, '[LokSound5 only] If the actual loco speed step is smaller than the one indicated here (up to 255), the brake sound will be switched off again. Compare chapter 13.4. Range: 0-255. Default: 7.'),
+    ('CV_SOUND_FADER',               133, 0,   0, 255, 128,  False, 'Volume when sound fader is active. See chapter 13.5. Range: 0-255. Default: 128.'),
+    ('CV_SMOKE_UNIT_TRIM_FAN',       138, 0,   0, 255, 128,  False, '[LokSound5 only] Divided by 128, this gives the factor by which the fan speed of synchronized smoke units can be adjusted. Range: 0-255. Default: 128.'),
+    ('CV_SMOKE_UNIT_TRIM_TEMP',      139, 0,   0, 255, 128,  False, '[LokSound5 only] Divided by 128, this gives the factor by which the temperature of synchronized smoke units can be adjusted. Range: 0-255. Default: 128.'),
+    ('CV_SMOKE_TIMEOUT',             140, 0,   0, 255, 255,  False, '[LokSound5 only] Time until automatic shutdown of the smoke unit. Range: 0-255. Default: 255.'),
+    ('CV_SMOKE_CHUFF_MIN',           141, 0,   0, 255, 10,   False, '[LokSound5 only] Minimum duration of a steam chuff of an external smoke unit in 0.041 resolution. Range: 0-255. Default: 10.'),
+    ('CV_SMOKE_CHUFF_MAX',           142, 0,   0, 255, 125,  False, '[LokSound5 only] Maximum duration of a steam chuff of an external smoke unit in 0.041 resolution. Range: 0-255. Default: 125.'),
+    ('CV_SMOKE_CHUF_LENGTH',         143, 0,   0, 255, 255,  False, '[LokSound5 only] Divided by 128, this gives the factor by which the duration of the steam chuffs can be adjusted relative to the trigger pulses. Range: 0-255. Default: 255.'),
+    ('CV_SMOKE_PREHEAT_TEMP',        144, 0,   0, 255, 150,  False, '[LokSound5 only] Preheating temperature in degrees Celsius for secondary smoke generators (cylinder smoke unit). Range: 0-255. Default: 150.'),
+    ('CV_SOUND_CV1',                 155, 0,   0, 255, 0,    False, '16 CVs for selecting sounds that can be assigned within sound projects. Please note the documentation for the sound project. Range: 0-255. Default: 0.'),
+    ('CV_SOUND_CV2',                 156, 0,   0, 255, 0,    False, '16 CVs for selecting sounds that can be assigned within sound projects. Please note the documentation for the sound project. Range: 0-255. Default: 0.'),
+    ('CV_SOUND_CV3',                 157, 0,   0, 255, 0,    False, '16 CVs for selecting sounds that can be assigned within sound projects. Please note the documentation for the sound project. Range: 0-255. Default: 0.'),
+    ('CV_SOUND_CV4',                 158, 0,   0, 255, 0,    False, '16 CVs for selecting sounds that can be assigned within sound projects. Please note the documentation for the sound project. Range: 0-255. Default: 0.'),
+    ('CV_SOUND_CV5',                 159, 0,   0, 255, 0,    False, '16 CVs for selecting sounds that can be assigned within sound projects. Please note the documentation for the sound project. Range: 0-255. Default: 0.'),
+    ('CV_SOUND_CV6',                 160, 0,   0, 255, 0,    False, '16 CVs for selecting sounds that can be assigned within sound projects. Please note the documentation for the sound project. Range: 0-255. Default: 0.'),
+    ('CV_SOUND_CV7',                 161, 0,   0, 255, 0,    False, '16 CVs for selecting sounds that can be assigned within sound projects. Please note the documentation for the sound project. Range: 0-255. Default: 0.'),
+    ('CV_SOUND_CV8',                 162, 0,   0, 255, 0,    False, '16 CVs for selecting sounds that can be assigned within sound projects. Please note the documentation for the sound project. Range: 0-255. Default: 0.'),
+    ('CV_SOUND_CV9',                 163, 0,   0, 255, 0,    False, '16 CVs for selecting sounds that can be assigned within sound projects. Please note the documentation for the sound project. Range: 0-255. Default: 0.'),
+    ('CV_SOUND_CV10',                164, 0,   0, 255, 0,    False, '16 CVs for selecting sounds that can be assigned within sound projects. Please note the documentation for the sound project. Range: 0-255. Default: 0.'),
+    ('CV_SOUND_CV11',                165, 0,   0, 255, 0,    False, '16 CVs for selecting sounds that can be assigned within sound projects. Please note the documentation for the sound project. Range: 0-255. Default: 0.'),
+    ('CV_SOUND_CV12',                166, 0,   0, 255, 0,    False, '16 CVs for selecting sounds that can be assigned within sound projects. Please note the documentation for the sound project. Range: 0-255. Default: 0.'),
+    ('CV_SOUND_CV13',                167, 0,   0, 255, 0,    False, '16 CVs for selecting sounds that can be assigned within sound projects. Please note the documentation for the sound project. Range: 0-255. Default: 0.'),
+    ('CV_SOUND_CV14',                168, 0,   0, 255, 0,    False, '16 CVs for selecting sounds that can be assigned within sound projects. Please note the documentation for the sound project. Range: 0-255. Default: 0.'),
+    ('CV_SOUND_CV15',                169, 0,   0, 255, 0,    False, '16 CVs for selecting sounds that can be assigned within sound projects. Please note the documentation for the sound project. Range: 0-255. Default: 0.'),
+    ('CV_SOUND_CV16',                170, 0,   0, 255, 0,    False, '16 CVs for selecting sounds that can be assigned within sound projects. Please note the documentation for the sound project. Range: 0-255. Default: 0.'),
+    ('CV_MIN_STEAM_CHUFF_DISTANCE',  249, 0,   0, 255, 0,    False, 'Minimum distance of two steam chuffs, independant from sensor data. Compage chapter 13.3. Range: 0-255. Default: 0.'),
+    ('CV_SEC_STEAM_CHUFF_TRIGGER',   250, 0,   0, 255, 0,    False, '[LokSound5 only] Defines the distance between two consecutive steam chuffs for the secondary steam chuff generator. The value indicates the promilles the steam chuff distances of the secondary steam chuff generator ought to be shorter then those of the primary steam chuff generator. It is needed for steam locos with two independent boogies, such as „Big Boy” or „Mallet”. Range: 0-255. Default: 0.'),
+    ('CV_BRAKE_VOLUME',              259, 2,   0, 128, 0,    False, 'Brake sound volume. Range: 0-128. Default: 0.'),
+)
+
+# Accessory decoders, NMRA S-9.2.2.
+ACCESSORY_CVS = (
+    ('CV_ACCESSORY_ADDRESS_L',       1,   0,   1,  63, 1,    False, 'Least significant 6 bits of the accessory decoder address. Range: 1-63. Default: 1'),
+    ('CV_VERSION_NUMBER',            7,   0,   0, 255, None, True,  'Internal software version of decoder'),
+    ('CV_MANUFACTURERS_ID',          8,   0,   8,   8, None, False, 'Manufacturers‘s ID - Writing value 8 in this CV triggers a reset to factory default values.'),
+    ('CV_ACCESSORY_ADDRESS_H',       9,   0,   0,   7, 0,    False, 'Most significant 3 bits of the accessory decoder address. Range: 0-7. Default: 0'),
+    ('CV_CONFIGURATION_REGISTER',   29,   0,   0, 255, 128,  False, 'Bit 7 set: accessory decoder. Default: 128'),
+)
+
+def cvKey(cvId, pageIndex=0):
+    """Answer the (cvId, pageIndex) key of the CV. The @pageIndex only matters for the paged CV257-511.
+    @cvId can also be the key of a CV in a profile, the tuple (cvId, pageIndex).
+
+    >>> cvKey(3, 2), cvKey(259, 2), cvKey((259, 2))
+    ((3, 0), (259, 2), (259, 2))
+    """
+    if isinstance(cvId, tuple): # Key of a profile
+        cvId, pageIndex = cvId
+    return cvId, pageIndex if cvId >= FIRST_PAGED_CV else 0
+
+class CvDef:
+    """Definition of a single CV in a DecoderProfile.
+
+    >>> cv = CvDef('CV_MASTER_VOLUME', 63, 0, 0, 192, 180)
+    >>> cv, cv.key, cv.validate(180)
+    (<CvDef CV_MASTER_VOLUME CV63 0-192 default=180>, (63, 0), 180)
+    >>> cv.validate(200)
+    Traceback (most recent call last):
+    ...
+    ValueError: CV_MASTER_VOLUME (CV63) value 200 not in range 0-192
+    """
+    __slots__ = ('name', 'cvId', 'pageIndex', 'minimum', 'maximum', 'default', 'readOnly', 'description')
+
+    def __init__(self, name, cvId, pageIndex=0, minimum=0, maximum=255, default=None, readOnly=False, description=''):
+        self.name = name
+        self.cvId = cvId
+        self.pageIndex = pageIndex if cvId >= FIRST_PAGED_CV else 0
+        self.minimum = minimum
+        self.maximum = maximum
+        self.default = default
+        self.readOnly = readOnly
+        self.description = description
+
+    def __repr__(self):
+        s = f'<{self.__class__.__name__} {self.name} CV{self.cvId}'
+        if self.cvId >= FIRST_PAGED_CV:
+            s += f' page={self.pageIndex}'
+        s += f' {self.minimum}-{self.maximum}'
+        if self.default is not None:
+            s += f' default={self.default}'
+        if self.readOnly:
+            s += ' read only'
+        return s + '>'
+
+    def _get_key(self):
+        return self.cvId, self.pageIndex
+    key = property(_get_key)
+
+    def validate(self, value):
+        """Answer @value if it can be written to this CV. Otherwise raise ValueError."""
+        if self.readOnly:
+            raise ValueError(f'{self.name} (CV{self.cvId}) is read only')
+        if not self.minimum <= value <= self.maximum:
+            raise ValueError(f'{self.name} (CV{self.cvId}) value {value} not in range {self.minimum}-{self.maximum}')
+        return value
+
+class DecoderProfile:
+    """The CVs of a decoder type, from the tuple @cvs and the CVs of the @base profile. A CV of @cvs replaces
+    the CV of @base with the same name. The profile is detected by the @manufacturerId in CV8 and, if defined,
+    the @versions (e.g. a range) of CV7.
+
+    >>> profile = DecoderProfile('Test', (('CV_VOLUME', 63, 0, 0, 192, 180, False, ''), ('CV_PAGED', 259, 2, 0, 128, 0, False, '')), base=NMRA)
+    >>> profile.cv('CV_VOLUME').cvId, profile[63].name, 'CV_LOCO_ADDRESS' in profile, 7 in profile, 259 in profile
+    (63, 'CV_VOLUME', True, True, False)
+    >>> profile.get(259, 2), profile.get(259, 3)
+    (<CvDef CV_PAGED CV259 page=2 0-128 default=0>, None)
+    >>> profile.validate(3, 28).name, profile.validate(300, 1), profile.validate(259, 100, 2).name
+    ('CV_ACCELERATION', None, 'CV_PAGED')
+    >>> profile.validate(7, 1)
+    Traceback (most recent call last):
+    ...
+    ValueError: CV_VERSION_NUMBER (CV7) is read only
+    >>> profile.defaults()[(3, 0)], profile.defaults()[(259, 2)], (6, 0) in profile.defaults()
+    (28, 0, False)
+    """
+    def __init__(self, name, cvs, manufacturerId=None, versions=None, base=None):
+        self.name = name
+        self.manufacturerId = manufacturerId
+        self.versions = versions # None for all versions
+        self.base = base
+        self.cvs = cvs # Table of tuples, compiled on first use.
+        self._byName = None # Name --> CvDef
+        self._byKey = None # (cvId, pageIndex) --> CvDef
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.name}>'
+
+    def _compile(self):
+        byName = {} if self.base is None else dict(self.base.byName)
+        byKey = {} if self.base is None else dict(self.base.byKey)
+        for cv in self.cvs:
+            cv = CvDef(*cv)
+            replaced = byName.get(cv.name)
+            if replaced is not None and byKey.get(replaced.key) is replaced:
+                del byKey[replaced.key]
+            byName[cv.name] = cv
+            byKey[cv.key] = cv # Two names for one CV (CV133 of the LokPilot and the LokSound5): this profile wins.
+        self._byName = byName
+        self._byKey = byKey
+
+    def _get_byName(self):
+        if self._byName is None:
+            self._compile()
+        return self._byName
+    byName = property(_get_byName)
+
+    def _get_byKey(self):
+        if self._byKey is None:
+            self._compile()
+        return self._byKey
+    byKey = property(_get_byKey)
+
+    def __len__(self):
+        return len(self.byName)
+
+    def __contains__(self, cvId):
+        """Answer True if the profile has the CV with name or number @cvId. A paged CV is only found on page 0."""
+        if isinstance(cvId, str):
+            return cvId in self.byName
+        return cvKey(cvId) in self.byKey
+
+    def __getitem__(self, cvId):
+        """Answer the CvDef with name or number @cvId. Raise KeyError if the profile does not have it."""
+        if isinstance(cvId, str):
+            return self.byName[cvId]
+        return self.byKey[cvKey(cvId)]
+
+    def cv(self, name):
+        """Answer the CvDef of CV_... @name. Raise KeyError if the profile does not have it."""
+        return self.byName[name]
+
+    def get(self, cvId, pageIndex=0):
+        """Answer the CvDef of @cvId on @pageIndex, or None if the profile does not have it."""
+        return self.byKey.get(cvKey(cvId, pageIndex))
+
+    def validate(self, cvId, value, pageIndex=0):
+        """Raise ValueError if @value cannot be written to @cvId on @pageIndex. Answer the CvDef, or None if the
+        profile does not have the CV, in which case any byte value is accepted."""
+        cv = self.byKey.get(cvKey(cvId, pageIndex))
+        if cv is None:
+            if value not in range(0, 256):
+                raise ValueError(f'CV{cvId} value {value} not in range 0-255')
+        else:
+            cv.validate(value)
+        return cv
+
+    def matches(self, manufacturerId, version=None):
+        """Answer True if this profile is of the decoder with CV8 @manufacturerId and CV7 @version."""
+        return manufacturerId == self.manufacturerId and (self.versions is None or version in self.versions)
+
+    def defaults(self):
+        """Answer the dictionary (cvId, pageIndex) --> default value of the writable CVs with a known default, 
+        e.g. for DecoderCvs.setProfile in z21cvcache.py. CV8 (reset) is not included."""
+        return {cv.key: cv.default for cv in self.byKey.values()
+            if cv.default is not None and not cv.readOnly and cv.minimum <= cv.default <= cv.maximum}
+
+    def cvNames(self):
+        """Answer the dictionary cvId --> list of CV_... names, of all CVs of this profile, sorted by cvId."""
+        names = {}
+        for cv in self.byName.values():
+            names.setdefault(cv.cvId, []).append(cv.name)
+        return {cvId: sorted(names[cvId]) for cvId in sorted(names)}
+
+NMRA = DecoderProfile('NMRA', NMRA_CVS)
+LOKPILOT = DecoderProfile('LokPilot', LOKPILOT_CVS, MANUFACTURER_ESU, base=NMRA)
+LOKSOUND5 = DecoderProfile('LokSound5', LOKSOUND5_CVS, MANUFACTURER_ESU, base=LOKPILOT)
+ACCESSORY = DecoderProfile('Accessory', ACCESSORY_CVS)
+SWITCHPILOT_SERVO = DecoderProfile('SwitchPilotServo', (), MANUFACTURER_ESU, base=ACCESSORY)
+
+DEFAULT_PROFILE = LOKSOUND5 # Answers the CV_... names of the Z21 class.
+
+# CV_... name --> CV number of DEFAULT_PROFILE. The names are also constants of this module, e.g.
+# CV_LOCO_ADDRESS, and class attributes of Z21, e.g. Z21.CV_ACCELERATION.
+CV_NUMBERS = {cv.name: cv.cvId for cv in DEFAULT_PROFILE.byName.values()}
+globals().update(CV_NUMBERS)
+
+# Name --> DecoderProfile
+PROFILES = {profile.name: profile for profile in (NMRA, LOKPILOT, LOKSOUND5, ACCESSORY, SWITCHPILOT_SERVO)}
+
+# Loco decoder profiles in order of detection. CV7 of the ESU decoders is the firmware version, that does not
+# tell a LokPilot from a LokSound5, so the LokSound5, having all CVs of the LokPilot, is selected for both.
+LOCO_PROFILES = (LOKSOUND5,)
+ACCESSORY_PROFILES = (SWITCHPILOT_SERVO,)
+
+def profileFor(manufacturerId, version=None, accessory=False):
+    """Answer the DecoderProfile of the decoder with CV8 @manufacturerId and CV7 @version. Answer the NMRA
+    profile (or the ACCESSORY profile) if the decoder is not known.
+
+    >>> profileFor(151, 1), profileFor(151, accessory=True), profileFor(99, 1), profileFor(99, accessory=True)
+    (<DecoderProfile LokSound5>, <DecoderProfile SwitchPilotServo>, <DecoderProfile NMRA>, <DecoderProfile Accessory>)
+    >>> len(NMRA), len(LOKPILOT), len(LOKSOUND5), LOKSOUND5[133].name, LOKPILOT[133].name
+    (24, 76, 108, 'CV_SOUND_FADER', 'CV_POWER_FAIL_BYPASS')
+    >>> LOKSOUND5.cvNames()[133], PROFILES['LokSound5'].cv('CV_BRAKE_VOLUME').key
+    (['CV_POWER_FAIL_BYPASS', 'CV_SOUND_FADER'], (259, 2))
+    """
+    for profile in ACCESSORY_PROFILES if accessory else LOCO_PROFILES:
+        if profile.matches(manufacturerId, version):
+            return profile
+    return ACCESSORY if accessory else NMRA
+
+if __name__ == '__main__':
+    import doctest
+    import sys
+    sys.exit(doctest.testmod()[0])
@@ -0,0 +1,259 @@
+# -*- coding: UTF-8 -*-
+# ------------------------------------------------------------------------------
+#     Copyright (c) 2023+ TYPETR
+#     Usage by MIT License
+# ..............................................................................
+#
+#    TYPETR z21feedback.py
+#
+#   [R-Bus detectors] ---> [Z21] ---(LAN_RMBUS_DATACHANGED)---> [Occupancy] ---(OccupancyEvent)---> listeners
+#
+#   Occupancy of the feedback detectors (the Koploper “melders”), as the Z21 reports them.
+#
+#   The R-Bus has up to 20 feedback modules of 8 inputs. The Z21 sends the status bytes of 10 modules in
+#   one LAN_RMBUS_DATACHANGED packet. The Occupancy keeps the inputs of all modules as a bit array and
+#   compares the new status bytes with it, so unchanged modules cost a single comparison. Every input that
+#   changed becomes an OccupancyEvent (occupied or free) with the time of arrival, for the listeners.
+#   Reading a detector is a bit test on the bit array, without traffic to the Z21, so an automation loop
+#   can check hundreds of detectors every tick:
+#
+#       z21.watchFeedback()                     # Sets the R-Bus broadcast flag and reads the current state.
+#       z21.occupancy.setBlocks(KoploperIO(path).detectorBlocks())
+#       z21.occupancy[13]                       # True if detector 13 (module 2, input 5) is occupied.
+#       z21.occupancy.blockOccupied(5)          # True if any detector of Koploper BLOK 5 is occupied.
+#       z21.occupancy.addListener(print)        # <OccupancyEvent 13 occupied blocks=(12,) ...>
+#
+#   Detectors are numbered from 1, as in Koploper: (module - 1) * 8 + input, with module 1-20 and input 1-8.
+#
+#   The CAN occupancy detectors (e.g. 10808) report each input separately with LAN_CAN_DETECTOR, by module
+#   address and port 0-7. They go into their own Occupancy, numbered the same way, see updateCanDetector():
+#
+#       z21.watchCanDetectors()
+#       z21.canOccupancy[detectorId(5, 1)]      # Port 0 of CAN module address 5
+#
+#   "Z21:" is referencing to the chapters in the z21-lan-protokoll-en.pdf manual.
+#
+import threading
+import time
+from array import array
+
+MODULE_INPUTS = 8
+RMBUS_MODULES = 20 # Group index 0: modules 1-10, group index 1: modules 11-20. Z21: 7.1
+RMBUS_GROUP_MODULES = 10
+RMBUS_GROUPS = RMBUS_MODULES // RMBUS_GROUP_MODULES
+
+CAN_MODULES = 256 # Module addresses 1-256 of the CAN occupancy detectors that are kept.
+CAN_ALL_DETECTORS = 0xD000 # NId of LAN_CAN_DETECTOR that requests the reports of all CAN detectors, Z21: 10.1
+CAN_OCCUPANCY = 0x01 # Type of LAN_CAN_DETECTOR with the occupancy in Value1, Z21: 10.1
+CAN_OCCUPIED = 0x1000 # Value1 bit: occupied, the other bits tell track voltage and overload.
+
+def detectorId(module, input):
+    """Answer the detector number of @input (1-8) of feedback @module (1-20).
+
+    >>> detectorId(1, 1), detectorId(2, 5), detectorId(20, 8)
+    (1, 13, 160)
+    """
+    return (module - 1) * MODULE_INPUTS + input
+
+def detectorInput(detector):
+    """Answer the tuple (module, input) of @detector.
+
+    >>> detectorInput(13)
+    (2, 5)
+    """
+    module, input = divmod(detector - 1, MODULE_INPUTS)
+    return module + 1, input + 1
+
+class OccupancyEvent:
+    """Change of a single detector: occupied (True) or free (False), at @time (time.time()) of arrival.
+    @blocks is the tuple of the blocks of the detector."""
+    __slots__ = ('detector', 'occupied', 'time', 'blocks')
+
+    def __init__(self, detector, occupied, time, blocks=()):
+        self.detector = detector
+        self.occupied = occupied
+        self.time = time
+        self.blocks = blocks
+
+    def __repr__(self):
+        state = 'occupied' if self.occupied else 'free'
+        return f'<{self.__class__.__name__} {self.detector} {state} blocks={self.blocks} time={self.time}>'
+
+class Occupancy:
+    """Bit array of the occupancy of @modules feedback modules, with the time of the last change of each
+    detector and the index detector --> blocks. Updates come from the receiver thread, reading is lock free.
+
+    >>> occupancy = Occupancy()
+    >>> occupancy.setBlocks({13: 12, 14: 12, 1: 1})
+    >>> events = []
+    >>> occupancy.addListener(events.append)
+    >>> occupancy.update(2, bytes((0x10,)), 100.0) # Module 2, input 5
+    [<OccupancyEvent 13 occupied blocks=(12,) time=100.0>]
+    >>> occupancy[13], occupancy[14], occupancy.blockOccupied(12), occupancy.occupiedBlocks(), occupancy.lastChange(13)
+    (True, False, True, [12], 100.0)
+    >>> occupancy.update(2, bytes((0x30,)), 101.0), occupancy.update(2, bytes((0x20,)), 102.0)
+    ([<OccupancyEvent 14 occupied blocks=(12,) time=101.0>], [<OccupancyEvent 13 free blocks=(12,) time=102.0>])
+    >>> occupancy.blockOccupied(12), occupancy.occupiedDetectors(), len(events)
+    (True, [14], 3)
+    >>> occupancy.update(2, bytes((0x20,)), 103.0) # No change
+    []
+    >>> occupancy.updateRmBus(bytes((0x0F, 0, 0x80, 0, 0, 0x01, 0, 0, 0, 0, 0, 0, 0, 0, 0))) # doctest: +ELLIPSIS
+    [<OccupancyEvent 1 occupied blocks=(1,) time=...>, <OccupancyEvent 14 free blocks=(12,) time=...>]
+    >>> occupancy.blockOccupied(12), occupancy.occupiedBlocks()
+    (False, [1])
+    """
+    def __init__(self, modules=RMBUS_MODULES):
+        self.lock = threading.Lock()
+        self.bits = bytearray(modules) # Status byte per module, bit 0 is input 1.
+        self.times = array('d', bytes(8 * (modules * MODULE_INPUTS + 1))) # Detector --> time of the last change
+        self.detectorBlocks = {} # Detector --> tuple of blocks
+        self.blockCounts = {} # Block --> number of its occupied detectors
+        self.listeners = []
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} detectors={len(self)} occupied={len(self.occupiedDetectors())}>'
+
+    def __len__(self):
+        return len(self.bits) * MODULE_INPUTS
+
+    def __getitem__(self, detector):
+        """Answer True if @detector is occupied."""
+        detector -= 1
+        return bool(self.bits[detector >> 3] & (1 << (detector & 7)))
+
+    def lastChange(self, detector):
+        """Answer the time.time() of the last change of @detector, 0 if it did not change yet."""
+        return self.times[detector]
+
+    def occupiedDetectors(self):
+        """Answer the sorted list of occupied detectors."""
+        bits = bytes(self.bits)
+        return [index * MODULE_INPUTS + input + 1 for index, value in enumerate(bits) if value
+            for input in range(MODULE_INPUTS) if value & (1 << input)]
+
+    def addListener(self, callback):
+        """Call @callback(event) with the OccupancyEvent of every change. Note that the callback is called
+        from the receiver thread."""
+        self.listeners.append(callback)
+
+    def removeListener(self, callback):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    #   B L O C K S
+
+    def setBlocks(self, detectorBlocks):
+        """Set the index of the blocks from dictionary @detectorBlocks, detector --> block or tuple of blocks,
+        e.g. as answered by KoploperIO.detectorBlocks(). Detectors that are not in the modules (e.g. above
+        160 for the R-Bus) are skipped.
+
+        >>> occupancy = Occupancy()
+        >>> occupancy.setBlocks({13: (12, 14), 0: 1, 160: 20, 161: 21})
+        >>> occupancy.detectorBlocks, occupancy.occupiedBlocks(), sorted(occupancy.blockCounts)
+        ({13: (12, 14), 160: (20,)}, [], [12, 14, 20])
+        """
+        with self.lock:
+            self.detectorBlocks = {}
+            self.blockCounts = {}
+            for detector, blocks in detectorBlocks.items():
+                if not 1 <= detector <= len(self):
+                    continue
+                if not isinstance(blocks, tuple):
+                    blocks = (blocks,)
+                self.detectorBlocks[detector] = blocks
+                for block in blocks:
+                    self.blockCounts[block] = self.blockCounts.get(block, 0) + self[detector]
+
+    def blockOccupied(self, block):
+        """Answer True if any detector of @block is occupied."""
+        return self.blockCounts.get(block, 0) > 0
+
+    def occupiedBlocks(self):
+        """Answer the sorted list of occupied blocks."""
+        return sorted(block for block, count in list(self.blockCounts.items()) if count)
+
+    #   U P D A T E
+
+    def update(self, firstModule, status, t=None):
+        """Store the @status bytes of the modules from @firstModule on. Answer the list of OccupancyEvent
+        of the inputs that changed, at time @t (default now), after calling the listeners with them."""
+        index = firstModule - 1
+        bits = self.bits
+        if bits[index:index + len(status)] == status: # Most updates change one module, or none.
+            return []
+        if t is None:
+            t = time.time()
+        events = []
+        with self.lock:
+            for value in status:
+                changed = bits[index] ^ value
+                if changed:
+                    bits[index] = value
+                    for input in range(MODULE_INPUTS):
+                        if changed & (1 << input):
+                            detector = index * MODULE_INPUTS + input + 1
+                            occupied = bool(value & (1 << input))
+                            self.times[detector] = t
+                            blocks = self.detectorBlocks.get(detector, ())
+                            for block in blocks:
+                                self.blockCounts[block] += 1 if occupied else -1
+                            events.append(OccupancyEvent(detector, occupied, t, blocks))
+                index += 1
+        for event in events:
+            for callback in self.listeners:
+                callback(event)
+        return events
+
+    def set(self, detector, occupied, t=None):
+        """Store the state of the single @detector, for feedback that reports detectors one by one, as the
+        LocoNet sensors do. Answer the list of OccupancyEvent. Detectors outside the modules are skipped,
+        as in setBlocks().
+
+        >>> Occupancy().set(13, True, 100.0), Occupancy().set(13, False, 100.0)
+        ([<OccupancyEvent 13 occupied blocks=() time=100.0>], [])
+        >>> occupancy = Occupancy(2)
+        >>> occupancy.set(0, True), occupancy.set(len(occupancy) + 1, True), occupancy.occupiedDetectors()
+        ([], [], [])
+        """
+        if not 1 <= detector <= len(self):
+            return []
+        index, input = divmod(detector - 1, MODULE_INPUTS)
+        value = self.bits[index]
+        if occupied:
+            value |= 1 << input
+        else:
+            value &= ~(1 << input)
+        return self.update(index + 1, bytes((value,)), t)
+
+    def updateRmBus(self, packet):
+        """Store the LAN_RMBUS_DATACHANGED @packet. Can be used directly as subscriber of the Z21 receiver.
+        Answer the list of OccupancyEvent."""
+        return self.update(packet[4] * RMBUS_GROUP_MODULES + 1, bytes(packet[5:5 + RMBUS_GROUP_MODULES]))
+
+    def updateCanDetector(self, packet):
+        """Store the LAN_CAN_DETECTOR @packet, NId(16) Addr(16) Port Type Value1(16) Value2(16), if it is an
+        occupancy report of a module address in range. Can be used directly as subscriber of the Z21 receiver.
+        Answer the list of OccupancyEvent. Z21: 10.1
+
+        >>> occupancy = Occupancy(CAN_MODULES)
+        >>> occupancy.updateCanDetector(bytes((0x0E, 0, 0xC4, 0, 0x01, 0xD0, 5, 0, 2, 0x01, 0x00, 0x11, 0, 0)))  # doctest: +ELLIPSIS
+        [<OccupancyEvent 35 occupied blocks=() time=...>]
+        >>> occupancy[detectorId(5, 3)], occupancy.updateCanDetector(bytes((0x0E, 0, 0xC4, 0, 0x01, 0xD0, 5, 0, 2, 0x11, 3, 0, 0, 0)))
+        (True, [])
+        """
+        address = packet[6] | (packet[7] << 8)
+        if packet[9] != CAN_OCCUPANCY or not 0 < address <= len(self.bits):
+            return []
+        return self.set(detectorId(address, packet[8] + 1), bool((packet[10] | (packet[11] << 8)) & CAN_OCCUPIED))
+
+    def clear(self):
+        """Make all detectors free, without events, e.g. before reading the state again."""
+        with self.lock:
+            self.bits[:] = bytes(len(self.bits))
+            for block in self.blockCounts:
+                self.blockCounts[block] = 0
+
+if __name__ == '__main__':
+    import doctest
+    import sys
+    sys.exit(doctest.testmod()[0])
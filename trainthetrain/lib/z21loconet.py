@@ -0,0 +1,543 @@
+# -*- coding: UTF-8 -*-
+# ------------------------------------------------------------------------------
+#     Copyright (c) 2023+ TYPETR
+#     Usage by MIT License
+# ..............................................................................
+#
+#    TYPETR z21loconet.py
+#
+#   [LocoNet bus] <---> [Z21] <---(LAN_LOCONET_Z21_RX/TX, LAN_LOCONET_FROM_LAN)---> [LocoNetGateway]
+#
+#   LocoNet messages tunnelled through the LAN socket of the Z21, so the LocoNet detectors and throttles of
+#   the layout need no second (serial) interface.
+#
+#   The Z21 forwards every LocoNet message that it receives (LAN_LOCONET_Z21_RX) or sends (LAN_LOCONET_Z21_TX)
+#   to the clients with the LocoNet broadcast flags, and puts LAN_LOCONET_FROM_LAN messages of a client onto the
+#   bus. The LocoNetGateway validates the checksum, decodes the message by its opcode and keeps:
+#   - the SlotTable, the loco address, speed, direction and functions of each slot of the command station;
+#   - the Occupancy of the LocoNet sensors (OPC_INPUT_REP and the occupancy reports of LAN_LOCONET_DETECTOR),
+#     with the same OccupancyEvent as the R-Bus feedback, see z21feedback.py.
+#
+#       z21.watchLocoNet()
+#       z21.locoNet.occupancy[1021]             # Sensor 1021 occupied?
+#       z21.locoNet.slots.findAddress(3)        # <LocoSlot 1 loco=3 speed=40 forward in use>
+#       z21.locoNet.send(locoNetMessage(OPC_LOCO_SPD, slot, 40))
+#
+#   Opcodes and message formats from the LocoNet Personal Edition specification, "Z21:" is referencing to the
+#   chapters in the z21-lan-protokoll-en.pdf manual.
+#
+import threading
+import time
+
+from z21feedback import Occupancy
+from z21messages import LocoNetDetector
+
+LOCONET_SENSORS = 4096 # Sensor addresses 1-4096 of OPC_INPUT_REP
+
+# Opcodes
+OPC_BUSY = 0x81
+OPC_GPOFF = 0x82 # Global power off
+OPC_GPON = 0x83 # Global power on
+OPC_IDLE = 0x85 # Emergency stop of all locos
+OPC_LOCO_SPD = 0xA0 # Slot, speed
+OPC_LOCO_DIRF = 0xA1 # Slot, 0 0 DIR F0 F4 F3 F2 F1
+OPC_LOCO_SND = 0xA2 # Slot, 0 0 0 0 F8 F7 F6 F5
+OPC_SW_REQ = 0xB0 # Switch request
+OPC_SW_REP = 0xB1 # Switch sensor report
+OPC_INPUT_REP = 0xB2 # Sensor report
+OPC_LONG_ACK = 0xB4
+OPC_SLOT_STAT1 = 0xB5
+OPC_MOVE_SLOTS = 0xBA
+OPC_RQ_SL_DATA = 0xBB # Request the data of a slot
+OPC_SW_STATE = 0xBC
+OPC_LOCO_ADR = 0xBF # Request the slot of a loco address
+OPC_PEER_XFER = 0xE5
+OPC_SL_RD_DATA = 0xE7 # Slot data
+OPC_IMM_PACKET = 0xED
+OPC_WR_SL_DATA = 0xEF # Write slot data
+
+# Type of the LAN_LOCONET_DETECTOR request. Z21: 9.5
+DETECTOR_REQUEST_SIC = 0x80 # Uhlenbrock Stationary Interrogate Request, all detectors report, address ignored
+DETECTOR_REQUEST_REPORT = 0x81 # Uhlenbrock 63320 status of the report address
+DETECTOR_REQUEST_LISSY = 0x82 # Status of the Uhlenbrock LISSY at the report address
+
+FIRST_SPECIAL_SLOT = 120 # Slot 0 is the dispatch slot, 120-127 are the fast clock, programming and configuration.
+
+# Slot usage, STAT bits 5 and 4
+SLOT_FREE = 0
+SLOT_COMMON = 1
+SLOT_IDLE = 2
+SLOT_IN_USE = 3
+
+def locoNetLength(data):
+    """Answer the length of the LocoNet message that starts with @data, from the bits 6 and 5 of the opcode.
+    Variable length messages have the length in the second byte. Answer None if that is not known yet.
+
+    >>> locoNetLength(bytes((OPC_GPON,))), locoNetLength(bytes((OPC_INPUT_REP,))), locoNetLength(bytes((OPC_SL_RD_DATA, 0x0E)))
+    (2, 4, 14)
+    """
+    size = (data[0] >> 5) & 0x03
+    if size < 3:
+        return (2, 4, 6)[size]
+    return data[1] if len(data) > 1 else None
+
+def locoNetChecksum(data):
+    """Answer the checksum byte of the LocoNet message @data without checksum: the inverted XOR of all bytes.
+
+    >>> hex(locoNetChecksum(bytes((OPC_GPON,))))
+    '0x7c'
+    """
+    xor = 0xFF
+    for b in data:
+        xor ^= b
+    return xor
+
+def locoNetMessage(opcode, *args):
+    """Answer the bytes of the LocoNet message @opcode with the @args bytes and the checksum.
+
+    >>> locoNetMessage(OPC_LOCO_SPD, 1, 40).hex(' ')
+    'a0 01 28 76'
+    """
+    data = bytes((opcode,) + args)
+    return data + bytes((locoNetChecksum(data),))
+
+def functionBits(dirf, snd=0):
+    """Answer the functions F0-F8 as bits (bit n is Fn) from the DIRF and SND bytes of LocoNet.
+
+    >>> bin(functionBits(0x11, 0x01)) # F0, F1 and F5
+    '0b100011'
+    """
+    return ((dirf >> 4) & 0x01) | ((dirf & 0x0F) << 1) | ((snd & 0x0F) << 5)
+
+#   M E S S A G E S
+
+class LocoNetMessage:
+    """Base class of the decoded LocoNet messages, holding the bytes @data of the message including the checksum.
+    FIELDS is the list of property names that are shown in __repr__ and answered by asDict()."""
+    __slots__ = ('data',)
+    NAME = 'OPC_UNKNOWN'
+    FIELDS = ()
+
+    def __init__(self, data):
+        self.data = data
+
+    def __repr__(self):
+        fields = ''.join(f' {name}={getattr(self, name)}' for name in self.FIELDS)
+        return f'<{self.__class__.__name__}{fields}>'
+
+    def asDict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    def _get_opcode(self):
+        return self.data[0]
+    opcode = property(_get_opcode)
+
+    def _get_valid(self):
+        """Answer True if the length and the checksum of the message are right."""
+        data = self.data
+        if len(data) < 2 or locoNetLength(data) != len(data):
+            return False
+        return locoNetChecksum(data[:-1]) == data[-1]
+    valid = property(_get_valid)
+
+class UnknownLocoNetMessage(LocoNetMessage):
+    __slots__ = ()
+    FIELDS = ('opcode',)
+
+class Power(LocoNetMessage):
+    """OPC_GPON, OPC_GPOFF or OPC_IDLE (emergency stop)."""
+    __slots__ = ()
+    NAME = 'OPC_GPON'
+    FIELDS = ('on', 'idle')
+
+    def _get_on(self):
+        return self.data[0] == OPC_GPON
+    on = property(_get_on)
+
+    def _get_idle(self):
+        return self.data[0] == OPC_IDLE
+    idle = property(_get_idle)
+
+class LocoSpeed(LocoNetMessage):
+    """OPC_LOCO_SPD slot speed chk. Speed 0 is stop, 1 is emergency stop."""
+    __slots__ = ()
+    NAME = 'OPC_LOCO_SPD'
+    FIELDS = ('slot', 'speed')
+
+    def _get_slot(self):
+        return self.data[1]
+    slot = property(_get_slot)
+
+    def _get_speed(self):
+        return self.data[2]
+    speed = property(_get_speed)
+
+class LocoDirF(LocoNetMessage):
+    """OPC_LOCO_DIRF slot 0,0,DIR,F0,F4,F3,F2,F1 chk. DIR 1 is reverse."""
+    __slots__ = ()
+    NAME = 'OPC_LOCO_DIRF'
+    FIELDS = ('slot', 'forward', 'functions')
+
+    def _get_slot(self):
+        return self.data[1]
+    slot = property(_get_slot)
+
+    def _get_forward(self):
+        return not self.data[2] & 0x20
+    forward = property(_get_forward)
+
+    def _get_functions(self):
+        """Answer F0-F4 as bits, bit n is Fn."""
+        return functionBits(self.data[2])
+    functions = property(_get_functions)
+
+class LocoSound(LocoNetMessage):
+    """OPC_LOCO_SND slot 0,0,0,0,F8,F7,F6,F5 chk."""
+    __slots__ = ()
+    NAME = 'OPC_LOCO_SND'
+    FIELDS = ('slot', 'functions')
+
+    def _get_slot(self):
+        return self.data[1]
+    slot = property(_get_slot)
+
+    def _get_functions(self):
+        """Answer F5-F8 as bits, bit n is Fn."""
+        return functionBits(0, self.data[2])
+    functions = property(_get_functions)
+
+class SwitchRequest(LocoNetMessage):
+    """OPC_SW_REQ 0,A6..A0 0,0,DIR,ON,A10..A7 chk. DIR 1 is closed (straight), 0 is thrown.
+
+    >>> decodeLocoNet(locoNetMessage(OPC_SW_REQ, 0x04, 0x31))
+    <SwitchRequest address=133 closed=True on=True>
+    """
+    __slots__ = ()
+    NAME = 'OPC_SW_REQ'
+    FIELDS = ('address', 'closed', 'on')
+
+    def _get_address(self):
+        return (((self.data[2] & 0x0F) << 7) | self.data[1]) + 1
+    address = property(_get_address)
+
+    def _get_closed(self):
+        return bool(self.data[2] & 0x20)
+    closed = property(_get_closed)
+
+    def _get_on(self):
+        return bool(self.data[2] & 0x10)
+    on = property(_get_on)
+
+class InputReport(LocoNetMessage):
+    """OPC_INPUT_REP 0,A6..A0 0,X,I,L,A10..A7 chk. The sensor address is A10..A0, I + 1, L is occupied.
+
+    >>> m = decodeLocoNet(locoNetMessage(OPC_INPUT_REP, 0x7E, 0x77))
+    >>> m, m.valid
+    (<InputReport address=2046 occupied=True>, True)
+    """
+    __slots__ = ()
+    NAME = 'OPC_INPUT_REP'
+    FIELDS = ('address', 'occupied')
+
+    def _get_address(self):
+        data = self.data
+        return ((((data[2] & 0x0F) << 7) | data[1]) << 1 | ((data[2] >> 5) & 0x01)) + 1
+    address = property(_get_address)
+
+    def _get_occupied(self):
+        return bool(self.data[2] & 0x10)
+    occupied = property(_get_occupied)
+
+class LongAck(LocoNetMessage):
+    """OPC_LONG_ACK lopc ack1 chk, the answer to the message with opcode lopc & 0x7F | 0x80."""
+    __slots__ = ()
+    NAME = 'OPC_LONG_ACK'
+    FIELDS = ('answeredOpcode', 'ack')
+
+    def _get_answeredOpcode(self):
+        return self.data[1] | 0x80
+    answeredOpcode = property(_get_answeredOpcode)
+
+    def _get_ack(self):
+        return self.data[2]
+    ack = property(_get_ack)
+
+class SlotRequest(LocoNetMessage):
+    """OPC_RQ_SL_DATA slot 0 chk, or OPC_LOCO_ADR adr_hi adr_lo chk that requests the slot of a loco address."""
+    __slots__ = ()
+    NAME = 'OPC_RQ_SL_DATA'
+    FIELDS = ('slot', 'address')
+
+    def _get_slot(self):
+        return self.data[1] if self.data[0] == OPC_RQ_SL_DATA else None
+    slot = property(_get_slot)
+
+    def _get_address(self):
+        return (self.data[1] << 7) | self.data[2] if self.data[0] == OPC_LOCO_ADR else None
+    address = property(_get_address)
+
+class SlotData(LocoNetMessage):
+    """OPC_SL_RD_DATA or OPC_WR_SL_DATA 0x0E slot stat adr spd dirf trk ss2 adr2 snd id1 id2 chk.
+
+    >>> m = decodeLocoNet(locoNetMessage(OPC_SL_RD_DATA, 0x0E, 1, 0x33, 0x03, 40, 0x11, 0x07, 0, 0, 0x01, 0, 0))
+    >>> m, m.valid
+    (<SlotData slot=1 address=3 usage=3 speed=40 forward=True functions=35>, True)
+    """
+    __slots__ = ()
+    NAME = 'OPC_SL_RD_DATA'
+    FIELDS = ('slot', 'address', 'usage', 'speed', 'forward', 'functions')
+
+    def _get_slot(self):
+        return self.data[2]
+    slot = property(_get_slot)
+
+    def _get_status(self):
+        return self.data[3]
+    status = property(_get_status)
+
+    def _get_usage(self):
+        """Answer SLOT_FREE, SLOT_COMMON, SLOT_IDLE or SLOT_IN_USE."""
+        return (self.data[3] >> 4) & 0x03
+    usage = property(_get_usage)
+
+    def _get_address(self):
+        return (self.data[9] << 7) | self.data[4]
+    address = property(_get_address)
+
+    def _get_speed(self):
+        return self.data[5]
+    speed = property(_get_speed)
+
+    def _get_dirf(self):
+        return self.data[6]
+    dirf = property(_get_dirf)
+
+    def _get_forward(self):
+        return not self.data[6] & 0x20
+    forward = property(_get_forward)
+
+    def _get_snd(self):
+        return self.data[10]
+    snd = property(_get_snd)
+
+    def _get_functions(self):
+        """Answer F0-F8 as bits, bit n is Fn."""
+        return functionBits(self.data[6], self.data[10])
+    functions = property(_get_functions)
+
+LOCONET_MESSAGES = {
+    OPC_GPOFF: Power,
+    OPC_GPON: Power,
+    OPC_IDLE: Power,
+    OPC_LOCO_SPD: LocoSpeed,
+    OPC_LOCO_DIRF: LocoDirF,
+    OPC_LOCO_SND: LocoSound,
+    OPC_SW_REQ: SwitchRequest,
+    OPC_INPUT_REP: InputReport,
+    OPC_LONG_ACK: LongAck,
+    OPC_RQ_SL_DATA: SlotRequest,
+    OPC_LOCO_ADR: SlotRequest,
+    OPC_SL_RD_DATA: SlotData,
+    OPC_WR_SL_DATA: SlotData,
+}
+
+def decodeLocoNet(data):
+    """Answer the LocoNetMessage of the bytes @data, selected by its opcode. Check message.valid for the length
+    and the checksum.
+
+    >>> decodeLocoNet(locoNetMessage(OPC_GPOFF)), decodeLocoNet(bytes((0x99, 0x00))).valid
+    (<Power on=False idle=False>, False)
+    """
+    return LOCONET_MESSAGES.get(data[0], UnknownLocoNetMessage)(data)
+
+#   S L O T S
+
+class LocoSlot:
+    """State of a slot of the LocoNet command station, from the slot data and the loco messages on the bus."""
+    __slots__ = ('slot', 'address', 'usage', 'speed', 'forward', 'functions', 'time')
+
+    def __init__(self, slot):
+        self.slot = slot
+        self.address = None # Unknown until the slot data was read.
+        self.usage = SLOT_FREE
+        self.speed = 0
+        self.forward = True
+        self.functions = 0 # F0-F8, bit n is Fn
+        self.time = 0 # time.time() of the last change
+
+    def __repr__(self):
+        usage = ('free', 'common', 'idle', 'in use')[self.usage]
+        direction = 'forward' if self.forward else 'reverse'
+        return f'<{self.__class__.__name__} {self.slot} loco={self.address} speed={self.speed} {direction} {usage}>'
+
+class SlotTable:
+    """The LocoSlot of each slot that appeared on the bus.
+
+    >>> slots = SlotTable()
+    >>> slots.update(decodeLocoNet(locoNetMessage(OPC_SL_RD_DATA, 0x0E, 1, 0x33, 0x03, 0, 0, 0x07, 0, 0, 0, 0, 0)))
+    <LocoSlot 1 loco=3 speed=0 forward in use>
+    >>> _ = slots.update(decodeLocoNet(locoNetMessage(OPC_LOCO_SPD, 1, 40))); _ = slots.update(decodeLocoNet(locoNetMessage(OPC_LOCO_DIRF, 1, 0x31)))
+    >>> slots.findAddress(3), bin(slots[1].functions), slots.addresses()
+    (<LocoSlot 1 loco=3 speed=40 reverse in use>, '0b11', {3: 1})
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.slots = {} # Slot number --> LocoSlot
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} slots={len(self.slots)}>'
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __getitem__(self, slot):
+        return self.slots[slot]
+
+    def get(self, slot, default=None):
+        return self.slots.get(slot, default)
+
+    def findAddress(self, address):
+        """Answer the LocoSlot of loco @address, None if no slot is known for it."""
+        with self.lock:
+            for slot in self.slots.values():
+                if slot.address == address and slot.usage != SLOT_FREE:
+                    return slot
+        return None
+
+    def addresses(self):
+        """Answer the dictionary loco address --> slot number of the slots that are not free."""
+        with self.lock:
+            return {slot.address: slot.slot for slot in self.slots.values()
+                if slot.address is not None and slot.usage != SLOT_FREE}
+
+    def update(self, message, t=None):
+        """Update the slot of LocoNet @message. Answer the LocoSlot, None if the message is not about a loco slot."""
+        if isinstance(message, SlotData):
+            number = message.slot
+        elif isinstance(message, (LocoSpeed, LocoDirF, LocoSound)):
+            number = message.slot
+        else:
+            return None
+        if not 0 < number < FIRST_SPECIAL_SLOT:
+            return None
+        with self.lock:
+            slot = self.slots.get(number)
+            if slot is None:
+                slot = self.slots[number] = LocoSlot(number)
+            if isinstance(message, SlotData):
+                slot.address = message.address
+                slot.usage = message.usage
+                slot.speed = message.speed
+                slot.forward = message.forward
+                slot.functions = message.functions
+            elif isinstance(message, LocoSpeed):
+                slot.speed = message.speed
+            elif isinstance(message, LocoDirF):
+                slot.forward = message.forward
+                slot.functions = (slot.functions & ~0x1F) | message.functions
+            else:
+                slot.functions = (slot.functions & 0x1F) | message.functions
+            slot.time = time.time() if t is None else t
+        return slot
+
+    def clear(self):
+        with self.lock:
+            self.slots.clear()
+
+#   G A T E W A Y
+
+class LocoNetGateway:
+    """LocoNet through the LAN socket of @z21, that is expected to have sendLocoNet(data), as the Z21 class has.
+    The messages of the bus update the SlotTable self.slots and the Occupancy self.occupancy of the sensors.
+    Listeners are called as callback(message) for every valid message, also the ones that this client sent,
+    and for the LocoNetDetector reports.
+
+    >>> sent = []
+    >>> class Z21Stub:
+    ...     def sendLocoNet(self, data): sent.append(data)
+    >>> gateway = LocoNetGateway(Z21Stub())
+    >>> gateway.receive(bytes((0x08, 0, 0xA0, 0)) + locoNetMessage(OPC_INPUT_REP, 0x7E, 0x77)) # LAN_LOCONET_Z21_RX
+    <InputReport address=2046 occupied=True>
+    >>> gateway.occupancy[2046], gateway.receive(bytes((0x08, 0, 0xA0, 0, OPC_INPUT_REP, 0x7E, 0x77, 0))), gateway.errors
+    (True, None, 1)
+    >>> gateway.receiveDetector(bytes((0x08, 0, 0xA4, 0, 0x01, 0x0D, 0x00, 0x01))), gateway.occupancy[13]
+    (<LocoNetDetector type=1 address=13>, True)
+    >>> gateway.send(locoNetMessage(OPC_LOCO_SPD, 1, 40)); sent, gateway.slots[1].speed
+    ([b'\\xa0\\x01(v'], 40)
+    """
+    def __init__(self, z21, sensors=LOCONET_SENSORS):
+        self.z21 = z21
+        self.slots = SlotTable()
+        self.occupancy = Occupancy(sensors // 8)
+        self.listeners = []
+        self.received = 0 # Counters
+        self.errors = 0
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} received={self.received} errors={self.errors} slots={len(self.slots)}>'
+
+    def addListener(self, callback):
+        """Call @callback(message) with every valid LocoNetMessage. Note that the callback is called from the
+        receiver thread."""
+        self.listeners.append(callback)
+
+    def removeListener(self, callback):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    def receive(self, packet):
+        """Handle the LAN_LOCONET_Z21_RX, LAN_LOCONET_Z21_TX or LAN_LOCONET_FROM_LAN @packet. Can be used directly
+        as subscriber of the Z21 receiver. Answer the LocoNetMessage, None if its checksum is wrong."""
+        self.received += 1
+        message = decodeLocoNet(bytes(packet[4:]))
+        if not message.valid:
+            self.errors += 1
+            return None
+        self.apply(message)
+        return message
+
+    def receiveDetector(self, packet):
+        """Handle the LAN_LOCONET_DETECTOR @packet. Can be used directly as subscriber of the Z21 receiver.
+        Occupancy reports update self.occupancy, all reports go to the listeners. Answer the LocoNetDetector."""
+        self.received += 1
+        message = LocoNetDetector(bytes(packet))
+        if message.type == message.OCCUPANCY:
+            self.occupancy.set(message.address, message.occupied)
+        for callback in self.listeners:
+            callback(message)
+        return message
+
+    def apply(self, message, t=None):
+        """Update the slots and the occupancy with @message and call the listeners."""
+        if isinstance(message, InputReport):
+            self.occupancy.set(message.address, message.occupied, t)
+        else:
+            self.slots.update(message, t)
+        for callback in self.listeners:
+            callback(message)
+
+    def send(self, data):
+        """Send the LocoNet message @data (including the checksum, see locoNetMessage) onto the bus.
+        The Z21 does not echo the message to this client, so it is applied here as if it was received."""
+        message = decodeLocoNet(bytes(data))
+        if not message.valid:
+            raise ValueError(f'Invalid LocoNet message {bytes(data).hex(" ")}')
+        self.z21.sendLocoNet(message.data)
+        self.apply(message)
+
+    def requestSlot(self, slot):
+        """Ask the command station for the data of @slot. The OPC_SL_RD_DATA answer updates self.slots."""
+        self.send(locoNetMessage(OPC_RQ_SL_DATA, slot, 0))
+
+    def requestAddress(self, address):
+        """Ask the command station for the slot of loco @address. The OPC_SL_RD_DATA answer updates self.slots."""
+        self.send(locoNetMessage(OPC_LOCO_ADR, (address >> 7) & 0x7F, address & 0x7F))
+
+    def power(self, on):
+        """Switch the power of the whole LocoNet (and the Z21 tracks) on or off."""
+        self.send(locoNetMessage(OPC_GPON if on else OPC_GPOFF))
+
+if __name__ == '__main__':
+    import doctest
+    import sys
+    sys.exit(doctest.testmod()[0])
@@ -0,0 +1,167 @@
+# -*- coding: UTF-8 -*-
+# ------------------------------------------------------------------------------
+#     Copyright (c) 2023+ TYPETR
+#     Usage by MIT License
+# ..............................................................................
+#
+#    TYPETR z21locostate.py
+#
+#   Live cache of the state of all locos, by loco address.
+#
+#   Every LAN_X_LOCO_INFO packet that arrives (reply to LAN_X_GET_LOCO_INFO or broadcast) is stored
+#   as LocoInfo message. The Z21 class subscribes the cache to the receiver, so the state of the whole
+#   fleet can be read without a round-trip to the Z21/DR5000:
+#
+#       z21.locos[3].speed
+#       z21.locos.snapshot() # {address: {'speed': ..., 'functions': ..., ...}, ...}
+#
+#   Note that the Z21 only sends the broadcasts of locos that this client asked LAN_X_GET_LOCO_INFO for,
+#   with broadcast flag 0x00000001 set. Z21: 4.4
+#
+#   The cache also remembers the function values that this client sent, so the Z21 class can skip
+#   sending functions that are already in the wanted state. A received state that disagrees with a sent
+#   value may be older than the send, so then the value becomes unknown and it is sent again next time.
+#
+import threading
+
+from z21messages import LocoInfo
+
+ALL_FUNCTIONS = 0xFFFFFFFF # F0-F31
+
+class LocoStateCache:
+    """Thread-safe dictionary of loco address --> last received LocoInfo message.
+    The packets are copied, as the memoryview of the Receiver is only valid for one datagram.
+
+    >>> cache = LocoStateCache()
+    >>> changed = []
+    >>> cache.addListener(changed.append)
+    >>> info = cache.update(memoryview(bytes((0x0E, 0, 0x40, 0, 0xEF, 0, 0x03, 4, 0x95, 0x10, 0, 0, 0, 0x6D))))
+    >>> 3 in cache, cache[3].speed, cache[3].function(0), len(changed)
+    (True, 20, True, 1)
+    >>> cache.update(info.packet) is info, len(changed) # Same state, no change
+    (True, 1)
+    >>> cache.get(4) is None, cache.addresses()
+    (True, [3])
+    >>> cache.snapshot()[3]['forward']
+    True
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.states = {} # Loco address --> LocoInfo
+        self.sentFunctions = {} # Loco address --> [function bits, sent mask, doubt mask]
+        self.listeners = []
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {len(self)} locos>'
+
+    def __len__(self):
+        return len(self.states)
+
+    def __contains__(self, address):
+        return address in self.states
+
+    def __getitem__(self, address):
+        return self.states[address]
+
+    def get(self, address, default=None):
+        """Answer the last LocoInfo of @address, or @default if nothing was received for it yet."""
+        return self.states.get(address, default)
+
+    def addresses(self):
+        """Answer the sorted list of loco addresses that have a known state."""
+        with self.lock:
+            return sorted(self.states)
+
+    def snapshot(self):
+        """Answer the decoded state of all locos as dictionary address --> dict of the LocoInfo fields."""
+        with self.lock:
+            states = list(self.states.values())
+        return {info.address: info.asDict() for info in states}
+
+    def addListener(self, callback):
+        """Call @callback(info) with the new LocoInfo, every time that a loco state is received.
+        Note that the callback is called from the receiver thread."""
+        self.listeners.append(callback)
+
+    def removeListener(self, callback):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    def update(self, packet):
+        """Store the LAN_X_LOCO_INFO @packet and answer its LocoInfo message.
+        Can be used directly as subscriber of the Z21 receiver. Listeners are only called if the state
+        of the loco changed, so replies and repeated broadcasts of the same state are ignored."""
+        info = LocoInfo(bytes(packet))
+        with self.lock:
+            previous = self.states.get(info.address)
+            if previous is not None and previous.packet == info.packet:
+                return previous
+            self.states[info.address] = info
+            sent = self.sentFunctions.get(info.address)
+            if sent is not None:
+                disagree = (sent[0] ^ info.functions) & sent[1]
+                sent[1] &= ~disagree
+                sent[2] |= disagree
+        for callback in self.listeners:
+            callback(info)
+        return info
+
+    def clear(self):
+        with self.lock:
+            self.states.clear()
+            self.sentFunctions.clear()
+
+    #   F U N C T I O N S
+
+    def functionState(self, address):
+        """Answer the tuple (bits, known) of the functions of loco @address, where bit n is Fn.
+        Only the values of the functions in the @known bitmap are known: sent by this client or received.
+
+        >>> cache = LocoStateCache()
+        >>> cache.functionState(3)
+        (0, 0)
+        >>> cache.setFunctions(3, 0b101, 0b111); cache.functionState(3)
+        (5, 7)
+        >>> info = cache.update(bytes((0x0E, 0, 0x40, 0, 0xEF, 0, 0x03, 4, 0x80, 0x02, 0, 0, 0, 0))) # F0 off, F2 on
+        >>> bits, known = cache.functionState(3)
+        >>> bits & 0b111, hex(known) # F0 disagrees with the sent value, so it is unknown.
+        (4, '0xfffffffe')
+        >>> cache.setFunctions(3, 0b001, 0b001); hex(cache.functionState(3)[1])
+        '0xffffffff'
+        """
+        with self.lock:
+            info = self.states.get(address)
+            if info is None:
+                bits, known = 0, 0
+            else:
+                bits, known = info.functions, ALL_FUNCTIONS
+            sent = self.sentFunctions.get(address)
+            if sent is not None:
+                sentBits, sentMask, doubt = sent
+                bits = (bits & ~sentMask) | (sentBits & sentMask)
+                known = (known | sentMask) & ~doubt
+            return bits, known
+
+    def setFunctions(self, address, bits, mask):
+        """Remember that the functions in @mask of loco @address were sent with the values in @bits."""
+        with self.lock:
+            sent = self.sentFunctions.get(address)
+            if sent is None:
+                sent = self.sentFunctions[address] = [0, 0, 0]
+            sent[0] = (sent[0] & ~mask) | (bits & mask)
+            sent[1] |= mask
+            sent[2] &= ~mask
+
+    def forgetFunctions(self, address, mask=ALL_FUNCTIONS):
+        """Make the functions in @mask of loco @address unknown, so they are sent next time."""
+        with self.lock:
+            sent = self.sentFunctions.get(address)
+            if sent is None:
+                sent = self.sentFunctions[address] = [0, 0, 0]
+            sent[1] &= ~mask
+            sent[2] |= mask
+
+if __name__ == '__main__':
+    import doctest
+    import sys
+    sys.exit(doctest.testmod()[0])
@@ -0,0 +1,880 @@
+# -*- coding: UTF-8 -*-
+# ------------------------------------------------------------------------------
+#     Copyright (c) 2023+ TYPETR
+#     Usage by MIT License
+# ..............................................................................
+#
+#    TYPETR z21messages.py
+#
+#   Decoding of the packets that the Z21/DR5000 sends to the client.
+#
+#   decode(packet) answers a message object for the packet, selected by its header (and X-header).
+#   The message classes only hold a reference to the packet (a memoryview slice of the datagram,
+#   as the Receiver delivers it), using __slots__. Their fields are properties that read the values
+#   with precompiled struct.unpack_from at the offset of the Z21 protocol. Nothing is sliced or copied
+#   and bit fields are only decoded when they are asked for. This keeps the decoding of high-rate
+#   broadcast streams cheap, in time and in garbage.
+#
+#   Offsets are from the start of the packet, including the 4 byte length/header.
+#   "Z21:" is referencing to the chapters in the z21-lan-protokoll-en.pdf manual.
+#
+import struct
+
+from z21broadcast import BroadcastFlags
+
+UINT16_LE = struct.Struct('<H')
+INT16_LE = struct.Struct('<h')
+UINT16_BE = struct.Struct('>H')
+UINT32_LE = struct.Struct('<I')
+
+def bcd(value):
+    """Answer the integer of the binary coded decimal @value.
+
+    >>> bcd(0x0142)
+    142
+    """
+    return int('%x' % value)
+
+#   M E S S A G E
+
+class Message:
+    """Base class of all decoded Z21 messages. FIELDS is the list of property names that are shown
+    in __repr__ and answered by asDict()."""
+    __slots__ = ('packet',)
+    NAME = 'LAN_UNKNOWN'
+    FIELDS = ()
+
+    def __init__(self, packet):
+        self.packet = packet
+
+    def __repr__(self):
+        fields = ' '.join(f'{name}={getattr(self, name)}' for name in self.FIELDS)
+        return f'<{self.__class__.__name__} {fields}>'
+
+    def asDict(self):
+        """Answer all FIELDS decoded into a dictionary."""
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    def _get_header(self):
+        return UINT16_LE.unpack_from(self.packet, 2)[0]
+    header = property(_get_header)
+
+class UnknownMessage(Message):
+    __slots__ = ()
+    FIELDS = ('header',)
+
+#   Z 2 1 :  2  S Y S T E M ,  S T A T U S ,  V E R S I O N S
+
+class SerialNumber(Message):
+    """0x08 0x00 0x10 0x00 SerialNumber(32 bits, little-endian). Z21: 2.1"""
+    __slots__ = ()
+    NAME = 'LAN_GET_SERIAL_NUMBER'
+    FIELDS = ('serialNumber',)
+
+    def _get_serialNumber(self):
+        return UINT32_LE.unpack_from(self.packet, 4)[0]
+    serialNumber = property(_get_serialNumber)
+
+class Version(Message):
+    """0x09 0x00 0x40 0x00 0x63 0x21 XBus_Ver CMDST_ID XOR. Z21: 2.3"""
+    __slots__ = ()
+    NAME = 'LAN_X_GET_VERSION'
+    FIELDS = ('xBusVersion', 'commandStationId')
+
+    def _get_xBusVersion(self):
+        return '%x.%x' % divmod(self.packet[6], 16) # BCD, 0x30 = V3.0
+    xBusVersion = property(_get_xBusVersion)
+
+    def _get_commandStationId(self):
+        return self.packet[7] # 0x12 = Z21 device family
+    commandStationId = property(_get_commandStationId)
+
+class BcMessage(Message):
+    """0x07 0x00 0x40 0x00 0x61 DB0 XOR. LAN_X_BC_TRACK_POWER_OFF (DB0=0x00), LAN_X_BC_TRACK_POWER_ON (0x01),
+    LAN_X_BC_PROGRAMMING_MODE (0x02), LAN_X_BC_TRACK_SHORT_CIRCUIT (0x08), LAN_X_UNKNOWN_COMMAND (0x82). Z21: 2.7-2.11"""
+    __slots__ = ()
+    NAME = 'LAN_X_BC'
+    FIELDS = ('db0',)
+
+    def _get_db0(self):
+        return self.packet[5]
+    db0 = property(_get_db0)
+
+class BcTrackPower(BcMessage):
+    """Broadcast of the track power state: LAN_X_BC_TRACK_POWER_OFF, _ON, _PROGRAMMING_MODE or _SHORT_CIRCUIT.
+
+    >>> m = decode(bytes((0x07, 0, 0x40, 0, 0x61, 0x01, 0x60)))
+    >>> m.trackPowerOn, m.shortCircuit
+    (True, False)
+    """
+    __slots__ = ()
+    NAME = 'LAN_X_BC_TRACK_POWER'
+    FIELDS = ('trackPowerOn', 'programmingMode', 'shortCircuit')
+
+    def _get_trackPowerOn(self):
+        return self.packet[5] == 0x01
+    trackPowerOn = property(_get_trackPowerOn)
+
+    def _get_programmingMode(self):
+        return self.packet[5] == 0x02
+    programmingMode = property(_get_programmingMode)
+
+    def _get_shortCircuit(self):
+        return self.packet[5] == 0x08
+    shortCircuit = property(_get_shortCircuit)
+
+class UnknownCommand(BcMessage):
+    """LAN_X_UNKNOWN_COMMAND, the Z21 did not understand the command. Z21: 2.11"""
+    __slots__ = ()
+    NAME = 'LAN_X_UNKNOWN_COMMAND'
+    FIELDS = ()
+
+class CvNack(BcMessage):
+    """LAN_X_CV_NACK_SC (DB0=0x12, short circuit) or LAN_X_CV_NACK (DB0=0x13, no acknowledge). Z21: 6.3, 6.4"""
+    __slots__ = ()
+    NAME = 'LAN_X_CV_NACK'
+    FIELDS = ('shortCircuit',)
+
+    def _get_shortCircuit(self):
+        return self.packet[5] == 0x12
+    shortCircuit = property(_get_shortCircuit)
+
+class StatusChanged(Message):
+    """0x08 0x00 0x40 0x00 0x62 0x22 Status XOR. Z21: 2.12
+
+    >>> m = decode(bytes((0x08, 0, 0x40, 0, 0x62, 0x22, 0x02, 0x40)))
+    >>> m.csTrackVoltageOff, m.csEmergencyStop
+    (True, False)
+    """
+    __slots__ = ()
+    NAME = 'LAN_X_STATUS_CHANGED'
+    FIELDS = ('csEmergencyStop', 'csTrackVoltageOff', 'csShortCircuit', 'csProgrammingModeActive')
+
+    def _get_status(self):
+        return self.packet[6]
+    status = property(_get_status)
+
+    def _get_csEmergencyStop(self):
+        return bool(self.packet[6] & 0x01) # The emergency stop is switched on
+    csEmergencyStop = property(_get_csEmergencyStop)
+
+    def _get_csTrackVoltageOff(self):
+        return bool(self.packet[6] & 0x02) # The track voltage is switched off
+    csTrackVoltageOff = property(_get_csTrackVoltageOff)
+
+    def _get_csShortCircuit(self):
+        return bool(self.packet[6] & 0x04) # Short-circuit
+    csShortCircuit = property(_get_csShortCircuit)
+
+    def _get_csProgrammingModeActive(self):
+        return bool(self.packet[6] & 0x20) # The programming mode is active
+    csProgrammingModeActive = property(_get_csProgrammingModeActive)
+
+class BcStopped(Message):
+    """0x07 0x00 0x40 0x00 0x81 0x00 XOR. LAN_X_BC_STOPPED, emergency stop of all locos. Z21: 2.14"""
+    __slots__ = ()
+    NAME = 'LAN_X_BC_STOPPED'
+
+class FirmwareVersion(Message):
+    """0x09 0x00 0x40 0x00 0xF3 0x0A V_MSB V_LSB XOR, version in BCD. Z21: 2.15
+
+    >>> decode(bytes((0x09, 0, 0x40, 0, 0xF3, 0x0A, 0x01, 0x43, 0xBB))).firmwareVersion
+    '1.43'
+    """
+    __slots__ = ()
+    NAME = 'LAN_X_GET_FIRMWARE_VERSION'
+    FIELDS = ('firmwareVersion',)
+
+    def _get_firmwareVersion(self):
+        return '%x.%02x' % (self.packet[6], self.packet[7])
+    firmwareVersion = property(_get_firmwareVersion)
+
+class BroadcastFlagsInfo(Message):
+    """0x08 0x00 0x51 0x00 Broadcast-Flags(32 bits, little-endian). Z21: 2.17
+    The flags are answered as BroadcastFlags, see z21broadcast.py.
+
+    >>> decode(bytes((0x08, 0, 0x51, 0, 0x01, 0x01, 0, 0))).flags == BroadcastFlags.DRIVING_SWITCHING | BroadcastFlags.SYSTEM_STATE
+    True
+    """
+    __slots__ = ()
+    NAME = 'LAN_GET_BROADCASTFLAGS'
+    FIELDS = ('flags',)
+
+    def _get_flags(self):
+        return BroadcastFlags(UINT32_LE.unpack_from(self.packet, 4)[0])
+    flags = property(_get_flags)
+
+class SystemState(Message):
+    """0x14 0x00 0x84 0x00 followed by 16 bytes SystemState. Z21: 2.18
+    All values are little-endian. Currents in mA, temperature in °C, voltages in mV.
+
+    >>> packet = struct.pack('<HH6hBBBB', 0x14, 0x84, 120, 0, 110, 35, 18000, 16000, 0x02, 0x00, 0, 0x79)
+    >>> state = decode(packet)
+    >>> state.mainCurrent, state.temperature, state.supplyVoltage
+    (120, 35, 18000)
+    >>> state.csTrackVoltageOff, state.capRailCom, state.capabilities
+    (True, True, 121)
+    """
+    __slots__ = ()
+    NAME = 'LAN_SYSTEMSTATE_DATACHANGED'
+    FIELDS = ('mainCurrent', 'progCurrent', 'filteredMainCurrent', 'temperature', 'supplyVoltage', 'vccVoltage',
+        'csEmergencyStop', 'csTrackVoltageOff', 'csShortCircuit', 'csProgrammingModeActive',
+        'cseHighTemperature', 'csePowerLost', 'cseShortCircuitExternal', 'cseShortCircuitInternal', 'cseRCN213',
+        'capDCC', 'capMM', 'capRailCom', 'capLocoCmds', 'capAccessoryCmds', 'capDetectorCmds', 'capNeedsUnlockCode')
+
+    def _get_mainCurrent(self):
+        return INT16_LE.unpack_from(self.packet, 4)[0] # mA, Current on the main track
+    mainCurrent = property(_get_mainCurrent)
+
+    def _get_progCurrent(self):
+        return INT16_LE.unpack_from(self.packet, 6)[0] # mA, Current on programming track
+    progCurrent = property(_get_progCurrent)
+
+    def _get_filteredMainCurrent(self):
+        return INT16_LE.unpack_from(self.packet, 8)[0] # mA, smoothed current on the main track
+    filteredMainCurrent = property(_get_filteredMainCurrent)
+
+    def _get_temperature(self):
+        return INT16_LE.unpack_from(self.packet, 10)[0] # °C, command station internal temperature
+    temperature = property(_get_temperature)
+
+    def _get_supplyVoltage(self):
+        return UINT16_LE.unpack_from(self.packet, 12)[0] # mV, supply voltage
+    supplyVoltage = property(_get_supplyVoltage)
+
+    def _get_vccVoltage(self):
+        return UINT16_LE.unpack_from(self.packet, 14)[0] # mV, internal voltage, identical to track voltage
+    vccVoltage = property(_get_vccVoltage)
+
+    # Bitmask for CentralState
+
+    def _get_centralState(self):
+        return self.packet[16]
+    centralState = property(_get_centralState)
+
+    def _get_csEmergencyStop(self):
+        return bool(self.packet[16] & 0x01) # The emergency stop is switched on
+    csEmergencyStop = property(_get_csEmergencyStop)
+
+    def _get_csTrackVoltageOff(self):
+        return bool(self.packet[16] & 0x02) # The track voltage is switched off
+    csTrackVoltageOff = property(_get_csTrackVoltageOff)
+
+    def _get_csShortCircuit(self):
+        return bool(self.packet[16] & 0x04) # Short-circuit
+    csShortCircuit = property(_get_csShortCircuit)
+
+    def _get_csProgrammingModeActive(self):
+        return bool(self.packet[16] & 0x20) # The programming mode is active
+    csProgrammingModeActive = property(_get_csProgrammingModeActive)
+
+    # Bitmask for CentralStateEx
+
+    def _get_centralStateEx(self):
+        return self.packet[17]
+    centralStateEx = property(_get_centralStateEx)
+
+    def _get_cseHighTemperature(self):
+        return bool(self.packet[17] & 0x01) # Temperature too high
+    cseHighTemperature = property(_get_cseHighTemperature)
+
+    def _get_csePowerLost(self):
+        return bool(self.packet[17] & 0x02) # Input voltage too low
+    csePowerLost = property(_get_csePowerLost)
+
+    def _get_cseShortCircuitExternal(self):
+        return bool(self.packet[17] & 0x04) # S.C. at the external booster output
+    cseShortCircuitExternal = property(_get_cseShortCircuitExternal)
+
+    def _get_cseShortCircuitInternal(self):
+        return bool(self.packet[17] & 0x08) # S.C. at the main track or programming track
+    cseShortCircuitInternal = property(_get_cseShortCircuitInternal)
+
+    def _get_cseRCN213(self):
+        return bool(self.packet[17] & 0x20) # Turnout addresses according to RCN-213
+    cseRCN213 = property(_get_cseRCN213)
+
+    # Bitmask for Capabilities
+    # If capabilities == 0, then it can be assumed that the device has an older firmware version.
+    # The capabilities should not be evaluated when using older firmware versions!
+
+    def _get_capabilities(self):
+        return self.packet[19]
+    capabilities = property(_get_capabilities)
+
+    def _get_capDCC(self):
+        return bool(self.packet[19] & 0x01) # Capable of DCC
+    capDCC = property(_get_capDCC)
+
+    def _get_capMM(self):
+        return bool(self.packet[19] & 0x02) # Capable of MM
+    capMM = property(_get_capMM)
+
+    def _get_capRailCom(self):
+        return bool(self.packet[19] & 0x08) # Railcom is active
+    capRailCom = property(_get_capRailCom)
+
+    def _get_capLocoCmds(self):
+        return bool(self.packet[19] & 0x10) # Accepts LAN commands for locomotive decoders
+    capLocoCmds = property(_get_capLocoCmds)
+
+    def _get_capAccessoryCmds(self):
+        return bool(self.packet[19] & 0x20) # Accepts LAN commands for assessory decoders
+    capAccessoryCmds = property(_get_capAccessoryCmds)
+
+    def _get_capDetectorCmds(self):
+        return bool(self.packet[19] & 0x40) # Accepts LAN commands for detectors
+    capDetectorCmds = property(_get_capDetectorCmds)
+
+    def _get_capNeedsUnlockCode(self):
+        return bool(self.packet[19] & 0x80) # Device needs activate code (z21start)
+    capNeedsUnlockCode = property(_get_capNeedsUnlockCode)
+
+class HwInfo(Message):
+    """0x0C 0x00 0x1A 0x00 HwType(32 bits) FW Version(32 bits, BCD), little-endian. Z21: 2.20
+
+    >>> m = decode(bytes((0x0C, 0, 0x1A, 0, 0x01, 0x02, 0, 0, 0x43, 0x01, 0, 0)))
+    >>> '0x%04x' % m.hwType, m.firmwareVersion
+    ('0x0201', '1.43')
+    """
+    __slots__ = ()
+    NAME = 'LAN_GET_HWINFO'
+    FIELDS = ('hwType', 'fwVersion')
+
+    def _get_hwType(self):
+        return UINT32_LE.unpack_from(self.packet, 4)[0]
+    hwType = property(_get_hwType)
+
+    def _get_fwVersion(self):
+        return UINT32_LE.unpack_from(self.packet, 8)[0] # BCD, 0x0143 = V1.43
+    fwVersion = property(_get_fwVersion)
+
+    def _get_firmwareVersion(self):
+        return '%x.%02x' % divmod(self.fwVersion, 0x100)
+    firmwareVersion = property(_get_firmwareVersion)
+
+class Code(Message):
+    """0x05 0x00 0x18 0x00 Code(8 bits). Z21: 2.21"""
+    __slots__ = ()
+    NAME = 'LAN_GET_CODE'
+    FIELDS = ('code',)
+
+    def _get_code(self):
+        return self.packet[4]
+    code = property(_get_code)
+
+#   Z 2 1 :  3  S E T T I N G S
+
+class LocoMode(Message):
+    """0x07 0x00 0x60 0x00 LocoAddress(16 bits, big-endian) Mode. Z21: 3.1"""
+    __slots__ = ()
+    NAME = 'LAN_GET_LOCOMODE'
+    FIELDS = ('address', 'mode')
+
+    def _get_address(self):
+        return UINT16_BE.unpack_from(self.packet, 4)[0]
+    address = property(_get_address)
+
+    def _get_mode(self):
+        return self.packet[6] # 0 = DCC, 1 = MM
+    mode = property(_get_mode)
+
+class TurnoutMode(LocoMode):
+    """0x07 0x00 0x70 0x00 AccessoryDecoderAddress(16 bits, big-endian) Mode. Z21: 3.3"""
+    __slots__ = ()
+    NAME = 'LAN_GET_TURNOUTMODE'
+
+#   Z 2 1 :  4  D R I V I N G
+
+class LocoInfo(Message):
+    """0x40 0x00 0xEF Adr_MSB Adr_LSB DB2 DB3 DB4 DB5 ... XOR, with 7 ≤ n ≤ 14 data bytes. Z21: 4.4
+    Loco address = (Adr_MSB & 0x3F) << 8 + Adr_LSB
+    DB2 = 0000BKKK  B = busy (controlled by another X-BUS device), KKK = 0: 14, 2: 28, 4: 128 speed steps
+    DB3 = RVVVVVVV  R = forward, V = speed in the format of the speed steps
+    DB4 = 0DSLFGHJ  D = double traction, S = smart search, L = F0, F = F4, G = F3, H = F2, J = F1
+    DB5 = F5..F12, DB6 = F13..F20, DB7 = F21..F28, DB8 = F29..F31 (from FW 1.42), lowest bit first.
+    Missing function bytes (shorter packets of older firmware) read as 0.
+    The speed is the DCC speed step, 0 for stop and emergency stop. Note that locoDrive(loco, speed)
+    sends 128 steps as speed+1 for speed > 1, so the decoded speed is the same as the speed that was set.
+
+    >>> m = decode(bytes((0x0E, 0, 0x40, 0, 0xEF, 0xC1, 0x03, 4, 0x80, 0, 0, 0, 0, 0xA9)))
+    >>> m.address, m.speedSteps, m.forward, m.speed
+    (259, 128, True, 0)
+    >>> m = decode(bytes((0x0F, 0, 0x40, 0, 0xEF, 0, 0x03, 0x0C, 0xB3, 0x52, 0x01, 0, 0x80, 0x04, 0x84)))
+    >>> m
+    <LocoInfo address=3 busy=True speedSteps=128 forward=True speed=50 emergencyStop=False functions=0x90000025 doubleTraction=True smartSearch=False>
+    >>> m.function(0), m.function(1), m.function(2), m.function(28), m.function(31)
+    (True, False, True, True, True)
+    >>> m = decode(bytes((0x0E, 0, 0x40, 0, 0xEF, 0, 0x05, 0x02, 0x13, 0, 0, 0, 0, 0xFB))) # 28 steps
+    >>> m.speedSteps, m.forward, m.speed
+    (28, False, 4)
+    """
+    __slots__ = ()
+    NAME = 'LAN_X_LOCO_INFO'
+    FIELDS = ('address', 'busy', 'speedSteps', 'forward', 'speed', 'emergencyStop', 'functions',
+        'doubleTraction', 'smartSearch')
+
+    SPEED_STEPS = {0: 14, 2: 28, 4: 128} # KKK in DB2 --> number of speed steps
+
+    def __repr__(self):
+        # Same as Message.__repr__, but with the function bitmap in hex.
+        fields = ' '.join(f'{name}=0x{value:08X}' if name == 'functions' else f'{name}={value}'
+            for name, value in self.asDict().items())
+        return f'<{self.__class__.__name__} {fields}>'
+
+    def _get_address(self):
+        return UINT16_BE.unpack_from(self.packet, 5)[0] & 0x3FFF
+    address = property(_get_address)
+
+    def _get_busy(self):
+        return bool(self.packet[7] & 0x08)
+    busy = property(_get_busy)
+
+    def _get_speedSteps(self):
+        return self.SPEED_STEPS.get(self.packet[7] & 0x07, 128)
+    speedSteps = property(_get_speedSteps)
+
+    def _get_forward(self):
+        return bool(self.packet[8] & 0x80)
+    forward = property(_get_forward)
+
+    def _get_speedCode(self):
+        """Answer the speed value in DCC format, 0 = stop, 1 = emergency stop (2 and 3 for 28 steps)."""
+        v = self.packet[8]
+        if self.packet[7] & 0x07 == 2: # 28 steps: 0 0 V0 V4 V3 V2 V1, where V0 is the intermediate step.
+            return ((v & 0x0F) << 1) | ((v >> 4) & 0x01)
+        return v & 0x7F
+    speedCode = property(_get_speedCode)
+
+    def _get_speed(self):
+        code = self.speedCode
+        if self.packet[7] & 0x07 == 2:
+            return max(0, code - 3)
+        return max(0, code - 1)
+    speed = property(_get_speed)
+
+    def _get_emergencyStop(self):
+        code = self.speedCode
+        if self.packet[7] & 0x07 == 2:
+            return code in (2, 3)
+        return code == 1
+    emergencyStop = property(_get_emergencyStop)
+
+    def _get_doubleTraction(self):
+        return bool(self.packet[9] & 0x40)
+    doubleTraction = property(_get_doubleTraction)
+
+    def _get_smartSearch(self):
+        return bool(self.packet[9] & 0x20)
+    smartSearch = property(_get_smartSearch)
+
+    def _get_functions(self):
+        """Answer the state of F0..F31 as integer bitmap, where bit n is Fn."""
+        packet = self.packet
+        db4 = packet[9]
+        functions = ((db4 >> 4) & 0x01) | ((db4 & 0x0F) << 1)
+        end = len(packet) - 1 # Skip the XOR
+        for index, shift, mask in ((10, 5, 0xFF), (11, 13, 0xFF), (12, 21, 0xFF), (13, 29, 0x07)):
+            if index >= end:
+                break
+            functions |= (packet[index] & mask) << shift
+        return functions
+    functions = property(_get_functions)
+
+    def function(self, index):
+        """Answer the boolean state of function F@index."""
+        return bool(self.functions >> index & 1)
+
+#   Z 2 1 :  5  S W I T C H I N G
+
+class TurnoutInfo(Message):
+    """0x09 0x00 0x40 0x00 0x43 FAdr_MSB FAdr_LSB 000000ZZ XOR. Z21: 5.3
+    ZZ = 00 not switched yet, 01 output 1, 10 output 2, 11 invalid.
+
+    >>> m = decode(bytes((0x09, 0, 0x40, 0, 0x43, 0, 0x01, 0x02, 0x40)))
+    >>> m.address, m.state
+    (1, 2)
+    """
+    __slots__ = ()
+    NAME = 'LAN_X_TURNOUT_INFO'
+    FIELDS = ('address', 'state')
+
+    def _get_address(self):
+        return UINT16_BE.unpack_from(self.packet, 5)[0]
+    address = property(_get_address)
+
+    def _get_state(self):
+        return self.packet[7] & 0x03
+    state = property(_get_state)
+
+#   Z 2 1 :  6  R E A D I N G  A N D  W R I T I N G  D E C O D E R  C V S
+
+class CvResult(Message):
+    """0x0A 0x00 0x40 0x00 0x64 0x14 CVAdr_MSB CVAdr_LSB Value XOR. Z21: 6.5
+    Note that cvId is the true CV number: CV-Address + 1.
+
+    >>> m = decode(bytes((0x0A, 0, 0x40, 0, 0x64, 0x14, 0, 0x02, 13, 0x7F)))
+    >>> m.cvId, m.value
+    (3, 13)
+    """
+    __slots__ = ()
+    NAME = 'LAN_X_CV_RESULT'
+    FIELDS = ('cvId', 'value')
+
+    def _get_cvId(self):
+        return UINT16_BE.unpack_from(self.packet, 6)[0] + 1
+    cvId = property(_get_cvId)
+
+    def _get_value(self):
+        return self.packet[8]
+    value = property(_get_value)
+
+#   Z 2 1 :  7  F E E D B A C K  -  R - B U S
+
+class RmBusData(Message):
+    """0x0F 0x00 0x80 0x00 GroupIndex Feedback status (10 bytes). LAN_RMBUS_DATACHANGED, also the reply to
+    LAN_RMBUS_GETDATA. Group index 0 has the modules 1-10, group index 1 the modules 11-20. Each byte is a
+    module, bit 0 is input 1. Z21: 7.1
+
+    >>> m = decode(bytes((0x0F, 0, 0x80, 0, 1, 0x01, 0, 0, 0, 0, 0, 0, 0, 0, 0x80)))
+    >>> m.groupIndex, m.firstModule, m.module(11), m.module(20)
+    (1, 11, 1, 128)
+    """
+    __slots__ = ()
+    NAME = 'LAN_RMBUS_DATACHANGED'
+    FIELDS = ('groupIndex', 'status')
+
+    GROUP_MODULES = 10
+
+    def _get_groupIndex(self):
+        return self.packet[4]
+    groupIndex = property(_get_groupIndex)
+
+    def _get_firstModule(self):
+        """Answer the number of the module of the first status byte."""
+        return self.packet[4] * self.GROUP_MODULES + 1
+    firstModule = property(_get_firstModule)
+
+    def _get_status(self):
+        """Answer the 10 status bytes, one per module."""
+        return bytes(self.packet[5:15])
+    status = property(_get_status)
+
+    def module(self, module):
+        """Answer the status byte of @module (1-20), if it is in the group of this message."""
+        return self.packet[5 + module - self.firstModule]
+
+#   Z 2 1 :  8  R A I L C O M
+
+class RailComData(Message):
+    """0x11 0x00 0x88 0x00 LocoAddress(16) ReceiveCounter(32) ErrorCounter(16) reserved Options Speed QoS reserved.
+    LAN_RAILCOM_DATACHANGED, also the reply to LAN_RAILCOM_GETDATA. All values are little-endian. Z21: 8.1
+
+    >>> m = decode(struct.pack('<HHHIHxBBBx', 0x11, 0x88, 3, 1000, 2, 0x05, 40, 98))
+    >>> m.address, m.receiveCounter, m.errorCounter, m.speed, m.qos, m.hasSpeed, m.hasQoS
+    (3, 1000, 2, 40, 98, True, True)
+    """
+    __slots__ = ()
+    NAME = 'LAN_RAILCOM_DATACHANGED'
+    FIELDS = ('address', 'receiveCounter', 'errorCounter', 'options', 'speed', 'qos')
+
+    # Options
+    SPEED1 = 0x01 # Speed of CH7 subindex 0 is valid
+    SPEED2 = 0x02 # Speed of CH7 subindex 1 is valid
+    QOS = 0x04 # QoS of CH7 subindex 7 is valid
+
+    def _get_address(self):
+        return UINT16_LE.unpack_from(self.packet, 4)[0]
+    address = property(_get_address)
+
+    def _get_receiveCounter(self):
+        return UINT32_LE.unpack_from(self.packet, 6)[0] # RailCom packets received
+    receiveCounter = property(_get_receiveCounter)
+
+    def _get_errorCounter(self):
+        return UINT16_LE.unpack_from(self.packet, 10)[0] # RailCom packets received with errors
+    errorCounter = property(_get_errorCounter)
+
+    def _get_options(self):
+        return self.packet[13]
+    options = property(_get_options)
+
+    def _get_speed(self):
+        return self.packet[14] # km/h, if hasSpeed
+    speed = property(_get_speed)
+
+    def _get_qos(self):
+        return self.packet[15] # Quality of service, if hasQoS
+    qos = property(_get_qos)
+
+    def _get_hasSpeed(self):
+        return bool(self.packet[13] & (self.SPEED1 | self.SPEED2))
+    hasSpeed = property(_get_hasSpeed)
+
+    def _get_hasQoS(self):
+        return bool(self.packet[13] & self.QOS)
+    hasQoS = property(_get_hasQoS)
+
+class LocoNetDispatch(Message):
+    """0x07 0x00 0xA3 0x00 LocoAddress(16) Result. LAN_LOCONET_DISPATCH_ADDR, the reply of the Z21 with the slot
+    number that was dispatched for the loco, 0 if that failed. The address is little-endian. Z21: 9.4
+
+    >>> decode(bytes((0x07, 0, 0xA3, 0, 0x03, 0x00, 0x05)))
+    <LocoNetDispatch address=3 slot=5>
+    """
+    __slots__ = ()
+    NAME = 'LAN_LOCONET_DISPATCH_ADDR'
+    FIELDS = ('address', 'slot')
+
+    def _get_address(self):
+        return UINT16_LE.unpack_from(self.packet, 4)[0]
+    address = property(_get_address)
+
+    def _get_slot(self):
+        return self.packet[6] # 0: dispatch failed
+    slot = property(_get_slot)
+
+class LocoNetDetector(Message):
+    """DataLen 0x00 0xA4 0x00 Type FeedbackAddress(16) Info[]. LAN_LOCONET_DETECTOR, the report of a LocoNet
+    occupancy or transponder detector, also the reply to the request of that name. Z21: 9.5
+
+    >>> m = decode(bytes((0x08, 0, 0xA4, 0, 0x01, 0x0D, 0x00, 0x01)))
+    >>> m, m.occupied, m.transponder
+    (<LocoNetDetector type=1 address=13>, True, None)
+    >>> decode(bytes((0x09, 0, 0xA4, 0, 0x02, 0x0D, 0x00, 0x03, 0x00))).transponder
+    3
+    """
+    __slots__ = ()
+    NAME = 'LAN_LOCONET_DETECTOR'
+    FIELDS = ('type', 'address')
+
+    # Report types
+    OCCUPANCY = 0x01 # Info: 0 free, 1 occupied
+    TRANSPONDER_ENTERS = 0x02 # Info: transponder address (16)
+    TRANSPONDER_EXITS = 0x03 # Info: transponder address (16)
+    LISSY_LOCO = 0x10 # Info: loco address (16), class and direction
+    LISSY_BLOCK = 0x11 # Info: block status
+    LISSY_SPEED = 0x12 # Info: speed (16)
+
+    def _get_type(self):
+        return self.packet[4]
+    type = property(_get_type)
+
+    def _get_address(self):
+        return UINT16_LE.unpack_from(self.packet, 5)[0]
+    address = property(_get_address)
+
+    def _get_info(self):
+        return bytes(self.packet[7:])
+    info = property(_get_info)
+
+    def _get_occupied(self):
+        """Answer the occupancy of an OCCUPANCY report, None for the other types."""
+        if self.type != self.OCCUPANCY:
+            return None
+        return bool(self.packet[7] & 0x01)
+    occupied = property(_get_occupied)
+
+    def _get_transponder(self):
+        """Answer the transponder address of a TRANSPONDER_ENTERS/EXITS report, None for the other types."""
+        if self.type not in (self.TRANSPONDER_ENTERS, self.TRANSPONDER_EXITS):
+            return None
+        return UINT16_LE.unpack_from(self.packet, 7)[0]
+    transponder = property(_get_transponder)
+
+class CanDetector(Message):
+    """0x0E 0x00 0xC4 0x00 NId(16) Addr(16) Port Type Value1(16) Value2(16). LAN_CAN_DETECTOR, the report of
+    port 0-7 of a CAN detector module, also the reply to the request of that name. All values are little-endian.
+    Z21: 10.1
+
+    >>> m = decode(bytes((0x0E, 0, 0xC4, 0, 0x01, 0xD0, 5, 0, 2, 0x01, 0x00, 0x11, 0, 0)))
+    >>> m, m.occupied, m.trackVoltage, m.overload
+    (<CanDetector netId=53249 address=5 port=2 type=1 value1=4352>, True, True, 0)
+    """
+    __slots__ = ()
+    NAME = 'LAN_CAN_DETECTOR'
+    FIELDS = ('netId', 'address', 'port', 'type', 'value1')
+
+    # Types
+    OCCUPANCY = 0x01 # Value1: occupancy, track voltage and overload
+    RAILCOM_FIRST = 0x11 # 0x11-0x1F: Value1 and Value2 are the loco addresses found by RailCom in the section.
+    RAILCOM_LAST = 0x1F
+
+    def _get_netId(self):
+        return UINT16_LE.unpack_from(self.packet, 4)[0]
+    netId = property(_get_netId)
+
+    def _get_address(self):
+        return UINT16_LE.unpack_from(self.packet, 6)[0] # Module address
+    address = property(_get_address)
+
+    def _get_port(self):
+        return self.packet[8]
+    port = property(_get_port)
+
+    def _get_type(self):
+        return self.packet[9]
+    type = property(_get_type)
+
+    def _get_value1(self):
+        return UINT16_LE.unpack_from(self.packet, 10)[0]
+    value1 = property(_get_value1)
+
+    def _get_value2(self):
+        return UINT16_LE.unpack_from(self.packet, 12)[0]
+    value2 = property(_get_value2)
+
+    def _get_occupied(self):
+        """Answer the occupancy of an OCCUPANCY report, None for the other types."""
+        if self.type != self.OCCUPANCY:
+            return None
+        return bool(self.value1 & 0x1000)
+    occupied = property(_get_occupied)
+
+    def _get_trackVoltage(self):
+        """Answer True if an OCCUPANCY report has voltage on the track, None for the other types."""
+        if self.type != self.OCCUPANCY:
+            return None
+        return bool(self.value1 & 0x0100)
+    trackVoltage = property(_get_trackVoltage)
+
+    def _get_overload(self):
+        """Answer the overload 1-3 of an OCCUPANCY report, 0 without overload, None for the other types."""
+        if self.type != self.OCCUPANCY:
+            return None
+        return self.value1 & 0x00FF if self.value1 & 0x0200 else 0
+    overload = property(_get_overload)
+
+class CanDeviceDescription(Message):
+    """0x16 0x00 0xC8 0x00 NId(16) Name(16 bytes, zero terminated). LAN_CAN_DEVICE_GET_DESCRIPTION reply.
+    Z21: 10.2.1
+
+    >>> decode(bytes((0x16, 0, 0xC8, 0, 0x01, 0xC1)) + b'Booster 1'.ljust(16, b'\\0'))
+    <CanDeviceDescription netId=49409 name=Booster 1>
+    """
+    __slots__ = ()
+    NAME = 'LAN_CAN_DEVICE_GET_DESCRIPTION'
+    FIELDS = ('netId', 'name')
+
+    def _get_netId(self):
+        return UINT16_LE.unpack_from(self.packet, 4)[0]
+    netId = property(_get_netId)
+
+    def _get_name(self):
+        return bytes(self.packet[6:22]).split(b'\0')[0].decode('latin-1')
+    name = property(_get_name)
+
+class CanBoosterState(Message):
+    """0x0E 0x00 0xCA 0x00 NId(16) OutputPort(16) State(16) VCCVoltage(16) Current(16).
+    LAN_CAN_BOOSTER_SYSTEMSTATE_CHGD, the state of one output of a CAN booster. All values are little-endian.
+    Z21: 10.2.3
+
+    >>> m = decode(struct.pack('<HHHHHHH', 0x0E, 0xCA, 0xC101, 1, 0x0002, 18500, 3200))
+    >>> m, m.shortCircuit, m.trackVoltageOff
+    (<CanBoosterState netId=49409 port=1 state=2 voltage=18500 current=3200>, True, False)
+    """
+    __slots__ = ()
+    NAME = 'LAN_CAN_BOOSTER_SYSTEMSTATE_CHGD'
+    FIELDS = ('netId', 'port', 'state', 'voltage', 'current')
+
+    # State
+    BG_ACTIVE = 0x0001 # Brake generator active
+    SHORT_CIRCUIT = 0x0002
+    TRACK_VOLTAGE_OFF = 0x0100
+    RAILCOM_ACTIVE = 0x0800
+    OUTPUT_DISABLED = 0x1000
+
+    def _get_netId(self):
+        return UINT16_LE.unpack_from(self.packet, 4)[0]
+    netId = property(_get_netId)
+
+    def _get_port(self):
+        return UINT16_LE.unpack_from(self.packet, 6)[0] # Output 1 or 2
+    port = property(_get_port)
+
+    def _get_state(self):
+        return UINT16_LE.unpack_from(self.packet, 8)[0]
+    state = property(_get_state)
+
+    def _get_voltage(self):
+        return UINT16_LE.unpack_from(self.packet, 10)[0] # mV
+    voltage = property(_get_voltage)
+
+    def _get_current(self):
+        return UINT16_LE.unpack_from(self.packet, 12)[0] # mA
+    current = property(_get_current)
+
+    def _get_shortCircuit(self):
+        return bool(self.state & self.SHORT_CIRCUIT)
+    shortCircuit = property(_get_shortCircuit)
+
+    def _get_trackVoltageOff(self):
+        return bool(self.state & self.TRACK_VOLTAGE_OFF)
+    trackVoltageOff = property(_get_trackVoltageOff)
+
+#   D E C O D E R
+
+# LAN_X_BC_... messages share X-header 0x61, DB0 selects the message.
+BC_MESSAGES = {
+    0x00: BcTrackPower, # LAN_X_BC_TRACK_POWER_OFF
+    0x01: BcTrackPower, # LAN_X_BC_TRACK_POWER_ON
+    0x02: BcTrackPower, # LAN_X_BC_PROGRAMMING_MODE
+    0x08: BcTrackPower, # LAN_X_BC_TRACK_SHORT_CIRCUIT
+    0x12: CvNack, # LAN_X_CV_NACK_SC
+    0x13: CvNack, # LAN_X_CV_NACK
+    0x82: UnknownCommand, # LAN_X_UNKNOWN_COMMAND
+}
+
+# LAN_X_... messages (header 0x40) by X-header.
+X_MESSAGES = {
+    0x43: TurnoutInfo,
+    0x62: StatusChanged,
+    0x63: Version,
+    0x64: CvResult,
+    0x81: BcStopped,
+    0xEF: LocoInfo,
+    0xF3: FirmwareVersion,
+}
+
+# All other messages by header.
+MESSAGES = {
+    0x10: SerialNumber,
+    0x18: Code,
+    0x1A: HwInfo,
+    0x51: BroadcastFlagsInfo,
+    0x60: LocoMode,
+    0x70: TurnoutMode,
+    0x80: RmBusData,
+    0x84: SystemState,
+    0x88: RailComData,
+    0xA3: LocoNetDispatch,
+    0xA4: LocoNetDetector,
+    0xC4: CanDetector,
+    0xC8: CanDeviceDescription,
+    0xCA: CanBoosterState,
+}
+
+def decode(packet):
+    """Answer the message object for the @packet (bytes or memoryview of one Z21 packet).
+    Unknown packets answer an UnknownMessage, so the caller can still inspect the header.
+
+    >>> decode(bytes((0x07, 0, 0x40, 0, 0x61, 0x13, 0x72)))
+    <CvNack shortCircuit=False>
+    >>> decode(bytes((0x04, 0, 0x99, 0)))
+    <UnknownMessage header=153>
+    """
+    header = packet[2] | (packet[3] << 8)
+    if header == 0x40:
+        xHeader = packet[4]
+        if xHeader == 0x61:
+            cls = BC_MESSAGES.get(packet[5], BcMessage)
+        else:
+            cls = X_MESSAGES.get(xHeader, UnknownMessage)
+    else:
+        cls = MESSAGES.get(header, UnknownMessage)
+    return cls(packet)
+
+if __name__ == '__main__':
+    import doctest
+    import sys
+    sys.exit(doctest.testmod()[0])
@@ -0,0 +1,145 @@
+# -*- coding: UTF-8 -*-
+# ------------------------------------------------------------------------------
+#     Copyright (c) 2023+ TYPETR
+#     Usage by MIT License
+# ..............................................................................
+#
+#    TYPETR z21pom.py
+#
+#   [Z21.pomSchedule] ---> [PomScheduler] ---(round robin, POM_PER_SECOND)---> [Z21.pomWriteCV] ---> (DCC rails)
+#
+#   Programming on the main (POM) writes the CVs of a loco while it runs on the layout, without moving it
+#   to the programming track. Every POM write is a DCC packet on the rails, that the command station
+#   repeats, so writing a whole profile to a fleet at once would starve the drive commands of the locos.
+#   The PomScheduler keeps the pending writes per loco and sends them round robin, one loco after the
+#   other, at @rate writes per second. A newer value for the same loco and CV replaces the pending one.
+#   Reading by POM needs RailCom: the decoder answers on the rails and the Z21 sends LAN_X_CV_RESULT.
+#
+#       z21.pomScheduleProfile((3, 4, 259), {z21.CV_ACCELERATION: 20, z21.CV_MASTER_VOLUME: 80})
+#       z21.pomScheduler.flush()
+#
+import logging
+import threading
+import time
+from collections import deque
+
+POM_PER_SECOND = 10 # POM writes per second, a small part of the DCC_PACKETS_PER_SECOND of the send queue.
+
+logger = logging.getLogger(__name__)
+
+class PomScheduler(threading.Thread):
+    """Background thread that calls @write(loco, cvId, value) for the scheduled POM writes, round robin over
+    the locos and at most @rate writes per second.
+
+    >>> written = []
+    >>> scheduler = PomScheduler(lambda *args: written.append(args))
+    >>> scheduler.put(3, 3, 20); scheduler.put(3, 4, 10); scheduler.put(4, 3, 20); scheduler.put(3, 3, 25)
+    >>> [scheduler.next() for _ in range(len(scheduler))] # Loco 3 and 4 alternate, CV3 of loco 3 is replaced.
+    [(3, 3, 25), (4, 3, 20), (3, 4, 10)]
+    >>> scheduler.start()
+    >>> scheduler.put(5, 63, 80); scheduler.flush(1), written
+    (True, [(5, 63, 80)])
+    """
+    def __init__(self, write, rate=POM_PER_SECOND):
+        threading.Thread.__init__(self, name='Z21PomScheduler', daemon=True)
+        self.write = write
+        self.rate = rate
+        self.condition = threading.Condition()
+        self.pending = {} # Loco --> dictionary cvId --> value, in order of scheduling.
+        self.order = deque() # Locos with pending writes, the next one first.
+        self.writing = 0 # Number of writes taken from the pending ones, not written yet.
+        self.stopped = False
+        self.written = 0 # Counters
+        self.replaced = 0
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} pending={len(self)} written={self.written} replaced={self.replaced}>'
+
+    def __len__(self):
+        with self.condition:
+            return sum(len(cvs) for cvs in self.pending.values())
+
+    def put(self, loco, cvId, value):
+        """Schedule writing @value to @cvId of @loco. A pending write of the same CV is replaced."""
+        with self.condition:
+            cvs = self.pending.get(loco)
+            if cvs is None:
+                cvs = self.pending[loco] = {}
+                self.order.append(loco)
+            if cvId in cvs:
+                self.replaced += 1
+            cvs[cvId] = value
+            self.condition.notify()
+
+    def next(self):
+        """Answer the next (loco, cvId, value) to write and remove it from the pending writes, None if there are none.
+        The oldest write of the next loco is answered, then the loco goes to the end of the line."""
+        with self.condition:
+            if not self.order:
+                return None
+            loco = self.order.popleft()
+            cvs = self.pending[loco]
+            cvId = next(iter(cvs))
+            value = cvs.pop(cvId)
+            if cvs:
+                self.order.append(loco)
+            else:
+                del self.pending[loco]
+            return loco, cvId, value
+
+    def purge(self, loco=None):
+        """Remove the pending writes of @loco, or of all locos if @loco is None."""
+        with self.condition:
+            if loco is None:
+                self.pending.clear()
+                self.order.clear()
+            elif loco in self.pending:
+                del self.pending[loco]
+                self.order.remove(loco)
+
+    def run(self):
+        condition = self.condition
+        due = time.monotonic()
+        while True:
+            with condition:
+                while not self.order:
+                    if self.stopped:
+                        return
+                    condition.wait()
+                wait = due - time.monotonic()
+                if wait > 0:
+                    condition.wait(wait)
+                    continue
+                write = self.next()
+                self.writing += 1
+            try:
+                self.write(*write)
+            except Exception:
+                logger.exception('Error writing POM %r', write)
+            finally:
+                with condition:
+                    self.writing -= 1
+                    self.written += 1
+                    condition.notify_all() # For flush()
+            due = max(due + 1 / self.rate, time.monotonic() - 1 / self.rate) # No catching up after idle time.
+
+    def flush(self, timeout=None):
+        """Wait until all pending writes are written. Answer False if that did not happen within @timeout seconds."""
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.order and not self.writing, timeout)
+
+    def stop(self, flush=True):
+        """Stop the thread. If @flush is True, the pending writes are written first, at the scheduled rate."""
+        if flush and self.ident is not None:
+            self.flush()
+        with self.condition:
+            self.purge()
+            self.stopped = True
+            self.condition.notify_all()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+if __name__ == '__main__':
+    import doctest
+    import sys
+    sys.exit(doctest.testmod()[0])
@@ -0,0 +1,307 @@
+# -*- coding: UTF-8 -*-
+# ------------------------------------------------------------------------------
+#     Copyright (c) 2023+ TYPETR
+#     Usage by MIT License
+# ..............................................................................
+#
+#    TYPETR z21receiver.py
+#
+#   [Z21] <--- send() ------------- (LAN) ---> [DR5000]
+#   [Z21] <--- Dispatcher <--- Receiver <----- (LAN) ---- [DR5000]
+#
+#   The Receiver is a background thread that reads every UDP datagram that the Z21/DR5000 sends
+#   to this client. A single datagram may hold several concatenated Z21 packets. They are split by their
+#   16 bit length header and handed to the Dispatcher, that routes them by (header, X-header):
+#   either to a pending request that is waiting for the reply, or to the subscribers of broadcast events.
+#
+#   This way broadcasts (LAN_SET_BROADCASTFLAGS) can remain on, without their packets being mistaken
+#   for the reply of a query. And multiple requests can be in flight at the same time.
+#   Each pending request can have a RetryPolicy: the timeout for the reply and the number of times
+#   to resend the command. The deadlines are checked by the Receiver thread.
+#
+import heapq
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from socket import timeout as SocketTimeout
+
+MAX_READ = 1024 # Maximum size of a UDP datagram from the Z21.
+POLL_INTERVAL = 0.2 # Seconds. Interval for the Receiver thread to check if it needs to stop.
+
+LAN_X_HEADER = 0x40 # Header of all LAN_X_... packets. Their X-header is the first byte after the 4 byte header.
+
+logger = logging.getLogger(__name__)
+
+#   P A C K E T  H E L P E R S
+
+def splitPackets(data):
+    """Generate the Z21 packets in the @data datagram. Each packet starts with its own
+    16 bit little-endian length, including the 4 byte length/header itself.
+    Incomplete or malformed trailing data is ignored.
+
+    >>> data = bytes((0x04, 0, 0x10, 0, 0x07, 0, 0x40, 0, 0x61, 0x01, 0x60))
+    >>> [bytes(p) for p in splitPackets(data)]
+    [b'\\x04\\x00\\x10\\x00', b'\\x07\\x00@\\x00a\\x01`']
+    >>> list(splitPackets(bytes((0x08, 0, 0x10, 0))))
+    []
+    """
+    index = 0
+    size = len(data)
+    while index + 4 <= size:
+        length = data[index] | (data[index+1] << 8)
+        if length < 4 or index + length > size:
+            break # Malformed length, skip the rest of the datagram.
+        yield data[index:index+length]
+        index += length
+
+def packetKey(packet):
+    """Answer the (header, xHeader) routing key of the @packet. For LAN_X_... packets the xHeader
+    is the first data byte. For all other packets xHeader is None.
+
+    >>> packetKey(bytes((0x07, 0, 0x40, 0, 0x61, 0x01, 0x60)))
+    (64, 97)
+    >>> packetKey(bytes((0x08, 0, 0x10, 0, 1, 2, 3, 4)))
+    (16, None)
+    """
+    header = packet[2] | (packet[3] << 8)
+    if header == LAN_X_HEADER and len(packet) > 4:
+        return header, packet[4]
+    return header, None
+
+#   R E Q U E S T S
+
+class RetryPolicy:
+    """Defines how long a request waits for its reply and how many times the command is sent again
+    if the reply did not arrive in time. Each retry waits @backoff times longer than the previous one.
+
+    >>> policy = RetryPolicy(timeout=0.5, retries=2, backoff=2)
+    >>> [policy.timeoutFor(attempt) for attempt in range(3)]
+    [0.5, 1.0, 2.0]
+    """
+    def __init__(self, timeout=None, retries=0, backoff=1):
+        self.timeout = timeout # Seconds. None waits forever, without retries.
+        self.retries = retries
+        self.backoff = backoff
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} timeout={self.timeout} retries={self.retries} backoff={self.backoff}>'
+
+    def timeoutFor(self, attempt):
+        """Answer the seconds to wait for the reply of the @attempt, where 0 is the first send."""
+        return self.timeout * self.backoff ** attempt
+
+class PendingRequest:
+    """Request waiting in the Dispatcher for a reply packet with one of the @keys.
+    The optional @match function correlates the reply, e.g. by loco address or CV address.
+    The optional @parse function converts the reply packet into the result of the future.
+    The optional @resend function is called to send the command again on retry.
+    """
+    def __init__(self, keys, match=None, parse=None, resend=None, policy=None):
+        self.future = Future()
+        self.keys = keys
+        self.match = match
+        self.parse = parse
+        self.resend = resend
+        self.policy = policy
+        self.attempt = 0 # Number of retries sent so far.
+        self.deadline = None # Time (time.monotonic) after which the reply is considered lost.
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} keys={self.keys} attempt={self.attempt}>'
+
+    def accepts(self, packet):
+        return not self.future.done() and (self.match is None or self.match(packet))
+
+#   D I S P A T C H E R
+
+class Dispatcher:
+    """Route incoming Z21 packets by their (header, xHeader) key.
+    A packet is delivered to the oldest pending request for that key that accepts it, if there is one.
+    Subscribers of the key always get the packet, as well as the subscribers of key None (all packets).
+
+    >>> d = Dispatcher()
+    >>> events = []
+    >>> d.subscribe((0x40, 0x61), events.append)
+    >>> future = d.expect((0x10, None))
+    >>> d.dispatch(bytes((0x08, 0, 0x10, 0, 1, 2, 3, 4)))
+    >>> future.result(0)
+    b'\\x08\\x00\\x10\\x00\\x01\\x02\\x03\\x04'
+    >>> d.dispatch(bytes((0x07, 0, 0x40, 0, 0x61, 0x01, 0x60)))
+    >>> len(events)
+    1
+
+    A future can wait for several keys. The optional @match function filters the packets it accepts.
+    >>> future = d.expect((0x40, 0x64), (0x40, 0x61), match=lambda p: p[4] == 0x64 or p[5] == 0x13)
+    >>> d.dispatch(bytes((0x07, 0, 0x40, 0, 0x61, 0x01, 0x60))) # LAN_X_BC_TRACK_POWER_ON is not the reply
+    >>> future.done()
+    False
+    >>> d.dispatch(bytes((0x07, 0, 0x40, 0, 0x61, 0x13, 0x72))) # LAN_X_CV_NACK
+    >>> future.result(0)[5]
+    19
+
+    Requests with a RetryPolicy are resent when their deadline expires, and fail with TimeoutError
+    when all retries are used.
+    >>> sent = []
+    >>> future = d.expect((0x10, None), resend=lambda: sent.append(1), policy=RetryPolicy(0.01, retries=1))
+    >>> d.expire(time.monotonic() + 1)
+    >>> sent
+    [1]
+    >>> d.expire(time.monotonic() + 2)
+    >>> future.exception(0).__class__.__name__
+    'TimeoutError'
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {} # Key --> list of PendingRequest instances, waiting for a reply, oldest first.
+        self.deadlines = [] # Heap of (deadline, sequence, request) for the requests with a timeout.
+        self.sequence = 0 # Unique tie breaker for requests with identical deadlines in the heap.
+        self.subscribers = {} # Key --> list of callbacks, called with the packet bytes.
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} pending={sum(len(r) for r in self.pending.values())} subscribers={len(self.subscribers)}>'
+
+    def expect(self, *keys, match=None, parse=None, resend=None, policy=None):
+        """Answer a new Future that will hold the first dispatched packet with one of the @keys.
+        If @match is defined, then only packets for which match(packet) is True are accepted.
+        If @parse is defined, then the future holds the answer of parse(packet) instead of the packet.
+        If the @policy has a timeout, then the request is resent by calling @resend() after each timeout, 
+        until policy.retries is exhausted. Then the future gets a TimeoutError.
+        Make sure to call this before the command is sent, so the reply cannot get lost."""
+        request = PendingRequest(keys, match, parse, resend, policy)
+        with self.lock:
+            for key in keys:
+                self.pending.setdefault(key, []).append(request)
+            if policy is not None and policy.timeout is not None:
+                self._schedule(request, time.monotonic())
+        return request.future
+
+    def _schedule(self, request, now):
+        request.deadline = now + request.policy.timeoutFor(request.attempt)
+        self.sequence += 1
+        heapq.heappush(self.deadlines, (request.deadline, self.sequence, request))
+
+    def cancel(self, future, *keys):
+        """Remove the pending @future from @keys, e.g. when it timed out or when it got its reply
+        through one of the other keys."""
+        with self.lock:
+            for key in keys:
+                requests = self.pending.get(key)
+                if requests:
+                    requests[:] = [request for request in requests if request.future is not future]
+        future.cancel() # Does nothing if the future is already done.
+
+    def waitTime(self, maxWait):
+        """Answer the seconds until the first deadline expires, with @maxWait as maximum."""
+        with self.lock:
+            if not self.deadlines:
+                return maxWait
+            return max(0, min(maxWait, self.deadlines[0][0] - time.monotonic()))
+
+    def expire(self, now=None):
+        """Check the deadlines of the pending requests. Resend the ones that have retries left
+        and let the others fail with a TimeoutError."""
+        if now is None:
+            now = time.monotonic()
+        resend = []
+        failed = []
+        with self.lock:
+            while self.deadlines and self.deadlines[0][0] <= now:
+                deadline, _, request = heapq.heappop(self.deadlines)
+                if request.future.done() or deadline != request.deadline:
+                    continue # Answered, cancelled or rescheduled in the mean time.
+                if request.attempt < request.policy.retries and request.resend is not None:
+                    request.attempt += 1
+                    self._schedule(request, now)
+                    resend.append(request)
+                else:
+                    for key in request.keys:
+                        requests = self.pending.get(key)
+                        if requests and request in requests:
+                            requests.remove(request)
+                    failed.append(request)
+        for request in resend:
+            request.resend()
+        for request in failed:
+            if request.future.set_running_or_notify_cancel():
+                request.future.set_exception(TimeoutError(f'No reply for {request.keys} after {request.attempt+1} attempt(s)'))
+
+    def subscribe(self, key, callback):
+        """Call @callback(packet) for every packet with @key. If @key is None, then the callback
+        gets all packets."""
+        with self.lock:
+            self.subscribers.setdefault(key, []).append(callback)
+
+    def unsubscribe(self, key, callback):
+        with self.lock:
+            callbacks = self.subscribers.get(key)
+            if callbacks and callback in callbacks:
+                callbacks.remove(callback)
+
+    def dispatch(self, packet):
+        """Deliver the @packet to all subscribers of its key and then to the oldest pending request that accepts it."""
+        key = packetKey(packet)
+        request = None
+        with self.lock:
+            requests = self.pending.get(key)
+            if requests:
+                for index, r in enumerate(requests):
+                    if r.accepts(packet):
+                        request = r
+                        del requests[index]
+                        break
+                # Cleanup the requests that were cancelled or answered through another key.
+                requests[:] = [r for r in requests if not r.future.done()]
+            callbacks = self.subscribers.get(key, []) + self.subscribers.get(None, [])
+        # Subscribers first, so state they keep (e.g. Z21.locos) is current when the requester wakes up.
+        for callback in callbacks:
+            try:
+                callback(packet)
+            except Exception:
+                logger.exception('Error in Z21 subscriber %r for %r', callback, key)
+        if request is not None and request.future.set_running_or_notify_cancel(): # False if it was cancelled just now.
+            try:
+                request.future.set_result(packet if request.parse is None else request.parse(packet))
+            except Exception as e: # Error in the parse function.
+                request.future.set_exception(e)
+
+#   R E C E I V E R
+
+class Receiver(threading.Thread):
+    """Background thread reading all datagrams from the open Z21 socket @s and feeding the
+    packets to the @dispatcher. The socket gets a short timeout, so the thread can check regularly
+    if it should stop and if pending requests did expire."""
+
+    def __init__(self, s, dispatcher, pollInterval=POLL_INTERVAL):
+        threading.Thread.__init__(self, name='Z21Receiver', daemon=True)
+        self.s = s
+        self.dispatcher = dispatcher
+        self.pollInterval = pollInterval
+        self.s.settimeout(pollInterval)
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.s.settimeout(self.dispatcher.waitTime(self.pollInterval) or 0.001) # Timeout 0 would make it non-blocking
+            try:
+                data = self.s.recv(MAX_READ)
+            except SocketTimeout:
+                pass
+            except OSError: # Socket closed or connection refused (no Z21 on the address).
+                if self.stopped.is_set() or self.s.fileno() == -1:
+                    break
+            else: # Packets are memoryview slices of the datagram, they are not copied.
+                for packet in splitPackets(memoryview(data)):
+                    self.dispatcher.dispatch(packet)
+            self.dispatcher.expire()
+
+    def stop(self):
+        """Stop the thread and wait for it to finish its current poll."""
+        self.stopped.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+if __name__ == '__main__':
+    import doctest
+    import sys
+    sys.exit(doctest.testmod()[0])
@@ -0,0 +1,188 @@
+# -*- coding: UTF-8 -*-
+# ------------------------------------------------------------------------------
+#     Copyright (c) 2023+ TYPETR
+#     Usage by MIT License
+# ..............................................................................
+#
+#    TYPETR z21sendqueue.py
+#
+#   [Z21.locoDrive] ---> [SendQueue] ---(rate limited)---> [socket] ---> [DR5000] ---> (DCC rails)
+#
+#   Every loco and turnout command sent by LAN becomes a DCC packet on the rails, where the bandwidth is
+#   small: a DCC packet takes about 5-6 ms, and the command station also needs the time to repeat the
+#   state of all locos. A throttle slider that calls locoDrive on every tick floods the track.
+#
+#   The SendQueue coalesces commands with the same key, e.g. ('drive', loco): a command is sent at once
+#   if its key was not sent within the last @window seconds. Otherwise it waits until the window has
+#   passed and only the latest command of that key is sent. So a slider sends its first and last position
+#   and at most one speed per window in between. All sends share a token bucket of @rate packets per second.
+#   Commands without key are sent in order. Urgent commands (e-stop, track power off) are not queued at all:
+#   the Z21 class sends them directly and purges the queued commands that they overrule.
+#
+import heapq
+import logging
+import threading
+import time
+
+DCC_PACKETS_PER_SECOND = 100 # Budget for new commands, leaving track time for the refresh of the command station.
+WINDOW = 0.05 # Seconds. Minimum interval between two sends of the same key.
+
+logger = logging.getLogger(__name__)
+
+class SendQueue(threading.Thread):
+    """Background thread that calls @send(packet) for the queued packets, coalescing packets with the
+    same key within @window seconds and limited to @rate packets per second, with bursts of @burst packets.
+
+    >>> sent = []
+    >>> q = SendQueue(sent.append, rate=1000, window=0.05)
+    >>> q.start()
+    >>> q.put(bytes((0,)), ('drive', 3)) # First slider tick is sent at once.
+    >>> q.flush()
+    True
+    >>> for speed in range(1, 10):
+    ...     q.put(bytes((speed,)), ('drive', 3)) # Following ticks within the window
+    >>> q.put(b'F', ('function', 3, 0))
+    >>> q.stop()
+    >>> sent # First and last speed of the window, the function in between.
+    [b'\\x00', b'F', b'\\t']
+    >>> q.submitted, q.coalesced, q.sent
+    (11, 8, 3)
+    """
+    def __init__(self, send, rate=DCC_PACKETS_PER_SECOND, window=WINDOW, burst=None):
+        threading.Thread.__init__(self, name='Z21SendQueue', daemon=True)
+        self.send = send
+        self.rate = rate
+        self.window = window
+        self.burst = burst or max(1, rate // 10)
+        self.tokens = self.burst
+        self.refilled = time.monotonic()
+
+        self.condition = threading.Condition()
+        self.pending = {} # Key --> (sequence, packet), the latest packet of the key and its schedule entry.
+        self.schedule = [] # Heap of (due time, sequence, key)
+        self.lastSent = {} # Key --> time that the key was last sent.
+        self.sequence = 0
+        self.sending = 0 # Number of packets taken from the queue, that are not sent yet.
+        self.stopped = False
+
+        self.submitted = 0 # Counters
+        self.coalesced = 0
+        self.sent = 0
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} pending={len(self.pending)} sent={self.sent} coalesced={self.coalesced}>'
+
+    def put(self, packet, key=None):
+        """Queue the @packet (bytes or memoryview, it is copied). @key is a tuple, e.g. ('drive', loco).
+        If a packet with the same @key is still
+        waiting, then it is replaced by this one, keeping its place in the queue. Without @key, the packet
+        is always sent, in order."""
+        packet = bytes(packet)
+        with self.condition:
+            self.submitted += 1
+            self.sequence += 1
+            if key is None:
+                key = (None, self.sequence) # Unique key, never coalesced.
+            elif key in self.pending:
+                self.pending[key] = self.pending[key][0], packet
+                self.coalesced += 1
+                return
+            now = time.monotonic()
+            due = now
+            last = self.lastSent.get(key)
+            if last is not None:
+                due = max(now, last + self.window)
+            self.pending[key] = self.sequence, packet
+            heapq.heappush(self.schedule, (due, self.sequence, key))
+            self.condition.notify_all() # The sender thread, flush() waits on the same condition.
+
+    def isPending(self, key):
+        """Answer True if a packet with @key is waiting to be sent."""
+        with self.condition:
+            return key in self.pending
+
+    def purge(self, match=None):
+        """Remove the waiting packets with a key for which match(key) is True, or all packets if @match
+        is None. Used for urgent commands, so the queue does not send commands that they overrule.
+        A key that is queued again after the purge keeps its window since the last send.
+
+        >>> sent = []
+        >>> q = SendQueue(lambda packet: sent.append((packet, time.monotonic())), rate=1000, window=0.2)
+        >>> q.put(b'a', ('drive', 3)); q.purge() # The schedule entry of 'a' is due now.
+        >>> q.lastSent[('drive', 3)] = start = time.monotonic() # As if the key was sent just now.
+        >>> q.put(b'b', ('drive', 3))
+        >>> q.start(); q.flush()
+        True
+        >>> sent[0][0], sent[0][1] - start >= 0.2 # Not sent by the purged entry, but after the window.
+        (b'b', True)
+        >>> q.stop()
+        """
+        with self.condition:
+            if match is None:
+                self.pending.clear()
+            else:
+                for key in [key for key in self.pending if match(key)]:
+                    del self.pending[key]
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+
+    def run(self):
+        condition = self.condition
+        while True:
+            with condition:
+                while True:
+                    if self.stopped and not self.pending:
+                        return
+                    # Skip the schedule entries of purged keys, also if the key was queued again.
+                    while self.schedule and self.pending.get(self.schedule[0][2], (None,))[0] != self.schedule[0][1]:
+                        heapq.heappop(self.schedule)
+                    now = time.monotonic()
+                    if not self.schedule:
+                        condition.wait(None if not self.stopped else 0)
+                        continue
+                    due = self.schedule[0][0]
+                    if self.stopped:
+                        due = now # Flush, without waiting for the window.
+                    self._refill(now)
+                    wait = max(due - now, (1 - self.tokens) / self.rate)
+                    if wait <= 0:
+                        break
+                    condition.wait(wait)
+                _, _, key = heapq.heappop(self.schedule)
+                _, packet = self.pending.pop(key)
+                self.tokens -= 1
+                if key[0] is not None:
+                    self.lastSent[key] = now
+                self.sending += 1
+            try:
+                self.send(packet)
+            except Exception:
+                logger.exception('Error sending %r', packet)
+            with condition:
+                self.sending -= 1
+                self.sent += 1
+                if not self.pending and not self.sending:
+                    condition.notify_all() # For flush()
+
+    def flush(self, timeout=None):
+        """Wait until all waiting packets are sent. Answer False if that did not happen within @timeout seconds."""
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.pending and not self.sending, timeout)
+
+    def stop(self, flush=True):
+        """Stop the thread. If @flush is True, the waiting packets are sent first, without waiting for
+        their window, but still within the rate."""
+        with self.condition:
+            if not flush:
+                self.pending.clear()
+            self.stopped = True
+            self.condition.notify_all()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+if __name__ == '__main__':
+    import doctest
+    import sys
+    sys.exit(doctest.testmod()[0])
@@ -0,0 +1,739 @@
+# -*- coding: UTF-8 -*-
+# ------------------------------------------------------------------------------
+#     Copyright (c) 2023+ TYPETR
+#     Usage by MIT License
+# ..............................................................................
+#
+#    TYPETR z21simulator.py
+#
+#   [Z21] <----- (UDP localhost) -----> [Z21Simulator] <-----> [SimulatedDecoder, ...]
+#
+#   Simulation of a Z21/DR5000 command station on a localhost UDP port, so the Z21 class can be
+#   tested and benchmarked without hardware. It answers the LAN protocol as the Z21 class sends it:
+#   serial number, version, hardware info, status, system state, broadcast flags, loco drive, functions
+#   and info, RailCom, turnouts, R-Bus feedback, LocoNet slots and detectors, CAN detectors and boosters and
+#   a programming track with CV memory for each decoder.
+#   Broadcasts are sent to the clients that set the broadcast flags, loco broadcasts only for the
+#   last 16 addresses that the client polled with LAN_X_GET_LOCO_INFO (or for all locos with flag 0x00010000).
+#
+#   Latency, jitter and packet loss can be set, to test the timeouts and retries of the client:
+#
+#       simulator = Z21Simulator(latency=0.002, jitter=0.001, loss=0.01, seed=1)
+#       simulator.start()
+#       z21 = Z21(*simulator.address, timeout=0.1, retries=3)
+#       ...
+#       z21.close()
+#       simulator.stop()
+#
+#   Packets with a wrong XOR are ignored, as the Z21 does, and counted in simulator.errors.
+#   "Z21:" is referencing to the chapters in the z21-lan-protokoll-en.pdf manual.
+#
+import heapq
+import random
+import struct
+import threading
+import time
+from socket import socket, AF_INET, SOCK_DGRAM, SOL_SOCKET, SO_RCVBUF, timeout as SocketTimeout
+
+from z21broadcast import BroadcastFlags, MAX_LOCO_SUBSCRIPTIONS
+from z21codec import (xorChecksum, functionGroupBits, functionGroupMask, FUNCTION_GROUPS, POM_READ_BYTE,
+    POM_WRITE_BIT, POM_WRITE_BYTE)
+from z21cvread import REGISTER_CVS
+from z21feedback import CAN_ALL_DETECTORS, CAN_OCCUPIED, MODULE_INPUTS, RMBUS_GROUP_MODULES, RMBUS_GROUPS, RMBUS_MODULES
+from z21loconet import (decodeLocoNet, locoNetMessage, DETECTOR_REQUEST_SIC, FIRST_SPECIAL_SLOT, OPC_LOCO_ADR,
+    OPC_LOCO_DIRF, OPC_LOCO_SPD, OPC_RQ_SL_DATA, OPC_SL_RD_DATA)
+from z21receiver import MAX_READ, POLL_INTERVAL, splitPackets
+
+RECEIVE_BUFFER = 4 * 1024 * 1024 # Bytes, limited by the OS (net.core.rmem_max on Linux).
+
+SYSTEM_STATE = struct.Struct('<HH6hBBBB') # LAN_SYSTEMSTATE_DATACHANGED, Z21: 2.18
+
+# Central state bits, in LAN_X_STATUS_CHANGED and LAN_SYSTEMSTATE_DATACHANGED
+CS_EMERGENCY_STOP = 0x01
+CS_TRACK_VOLTAGE_OFF = 0x02
+CS_SHORT_CIRCUIT = 0x04
+CS_PROGRAMMING_MODE_ACTIVE = 0x20
+
+STEPS_KKK = {0x10: 0, 0x12: 2, 0x13: 4} # DCC steps code in LAN_X_SET_LOCO_DRIVE --> KKK in LAN_X_LOCO_INFO
+
+def xPacket(*data):
+    """Answer the LAN_X_... packet with the @data bytes (X-header, DB0, ...) and the XOR.
+
+    >>> xPacket(0x61, 0x01).hex(' ') # LAN_X_BC_TRACK_POWER_ON
+    '07 00 40 00 61 01 60'
+    """
+    return bytes((len(data) + 5, 0, 0x40, 0)) + bytes(data) + bytes((xorChecksum(data),))
+
+def lanPacket(header, payload=b''):
+    """Answer the packet with 16 bit @header and @payload bytes, without XOR.
+
+    >>> lanPacket(0x10, (12345).to_bytes(4, 'little')).hex(' ') # LAN_GET_SERIAL_NUMBER reply
+    '08 00 10 00 39 30 00 00'
+    """
+    return struct.pack('<HH', len(payload) + 4, header) + bytes(payload)
+
+REGISTER_CV = {register: cvId for cvId, register in REGISTER_CVS.items()} # Register mode of LAN_X_DCC_READ_REGISTER
+
+#   D E C O D E R
+
+class SimulatedDecoder:
+    """Loco decoder with CV memory and driving state. CV257-511 are indexed by the CV31/CV32 page,
+    as with the LokSound5. The state is kept as the raw bytes of the protocol.
+
+    >>> d = SimulatedDecoder(3)
+    >>> d.readCV(1), d.readCV(8)
+    (3, 151)
+    >>> d.writeCV(259, 100); d.writeCV(32, 2); d.readCV(259), d.pages[(16, 2)][259-257]
+    (0, 0)
+    >>> d.writeCV(259, 100); d.readCV(259), d.pages[(16, 2)][259-257]
+    (100, 100)
+    >>> d.functions = 0x80000005; d.speedByte = 0x80 | 21
+    >>> d.locoInfo().hex(' ')
+    '0f 00 40 00 ef 00 03 04 95 12 00 00 00 04 6b'
+    >>> SimulatedDecoder(259).readCV(29) & 0x20, SimulatedDecoder(259).address
+    (32, 259)
+    """
+    def __init__(self, address):
+        self.cvs = bytearray(1024) # CV1 is at index 0.
+        self.pages = {} # (CV31, CV32) --> bytearray of CV257-511
+        self.cvs[2-1] = 3 # Start voltage
+        self.cvs[3-1] = 28 # Acceleration
+        self.cvs[4-1] = 21 # Deceleration
+        self.cvs[5-1] = 255 # Maximum speed
+        self.cvs[7-1] = 1 # Version number
+        self.cvs[8-1] = 151 # Manufacturer ESU
+        self.cvs[29-1] = 12 # Configuration register, 28/128 steps and analog mode
+        self.cvs[31-1] = 16 # Index register high
+        self.cvs[63-1] = 180 # Master volume
+        self.address = address
+        self.stepsCode = 0x13 # 128 steps
+        self.speedByte = 0x80 # RVVVVVVV, forward and stopped
+        self.functions = 0 # Bit n is Fn
+        self.railComReceived = 0 # RailCom counters of the Z21 for this decoder, see railComData()
+        self.railComErrors = 0
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.address}>'
+
+    def _get_address(self):
+        if self.cvs[29-1] & 0x20: # Long address in CV17/CV18
+            return ((self.cvs[17-1] & 0x3F) << 8) | self.cvs[18-1]
+        return self.cvs[1-1]
+    def _set_address(self, address):
+        if address >= 128:
+            self.cvs[17-1] = 0xC0 | (address >> 8)
+            self.cvs[18-1] = address & 0xFF
+            self.cvs[29-1] |= 0x20
+        else:
+            self.cvs[1-1] = address
+            self.cvs[29-1] &= ~0x20
+    address = property(_get_address, _set_address)
+
+    def _cvMemory(self, cvId):
+        """Answer the memory and index of @cvId, taking the page in CV31/CV32 into account."""
+        if 257 <= cvId <= 511:
+            page = (self.cvs[31-1], self.cvs[32-1])
+            if page not in self.pages:
+                self.pages[page] = bytearray(255)
+            return self.pages[page], cvId - 257
+        return self.cvs, cvId - 1
+
+    def readCV(self, cvId):
+        memory, index = self._cvMemory(cvId)
+        return memory[index]
+
+    def writeCV(self, cvId, value):
+        memory, index = self._cvMemory(cvId)
+        memory[index] = value
+
+    def setFunction(self, functionCode):
+        """Set a function from the TTNNNNNN byte of LAN_X_SET_LOCO_FUNCTION. TT: 00 off, 01 on, 10 toggle."""
+        switchType = functionCode >> 6
+        bit = 1 << (functionCode & 0x3F)
+        if switchType == 0:
+            self.functions &= ~bit
+        elif switchType == 1:
+            self.functions |= bit
+        elif switchType == 2:
+            self.functions ^= bit
+
+    def setFunctionGroup(self, group, value):
+        """Set the functions of LAN_X_SET_LOCO_FUNCTION_GROUP @group from its @value byte."""
+        if group in FUNCTION_GROUPS:
+            self.functions = (self.functions & ~functionGroupMask(group)) | functionGroupBits(group, value)
+        elif group == 0x29: # F36 .. F29, only F29-F31 are stored
+            self.functions = (self.functions & ~(0x07 << 29)) | ((value & 0x07) << 29)
+
+    def locoInfo(self):
+        """Answer the LAN_X_LOCO_INFO packet of the current state, including F29-F31. Z21: 4.4"""
+        address = self.address
+        f = self.functions
+        return xPacket(0xEF, (address >> 8) | (0xC0 if address >= 128 else 0), address & 0xFF,
+            STEPS_KKK.get(self.stepsCode, 4), self.speedByte, ((f & 0x01) << 4) | ((f >> 1) & 0x0F),
+            (f >> 5) & 0xFF, (f >> 13) & 0xFF, (f >> 21) & 0xFF, (f >> 29) & 0x07)
+
+    def railComData(self):
+        """Answer the LAN_RAILCOM_DATACHANGED packet of the decoder. The decoder answers every drive command, 
+        reporting its speed step as km/h with a QoS of 100. Z21: 8.1"""
+        speed = max(0, (self.speedByte & 0x7F) - 1)
+        return lanPacket(0x88, struct.pack('<HIHxBBBx', self.address, self.railComReceived, self.railComErrors, 
+            0x05, speed, 100)) # Options: speed (CH7 subindex 0) and QoS valid
+
+    def locoNetSlotData(self, slot):
+        """Answer the LocoNet OPC_SL_RD_DATA message of @slot, holding this decoder in use at 128 steps."""
+        address = self.address
+        f = self.functions
+        dirf = (0 if self.speedByte & 0x80 else 0x20) | ((f & 0x01) << 4) | ((f >> 1) & 0x0F)
+        return locoNetMessage(OPC_SL_RD_DATA, 0x0E, slot, 0x33, address & 0x7F, self.speedByte & 0x7F, dirf, 0x07, 0,
+            (address >> 7) & 0x7F, (f >> 5) & 0x0F, 0, 0)
+
+    def _get_moving(self):
+        return (self.speedByte & 0x7F) > 1
+    moving = property(_get_moving)
+
+#   S I M U L A T O R
+
+class SimulatedClient:
+    """The state that the simulator keeps for each client address: its broadcast flags and the
+    loco addresses that it polled with LAN_X_GET_LOCO_INFO."""
+    def __init__(self, address):
+        self.address = address
+        self.flags = BroadcastFlags.NONE
+        self.locos = [] # Oldest first, at most MAX_LOCO_SUBSCRIPTIONS
+
+    def subscribeLoco(self, loco):
+        if loco in self.locos:
+            self.locos.remove(loco)
+        self.locos.append(loco)
+        del self.locos[:-MAX_LOCO_SUBSCRIPTIONS]
+
+class Z21Simulator(threading.Thread):
+    """UDP server on @host:@port (port 0 selects a free port, see self.address) that behaves like a Z21.
+    Every packet sent is delayed by @latency seconds, plus a random offset of ±@jitter seconds, and
+    dropped with probability @loss. The same @loss applies to the received datagrams. Use @seed for a
+    repeatable sequence of delays and losses. CV reads and writes take an additional @programmingDelay,
+    register reads (LAN_X_DCC_READ_REGISTER) take @registerDelay, default the same as @programmingDelay.
+    If @systemStateInterval is set, then LAN_SYSTEMSTATE_DATACHANGED is broadcast in that interval.
+    @programmingTrack is the address of the decoder on the programming track, or None if it is empty.
+    """
+    def __init__(self, host='127.0.0.1', port=0, latency=0, jitter=0, loss=0, seed=None, programmingDelay=0,
+            registerDelay=None, systemStateInterval=0, programmingTrack=3, serialNumber=123456, hwType=0x00000201, fwVersion=0x0143):
+        threading.Thread.__init__(self, name='Z21Simulator', daemon=True)
+        self.s = socket(AF_INET, SOCK_DGRAM)
+        # Large receive buffer, so bursts of commands are not dropped by the OS before the thread reads them.
+        self.s.setsockopt(SOL_SOCKET, SO_RCVBUF, RECEIVE_BUFFER)
+        self.s.bind((host, port))
+        self.address = self.s.getsockname() # The (host, port) to connect the Z21 class to.
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.random = random.Random(seed)
+        self.programmingDelay = programmingDelay
+        self.registerDelay = programmingDelay if registerDelay is None else registerDelay
+        self.systemStateInterval = systemStateInterval
+        self.serialNumber = serialNumber
+        self.hwType = hwType
+        self.fwVersion = fwVersion # BCD, 0x0143 = V1.43
+
+        self.lock = threading.RLock()
+        self.stopped = threading.Event()
+        self.outgoing = [] # Heap of (time, sequence, packet, client address), for delayed packets.
+        self.sequence = 0
+        self.nextSystemState = 0
+
+        self.clients = {} # Client (host, port) --> SimulatedClient
+        self.decoders = {} # Loco address --> SimulatedDecoder
+        self.turnouts = {} # Turnout address --> 000000ZZ state
+        self.accessoryCvs = {} # (aaaaaaaa AAAACDDD, cvId) --> value, CVs of accessory decoders written by POM
+        self.feedback = bytearray(RMBUS_MODULES) # Status byte of each R-Bus feedback module, see setDetector()
+        self.railComNext = -1 # Index of the last loco answered by LAN_RAILCOM_GETDATA for address 0
+        self.locoNetSlots = {} # LocoNet slot --> loco address, see locoNetSlot()
+        self.locoNetDetectors = {} # LocoNet report address --> occupied, see setLocoNetDetector()
+        self.canDetectors = {} # (NId, module address, port) --> occupancy Value1, see setCanDetector()
+        self.canBoosters = {} # (NId, output port) --> [state, voltage, current], see setCanBooster()
+        self.canDescriptions = {} # NId --> name of the CAN device
+        self.locoModes = {}
+        self.turnoutModes = {}
+        self.centralState = 0
+        self.programmingTrack = None
+        if programmingTrack is not None:
+            self.programmingTrack = self.decoder(programmingTrack)
+
+        self.received = 0 # Counters
+        self.sent = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def __repr__(self):
+        return (f'<{self.__class__.__name__} {self.address[0]}:{self.address[1]} received={self.received} '
+            f'sent={self.sent} dropped={self.dropped} errors={self.errors}>')
+
+    def decoder(self, address):
+        """Answer the decoder of loco @address. Like a Z21, any address can be driven, so unknown addresses
+        get a new decoder with default CVs."""
+        with self.lock:
+            decoder = self.decoders.get(address)
+            if decoder is None:
+                decoder = self.decoders[address] = SimulatedDecoder(address)
+            return decoder
+
+    def placeOnProgrammingTrack(self, address):
+        """Put the decoder of loco @address on the programming track. None makes it empty."""
+        with self.lock:
+            self.programmingTrack = None if address is None else self.decoder(address)
+
+    #   S E N D I N G
+
+    def sendTo(self, packet, client, delay=0):
+        """Send @packet to the @client address, after the latency, jitter and @delay, unless it is lost."""
+        with self.lock:
+            if self.loss and self.random.random() < self.loss:
+                self.dropped += 1
+                return
+            delay += self.latency
+            if self.jitter:
+                delay += self.random.uniform(-self.jitter, self.jitter)
+            if delay <= 0:
+                self.s.sendto(packet, client)
+                self.sent += 1
+                return
+            self.sequence += 1
+            heapq.heappush(self.outgoing, (time.monotonic() + delay, self.sequence, packet, client))
+
+    def broadcast(self, packet, flag, loco=None):
+        """Send @packet to all clients that set the broadcast @flag. For loco broadcasts (@loco is the address),
+        only to the clients that polled the loco, or that set the flag for all locos."""
+        with self.lock:
+            for client in list(self.clients.values()):
+                if loco is not None:
+                    if client.flags & BroadcastFlags.ALL_LOCO_INFO or (client.flags & flag and loco in client.locos):
+                        self.sendTo(packet, client.address)
+                elif client.flags & flag:
+                    self.sendTo(packet, client.address)
+
+    def broadcastLocoInfo(self, loco):
+        """Send the LAN_X_LOCO_INFO of @loco to the subscribed clients, as after a change of its state."""
+        self.broadcast(self.decoder(loco).locoInfo(), BroadcastFlags.DRIVING_SWITCHING, loco)
+
+    def setDetector(self, detector, occupied):
+        """Set the occupancy of feedback @detector, (module - 1) * 8 + input, and broadcast LAN_RMBUS_DATACHANGED 
+        of its group if it changed."""
+        with self.lock:
+            module, input = divmod(detector - 1, MODULE_INPUTS)
+            value = self.feedback[module]
+            if occupied:
+                self.feedback[module] |= 1 << input
+            else:
+                self.feedback[module] &= ~(1 << input)
+            if self.feedback[module] != value:
+                self.broadcast(self.rmBusPacket(module // RMBUS_GROUP_MODULES), BroadcastFlags.RMBUS)
+
+    def rmBusPacket(self, groupIndex):
+        """Answer LAN_RMBUS_DATACHANGED of the 10 modules of @groupIndex. Z21: 7.1"""
+        first = groupIndex * RMBUS_GROUP_MODULES
+        return lanPacket(0x80, bytes((groupIndex,)) + self.feedback[first:first + RMBUS_GROUP_MODULES])
+
+    def broadcastRailCom(self, loco):
+        """Send the LAN_RAILCOM_DATACHANGED of @loco to the clients that polled the loco and set the RailCom flag,
+        or that set the flag for all locos."""
+        with self.lock:
+            packet = self.decoder(loco).railComData()
+            for client in list(self.clients.values()):
+                if client.flags & BroadcastFlags.ALL_RAILCOM or (client.flags & BroadcastFlags.RAILCOM and loco in client.locos):
+                    self.sendTo(packet, client.address)
+
+    def locoNetSlot(self, address):
+        """Answer the LocoNet slot of loco @address, taking the first free slot if it has none yet."""
+        with self.lock:
+            for slot, loco in self.locoNetSlots.items():
+                if loco == address:
+                    return slot
+            slot = len(self.locoNetSlots) + 1
+            if slot >= FIRST_SPECIAL_SLOT:
+                return 0
+            self.locoNetSlots[slot] = address
+            return slot
+
+    def locoNetReceive(self, data):
+        """Put the LocoNet message @data onto the simulated bus, as from a throttle or sensor, so the clients
+        with the LocoNet flag get it as LAN_LOCONET_Z21_RX. Z21: 9.1"""
+        self.broadcast(lanPacket(0xA0, data), BroadcastFlags.LOCONET)
+
+    def setLocoNetDetector(self, address, occupied):
+        """Set the occupancy of the LocoNet detector at report @address and broadcast LAN_LOCONET_DETECTOR if
+        it changed. Z21: 9.5"""
+        with self.lock:
+            if self.locoNetDetectors.get(address, False) != occupied:
+                self.locoNetDetectors[address] = occupied
+                self.broadcast(self.locoNetDetectorPacket(address), BroadcastFlags.LOCONET_DETECTOR)
+
+    def locoNetDetectorPacket(self, address):
+        """Answer the LAN_LOCONET_DETECTOR occupancy report of @address. Z21: 9.5"""
+        return lanPacket(0xA4, struct.pack('<BHB', 0x01, address, self.locoNetDetectors.get(address, False)))
+
+    def setCanDetector(self, netId, address, port, occupied):
+        """Set the occupancy of @port (0-7) of the CAN detector module @netId with @address, with track voltage,
+        and broadcast its LAN_CAN_DETECTOR report if it changed. Z21: 10.1"""
+        with self.lock:
+            key = (netId, address, port)
+            value = CAN_OCCUPIED | 0x0100 if occupied else 0x0100
+            if self.canDetectors.get(key) != value:
+                self.canDetectors[key] = value
+                self.broadcast(self.canDetectorPacket(key), BroadcastFlags.CAN_DETECTOR)
+
+    def canDetectorPacket(self, key):
+        """Answer the LAN_CAN_DETECTOR occupancy report of @key (NId, module address, port). Z21: 10.1"""
+        netId, address, port = key
+        return lanPacket(0xC4, struct.pack('<HHBBHH', netId, address, port, 0x01, self.canDetectors[key], 0))
+
+    def setCanBooster(self, netId, port, current=None, state=None, voltage=None):
+        """Set the @current (mA), @state and @voltage (mV) of output @port of the CAN booster @netId and broadcast
+        LAN_CAN_BOOSTER_SYSTEMSTATE_CHGD. Values that are None keep their last value. Z21: 10.2.3"""
+        with self.lock:
+            values = self.canBoosters.setdefault((netId, port), [0, 18000, 0])
+            for index, value in enumerate((state, voltage, current)):
+                if value is not None:
+                    values[index] = value
+            self.broadcast(lanPacket(0xCA, struct.pack('<HHHHH', netId, port, *values)), BroadcastFlags.CAN_BOOSTER)
+
+    def broadcastSystemState(self):
+        self.broadcast(self.systemStatePacket(), BroadcastFlags.SYSTEM_STATE)
+
+    def _flush(self, now):
+        """Send the delayed packets that are due."""
+        with self.lock:
+            outgoing = self.outgoing
+            while outgoing and outgoing[0][0] <= now:
+                _, _, packet, client = heapq.heappop(outgoing)
+                self.s.sendto(packet, client)
+                self.sent += 1
+
+    def _waitTime(self, now):
+        """Answer the socket timeout until the next delayed packet or system state broadcast is due."""
+        wait = POLL_INTERVAL
+        with self.lock:
+            if self.outgoing:
+                wait = min(wait, self.outgoing[0][0] - now)
+        if self.systemStateInterval:
+            wait = min(wait, self.nextSystemState - now)
+        return max(wait, 0.0001)
+
+    #   T H R E A D
+
+    def run(self):
+        while not self.stopped.is_set():
+            now = time.monotonic()
+            if self.systemStateInterval and now >= self.nextSystemState:
+                self.nextSystemState = now + self.systemStateInterval
+                self.broadcastSystemState()
+            self.s.settimeout(self._waitTime(now))
+            try:
+                data, client = self.s.recvfrom(MAX_READ)
+            except SocketTimeout:
+                data = None
+            except OSError:
+                if self.stopped.is_set() or self.s.fileno() == -1:
+                    break
+                raise
+            if data:
+                with self.lock:
+                    self.received += 1
+                    if self.loss and self.random.random() < self.loss:
+                        self.dropped += 1
+                    else:
+                        for packet in splitPackets(data):
+                            self.handle(bytes(packet), client)
+            self._flush(time.monotonic())
+
+    def stop(self):
+        """Stop the thread and close the socket."""
+        self.stopped.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+        self.s.close()
+
+    #   P R O T O C O L
+
+    def handle(self, packet, client):
+        """Handle one @packet from @client address."""
+        with self.lock:
+            c = self.clients.get(client)
+            if c is None:
+                c = self.clients[client] = SimulatedClient(client)
+            header = packet[2] | (packet[3] << 8)
+            if header == 0x40:
+                if xorChecksum(packet[4:]) != 0: # XOR over data and checksum is 0 for a valid packet.
+                    self.errors += 1
+                    return
+                self.handleX(packet, c)
+            else:
+                handler = self.LAN_HANDLERS.get(header)
+                if handler is not None:
+                    handler(self, packet, c)
+
+    def _serialNumber(self, packet, client): # LAN_GET_SERIAL_NUMBER, Z21: 2.1
+        self.sendTo(lanPacket(0x10, struct.pack('<I', self.serialNumber)), client.address)
+
+    def _code(self, packet, client): # LAN_GET_CODE, Z21: 2.21
+        self.sendTo(lanPacket(0x18, bytes((0,))), client.address) # Z21_NO_LOCK
+
+    def _hwInfo(self, packet, client): # LAN_GET_HWINFO, Z21: 2.20
+        self.sendTo(lanPacket(0x1A, struct.pack('<II', self.hwType, self.fwVersion)), client.address)
+
+    def _logoff(self, packet, client): # LAN_LOGOFF, Z21: 2.2
+        del self.clients[client.address]
+
+    def _setBroadcastFlags(self, packet, client): # LAN_SET_BROADCASTFLAGS, Z21: 2.16
+        client.flags = BroadcastFlags(struct.unpack_from('<I', packet, 4)[0])
+
+    def _getBroadcastFlags(self, packet, client): # LAN_GET_BROADCASTFLAGS, Z21: 2.17
+        self.sendTo(lanPacket(0x51, struct.pack('<I', int(client.flags))), client.address)
+
+    def _getLocoMode(self, packet, client): # LAN_GET_LOCOMODE, Z21: 3.1
+        address = struct.unpack_from('>H', packet, 4)[0]
+        self.sendTo(lanPacket(0x60, packet[4:6] + bytes((self.locoModes.get(address, 0),))), client.address)
+
+    def _setLocoMode(self, packet, client): # LAN_SET_LOCOMODE, Z21: 3.2
+        self.locoModes[struct.unpack_from('>H', packet, 4)[0]] = packet[6]
+
+    def _getTurnoutMode(self, packet, client): # LAN_GET_TURNOUTMODE, Z21: 3.3
+        address = struct.unpack_from('>H', packet, 4)[0]
+        self.sendTo(lanPacket(0x70, packet[4:6] + bytes((self.turnoutModes.get(address, 0),))), client.address)
+
+    def _setTurnoutMode(self, packet, client): # LAN_SET_TURNOUTMODE, Z21: 3.4
+        self.turnoutModes[struct.unpack_from('>H', packet, 4)[0]] = packet[6]
+
+    def _systemState(self, packet, client): # LAN_SYSTEMSTATE_GETDATA, Z21: 2.19
+        self.sendTo(self.systemStatePacket(), client.address)
+
+    def _railComData(self, packet, client): # LAN_RAILCOM_GETDATA, Z21: 8.2
+        loco = struct.unpack_from('<H', packet, 5)[0]
+        if not loco: # Next loco of the RailCom buffer, round robin.
+            locos = sorted(self.decoders)
+            if not locos:
+                return
+            self.railComNext = (self.railComNext + 1) % len(locos)
+            loco = locos[self.railComNext]
+        self.sendTo(self.decoder(loco).railComData(), client.address)
+
+    def _rmBusData(self, packet, client): # LAN_RMBUS_GETDATA, Z21: 7.2
+        if packet[4] < RMBUS_GROUPS:
+            self.sendTo(self.rmBusPacket(packet[4]), client.address)
+
+    def _locoNetFromLan(self, packet, client): # LAN_LOCONET_FROM_LAN, Z21: 9.3
+        message = decodeLocoNet(packet[4:])
+        if not message.valid:
+            self.errors += 1
+            return
+        for other in list(self.clients.values()): # The other clients see the message on the bus.
+            if other is not client and other.flags & BroadcastFlags.LOCONET:
+                self.sendTo(packet, other.address)
+        opcode = message.opcode
+        if opcode in (OPC_RQ_SL_DATA, OPC_LOCO_ADR): # The command station answers as LAN_LOCONET_Z21_TX.
+            if opcode == OPC_LOCO_ADR:
+                slot = self.locoNetSlot(message.address)
+            else:
+                slot = message.slot
+            if slot in self.locoNetSlots:
+                data = self.decoder(self.locoNetSlots[slot]).locoNetSlotData(slot)
+                self.broadcast(lanPacket(0xA1, data), BroadcastFlags.LOCONET)
+        elif opcode in (OPC_LOCO_SPD, OPC_LOCO_DIRF) and message.slot in self.locoNetSlots:
+            loco = self.locoNetSlots[message.slot]
+            decoder = self.decoder(loco)
+            if opcode == OPC_LOCO_SPD: # LocoNet speed 0 stop, 1 emergency stop, as the DCC 128 steps.
+                decoder.speedByte = (decoder.speedByte & 0x80) | message.speed
+            else:
+                decoder.speedByte = (decoder.speedByte & 0x7F) | (0x80 if message.forward else 0)
+                decoder.functions = (decoder.functions & ~0x1F) | message.functions
+            self.broadcastLocoInfo(loco)
+
+    def _locoNetDispatch(self, packet, client): # LAN_LOCONET_DISPATCH_ADDR, Z21: 9.4
+        address = struct.unpack_from('<H', packet, 4)[0]
+        self.sendTo(lanPacket(0xA3, struct.pack('<HB', address, self.locoNetSlot(address))), client.address)
+
+    def _locoNetDetector(self, packet, client): # LAN_LOCONET_DETECTOR, Z21: 9.5
+        requestType, address = struct.unpack_from('<BH', packet, 4)
+        addresses = sorted(self.locoNetDetectors) if requestType == DETECTOR_REQUEST_SIC else [address]
+        for address in addresses:
+            self.sendTo(self.locoNetDetectorPacket(address), client.address)
+
+    def _canDetector(self, packet, client): # LAN_CAN_DETECTOR, Z21: 10.1
+        netId = struct.unpack_from('<H', packet, 5)[0]
+        for key in sorted(self.canDetectors):
+            if netId in (CAN_ALL_DETECTORS, key[0]):
+                self.sendTo(self.canDetectorPacket(key), client.address)
+
+    def _canDeviceDescription(self, packet, client): # LAN_CAN_DEVICE_GET_DESCRIPTION, Z21: 10.2.1
+        netId = struct.unpack_from('<H', packet, 4)[0]
+        name = self.canDescriptions.get(netId, '').encode('latin-1')
+        self.sendTo(lanPacket(0xC8, struct.pack('<H16s', netId, name)), client.address)
+
+    def _setCanDeviceDescription(self, packet, client): # LAN_CAN_DEVICE_SET_DESCRIPTION, Z21: 10.2.2
+        netId = struct.unpack_from('<H', packet, 4)[0]
+        self.canDescriptions[netId] = packet[6:22].split(b'\0')[0].decode('latin-1')
+
+    def _canBoosterTrackPower(self, packet, client): # LAN_CAN_BOOSTER_SET_TRACKPOWER, Z21: 10.2.4
+        netId, power = struct.unpack_from('<HB', packet, 4)
+        for (boosterId, port), (state, _, _) in list(self.canBoosters.items()):
+            if boosterId == netId and power in (0x00, 0xFF, (port << 4), (port << 4) | 1):
+                on = bool(power & 0x01) # 0xFF and 0x11, 0x21 are on.
+                state = state & ~0x0100 if on else state | 0x0100 # Track voltage off
+                self.setCanBooster(netId, port, state=state, current=None if on else 0)
+
+    LAN_HANDLERS = {
+        0x10: _serialNumber,
+        0x18: _code,
+        0x1A: _hwInfo,
+        0x30: _logoff,
+        0x50: _setBroadcastFlags,
+        0x51: _getBroadcastFlags,
+        0x60: _getLocoMode,
+        0x61: _setLocoMode,
+        0x70: _getTurnoutMode,
+        0x71: _setTurnoutMode,
+        0x81: _rmBusData,
+        0x85: _systemState,
+        0x89: _railComData,
+        0xA2: _locoNetFromLan,
+        0xA3: _locoNetDispatch,
+        0xA4: _locoNetDetector,
+        0xC4: _canDetector,
+        0xC8: _canDeviceDescription,
+        0xC9: _setCanDeviceDescription,
+        0xCB: _canBoosterTrackPower,
+    }
+
+    def systemStatePacket(self):
+        """Answer LAN_SYSTEMSTATE_DATACHANGED. The main current rises with the number of moving locos."""
+        with self.lock:
+            moving = sum(1 for decoder in self.decoders.values() if decoder.moving)
+            on = not self.centralState & CS_TRACK_VOLTAGE_OFF
+            mainCurrent = (60 + 150 * moving) if on else 0
+            # Capabilities: DCC, RailCom, loco, accessory and detector commands, 0 before FW 1.42
+            capabilities = 0x79 if self.fwVersion >= 0x0142 else 0
+            return SYSTEM_STATE.pack(0x14, 0x84, mainCurrent, 0, mainCurrent, 35, 18000, 16000 if on else 0,
+                self.centralState, 0, 0, capabilities)
+
+    def handleX(self, packet, client):
+        """Handle the LAN_X_... @packet of @client."""
+        xHeader = packet[4]
+        db0 = packet[5] if len(packet) > 6 else None
+        address = client.address
+        if xHeader == 0x21:
+            if db0 == 0x21: # LAN_X_GET_VERSION, Z21: 2.3. X-Bus V3.0, command station Z21
+                self.sendTo(xPacket(0x63, 0x21, 0x30, 0x12), address)
+            elif db0 == 0x24: # LAN_X_GET_STATUS, Z21: 2.4
+                self.sendTo(xPacket(0x62, 0x22, self.centralState), address)
+            elif db0 == 0x80: # LAN_X_SET_TRACK_POWER_OFF, Z21: 2.5
+                self.centralState |= CS_TRACK_VOLTAGE_OFF
+                self.broadcast(xPacket(0x61, 0x00), BroadcastFlags.DRIVING_SWITCHING)
+            elif db0 == 0x81: # LAN_X_SET_TRACK_POWER_ON, Z21: 2.6
+                self.centralState &= ~(CS_TRACK_VOLTAGE_OFF | CS_EMERGENCY_STOP | CS_PROGRAMMING_MODE_ACTIVE)
+                self.broadcast(xPacket(0x61, 0x01), BroadcastFlags.DRIVING_SWITCHING)
+            else:
+                self.sendTo(xPacket(0x61, 0x82), address) # LAN_X_UNKNOWN_COMMAND
+        elif xHeader == 0x80: # LAN_X_SET_STOP, Z21: 2.13
+            self.centralState |= CS_EMERGENCY_STOP
+            for decoder in self.decoders.values():
+                decoder.speedByte = (decoder.speedByte & 0x80) | 0x01
+            self.broadcast(xPacket(0x81, 0x00), BroadcastFlags.DRIVING_SWITCHING)
+        elif xHeader == 0xF1 and db0 == 0x0A: # LAN_X_GET_FIRMWARE_VERSION, Z21: 2.15
+            self.sendTo(xPacket(0xF3, 0x0A, self.fwVersion >> 8, self.fwVersion & 0xFF), address)
+        elif xHeader == 0xE3 and db0 == 0xF0: # LAN_X_GET_LOCO_INFO, Z21: 4.1
+            loco = struct.unpack_from('>H', packet, 6)[0] & 0x3FFF
+            client.subscribeLoco(loco)
+            self.sendTo(self.decoder(loco).locoInfo(), address)
+        elif xHeader == 0xE4: # LAN_X_SET_LOCO_..., Z21: 4.2, 4.3
+            loco = struct.unpack_from('>H', packet, 6)[0] & 0x3FFF
+            decoder = self.decoder(loco)
+            if db0 in STEPS_KKK: # LAN_X_SET_LOCO_DRIVE
+                decoder.stepsCode = db0
+                decoder.speedByte = packet[8]
+                decoder.railComReceived += 1
+                self.broadcastRailCom(loco)
+            elif db0 == 0xF8: # LAN_X_SET_LOCO_FUNCTION
+                decoder.setFunction(packet[8])
+            elif db0 in FUNCTION_GROUPS or db0 == 0x29: # LAN_X_SET_LOCO_FUNCTION_GROUP
+                decoder.setFunctionGroup(db0, packet[8])
+            else:
+                self.sendTo(xPacket(0x61, 0x82), address)
+                return
+            self.broadcastLocoInfo(loco)
+        elif xHeader == 0x92: # LAN_X_SET_LOCO_E_STOP, Z21: 4.5
+            loco = struct.unpack_from('>H', packet, 5)[0] & 0x3FFF
+            decoder = self.decoder(loco)
+            decoder.speedByte = (decoder.speedByte & 0x80) | 0x01
+            self.broadcastLocoInfo(loco)
+        elif xHeader == 0x43: # LAN_X_GET_TURNOUT_INFO, Z21: 5.1
+            turnout = struct.unpack_from('>H', packet, 5)[0]
+            self.sendTo(xPacket(0x43, packet[5], packet[6], self.turnouts.get(turnout, 0)), address)
+        elif xHeader == 0x53: # LAN_X_SET_TURNOUT 10Q0A00P, Z21: 5.2
+            turnout = struct.unpack_from('>H', packet, 5)[0]
+            value = packet[7]
+            if value & 0x08: # A = 1, activate output P
+                self.turnouts[turnout] = (value & 0x01) + 1
+                self.broadcast(xPacket(0x43, packet[5], packet[6], self.turnouts[turnout]), BroadcastFlags.DRIVING_SWITCHING)
+        elif xHeader == 0x23 and db0 == 0x11: # LAN_X_CV_READ, Z21: 6.1
+            self._programCV(packet, address, None)
+        elif xHeader == 0x24 and db0 == 0x12: # LAN_X_CV_WRITE, Z21: 6.2
+            self._programCV(packet, address, packet[8])
+        elif xHeader == 0xE6 and db0 in (0x30, 0x31): # LAN_X_CV_POM, LAN_X_CV_POM_ACCESSORY, Z21: 6.6-6.11
+            self._programOnMain(packet, address)
+        elif xHeader == 0x22 and db0 == 0x11: # LAN_X_DCC_READ_REGISTER, Z21: 6.13
+            cvId = REGISTER_CV.get(packet[6])
+            if cvId is None: # Register 6, the page register, is not supported by the simulated decoders.
+                self.sendTo(xPacket(0x61, 0x13), address, self.registerDelay) # LAN_X_CV_NACK
+            else:
+                self._programCV(struct.pack('>6xH', cvId - 1), address, None, self.registerDelay)
+        else:
+            self.sendTo(xPacket(0x61, 0x82), address) # LAN_X_UNKNOWN_COMMAND, Z21: 2.11
+
+    def _programOnMain(self, packet, address):
+        """Write a byte or a bit, or read a CV of a loco or accessory decoder on the main track. Reads are answered
+        with LAN_X_CV_RESULT, as if the decoder answered by RailCom. Z21: 6.6-6.11"""
+        mode = packet[8] & 0xFC
+        cvAddress = ((packet[8] & 0x03) << 8) | packet[9]
+        cvId = cvAddress + 1
+        value = packet[10]
+        if packet[5] == 0x30:
+            decoder = self.decoder(struct.unpack_from('>H', packet, 6)[0] & 0x3FFF)
+            readCV, writeCV = decoder.readCV, decoder.writeCV
+        else: # Accessory decoder, aaaaaaaa AAAACDDD
+            key = struct.unpack_from('>H', packet, 6)[0]
+            def readCV(cvId):
+                return self.accessoryCvs.get((key, cvId), 0)
+            def writeCV(cvId, value):
+                self.accessoryCvs[(key, cvId)] = value
+        if mode == POM_WRITE_BYTE:
+            writeCV(cvId, value)
+        elif mode == POM_WRITE_BIT: # 1111VPPP
+            bit = 1 << (value & 0x07)
+            writeCV(cvId, (readCV(cvId) | bit) if value & 0x08 else (readCV(cvId) & ~bit))
+        elif mode == POM_READ_BYTE:
+            self.sendTo(xPacket(0x64, 0x14, cvAddress >> 8, cvAddress & 0xFF, readCV(cvId)), address, self.programmingDelay)
+
+    def _programCV(self, packet, address, value, delay=None):
+        """Read (@value is None) or write the CV on the programming track and answer LAN_X_CV_RESULT,
+        or LAN_X_CV_NACK if there is no decoder on the programming track. Z21: 6.3-6.5"""
+        if not self.centralState & CS_PROGRAMMING_MODE_ACTIVE:
+            self.centralState |= CS_PROGRAMMING_MODE_ACTIVE
+            self.broadcast(xPacket(0x61, 0x02), BroadcastFlags.DRIVING_SWITCHING) # LAN_X_BC_PROGRAMMING_MODE
+        decoder = self.programmingTrack
+        if decoder is None:
+            self.sendTo(xPacket(0x61, 0x13), address, self.programmingDelay if delay is None else delay) # LAN_X_CV_NACK
+            return
+        cvId = struct.unpack_from('>H', packet, 6)[0] + 1
+        if value is not None:
+            oldAddress = decoder.address
+            decoder.writeCV(cvId, value)
+            if decoder.address != oldAddress: # Programmed a new loco address
+                if self.decoders.get(oldAddress) is decoder:
+                    del self.decoders[oldAddress]
+                self.decoders[decoder.address] = decoder
+        self.sendTo(xPacket(0x64, 0x14, packet[6], packet[7], decoder.readCV(cvId)), address,
+            self.programmingDelay if delay is None else delay)
+
+if __name__ == '__main__':
+    import doctest
+    import sys
+    sys.exit(doctest.testmod()[0])
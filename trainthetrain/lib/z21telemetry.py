@@ -0,0 +1,546 @@
+# -*- coding: UTF-8 -*-
+# ------------------------------------------------------------------------------
+#     Copyright (c) 2023+ TYPETR
+#     Usage by MIT License
+# ..............................................................................
+#
+#    TYPETR z21telemetry.py
+#
+#   [Z21] ---(LAN_RAILCOM_DATACHANGED)---> [RailComTelemetry] ---> RingBuffer per loco
+#
+#   Telemetry of the layout in fixed size ring buffers.
+#
+#   A RingBuffer holds its columns as array.array of a fixed capacity, so a stream of samples costs no
+#   memory after the buffer is full and no object per sample: the oldest row is overwritten. The first
+#   column is the time of the sample, in increasing order, so windows of time are found by bisection.
+#
+#   RailComTelemetry keeps a RingBuffer per loco with the RailCom data of the Z21: the receive and error
+#   counters of the RailCom packets, the speed that the decoder reports and its quality of service (QoS).
+#   The values are unpacked from the packet straight into the arrays, without message objects:
+#
+#       z21.watchRailCom()                      # Broadcasts of the subscribed locos, or allLocos=True
+#       z21.railCom.latest(3)                   # {'time': ..., 'receiveCounter': ..., 'speed': 40, 'qos': 98, ...}
+#       z21.railCom.window(3, 60)               # Receive rate, error rate, speed and QoS of the last minute
+#
+#   BoosterTelemetry keeps a RingBuffer per output of each CAN booster with its LAN_CAN_BOOSTER_SYSTEMSTATE_CHGD
+#   broadcasts: state, track voltage and current. One client monitors the current and short circuits of all
+#   districts, without polling the boosters:
+#
+#       z21.watchBoosters()
+#       z21.boosters.totalCurrent()             # mA of all booster outputs
+#       z21.boosters.shortCircuits()            # [(netId, port), ...] of the outputs in short circuit
+#       z21.boosters.window(0xC101, 1, 3600)    # Current and voltage (min, max, mean) of the last hour
+#
+#   SystemStateTelemetry keeps the LAN_SYSTEMSTATE_DATACHANGED broadcasts of the Z21: main and programming
+#   current, temperature and voltages. The newest samples are kept as they are, older ones as the minimum,
+#   maximum and mean per minute and per 10 minutes (RollupBuffer), so a dashboard shows hours or days of
+#   telemetry in constant memory, without requests to the Z21:
+#
+#       z21.watchSystemState()
+#       z21.systemStates.latest()               # {'time': ..., 'mainCurrent': 210, 'temperature': 35, ...}
+#       z21.systemStates.series('mainCurrent', 6 * 3600) # [(time, minimum, maximum, mean), ...] per 10 minutes
+#
+#   "Z21:" is referencing to the chapters in the z21-lan-protokoll-en.pdf manual.
+#
+import struct
+import threading
+import time
+from array import array
+
+RAILCOM_CAPACITY = 600 # Samples per loco, e.g. 10 minutes at one RailCom broadcast per second.
+
+# LAN_RAILCOM_DATACHANGED data from offset 4: LocoAddress, ReceiveCounter, ErrorCounter, reserved, Options, Speed, QoS. Z21: 8.1
+RAILCOM_DATA = struct.Struct('<HIHxBBB')
+RAILCOM_COLUMNS = (('time', 'd'), ('receiveCounter', 'L'), ('errorCounter', 'L'), ('options', 'B'), ('speed', 'B'),
+    ('qos', 'B'))
+
+# Options of LAN_RAILCOM_DATACHANGED
+OPTION_SPEED = 0x03 # Speed of CH7 subindex 0 or 1 is valid
+OPTION_QOS = 0x04 # QoS of CH7 subindex 7 is valid
+
+BOOSTER_CAPACITY = 3600 # States per booster output
+
+# LAN_CAN_BOOSTER_SYSTEMSTATE_CHGD data from offset 4: NId, OutputPort, State, VCCVoltage, Current. Z21: 10.2.3
+BOOSTER_DATA = struct.Struct('<HHHHH')
+BOOSTER_COLUMNS = (('time', 'd'), ('state', 'H'), ('voltage', 'H'), ('current', 'H'))
+BOOSTER_SHORT_CIRCUIT = 0x0002 # State bit
+
+SYSTEM_STATE_CAPACITY = 3600 # Samples as broadcast, an hour at one broadcast per second.
+SYSTEM_STATE_ROLLUPS = ((60, 1440), (600, 1008)) # (Seconds per bucket, buckets): a day per minute, a week per 10 minutes.
+
+# LAN_SYSTEMSTATE_DATACHANGED data from offset 4: MainCurrent, ProgCurrent, FilteredMainCurrent, Temperature,
+# SupplyVoltage, VCCVoltage, CentralState, CentralStateEx. Z21: 2.18
+SYSTEM_STATE_DATA = struct.Struct('<hhhhHHBB')
+SYSTEM_STATE_COLUMNS = (('time', 'd'), ('mainCurrent', 'h'), ('progCurrent', 'h'), ('filteredMainCurrent', 'h'),
+    ('temperature', 'h'), ('supplyVoltage', 'H'), ('vccVoltage', 'H'), ('centralState', 'B'), ('centralStateEx', 'B'))
+SYSTEM_STATE_MEASUREMENTS = ('mainCurrent', 'progCurrent', 'filteredMainCurrent', 'temperature', 'supplyVoltage',
+    'vccVoltage') # The columns that are rolled up, the central states are flags.
+
+class RingBuffer:
+    """Fixed @capacity rows of the @columns, a tuple of (name, array typecode). When the buffer is full, a new row
+    replaces the oldest one. Rows are indexed from the oldest (0) to the newest (-1). The first column is the time,
+    in increasing order, that is used by since().
+
+    >>> buffer = RingBuffer(3, (('time', 'd'), ('value', 'H')))
+    >>> for t in range(5): buffer.append(t, t * 10)
+    >>> len(buffer), buffer.values('value'), buffer.latest(), buffer.row(0)
+    (3, [20, 30, 40], {'time': 4.0, 'value': 40}, {'time': 2.0, 'value': 20})
+    >>> buffer.since(3), buffer.values('value', buffer.since(3)), buffer.since(9)
+    (1, [30, 40], 3)
+    >>> buffer.stats('value')
+    (3, 20, 40, 30.0)
+    """
+    def __init__(self, capacity, columns):
+        self.capacity = capacity
+        self.names = tuple(name for name, _ in columns)
+        self.columns = [array(typecode, bytes(array(typecode).itemsize * capacity)) for _, typecode in columns]
+        self.start = 0 # Physical index of the oldest row
+        self.count = 0
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {len(self)}/{self.capacity} {self.names}>'
+
+    def __len__(self):
+        return self.count
+
+    def append(self, *values):
+        """Add a row with the @values in the order of the columns, replacing the oldest row if the buffer is full."""
+        if self.count < self.capacity:
+            index = (self.start + self.count) % self.capacity
+            self.count += 1
+        else:
+            index = self.start
+            self.start = (self.start + 1) % self.capacity
+        for column, value in zip(self.columns, values):
+            column[index] = value
+
+    def column(self, name):
+        """Answer the array of column @name, in physical order. See values() for the rows in order of time."""
+        return self.columns[self.names.index(name)]
+
+    def _physical(self, index):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError(f'{self.__class__.__name__} index {index} out of range')
+        return (self.start + index) % self.capacity
+
+    def get(self, name, index=-1):
+        """Answer the value of column @name of row @index, default the newest row."""
+        return self.column(name)[self._physical(index)]
+
+    def row(self, index):
+        """Answer the dictionary name --> value of row @index."""
+        index = self._physical(index)
+        return {name: column[index] for name, column in zip(self.names, self.columns)}
+
+    def latest(self):
+        """Answer the dictionary of the newest row, None if the buffer is empty."""
+        if not self.count:
+            return None
+        return self.row(-1)
+
+    def values(self, name, first=0):
+        """Answer the list of the values of column @name, of the rows from index @first to the newest."""
+        column = self.column(name)
+        if first >= self.count:
+            return []
+        begin = (self.start + first) % self.capacity
+        end = begin + self.count - first
+        if end <= self.capacity:
+            return column[begin:end].tolist()
+        return column[begin:].tolist() + column[:end - self.capacity].tolist()
+
+    def since(self, t):
+        """Answer the index of the first row with a time (first column) of @t or later, len(self) if there is none."""
+        times = self.columns[0]
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if times[(self.start + middle) % self.capacity] < t:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def stats(self, name, first=0):
+        """Answer the tuple (count, minimum, maximum, mean) of column @name from row @first.
+        Answer (0, None, None, None) if there are no rows."""
+        values = self.values(name, first)
+        if not values:
+            return 0, None, None, None
+        return len(values), min(values), max(values), sum(values) / len(values)
+
+    def downsample(self, name, interval, first=0):
+        """Answer the list of (time, minimum, maximum, mean) of column @name per bucket of @interval seconds,
+        from row @first on. The time is the start of the bucket, empty buckets are skipped.
+
+        >>> buffer = RingBuffer(10, (('time', 'd'), ('value', 'H')))
+        >>> for t in range(6): buffer.append(t, t * 10)
+        >>> buffer.downsample('value', 4)
+        [(0.0, 0, 30, 15.0), (4.0, 40, 50, 45.0)]
+        """
+        result = []
+        bucket = None
+        for t, value in zip(self.values(self.names[0], first), self.values(name, first)):
+            start = t // interval * interval
+            if start != bucket:
+                if bucket is not None:
+                    result.append((bucket, minimum, maximum, total / count))
+                bucket, minimum, maximum, total, count = start, value, value, 0, 0
+            minimum = min(minimum, value)
+            maximum = max(maximum, value)
+            total += value
+            count += 1
+        if bucket is not None:
+            result.append((bucket, minimum, maximum, total / count))
+        return result
+
+    def clear(self):
+        self.start = 0
+        self.count = 0
+
+class RollupBuffer:
+    """Minimum, maximum and mean of the @names values per bucket of @interval seconds, in a RingBuffer of @capacity
+    buckets. Samples are added in order of time, a bucket is stored when the first sample of the next one arrives.
+
+    >>> rollup = RollupBuffer(10, 100, ('current',))
+    >>> for t in range(25): rollup.add(t, (t,))
+    >>> len(rollup), rollup.series('current') # The last bucket is not complete yet.
+    (2, [(0.0, 0.0, 9.0, 4.5), (10.0, 10.0, 19.0, 14.5), (20.0, 20.0, 24.0, 22.0)])
+    >>> rollup.series('current', since=15)
+    [(10.0, 10.0, 19.0, 14.5), (20.0, 20.0, 24.0, 22.0)]
+    """
+    def __init__(self, interval, capacity, names):
+        self.interval = interval
+        self.names = tuple(names)
+        columns = [('time', 'd'), ('count', 'L')]
+        for name in names:
+            columns += [(name + 'Min', 'd'), (name + 'Max', 'd'), (name + 'Mean', 'd')]
+        self.buffer = RingBuffer(capacity, columns)
+        self.bucket = None # Start time of the bucket that is being filled.
+        self.minimums = self.maximums = self.totals = None
+        self.count = 0
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.interval}s {len(self)}/{self.buffer.capacity}>'
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def _get_span(self):
+        """Answer the seconds that the buffer covers when it is full."""
+        return self.interval * self.buffer.capacity
+    span = property(_get_span)
+
+    def add(self, t, values):
+        """Add the sample @values, in the order of self.names, at time @t."""
+        bucket = t // self.interval * self.interval
+        if bucket != self.bucket:
+            self.flush()
+            self.bucket = bucket
+            self.minimums = list(values)
+            self.maximums = list(values)
+            self.totals = [0] * len(values)
+        for index, value in enumerate(values):
+            if value < self.minimums[index]:
+                self.minimums[index] = value
+            elif value > self.maximums[index]:
+                self.maximums[index] = value
+            self.totals[index] += value
+        self.count += 1
+
+    def flush(self):
+        """Store the bucket that is being filled."""
+        if not self.count:
+            return
+        row = [self.bucket, self.count]
+        for minimum, maximum, total in zip(self.minimums, self.maximums, self.totals):
+            row += [minimum, maximum, total / self.count]
+        self.buffer.append(*row)
+        self.count = 0
+
+    def series(self, name, since=None):
+        """Answer the list of (time, minimum, maximum, mean) of @name per bucket, of the buckets that end after
+        @since (default all), including the bucket that is being filled."""
+        buffer = self.buffer
+        first = 0 if since is None else buffer.since(since - self.interval + 1e-9)
+        result = list(zip(buffer.values('time', first), buffer.values(name + 'Min', first),
+            buffer.values(name + 'Max', first), buffer.values(name + 'Mean', first)))
+        if self.count:
+            index = self.names.index(name)
+            result.append((float(self.bucket), float(self.minimums[index]), float(self.maximums[index]),
+                self.totals[index] / self.count))
+        return result
+
+    def clear(self):
+        self.buffer.clear()
+        self.bucket = None
+        self.count = 0
+
+class RailComTelemetry:
+    """RingBuffer of @capacity RailCom samples per loco address. The RailCom data of the Z21 is the state of
+    the counters and the last values, so a sample that repeats the previous one is not stored.
+
+    >>> telemetry = RailComTelemetry(capacity=100)
+    >>> for t in range(10): _ = telemetry.update(struct.pack('<HHHIHxBBBx', 0x11, 0x88, 3, 100 * t, t // 2, 0x05, 40 + t, 90), t)
+    >>> telemetry.update(struct.pack('<HHHIHxBBBx', 0x11, 0x88, 3, 900, 4, 0x05, 49, 90), 10) # Same as t=9
+    False
+    >>> telemetry.locos(), telemetry.latest(3)['speed'], telemetry.latest(4)
+    ([3], 49, None)
+    >>> w = telemetry.window(3, 4, now=9) # Samples of t=5 .. t=9
+    >>> w['samples'], w['receiveRate'], w['errorRate'], w['speed'], w['qos']
+    (5, 100.0, 0.005, (45, 49, 47.0), 90.0)
+    """
+    def __init__(self, capacity=RAILCOM_CAPACITY):
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.buffers = {} # Loco address --> RingBuffer of RAILCOM_COLUMNS
+        self.received = 0 # Counters
+        self.stored = 0
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} locos={len(self.buffers)} received={self.received} stored={self.stored}>'
+
+    def __contains__(self, loco):
+        return loco in self.buffers
+
+    def __getitem__(self, loco):
+        return self.buffers[loco]
+
+    def locos(self):
+        """Answer the sorted list of loco addresses with RailCom data."""
+        with self.lock:
+            return sorted(self.buffers)
+
+    def update(self, packet, t=None):
+        """Store the LAN_RAILCOM_DATACHANGED @packet, received at time.time() @t (default now). Can be used directly
+        as subscriber of the Z21 receiver. Answer True if the sample was stored, False if it repeats the last one."""
+        loco, receiveCounter, errorCounter, options, speed, qos = RAILCOM_DATA.unpack_from(packet, 4)
+        if t is None:
+            t = time.time()
+        with self.lock:
+            self.received += 1
+            buffer = self.buffers.get(loco)
+            if buffer is None:
+                buffer = self.buffers[loco] = RingBuffer(self.capacity, RAILCOM_COLUMNS)
+            elif (buffer.get('receiveCounter') == receiveCounter and buffer.get('errorCounter') == errorCounter and
+                    buffer.get('options') == options and buffer.get('speed') == speed and buffer.get('qos') == qos):
+                return False
+            buffer.append(t, receiveCounter, errorCounter, options, speed, qos)
+            self.stored += 1
+        return True
+
+    def latest(self, loco):
+        """Answer the dictionary of the last sample of @loco, None if there is no RailCom data for it."""
+        with self.lock:
+            buffer = self.buffers.get(loco)
+            return None if buffer is None else buffer.latest()
+
+    def window(self, loco, seconds, now=None):
+        """Answer the dictionary of statistics of the samples of @loco in the last @seconds before @now
+        (default time.time()), None if there are none:
+        samples         Number of samples
+        receiveRate     RailCom packets received per second
+        errorRate       Part of the received RailCom packets with errors
+        speed           (minimum, maximum, mean) of the samples with a valid speed, or None
+        qos             Mean QoS of the samples with a valid QoS, or None
+        """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            buffer = self.buffers.get(loco)
+            if buffer is None:
+                return None
+            first = buffer.since(now - seconds)
+            times = buffer.values('time', first)
+            if not times:
+                return None
+            receives = buffer.values('receiveCounter', first)
+            errors = buffer.values('errorCounter', first)
+            options = buffer.values('options', first)
+            speeds = [speed for speed, option in zip(buffer.values('speed', first), options) if option & OPTION_SPEED]
+            qos = [q for q, option in zip(buffer.values('qos', first), options) if option & OPTION_QOS]
+        received = (receives[-1] - receives[0]) % 0x100000000 # The counters wrap around.
+        duration = times[-1] - times[0]
+        return dict(samples=len(times), seconds=duration,
+            receiveRate=received / duration if duration else None,
+            errorRate=((errors[-1] - errors[0]) % 0x10000) / received if received else None,
+            speed=(min(speeds), max(speeds), sum(speeds) / len(speeds)) if speeds else None,
+            qos=sum(qos) / len(qos) if qos else None)
+
+    def clear(self):
+        with self.lock:
+            self.buffers.clear()
+
+class BoosterTelemetry:
+    """RingBuffer of @capacity states per booster output, by the key (netId, port). The Z21 broadcasts a state when
+    it changes, a state that repeats the previous one is not stored.
+
+    >>> boosters = BoosterTelemetry(capacity=100)
+    >>> for t, current in enumerate((1000, 1500, 2000)): _ = boosters.update(struct.pack('<HHHHHHH', 0x0E, 0xCA, 0xC101, 1, 0, 18000, current), t)
+    >>> boosters.update(struct.pack('<HHHHHHH', 0x0E, 0xCA, 0xC101, 2, 0x0002, 17000, 3000), 3)
+    True
+    >>> boosters.update(struct.pack('<HHHHHHH', 0x0E, 0xCA, 0xC101, 2, 0x0002, 17000, 3000), 4)
+    False
+    >>> boosters.outputs(), boosters.totalCurrent(), boosters.shortCircuits()
+    ([(49409, 1), (49409, 2)], 5000, [(49409, 2)])
+    >>> w = boosters.window(0xC101, 1, 10, now=3)
+    >>> w['samples'], w['current'], w['voltage'], w['shortCircuits']
+    (3, (1000, 2000, 1500.0), (18000, 18000, 18000.0), 0)
+    """
+    def __init__(self, capacity=BOOSTER_CAPACITY):
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.buffers = {} # (netId, port) --> RingBuffer of BOOSTER_COLUMNS
+        self.received = 0 # Counters
+        self.stored = 0
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} outputs={len(self.buffers)} received={self.received} stored={self.stored}>'
+
+    def __getitem__(self, output):
+        return self.buffers[output]
+
+    def outputs(self):
+        """Answer the sorted list of (netId, port) of the booster outputs with states."""
+        with self.lock:
+            return sorted(self.buffers)
+
+    def update(self, packet, t=None):
+        """Store the LAN_CAN_BOOSTER_SYSTEMSTATE_CHGD @packet, received at time.time() @t (default now). Can be used
+        directly as subscriber of the Z21 receiver. Answer True if the state was stored, False if it repeats the last one."""
+        netId, port, state, voltage, current = BOOSTER_DATA.unpack_from(packet, 4)
+        if t is None:
+            t = time.time()
+        with self.lock:
+            self.received += 1
+            buffer = self.buffers.get((netId, port))
+            if buffer is None:
+                buffer = self.buffers[(netId, port)] = RingBuffer(self.capacity, BOOSTER_COLUMNS)
+            elif (buffer.get('state') == state and buffer.get('voltage') == voltage and
+                    buffer.get('current') == current):
+                return False
+            buffer.append(t, state, voltage, current)
+            self.stored += 1
+        return True
+
+    def latest(self, netId, port):
+        """Answer the dictionary of the last state of the output, None if there is none."""
+        with self.lock:
+            buffer = self.buffers.get((netId, port))
+            return None if buffer is None else buffer.latest()
+
+    def totalCurrent(self):
+        """Answer the sum of the last current (mA) of all booster outputs."""
+        with self.lock:
+            return sum(buffer.get('current') for buffer in self.buffers.values())
+
+    def shortCircuits(self):
+        """Answer the sorted list of (netId, port) of the outputs that are in short circuit by their last state."""
+        with self.lock:
+            return sorted(output for output, buffer in self.buffers.items() 
+                if buffer.get('state') & BOOSTER_SHORT_CIRCUIT)
+
+    def window(self, netId, port, seconds, now=None):
+        """Answer the dictionary of statistics of the states of the output in the last @seconds before @now
+        (default time.time()), None if there are none:
+        samples         Number of states
+        current         (minimum, maximum, mean) mA of the states
+        voltage         (minimum, maximum, mean) mV of the states
+        shortCircuits   Number of times that the output went into short circuit
+        """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            buffer = self.buffers.get((netId, port))
+            if buffer is None:
+                return None
+            first = buffer.since(now - seconds)
+            samples, currentMin, currentMax, currentMean = buffer.stats('current', first)
+            if not samples:
+                return None
+            _, voltageMin, voltageMax, voltageMean = buffer.stats('voltage', first)
+            states = buffer.values('state', first)
+        shorts = [bool(state & BOOSTER_SHORT_CIRCUIT) for state in states]
+        return dict(samples=samples, current=(currentMin, currentMax, currentMean),
+            voltage=(voltageMin, voltageMax, voltageMean),
+            shortCircuits=sum(1 for previous, short in zip([False] + shorts, shorts) if short and not previous))
+
+    def clear(self):
+        with self.lock:
+            self.buffers.clear()
+
+class SystemStateTelemetry:
+    """The LAN_SYSTEMSTATE_DATACHANGED samples in a RingBuffer of @capacity rows, and rolled up into a RollupBuffer
+    per (interval, capacity) of @rollups, for the windows that are longer than the raw samples cover.
+
+    >>> states = SystemStateTelemetry(capacity=10, rollups=((10, 100),))
+    >>> for t in range(30): states.update(struct.pack('<HH6hBBBB', 0x14, 0x84, 100 + t, 0, 100, 35, 18000, 16000, 0, 0, 0, 0), t)
+    >>> states.latest()['mainCurrent'], len(states.samples), len(states.rollups[0])
+    (129, 10, 2)
+    >>> states.series('mainCurrent', 5, now=29) # From the raw samples
+    [(24.0, 124, 124, 124.0), (25.0, 125, 125, 125.0), (26.0, 126, 126, 126.0), (27.0, 127, 127, 127.0), (28.0, 128, 128, 128.0), (29.0, 129, 129, 129.0)]
+    >>> states.series('mainCurrent', 25, now=29) # From the rollup, raw samples are too short
+    [(0.0, 100.0, 109.0, 104.5), (10.0, 110.0, 119.0, 114.5), (20.0, 120.0, 129.0, 124.5)]
+    >>> states.series('mainCurrent', 5, now=29, interval=2) # Raw samples downsampled
+    [(24.0, 124, 125, 124.5), (26.0, 126, 127, 126.5), (28.0, 128, 129, 128.5)]
+    """
+    def __init__(self, capacity=SYSTEM_STATE_CAPACITY, rollups=SYSTEM_STATE_ROLLUPS):
+        self.lock = threading.Lock()
+        self.samples = RingBuffer(capacity, SYSTEM_STATE_COLUMNS)
+        self.rollups = [RollupBuffer(interval, buckets, SYSTEM_STATE_MEASUREMENTS) for interval, buckets in rollups]
+        self.received = 0 # Counter
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} samples={len(self.samples)} received={self.received}>'
+
+    def update(self, packet, t=None):
+        """Store the LAN_SYSTEMSTATE_DATACHANGED @packet, received at time.time() @t (default now). Can be used
+        directly as subscriber of the Z21 receiver."""
+        values = SYSTEM_STATE_DATA.unpack_from(packet, 4)
+        if t is None:
+            t = time.time()
+        measurements = values[:len(SYSTEM_STATE_MEASUREMENTS)]
+        with self.lock:
+            self.received += 1
+            self.samples.append(t, *values)
+            for rollup in self.rollups:
+                rollup.add(t, measurements)
+
+    def latest(self):
+        """Answer the dictionary of the last sample, None if there is none."""
+        with self.lock:
+            return self.samples.latest()
+
+    def series(self, name, seconds, now=None, interval=None):
+        """Answer the list of (time, minimum, maximum, mean) of measurement @name in the last @seconds before @now
+        (default time.time()). The raw samples are answered as single value buckets when they cover the window,
+        otherwise the buckets of the finest rollup that does, or of the coarsest one. With @interval, the raw samples
+        are downsampled to buckets of that many seconds, if they cover the window."""
+        if now is None:
+            now = time.time()
+        since = now - seconds
+        with self.lock:
+            samples = self.samples
+            if samples and (len(samples) < samples.capacity or samples.get('time', 0) <= since):
+                first = samples.since(since)
+                if interval:
+                    return samples.downsample(name, interval, first)
+                return [(t, value, value, float(value)) for t, value in 
+                    zip(samples.values('time', first), samples.values(name, first))]
+            for rollup in self.rollups:
+                if rollup.span >= seconds or rollup is self.rollups[-1]:
+                    return rollup.series(name, since)
+        return []
+
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+            for rollup in self.rollups:
+                rollup.clear()
+
+if __name__ == '__main__':
+    import doctest
+    import sys
+    sys.exit(doctest.testmod()[0])